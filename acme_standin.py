@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""Local stand-in for an ACME (RFC 8555) certificate authority
+
+Implements the subset of ACME that the Go server's autocert manager uses
+(directory, nonces, accounts, orders, authorizations, challenges, finalize
+and certificate download) against an in-memory CA, so certificate issuance,
+startup prewarming and renewal can be exercised and timed offline:
+
+    python acme_standin.py --port 14000 --ca-out acme-standin-ca.pem &
+    DEMO_FQDN=mtls.example.test ./mtls-server \\
+        -acme-directory http://127.0.0.1:14000/directory -cert-cache acme-cache
+
+The stand-in does not check JWS signatures and accepts every challenge
+without contacting the server, so any hostname can be issued. Issued
+certificates chain to a CA generated at startup (or --ca-cert/--ca-key);
+--ca-out writes it for clients that should trust the server.
+
+--latency adds a fixed delay per request (roughly a round trip to a public
+CA), --finalize-delay the time the CA takes to issue once an order is
+finalized, and --validity the certificate lifetime: autocert renews at the
+lesser of 30 days or a third of the lifetime before expiry, so
+--validity 15m shows a renewal every 10 minutes. With --reuse-authz a
+hostname validated once gets new orders that are ready straight away, as
+Let's Encrypt does for 30 days. GET /_stats returns request, order and
+issuance counters.
+"""
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+RETRY_AFTER = 1
+DURATION = re.compile(r"^(\d+)([smhd]?)$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def rfc3339(when):
+    return when.replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+def b64url_decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+def parse_duration(text):
+    """Seconds in '90d', '15m', '300s' or '300'"""
+    match = DURATION.match(text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"{text!r}: expected a number with an optional s/m/h/d suffix")
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def problem(kind, detail):
+    return {"type": f"urn:ietf:params:acme:error:{kind}", "detail": detail}
+
+
+# ---------------------------------------------------------------------------
+# CA
+# ---------------------------------------------------------------------------
+
+class StandinCA:
+    """Signs certificate requests with an ECDSA P-256 CA"""
+
+    def __init__(self, cert=None, key=None):
+        if cert is None:
+            key = ec.generate_private_key(ec.SECP256R1())
+            name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "ACME stand-in CA"),
+                              x509.NameAttribute(NameOID.ORGANIZATION_NAME, "mTLS Test")])
+            now = utcnow()
+            cert = (x509.CertificateBuilder()
+                    .subject_name(name).issuer_name(name)
+                    .public_key(key.public_key())
+                    .serial_number(x509.random_serial_number())
+                    .not_valid_before(now - datetime.timedelta(minutes=5))
+                    .not_valid_after(now + datetime.timedelta(days=3650))
+                    .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+                    .add_extension(x509.KeyUsage(digital_signature=True, key_cert_sign=True, crl_sign=True,
+                                                 content_commitment=False, key_encipherment=False,
+                                                 data_encipherment=False, key_agreement=False,
+                                                 encipher_only=False, decipher_only=False), critical=True)
+                    .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+                    .sign(key, hashes.SHA256()))
+        self.cert, self.key = cert, key
+        self.pem = cert.public_bytes(serialization.Encoding.PEM)
+
+    @classmethod
+    def load(cls, cert_path, key_path):
+        with open(cert_path, "rb") as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+        with open(key_path, "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), password=None)
+        return cls(cert, key)
+
+    def issue(self, csr_der, names, validity):
+        """PEM chain (leaf, CA) for a DER CSR covering names"""
+        csr = x509.load_der_x509_csr(csr_der)
+        if not csr.is_signature_valid:
+            raise ValueError("CSR signature does not verify")
+        now = utcnow()
+        cert = (x509.CertificateBuilder()
+                .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])]))
+                .issuer_name(self.cert.subject)
+                .public_key(csr.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - datetime.timedelta(minutes=1))
+                .not_valid_after(now + datetime.timedelta(seconds=validity))
+                .add_extension(x509.SubjectAlternativeName([x509.DNSName(n) for n in names]), critical=False)
+                .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+                .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+                .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(self.key.public_key()),
+                               critical=False)
+                .sign(self.key, hashes.SHA256()))
+        return cert.public_bytes(serialization.Encoding.PEM) + self.pem
+
+
+# ---------------------------------------------------------------------------
+# ACME
+# ---------------------------------------------------------------------------
+
+class StandinACME:
+    """Routing and state for the stand-in; thread safe"""
+
+    def __init__(self, ca, latency=0.0, finalize_delay=0.0, validity=90 * 86400, reuse_authz=False):
+        self.ca = ca
+        self.latency = latency
+        self.finalize_delay = finalize_delay
+        self.validity = validity
+        self.reuse_authz = reuse_authz
+        self.lock = threading.Lock()
+        self.accounts = {}   # JWK thumbprint -> account id
+        self.orders = {}
+        self.authzs = {}
+        self.certs = {}
+        self.validated = set()
+        self.stats = {"requests": 0, "accounts": 0, "orders": 0, "ready_orders": 0, "challenges": 0,
+                      "certificates": 0, "issued": {}}
+        self.routes = [
+            ("GET", r"/directory", self.directory),
+            ("HEAD", r"/directory", self.nonce),
+            ("HEAD", r"/new-nonce", self.nonce),
+            ("GET", r"/new-nonce", self.nonce),
+            ("POST", r"/new-account", self.new_account),
+            ("POST", r"/account/(\w+)", self.get_account),
+            ("POST", r"/new-order", self.new_order),
+            ("POST", r"/order/(\w+)", self.get_order),
+            ("POST", r"/authz/(\w+)", self.get_authz),
+            ("POST", r"/challenge/(\w+)/(\w+)", self.accept_challenge),
+            ("POST", r"/finalize/(\w+)", self.finalize),
+            ("POST", r"/cert/(\w+)", self.get_cert),
+            ("GET", r"/_stats", self.get_stats),
+        ]
+
+    def handle(self, method, path, base, body):
+        """Return (status, headers, payload) for a request; payload is a
+        dict sent as JSON, bytes sent as a PEM chain, or None"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.stats["requests"] += 1
+
+        jws = None
+        if method == "POST":
+            try:
+                jws = decode_jws(body)
+            except (ValueError, KeyError, TypeError):
+                return 400, {}, problem("malformed", "request body is not a flattened JWS")
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return handler(base, jws, *match.groups())
+        return 404, {}, problem("malformed", f"No route for {method} {path}")
+
+    # Handlers take (base URL, decoded JWS or None, *path groups)
+
+    def directory(self, base, jws):
+        return 200, {}, {
+            "newNonce": f"{base}/new-nonce",
+            "newAccount": f"{base}/new-account",
+            "newOrder": f"{base}/new-order",
+            "revokeCert": f"{base}/revoke-cert",
+            "keyChange": f"{base}/key-change",
+            "meta": {"termsOfService": f"{base}/terms"},
+        }
+
+    def nonce(self, base, jws):
+        return 200, {"Cache-Control": "no-store"}, None
+
+    def new_account(self, base, jws):
+        jwk = jws["protected"].get("jwk")
+        if not jwk:
+            return 400, {}, problem("malformed", "newAccount must be signed with a jwk")
+        thumbprint = hashlib.sha256(json.dumps(jwk, sort_keys=True).encode()).hexdigest()
+        with self.lock:
+            account_id = self.accounts.get(thumbprint)
+            status = 200
+            if account_id is None:
+                if (jws["payload"] or {}).get("onlyReturnExisting"):
+                    return 400, {}, problem("accountDoesNotExist", "no account for this key")
+                account_id = self.accounts[thumbprint] = new_id()
+                self.stats["accounts"] += 1
+                status = 201
+        account = {"status": "valid", "contact": (jws["payload"] or {}).get("contact", []),
+                   "orders": f"{base}/account/{account_id}/orders"}
+        return status, {"Location": f"{base}/account/{account_id}"}, account
+
+    def get_account(self, base, jws, account_id):
+        return 200, {"Location": f"{base}/account/{account_id}"}, {"status": "valid"}
+
+    def new_order(self, base, jws):
+        identifiers = (jws["payload"] or {}).get("identifiers") or []
+        names = [i.get("value", "") for i in identifiers if i.get("type") == "dns"]
+        if not names or len(names) != len(identifiers) or not all(names):
+            return 400, {}, problem("rejectedIdentifier", "only dns identifiers are supported")
+        with self.lock:
+            order_id = new_id()
+            authz_ids = []
+            for name in names:
+                authz_id = new_id()
+                valid = self.reuse_authz and name in self.validated
+                self.authzs[authz_id] = {
+                    "status": "valid" if valid else "pending",
+                    "identifier": {"type": "dns", "value": name},
+                    "expires": rfc3339(utcnow() + datetime.timedelta(days=7)),
+                    "order": order_id,
+                    "challenges": [{"type": kind, "status": "valid" if valid else "pending",
+                                    "token": base64.urlsafe_b64encode(uuid.uuid4().bytes).rstrip(b"=").decode()}
+                                   for kind in ("tls-alpn-01", "http-01")],
+                }
+                authz_ids.append(authz_id)
+            ready = all(self.authzs[a]["status"] == "valid" for a in authz_ids)
+            self.orders[order_id] = {"status": "ready" if ready else "pending", "names": names,
+                                     "authzs": authz_ids, "expires": rfc3339(utcnow() + datetime.timedelta(days=7))}
+            self.stats["orders"] += 1
+            self.stats["ready_orders"] += ready
+            return 201, {"Location": f"{base}/order/{order_id}"}, self.order_view(base, order_id)
+
+    def order_view(self, base, order_id):
+        order = self.orders[order_id]
+        view = {
+            "status": order["status"],
+            "expires": order["expires"],
+            "identifiers": [{"type": "dns", "value": n} for n in order["names"]],
+            "authorizations": [f"{base}/authz/{a}" for a in order["authzs"]],
+            "finalize": f"{base}/finalize/{order_id}",
+        }
+        if "cert" in order:
+            view["certificate"] = f"{base}/cert/{order['cert']}"
+        return view
+
+    def get_order(self, base, jws, order_id):
+        with self.lock:
+            if order_id not in self.orders:
+                return 404, {}, problem("malformed", "no such order")
+            headers = {"Location": f"{base}/order/{order_id}"}
+            if self.orders[order_id]["status"] in ("pending", "processing"):
+                headers["Retry-After"] = str(RETRY_AFTER)
+            return 200, headers, self.order_view(base, order_id)
+
+    def authz_view(self, base, authz_id):
+        authz = self.authzs[authz_id]
+        return {
+            "status": authz["status"],
+            "expires": authz["expires"],
+            "identifier": authz["identifier"],
+            "challenges": [{**c, "url": f"{base}/challenge/{authz_id}/{i}"}
+                           for i, c in enumerate(authz["challenges"])],
+        }
+
+    def get_authz(self, base, jws, authz_id):
+        with self.lock:
+            authz = self.authzs.get(authz_id)
+            if authz is None:
+                return 404, {}, problem("malformed", "no such authorization")
+            # POST {"status": "deactivated"}, as autocert does with leftovers
+            if (jws["payload"] or {}).get("status") == "deactivated" and authz["status"] == "pending":
+                authz["status"] = "deactivated"
+            return 200, {}, self.authz_view(base, authz_id)
+
+    def accept_challenge(self, base, jws, authz_id, index):
+        """Mark the challenge, its authorization and, once every
+        authorization is valid, the order valid/ready without validating"""
+        with self.lock:
+            authz = self.authzs.get(authz_id)
+            if authz is None or int(index) >= len(authz["challenges"]):
+                return 404, {}, problem("malformed", "no such challenge")
+            challenge = authz["challenges"][int(index)]
+            challenge["status"] = "valid"
+            challenge["validated"] = rfc3339(utcnow())
+            authz["status"] = "valid"
+            self.validated.add(authz["identifier"]["value"])
+            self.stats["challenges"] += 1
+            order = self.orders[authz["order"]]
+            if order["status"] == "pending" and all(self.authzs[a]["status"] == "valid" for a in order["authzs"]):
+                order["status"] = "ready"
+            view = {**challenge, "url": f"{base}/challenge/{authz_id}/{index}"}
+        return 200, {"Link": f'<{base}/authz/{authz_id}>;rel="up"'}, view
+
+    def finalize(self, base, jws, order_id):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return 404, {}, problem("malformed", "no such order")
+            if order["status"] != "ready":
+                return 403, {}, problem("orderNotReady", f"order is {order['status']}")
+            order["status"] = "processing"
+        try:
+            csr = b64url_decode((jws["payload"] or {})["csr"])
+            if self.finalize_delay:
+                time.sleep(self.finalize_delay)
+            chain = self.ca.issue(csr, order["names"], self.validity)
+        except (KeyError, ValueError) as e:
+            with self.lock:
+                order["status"] = "invalid"
+            return 400, {}, problem("badCSR", str(e))
+
+        with self.lock:
+            cert_id = new_id()
+            self.certs[cert_id] = chain
+            order["cert"] = cert_id
+            order["status"] = "valid"
+            self.stats["certificates"] += 1
+            for name in order["names"]:
+                self.stats["issued"][name] = self.stats["issued"].get(name, 0) + 1
+            return 200, {"Location": f"{base}/order/{order_id}"}, self.order_view(base, order_id)
+
+    def get_cert(self, base, jws, cert_id):
+        with self.lock:
+            chain = self.certs.get(cert_id)
+        if chain is None:
+            return 404, {}, problem("malformed", "no such certificate")
+        return 200, {"Content-Type": "application/pem-certificate-chain"}, chain
+
+    def get_stats(self, base, jws):
+        with self.lock:
+            return 200, {}, json.loads(json.dumps(self.stats))
+
+
+def decode_jws(body):
+    """protected header and payload of a flattened JWS; the payload is None
+    for POST-as-GET. The signature is not checked."""
+    envelope = json.loads(body)
+    protected = json.loads(b64url_decode(envelope["protected"]))
+    payload = envelope["payload"]
+    return {"protected": protected, "payload": json.loads(b64url_decode(payload)) if payload else None}
+
+
+def make_handler(acme):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def dispatch(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            base = f"http://{self.headers.get('Host') or '%s:%d' % self.server.server_address[:2]}"
+            self.respond(*acme.handle(self.command, self.path.split("?")[0], base, body))
+
+        def respond(self, status, headers, payload):
+            if payload is None:
+                data, content_type = b"", None
+            elif isinstance(payload, bytes):
+                data, content_type = payload, None
+            else:
+                data = json.dumps(payload).encode()
+                content_type = "application/problem+json" if status >= 400 else "application/json"
+            self.send_response(status)
+            self.send_header("Replay-Nonce", new_id())
+            if content_type:
+                self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+        do_GET = do_POST = do_HEAD = dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=0, ca=None, **kwargs):
+    """Start the stand-in in a background thread; returns (server, acme).
+    The directory URL is f"http://{host}:{server.server_port}/directory" and
+    acme.ca.pem the CA certificate issued chains lead to."""
+    acme = StandinACME(ca or StandinCA(), **kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(acme))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, acme
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for an ACME certificate authority",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=14000)
+    parser.add_argument("--latency", type=float, default=0, help="Added delay per request in ms")
+    parser.add_argument("--finalize-delay", type=float, default=0, help="Time to issue a finalized order in ms")
+    parser.add_argument("--validity", type=parse_duration, default="90d",
+                        help="Certificate lifetime, e.g. 90d, 15m or 300s (default: 90d)")
+    parser.add_argument("--reuse-authz", action="store_true",
+                        help="Hostnames validated once get ready orders without new challenges")
+    parser.add_argument("--ca-cert", help="CA certificate to issue from (default: generated)")
+    parser.add_argument("--ca-key", help="Unencrypted PEM key of --ca-cert")
+    parser.add_argument("--ca-out", help="Write the CA certificate here")
+    args = parser.parse_args(argv)
+    if bool(args.ca_cert) != bool(args.ca_key):
+        parser.error("--ca-cert and --ca-key go together")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        ca = StandinCA.load(args.ca_cert, args.ca_key) if args.ca_cert else StandinCA()
+        if args.ca_out:
+            with open(args.ca_out, "wb") as f:
+                f.write(ca.pem)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return 1
+
+    server, acme = serve(args.host, args.port, ca=ca, latency=args.latency / 1000,
+                         finalize_delay=args.finalize_delay / 1000, validity=args.validity,
+                         reuse_authz=args.reuse_authz)
+    print(f"ACME stand-in on http://{args.host}:{server.server_port}/directory")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"\n{acme.stats}")
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
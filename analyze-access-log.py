@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Summarize mTLS server access logs per client certificate and per route
+
+Reads the JSON-lines access log both servers write (ACCESS_LOG for the Rust
+server, -access-log for the Go server) and reports, per route and per client
+certificate, request counts, request rates, error ratios, bytes sent, the
+share of requests on resumed TLS sessions and latency percentiles.
+
+Logs are streamed: regular files are memory-mapped and read line by line,
+.gz files and stdin are read through generators, and latencies go into
+fixed-precision log-scale histograms, so memory use depends on the number of
+distinct routes and certificates, not on the size of the log. Percentiles
+are accurate to about 2%.
+
+--follow keeps reading a growing log like tail -F (surviving rotation) and
+prints a report for each --interval window.
+
+Examples:
+    python analyze-access-log.py access.log
+    python analyze-access-log.py access.log.1.gz access.log --by cert --top 20
+    python analyze-access-log.py --follow --interval 10 access.log
+    zcat access.log.*.gz | python analyze-access-log.py - --json report.json
+"""
+import argparse
+import gzip
+import io
+import json
+import math
+import mmap
+import os
+import sys
+import time
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+PERCENTILES = (50, 90, 99, 99.9)
+# Histogram bucket growth factor: a percentile is off by at most half of it
+BUCKET_GROWTH = 1.04
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+ANONYMOUS = "(no client certificate)"
+BY_ROUTE = "route"
+BY_CERT = "cert"
+# Fields KeyStats and Analyzer.add read, by the type they need; null counts
+# as missing
+NUMBER_FIELDS = ("status", "latency_us", "bytes", "ts")
+STRING_FIELDS = ("route", "fingerprint")
+
+
+class LatencyHistogram:
+    """Log-scale histogram of microsecond latencies with bounded memory"""
+
+    __slots__ = ("buckets", "count")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, us):
+        bucket = int(math.log(us) / _LOG_GROWTH) if us >= 1 else -1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+
+    def percentile(self, p):
+        """Latency in ms below which p percent of the samples fall"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                if bucket < 0:
+                    return 0.0
+                # Geometric middle of the bucket
+                return BUCKET_GROWTH ** (bucket + 0.5) / 1000
+        return 0.0
+
+
+def well_typed(record):
+    """Whether the fields the statistics are built from have usable types,
+    so one odd record is counted as malformed instead of ending the run"""
+    for field in NUMBER_FIELDS:
+        value = record.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        if isinstance(value, float) and not math.isfinite(value):
+            return False
+    return all(isinstance(record.get(field), (str, type(None))) for field in STRING_FIELDS)
+
+
+class KeyStats:
+    """Counters for one route or certificate"""
+
+    __slots__ = ("requests", "errors", "bytes", "resumed", "first_ts", "last_ts", "latency", "label")
+
+    def __init__(self, label):
+        self.label = label
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.resumed = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.latency = LatencyHistogram()
+
+    def add(self, record):
+        self.requests += 1
+        if (record.get("status") or 0) >= 400:
+            self.errors += 1
+        self.bytes += record.get("bytes") or 0
+        if record.get("resumed"):
+            self.resumed += 1
+        ts = record.get("ts")
+        if ts is not None:
+            if self.first_ts is None or ts < self.first_ts:
+                self.first_ts = ts
+            if self.last_ts is None or ts > self.last_ts:
+                self.last_ts = ts
+        self.latency.add(record.get("latency_us") or 0)
+
+    def summary(self, span):
+        return {
+            "label": self.label,
+            "requests": self.requests,
+            "rate_per_s": self.requests / span if span > 0 else 0.0,
+            "errors": self.errors,
+            "error_ratio": self.errors / self.requests if self.requests else 0.0,
+            "bytes": self.bytes,
+            "resumed_ratio": self.resumed / self.requests if self.requests else 0.0,
+            "latency_ms": {f"p{p:g}": round(self.latency.percentile(p), 3) for p in PERCENTILES},
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+        }
+
+
+class Analyzer:
+    """Incremental per-route and per-certificate statistics"""
+
+    def __init__(self):
+        self.total = KeyStats("total")
+        self.routes = {}
+        self.certs = {}
+        self.malformed = 0
+
+    def add(self, record):
+        self.total.add(record)
+        route = record.get("route") or "?"
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = KeyStats(route)
+        stats.add(record)
+
+        fingerprint = record.get("fingerprint")
+        stats = self.certs.get(fingerprint)
+        if stats is None:
+            label = f"{record.get('cn') or '?'} {fingerprint[:16]}" if fingerprint else ANONYMOUS
+            stats = self.certs[fingerprint] = KeyStats(label)
+        stats.add(record)
+
+    def feed(self, lines):
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if line.strip():
+                    self.malformed += 1
+                continue
+            if isinstance(record, dict) and well_typed(record):
+                self.add(record)
+            else:
+                self.malformed += 1
+
+    def span(self, window=None):
+        if window is not None:
+            return window
+        if self.total.first_ts is None:
+            return 0.0
+        return max(self.total.last_ts - self.total.first_ts, 1e-6)
+
+    def report(self, top, window=None):
+        span = self.span(window)
+
+        def ranked(table):
+            rows = sorted(table.values(), key=lambda s: s.requests, reverse=True)
+            return [s.summary(span) for s in (rows[:top] if top else rows)]
+
+        return {
+            "span_s": span,
+            "total": self.total.summary(span),
+            "malformed_lines": self.malformed,
+            "distinct_routes": len(self.routes),
+            "distinct_certs": len(self.certs),
+            "routes": ranked(self.routes),
+            "certs": ranked(self.certs),
+        }
+
+
+def mapped_lines(path):
+    """Lines of a regular file through mmap, without reading it into memory"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter(mm.readline, b"")
+
+
+def read_lines(path):
+    if path == "-":
+        return iter(sys.stdin.buffer)
+    if path.endswith(".gz"):
+        return _gzip_lines(path)
+    return mapped_lines(path)
+
+
+def _gzip_lines(path):
+    with gzip.open(path, "rb") as f:
+        yield from f
+
+
+def follow_lines(path, poll=0.5, from_start=False):
+    """Yield lines appended to path as they are written, like tail -F: the
+    file is reopened when it is rotated or truncated. Yields None whenever
+    there is no new data, so the caller can do periodic work."""
+    f, inode = None, None
+    pending = b""
+    while True:
+        if f is None:
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                from_start = True  # everything in a file created later is new
+                yield None
+                time.sleep(poll)
+                continue
+            inode = os.fstat(f.fileno()).st_ino
+            if not from_start:
+                f.seek(0, os.SEEK_END)
+            from_start = True  # files that replace a rotated one are read whole
+
+        chunk = f.read(1 << 20)
+        if chunk:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            yield from lines
+            continue
+
+        try:
+            st = os.stat(path)
+            rotated = st.st_ino != inode or st.st_size < f.tell()
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            f.close()
+            f, pending = None, b""
+            continue
+        yield None
+        time.sleep(poll)
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    header = f"{'requests':>10}{'req/s':>10}{'err%':>7}{'resumed':>9}"
+    header += "".join(f"{'p' + format(p, 'g') + ' ms':>11}" for p in PERCENTILES)
+    print(f"{header}  key")
+    for row in rows:
+        line = f"{row['requests']:>10}{row['rate_per_s']:>10.1f}{row['error_ratio']:>7.1%}{row['resumed_ratio']:>9.0%}"
+        line += "".join(f"{row['latency_ms'][f'p{p:g}']:>11.2f}" for p in PERCENTILES)
+        print(f"{line}  {row['label']}")
+
+
+def print_report(report, by):
+    total = report["total"]
+    print("=" * 78)
+    print(f"{total['requests']} requests over {report['span_s']:.1f}s ({total['rate_per_s']:.1f}/s), "
+          f"{total['error_ratio']:.1%} errors, {total['resumed_ratio']:.0%} on resumed sessions, "
+          f"{report['distinct_certs']} certificates, {report['distinct_routes']} routes")
+    if report["malformed_lines"]:
+        print(f"[!] {report['malformed_lines']} malformed lines skipped")
+    if by in (None, BY_ROUTE):
+        print_table("Per route", report["routes"])
+    if by in (None, BY_CERT):
+        print_table("Per client certificate", report["certs"])
+
+
+def write_json(path, report):
+    if path == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def follow(args):
+    if len(args.files) != 1 or args.files[0] == "-":
+        print("[!] --follow takes exactly one log file", file=sys.stderr)
+        return 2
+    out = None
+    if args.json:
+        out = sys.stdout if args.json == "-" else open(args.json, "a")
+    window, started = Analyzer(), time.monotonic()
+    try:
+        for line in follow_lines(args.files[0], from_start=args.from_start):
+            if line is not None:
+                window.feed((line,))
+            now = time.monotonic()
+            if now - started >= args.interval:
+                report = window.report(args.top, window=now - started)
+                if out:
+                    out.write(json.dumps(report) + "\n")
+                    out.flush()
+                if out is not sys.stdout:
+                    print(time.strftime("\n%H:%M:%S"))
+                    print_report(report, args.by)
+                    sys.stdout.flush()
+                window, started = Analyzer(), now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out and out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Per-certificate and per-route request rates and latency percentiles from access logs",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("files", nargs="+", help="Access log files (.gz allowed), - for stdin")
+    parser.add_argument("--by", choices=(BY_ROUTE, BY_CERT), help="Only report per route or per certificate")
+    parser.add_argument("--top", type=int, default=15, help="Rows per table, 0 for all (default: 15)")
+    parser.add_argument("--json", metavar="FILE",
+                        help="Write the report as JSON (- for stdout); with --follow, append one JSON line per window")
+    parser.add_argument("-f", "--follow", action="store_true", help="Keep reading the file as it grows")
+    parser.add_argument("--interval", type=float, default=10.0, help="Seconds per --follow report (default: 10)")
+    parser.add_argument("--from-start", action="store_true",
+                        help="With --follow, include what is already in the file in the first window")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.follow:
+        return follow(args)
+
+    analyzer = Analyzer()
+    for path in args.files:
+        try:
+            analyzer.feed(read_lines(path))
+        except OSError as e:
+            print(f"[!] {path}: {e}", file=sys.stderr)
+            return 1
+    report = analyzer.report(args.top)
+    if args.json:
+        write_json(args.json, report)
+    if args.json != "-":
+        print_report(report, args.by)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
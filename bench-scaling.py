@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Measure how mTLS handshake throughput scales with cores
+
+Starts the Rust server once per step with 1, 2, 4, ... cores and drives it
+with test-mtls.py --bench in new-connection mode (every request is a full
+handshake with a client certificate), then prints handshakes/s, speedup and
+parallel efficiency per step.
+
+--mode workers gives the server WORKERS=n worker threads in one process;
+--mode processes runs PROCESSES=n single-worker processes sharing the port
+through SO_REUSEPORT. On Linux the server is pinned to the first n CPUs
+with taskset so each step really has n cores; the load generators run as
+several processes (--clients) because one Python process is limited by the
+GIL, and should be given CPUs the server does not use for the numbers to
+mean anything (--client-cpus).
+
+Server settings (CERT_PATH, KEY_PATH, CA_PATH, ...) are taken from the
+environment; the server is always started on --port.
+
+Examples:
+    cargo build --release
+    python bench-scaling.py --cores 1,2,4 --duration 10
+    python bench-scaling.py --mode processes --cores 1,2,4,8 --client-cpus 8-15 --clients 8
+    python bench-scaling.py --json scaling.json
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+SERVER = os.path.join("target", "release", "mtls-server")
+LOAD_GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-mtls.py")
+MODE_WORKERS = "workers"
+MODE_PROCESSES = "processes"
+
+
+def default_cores():
+    """1, 2, 4, ... up to the CPU count"""
+    total = os.cpu_count() or 1
+    steps, n = [], 1
+    while n < total:
+        steps.append(n)
+        n *= 2
+    return steps + [total]
+
+
+def pinned(command, cpus):
+    """Prefix command with taskset -c cpus where taskset is available"""
+    if cpus and shutil.which("taskset"):
+        return ["taskset", "-c", cpus] + command
+    return command
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(args, cores):
+    env = dict(os.environ, BIND_ADDR="127.0.0.1", BIND_PORT=str(args.port), TLS_RELOAD_INTERVAL_SECS="0")
+    env.setdefault("LOG_LEVEL", "warn")
+    if args.mode == MODE_WORKERS:
+        env.update(WORKERS=str(cores), PROCESSES="1")
+    else:
+        env.update(WORKERS="1", PROCESSES=str(cores))
+    server = subprocess.Popen(pinned([args.server], f"0-{cores - 1}" if args.pin else None), env=env)
+    if not wait_for_port(args.port):
+        server.terminate()
+        raise RuntimeError(f"server did not start listening on port {args.port}")
+    # Spawned processes bind a moment after the first one
+    time.sleep(args.warmup)
+    return server
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_load(args):
+    """Run --clients load generators in parallel; returns their results"""
+    command = [sys.executable, LOAD_GENERATOR, "--bench", "--mode", "new", "--cert-ratio", "1",
+               "--url", f"https://127.0.0.1:{args.port}{args.path}", "--cert", args.cert, "--key", args.key,
+               "--concurrency", str(args.concurrency), "--duration", str(args.duration), "--json", "-"]
+    clients = [subprocess.Popen(pinned(command, args.client_cpus), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+               for _ in range(args.clients)]
+    results = []
+    for client in clients:
+        out, _ = client.communicate()
+        try:
+            results.append(json.loads(out))
+        except ValueError:
+            raise RuntimeError("load generator produced no results") from None
+    return results
+
+
+def summarize(cores, results):
+    groups = [r["groups"].get("with-cert", {}) for r in results]
+    handshakes = sum(g.get("full_handshakes", 0) for g in groups)
+    elapsed = max(r["elapsed_s"] for r in results)
+    return {
+        "cores": cores,
+        "handshakes": handshakes,
+        "handshakes_per_s": handshakes / elapsed if elapsed > 0 else 0.0,
+        # Worst client's percentiles: a conservative merge without raw samples
+        "handshake_p50_ms": max(g.get("handshake_ms", {}).get("p50", 0.0) for g in groups),
+        "handshake_p99_ms": max(g.get("handshake_ms", {}).get("p99", 0.0) for g in groups),
+        "errors": sum(r["total"]["errors"] for r in results),
+    }
+
+
+def print_report(args, steps):
+    print("=" * 70)
+    print(f"Handshake scaling: mode={args.mode}, {args.clients} clients x {args.concurrency} connections, "
+          f"{args.duration:g}s per step")
+    print("=" * 70)
+    print(f"{'cores':>6}{'hs/s':>12}{'speedup':>10}{'efficiency':>12}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    base = steps[0]["handshakes_per_s"] / steps[0]["cores"] if steps and steps[0]["handshakes_per_s"] else 0.0
+    for step in steps:
+        speedup = step["handshakes_per_s"] / base if base else 0.0
+        efficiency = speedup / step["cores"]
+        step["speedup"], step["efficiency"] = speedup, efficiency
+        print(f"{step['cores']:>6}{step['handshakes_per_s']:>12.1f}{speedup:>10.2f}{efficiency:>11.0%}"
+              f"{step['handshake_p50_ms']:>10.2f}{step['handshake_p99_ms']:>10.2f}{step['errors']:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure mTLS handshake throughput of the Rust server from 1 to N cores",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("--server", default=SERVER, help=f"Server binary (default: {SERVER})")
+    parser.add_argument("--mode", choices=(MODE_WORKERS, MODE_PROCESSES), default=MODE_WORKERS,
+                        help="Scale worker threads in one process, or SO_REUSEPORT processes")
+    parser.add_argument("--cores", help="Comma separated core counts (default: 1, 2, 4, ... up to the CPU count)")
+    parser.add_argument("--port", type=int, default=9543, help="Port to run the server on (default: 9543)")
+    parser.add_argument("--path", default="/health", help="Request path (default: /health)")
+    parser.add_argument("--cert", default="client-cert.pem", help="Client certificate")
+    parser.add_argument("--key", default="client-key.pem", help="Client private key")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Seconds per step")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Connections per load generator")
+    parser.add_argument("--clients", type=int, default=min(8, os.cpu_count() or 1),
+                        help="Load generator processes")
+    parser.add_argument("--client-cpus", help="taskset CPU list for the load generators, e.g. 8-15")
+    parser.add_argument("--no-pin", dest="pin", action="store_false", help="Do not pin the server with taskset")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to wait after the server is up")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+    try:
+        args.cores = [int(c) for c in args.cores.split(",")] if args.cores else default_cores()
+    except ValueError:
+        parser.error("--cores must be a comma separated list of integers")
+    if min(args.cores) < 1:
+        parser.error("--cores must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.pin and not shutil.which("taskset"):
+        print("[!] taskset not found: the server is not pinned, steps only differ in threads/processes",
+              file=sys.stderr)
+
+    steps = []
+    for cores in args.cores:
+        print(f"[*] {cores} core(s)...", file=sys.stderr)
+        try:
+            server = start_server(args, cores)
+        except (OSError, RuntimeError) as e:
+            print(f"[!] {e}", file=sys.stderr)
+            return 1
+        try:
+            steps.append(summarize(cores, run_load(args)))
+        except RuntimeError as e:
+            print(f"[!] {e}", file=sys.stderr)
+            return 1
+        finally:
+            stop_server(server)
+
+    print_report(args, steps)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"mode": args.mode, "clients": args.clients, "concurrency": args.concurrency,
+                       "duration_s": args.duration, "steps": steps}, f, indent=2)
+    return 1 if any(step["errors"] for step in steps) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
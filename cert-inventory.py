@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""Inventory certificates across directory trees and flag upcoming expiry
+
+Walks the given directories (for example one per host, or the repo with
+its ca.pem, cert.pem, client PEMs, .p12 bundles and letsencrypt/) and
+lists every certificate in PEM, DER and PKCS#12 files: subject, issuer,
+serial, key type, validity and SHA-256 fingerprint, as JSON or CSV.
+
+Files are parsed by a pool of worker processes. What they found is kept
+in a persistent index keyed by path, modification time and size, so a
+rerun only parses new and changed files; with an unchanged tree a rerun
+costs the directory walk and a stat per file, which keeps 100k files well
+inside a cron interval. Entries for deleted files are dropped from the
+index. Unreadable or unparseable files are reported on stderr and kept in
+the index, so they are not retried until they change.
+
+Exit codes follow the monitoring plugin convention, so the scanner can run
+from cron or as a check:
+    0  nothing expires within --warn days
+    1  something expires within --warn days
+    2  something expires within --critical days, or has expired
+    3  the scan itself failed
+
+Examples:
+    python cert-inventory.py . --format csv -o inventory.csv
+    python cert-inventory.py /srv/hosts/* --warn 30 --critical 7 --quiet
+    python cert-inventory.py issued letsencrypt --p12-password s3cret --expiring
+    python cert-inventory.py /etc/ssl --index /var/cache/cert-inventory.json -j 16
+"""
+import argparse
+import csv
+import datetime
+import fnmatch
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed448, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+INDEX_VERSION = 1
+DEFAULT_INDEX = ".cert-inventory-index.json"
+DEFAULT_EXTENSIONS = (".pem", ".crt", ".cer", ".der", ".p12", ".pfx")
+DEFAULT_EXCLUDES = (".git", "node_modules", "target", "vendor", "__pycache__")
+P12_EXTENSIONS = (".p12", ".pfx")
+# Files larger than this are not certificate stores
+MAX_FILE_SIZE = 4 * 1024 * 1024
+
+EXIT_OK, EXIT_WARNING, EXIT_CRITICAL, EXIT_UNKNOWN = 0, 1, 2, 3
+STATUSES = {EXIT_OK: "ok", EXIT_WARNING: "warning", EXIT_CRITICAL: "critical"}
+
+FIELDS = ("status", "days_left", "not_after", "not_before", "subject", "issuer", "serial",
+          "key_type", "is_ca", "sha256", "root", "path", "position")
+
+
+# ---------------------------------------------------------------------------
+# Parsing (worker processes)
+# ---------------------------------------------------------------------------
+
+_p12_passwords = ()
+
+
+def init_worker(p12_passwords):
+    global _p12_passwords
+    _p12_passwords = tuple(None if p == "" else p.encode() for p in p12_passwords)
+
+
+def key_type(cert):
+    try:
+        key = cert.public_key()
+    except (ValueError, TypeError):
+        return "unknown"
+    if isinstance(key, rsa.RSAPublicKey):
+        return f"RSA {key.key_size}"
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        return f"EC {key.curve.name}"
+    if isinstance(key, ed25519.Ed25519PublicKey):
+        return "Ed25519"
+    if isinstance(key, ed448.Ed448PublicKey):
+        return "Ed448"
+    if isinstance(key, dsa.DSAPublicKey):
+        return f"DSA {key.key_size}"
+    return type(key).__name__
+
+
+def describe(cert):
+    try:
+        constraints = cert.extensions.get_extension_for_class(x509.BasicConstraints).value
+        is_ca = constraints.ca
+    except (x509.ExtensionNotFound, ValueError):
+        is_ca = False
+    return {
+        "subject": cert.subject.rfc4514_string(),
+        "issuer": cert.issuer.rfc4514_string(),
+        "serial": format(cert.serial_number, "x"),
+        "key_type": key_type(cert),
+        "not_before": cert.not_valid_before_utc.isoformat(),
+        "not_after": cert.not_valid_after_utc.isoformat(),
+        "is_ca": is_ca,
+        "sha256": hashlib.sha256(cert.public_bytes(serialization.Encoding.DER)).hexdigest(),
+    }
+
+
+def load_p12(data):
+    for password in _p12_passwords:
+        try:
+            _, cert, extra = pkcs12.load_key_and_certificates(data, password)
+        except ValueError:
+            continue
+        return ([cert] if cert else []) + list(extra)
+    raise ValueError("PKCS#12 password not in --p12-password")
+
+
+def parse_file(path):
+    """Certificates in one file: (path, [certificate dicts], error)"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(MAX_FILE_SIZE + 1)
+        if len(data) > MAX_FILE_SIZE:
+            return path, [], None
+        if path.lower().endswith(P12_EXTENSIONS):
+            certs = load_p12(data)
+        elif b"-----BEGIN CERTIFICATE-----" in data:
+            certs = x509.load_pem_x509_certificates(data)
+        elif data[:1] == b"\x30":
+            try:
+                certs = [x509.load_der_x509_certificate(data)]
+            except ValueError:
+                # A DER key, CSR or CRL
+                certs = []
+        else:
+            # PEM keys, CSRs and other non-certificate files
+            certs = []
+        return path, [describe(cert) for cert in certs], None
+    except (OSError, ValueError) as e:
+        return path, [], str(e) or type(e).__name__
+
+
+# ---------------------------------------------------------------------------
+# Walk and index
+# ---------------------------------------------------------------------------
+
+def walk(root, extensions, excludes):
+    """(path, mtime_ns, size) of candidate files under root. Symlinked files
+    are followed, symlinked directories are not, so loops are impossible."""
+    excluded = re.compile("|".join(fnmatch.translate(pattern) for pattern in excludes)).match
+    if os.path.isfile(root):
+        st = os.stat(root)
+        yield root, st.st_mtime_ns, st.st_size
+        return
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            print(f"[!] {directory}: {e.strerror}", file=sys.stderr)
+            continue
+        with entries:
+            for entry in entries:
+                if excluded(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        st = entry.stat()
+                        yield entry.path, st.st_mtime_ns, st.st_size
+                except OSError:
+                    # Dangling symlink, or removed while walking
+                    continue
+
+
+def load_index(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        print(f"[!] {path} is corrupt, rebuilding it", file=sys.stderr)
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index.get("files", {})
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def save_index(path, files):
+    write_atomic(path, json.dumps({"version": INDEX_VERSION, "files": files}, separators=(",", ":")))
+
+
+def scan(args):
+    """Walk the roots and bring the index up to date. Returns
+    ({path: index entry}, {path: root}, files parsed)."""
+    files = load_index(args.index)
+    extensions = tuple(e.lower() for e in args.ext)
+    seen, stale, changed = {}, [], False
+    for root in args.roots:
+        for path, mtime_ns, size in walk(root, extensions, args.exclude):
+            seen[path] = root
+            entry = files.get(path)
+            if entry is None or entry["mtime_ns"] != mtime_ns or entry["size"] != size:
+                files[path] = {"mtime_ns": mtime_ns, "size": size, "certs": [], "error": None}
+                stale.append(path)
+
+    # Forget deleted files under the scanned roots; entries under other
+    # roots sharing the index stay
+    prefixes = tuple(os.path.join(root, "") for root in args.roots)
+    for path in [p for p in files if p not in seen and (p.startswith(prefixes) or p in args.roots)]:
+        del files[path]
+        changed = True
+
+    if stale:
+        if not args.quiet:
+            print(f"[*] {len(seen)} files, parsing {len(stale)} new or changed with {args.workers} workers",
+                  file=sys.stderr)
+        # Large chunks: most files take well under a millisecond to parse
+        chunksize = max(1, min(256, len(stale) // (args.workers * 4)))
+        with multiprocessing.Pool(args.workers, init_worker, (args.p12_password,)) as pool:
+            for path, certs, error in pool.imap_unordered(parse_file, stale, chunksize):
+                files[path]["certs"], files[path]["error"] = certs, error
+    if stale or changed:
+        save_index(args.index, files)
+    return files, seen, len(stale)
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+def inventory(files, seen, args, now):
+    """Certificate rows, soonest expiry first, and the worst status"""
+    rows, worst = [], EXIT_OK
+    for path, root in seen.items():
+        entry = files[path]
+        if entry["error"] and not args.quiet:
+            print(f"[!] {path}: {entry['error']}", file=sys.stderr)
+        for position, cert in enumerate(entry["certs"]):
+            days_left = (datetime.datetime.fromisoformat(cert["not_after"]) - now).total_seconds() / 86400
+            if days_left <= args.critical:
+                status = EXIT_CRITICAL
+            elif days_left <= args.warn:
+                status = EXIT_WARNING
+            else:
+                status = EXIT_OK
+            worst = max(worst, status)
+            if args.expiring and status == EXIT_OK:
+                continue
+            rows.append(dict(cert, status=STATUSES[status], days_left=round(days_left, 1),
+                             root=root, path=path, position=position))
+    rows.sort(key=lambda row: (row["not_after"], row["path"], row["position"]))
+    return rows, worst
+
+
+def write_report(rows, args, summary):
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output != "-" else sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(out, FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            # One certificate per line: readable, and far faster than
+            # indenting with json.dump for a large inventory
+            header = json.dumps(summary, indent=2)[:-2]
+            out.write(header + ',\n  "certificates": [')
+            out.write(",".join("\n    " + json.dumps(row) for row in rows))
+            out.write("\n  ]\n}\n" if rows else "]\n}\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inventory PEM, DER and PKCS#12 certificates and flag upcoming expiry",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("roots", nargs="+", help="Directories (or files) to scan")
+    parser.add_argument("--format", choices=("json", "csv"), default="json", help="Output format (default: json)")
+    parser.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    parser.add_argument("--index", default=DEFAULT_INDEX, help=f"Index file (default: {DEFAULT_INDEX})")
+    parser.add_argument("--warn", type=float, default=30, help="Warning threshold in days (default: 30)")
+    parser.add_argument("--critical", type=float, default=7, help="Critical threshold in days (default: 7)")
+    parser.add_argument("--expiring", action="store_true", help="Only list certificates past --warn")
+    parser.add_argument("--ext", action="append", default=None, metavar="EXT",
+                        help=f"File extension to parse, repeatable (default: {' '.join(DEFAULT_EXTENSIONS)})")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB",
+                        help=f"File or directory names to skip, repeatable (default: {' '.join(DEFAULT_EXCLUDES)})")
+    parser.add_argument("--p12-password", action="append", default=None,
+                        help="PKCS#12 password to try, repeatable (default: mtls and empty)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the summary line; a report for -o is still written")
+    args = parser.parse_args(argv)
+    args.ext = args.ext or list(DEFAULT_EXTENSIONS)
+    args.exclude = args.exclude or list(DEFAULT_EXCLUDES)
+    args.p12_password = args.p12_password or ["mtls", ""]
+    args.roots = [os.path.abspath(root) for root in args.roots]
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.critical > args.warn:
+        parser.error("--critical must not exceed --warn")
+    return args
+
+
+def main(argv=None):
+    try:
+        args = parse_args(argv)
+    except SystemExit as e:
+        return EXIT_UNKNOWN if e.code else EXIT_OK
+
+    start = time.monotonic()
+    try:
+        files, seen, parsed = scan(args)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        rows, worst = inventory(files, seen, args, now)
+        certificates = sum(len(files[path]["certs"]) for path in seen)
+        errors = sum(1 for path in seen if files[path]["error"])
+        summary = {
+            "generated": now.isoformat(timespec="seconds"),
+            "files": len(seen),
+            "certificate_count": certificates,
+            "errors": errors,
+            "status": STATUSES[worst],
+        }
+        # --quiet leaves only the summary line, unless the report goes to a file
+        if args.output != "-" or not args.quiet:
+            write_report(rows, args, summary)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return EXIT_UNKNOWN
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted; the index was not updated", file=sys.stderr)
+        return EXIT_UNKNOWN
+
+    counts = {status: sum(1 for row in rows if row["status"] == name) for status, name in STATUSES.items()}
+    mark = "✓" if worst == EXIT_OK else "!"
+    print(f"[{mark}] {len(seen)} files ({parsed} parsed) in {time.monotonic() - start:.1f}s, "
+          f"{certificates} certificates: {counts[EXIT_CRITICAL]} critical, {counts[EXIT_WARNING]} warning"
+          + (f", {errors} unreadable" if errors else ""), file=sys.stderr)
+    return worst
+
+
+if __name__ == "__main__":
+    sys.exit(main())
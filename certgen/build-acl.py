@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Build or check the client certificate ACL from issuance manifests
+
+The Rust (ACL_FILE) and Go (-acl-file) servers load the output into a hash
+index keyed by certificate fingerprint and check every request against it,
+reloading the file when it changes. It is written to a temporary file and
+renamed into place, so a server never reads a half-written ACL.
+
+Certificates come from bulk-issue.py manifest.jsonl files. Each one gets
+the routes of the first --rule whose CN pattern matches it, or --routes if
+none does; certificates with neither, expired ones and those whose serial
+is listed in a --revoked file are left out. Rules are keyed on the SPKI
+fingerprint (which survives re-issuing a certificate for the same key) or,
+with --key cert, on the certificate fingerprint.
+
+File format, one rule per line, # starts a comment:
+
+    public <route>...             open to every client, with or without a certificate
+    spki <sha256 hex> <route>...  leaf SubjectPublicKeyInfo fingerprint
+    cert <sha256 hex> <route>...  leaf certificate fingerprint
+    cn <pattern> <route>...       subject CN, exact or with * wildcards, %-encoded
+
+A route is an exact path, a prefix ending in *, or * for every path.
+Fingerprint rules for one client are merged; CN rules only apply to clients
+without a fingerprint rule.
+
+Examples:
+    python certgen/build-acl.py issued/manifest.jsonl --routes /api/certs --public /health
+    python certgen/build-acl.py issued/manifest.jsonl --rule 'ops-*=*' --rule 'kiosk-*=/api/certs'
+    python certgen/build-acl.py issued/manifest.jsonl --cn-rule 'build agent=/metrics' -o acl.txt
+    python certgen/build-acl.py --check acl.txt issued/manifest.jsonl
+"""
+import argparse
+import datetime
+import fnmatch
+import io
+import json
+import os
+import re
+import sys
+import urllib.parse
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+KEY_SPKI = "spki"
+KEY_CERT = "cert"
+RULE_KINDS = ("public", KEY_SPKI, KEY_CERT, "cn")
+FINGERPRINT = re.compile(r"^[0-9a-f]{64}$")
+
+# Paths the servers serve, for warnings about routes that match nothing
+KNOWN_ROUTES = (
+    "/health", "/api/certs", "/api/certs/valid", "/metrics",  # Rust
+    "/", "/json", "/json/valid",                             # Go
+    "/.well-known/est/cacerts", "/.well-known/est/simpleenroll", "/.well-known/est/simplereenroll",
+    "/images/mtls-on.svg", "/images/mtls-off.svg",
+)
+
+
+def parse_routes(text):
+    routes = [r for r in re.split(r"[,\s]+", text.strip()) if r]
+    for route in routes:
+        if route != "*" and not route.startswith("/"):
+            raise ValueError(f"route {route!r} must start with / or be *")
+    return routes
+
+
+def parse_rule(text):
+    """PATTERN=ROUTES from --rule/--cn-rule"""
+    pattern, sep, routes = text.rpartition("=")
+    if not sep or not pattern:
+        raise argparse.ArgumentTypeError(f"{text!r}: expected PATTERN=ROUTES")
+    try:
+        return pattern, parse_routes(routes)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def route_matches(pattern, path):
+    if pattern == "*":
+        return True
+    if pattern.endswith("*"):
+        return path.startswith(pattern[:-1])
+    return pattern == path
+
+
+# ---------------------------------------------------------------------------
+# Inputs
+# ---------------------------------------------------------------------------
+
+def read_manifest(path):
+    """Records of a bulk-issue manifest.jsonl"""
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{lineno}: {e}") from None
+            if not isinstance(record, dict) or "cn" not in record:
+                raise ValueError(f"{path}:{lineno}: not a manifest record")
+            yield record
+
+
+def read_serials(path):
+    """Lower-case hex serials without leading zeros, one per line"""
+    serials = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#")[0].strip().lower().replace(":", "")
+            if line:
+                serials.add(line.removeprefix("0x").lstrip("0") or "0")
+    return serials
+
+
+def is_expired(record, now):
+    not_after = record.get("not_after")
+    if not not_after:
+        return False
+    return datetime.datetime.fromisoformat(not_after) < now
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def select(records, args, revoked, now):
+    """(record, routes) for every certificate to grant, plus skip counts"""
+    selected, skipped = [], {"expired": 0, "revoked": 0, "no routes": 0}
+    for record in records:
+        serial = str(record.get("serial", "")).lower().lstrip("0") or "0"
+        if serial in revoked:
+            skipped["revoked"] += 1
+            continue
+        if not args.include_expired and is_expired(record, now):
+            skipped["expired"] += 1
+            continue
+        routes = next((r for pattern, r in args.rule if fnmatch.fnmatchcase(record["cn"], pattern)), args.routes)
+        if not routes:
+            skipped["no routes"] += 1
+            continue
+        selected.append((record, routes))
+    return selected, skipped
+
+
+def render(selected, args):
+    lines = [f"# Generated by certgen/build-acl.py on "
+             f"{datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')}"]
+    if args.public:
+        lines.append("public " + " ".join(args.public))
+    field = "spki_sha256" if args.key == KEY_SPKI else "sha256"
+    for record, routes in sorted(selected, key=lambda item: (item[0]["cn"], item[0].get(field, ""))):
+        fingerprint = record.get(field)
+        if not fingerprint:
+            raise ValueError(f"{record['cn']}: manifest record has no {field}")
+        name = record.get("name") or record["cn"]
+        lines.append(f"{args.key} {fingerprint} {' '.join(routes)}  # {name}")
+    for pattern, routes in args.cn_rule:
+        lines.append(f"cn {urllib.parse.quote(pattern, safe='*')} {' '.join(routes)}")
+    return "\n".join(lines) + "\n"
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------------------
+# Check
+# ---------------------------------------------------------------------------
+
+def check(text, manifests=()):
+    """Validate ACL text the way the servers parse it. Returns (errors,
+    warnings, rule count)."""
+    errors, warnings = [], []
+    known = {}
+    for record in manifests:
+        for field in ("spki_sha256", "sha256"):
+            if record.get(field):
+                known[record[field]] = record.get("name") or record["cn"]
+    seen = {}
+    rules = 0
+
+    for lineno, line in enumerate(text.splitlines(), 1):
+        fields = line.split()
+        for i, f in enumerate(fields):
+            if f.startswith("#"):
+                fields = fields[:i]
+                break
+        if not fields:
+            continue
+        kind, rest = fields[0], fields[1:]
+        where = f"line {lineno}"
+        if kind not in RULE_KINDS:
+            errors.append(f"{where}: unknown rule {kind!r}")
+            continue
+        if kind != "public":
+            if not rest:
+                errors.append(f"{where}: {kind} rule without a {'pattern' if kind == 'cn' else 'fingerprint'}")
+                continue
+            key, rest = rest[0], rest[1:]
+            if kind in (KEY_SPKI, KEY_CERT):
+                if not FINGERPRINT.match(key):
+                    errors.append(f"{where}: expected a 64 lower-case hex digit SHA-256 fingerprint")
+                    continue
+                if manifests and key not in known:
+                    warnings.append(f"{where}: fingerprint {key[:16]}... is not in the manifests")
+            elif re.search(r"%(?![0-9a-fA-F]{2})", key):
+                errors.append(f"{where}: invalid %-escape in CN pattern")
+                continue
+            if (kind, key) in seen:
+                warnings.append(f"{where}: duplicate of line {seen[kind, key]}, the routes are merged")
+            seen.setdefault((kind, key), lineno)
+            rules += 1
+        if not rest:
+            warnings.append(f"{where}: rule grants no routes")
+        for route in rest:
+            if route != "*" and not route.startswith("/"):
+                errors.append(f"{where}: route {route!r} must start with / or be *")
+            elif not any(route_matches(route, path) for path in KNOWN_ROUTES):
+                warnings.append(f"{where}: route {route} matches no route either server serves")
+    return errors, warnings, rules
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the client certificate ACL from bulk-issue manifests, or check an ACL file",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("manifests", nargs="*", help="bulk-issue manifest.jsonl files")
+    parser.add_argument("--routes", type=parse_routes, default=[],
+                        help="Routes for certificates no --rule matches, comma separated")
+    parser.add_argument("--rule", type=parse_rule, action="append", default=[], metavar="CN_GLOB=ROUTES",
+                        help="Routes for manifest certificates whose CN matches (repeatable, first match wins)")
+    parser.add_argument("--cn-rule", type=parse_rule, action="append", default=[], metavar="CN_PATTERN=ROUTES",
+                        help="Emit a CN rule, for certificates not in the manifests (repeatable)")
+    parser.add_argument("--public", type=parse_routes, default=[], help="Routes open to every client")
+    parser.add_argument("--key", choices=(KEY_SPKI, KEY_CERT), default=KEY_SPKI,
+                        help="Fingerprint to key rules on (default: spki)")
+    parser.add_argument("--revoked", action="append", default=[],
+                        help="File of hex serials to leave out (repeatable)")
+    parser.add_argument("--include-expired", action="store_true", help="Keep certificates past their not_after")
+    parser.add_argument("--check", metavar="ACL", help="Check an existing ACL file (against the manifests, if given)")
+    parser.add_argument("-o", "--output", default="acl.txt", help="Output file (default: acl.txt)")
+    args = parser.parse_args(argv)
+    if not args.check and not args.manifests and not args.cn_rule and not args.public:
+        parser.error("nothing to build: give manifests, --cn-rule or --public")
+    return args
+
+
+def report(errors, warnings):
+    for warning in warnings:
+        print(f"[!] {warning}", file=sys.stderr)
+    for error in errors:
+        print(f"[✗] {error}", file=sys.stderr)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        records = [r for path in args.manifests for r in read_manifest(path)]
+        if args.check:
+            with open(args.check, encoding="utf-8") as f:
+                errors, warnings, rules = check(f.read(), records)
+            report(errors, warnings)
+            if errors:
+                return 1
+            print(f"[✓] {args.check}: {rules} rules, {len(warnings)} warnings")
+            return 0
+
+        revoked = set()
+        for path in args.revoked:
+            revoked |= read_serials(path)
+        selected, skipped = select(records, args, revoked, datetime.datetime.now(datetime.timezone.utc))
+        text = render(selected, args)
+        errors, warnings, rules = check(text)
+        report(errors, warnings)
+        if errors:
+            return 1
+        write_atomic(args.output, text)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return 1
+
+    skipped_text = ", ".join(f"{n} {reason}" for reason, n in skipped.items() if n)
+    print(f"[✓] {rules} rules -> {args.output}" + (f" (skipped {skipped_text})" if skipped_text else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""Issue client certificates in bulk
+
+Batch replacement for running gencert.sh once per device. Reads a CSV or
+JSONL manifest with one certificate per row, generates the keys in a pool
+of worker processes and signs them in process with the CA loaded once per
+worker, instead of shelling out to cfssl and openssl for every cert.
+
+Each row needs a CN; the subject fields C, L, O, OU and ST default to the
+names in ca.json and can be overridden per row, as can the key type
+("algo": rsa or ecdsa) and size. Signing usages and expiry come from the
+default profile in config.json, the same files cfssl uses.
+
+For every certificate <name>.pem, <name>-key.pem and <name>.p12 are written
+to the output directory (cfssljson naming), and a line with its serial and
+fingerprints is appended to <out>/manifest.jsonl once all files are on
+disk. Rerunning with the same manifest skips everything already recorded
+there, so an interrupted run can simply be restarted.
+
+Examples:
+    python certgen/bulk-issue.py devices.csv --out issued
+    python certgen/bulk-issue.py devices.jsonl --key-type ecdsa --workers 8
+    python certgen/bulk-issue.py devices.csv --p12-legacy --p12-password s3cret
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+CERTGEN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+KEY_RSA = "rsa"
+KEY_ECDSA = "ecdsa"
+DEFAULT_KEY_SIZES = {KEY_RSA: 2048, KEY_ECDSA: 256}
+CURVES = {256: ec.SECP256R1, 384: ec.SECP384R1, 521: ec.SECP521R1}
+
+# cfssl subject field names -> X.509 attributes
+SUBJECT_FIELDS = [
+    ("C", NameOID.COUNTRY_NAME),
+    ("ST", NameOID.STATE_OR_PROVINCE_NAME),
+    ("L", NameOID.LOCALITY_NAME),
+    ("O", NameOID.ORGANIZATION_NAME),
+    ("OU", NameOID.ORGANIZATIONAL_UNIT_NAME),
+]
+
+# cfssl usage names -> KeyUsage flags / ExtendedKeyUsage OIDs
+KEY_USAGES = {
+    "signing": "digital_signature",
+    "digital signature": "digital_signature",
+    "key encipherment": "key_encipherment",
+    "key agreement": "key_agreement",
+}
+EXT_KEY_USAGES = {
+    "client auth": ExtendedKeyUsageOID.CLIENT_AUTH,
+    "server auth": ExtendedKeyUsageOID.SERVER_AUTH,
+    "email protection": ExtendedKeyUsageOID.EMAIL_PROTECTION,
+}
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+def parse_expiry(value):
+    """Parse a cfssl/Go duration such as "262800h" or "8760h30m" """
+    units = {"h": 3600, "m": 60, "s": 1}
+    parts = re.findall(r"(\d+(?:\.\d+)?)([hms])", value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        raise ValueError(f"unsupported expiry {value!r}")
+    return datetime.timedelta(seconds=sum(float(n) * units[u] for n, u in parts))
+
+
+def load_profile(config_file, profile):
+    """Return (usages, expiry) of a signing profile in config.json"""
+    with open(config_file, encoding="utf-8") as f:
+        signing = json.load(f)["signing"]
+    if profile == "default":
+        settings = signing["default"]
+    else:
+        settings = signing.get("profiles", {})[profile]
+    usages = settings.get("usages", [])
+    unknown = [u for u in usages if u not in KEY_USAGES and u not in EXT_KEY_USAGES]
+    if unknown:
+        raise ValueError(f"unsupported usages in {config_file}: {', '.join(unknown)}")
+    return usages, parse_expiry(settings.get("expiry", "8760h"))
+
+
+def load_subject_defaults(ca_config_file):
+    """Subject fields from the first "names" entry of ca.json"""
+    with open(ca_config_file, encoding="utf-8") as f:
+        names = json.load(f).get("names") or [{}]
+    return {field: names[0][field] for field, _ in SUBJECT_FIELDS if names[0].get(field)}
+
+
+# ---------------------------------------------------------------------------
+# Manifest input and output
+# ---------------------------------------------------------------------------
+
+def read_requests(path):
+    """Yield one dict per row of a CSV or JSONL request manifest"""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f"{path}:{lineno}: {e}") from None
+        else:
+            for row in csv.DictReader(f):
+                yield {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+
+
+def file_stem(request):
+    """Output file name for a request: its "name" column, or the CN"""
+    name = request.get("name") or request["CN"]
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+def load_issued(manifest_file):
+    """File stems already recorded in the output manifest"""
+    issued = set()
+    if not os.path.exists(manifest_file):
+        return issued
+    with open(manifest_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                issued.add(json.loads(line)["name"])
+            except (json.JSONDecodeError, KeyError):
+                # A torn last line from an interrupted run; that cert is
+                # simply issued again
+                continue
+    return issued
+
+
+def plan(requests, defaults, issued):
+    """Resolve requests into jobs, skipping issued and duplicate names"""
+    jobs, seen, skipped = [], set(), 0
+    for request in requests:
+        if not request.get("CN"):
+            raise ValueError(f"request without a CN: {request}")
+        stem = file_stem(request)
+        if stem in seen:
+            print(f"[!] Duplicate name {stem!r}, issuing it once", file=sys.stderr)
+            continue
+        seen.add(stem)
+        if stem in issued:
+            skipped += 1
+            continue
+
+        algo = str(request.get("algo", defaults["algo"])).lower()
+        if algo not in DEFAULT_KEY_SIZES:
+            raise ValueError(f"{stem}: unsupported key algo {algo!r}")
+        size = int(request.get("size") or (defaults["size"] if algo == defaults["algo"] else DEFAULT_KEY_SIZES[algo]))
+        if algo == KEY_ECDSA and size not in CURVES:
+            raise ValueError(f"{stem}: unsupported ECDSA size {size}")
+
+        subject = dict(defaults["subject"])
+        subject.update({field: request[field] for field, _ in SUBJECT_FIELDS if request.get(field)})
+        jobs.append({"name": stem, "cn": request["CN"], "subject": subject, "algo": algo, "size": size})
+    return jobs, skipped
+
+
+# ---------------------------------------------------------------------------
+# Worker processes
+# ---------------------------------------------------------------------------
+
+_worker = {}
+
+
+def init_worker(ca_cert_file, ca_key_file, usages, expiry, out_dir, p12_password, p12_legacy):
+    """Load the CA and signing settings once per worker process"""
+    with open(ca_cert_file, "rb") as f:
+        ca_cert = x509.load_pem_x509_certificate(f.read())
+    with open(ca_key_file, "rb") as f:
+        ca_key = serialization.load_pem_private_key(f.read(), password=None)
+
+    p12_encryption = None
+    if p12_password is not None:
+        if p12_legacy:
+            # 3DES/SHA-1 so that older Windows and macOS keychains can import it
+            p12_encryption = (
+                serialization.PrivateFormat.PKCS12.encryption_builder()
+                .kdf_rounds(50000)
+                .key_cert_algorithm(pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC)
+                .hmac_hash(hashes.SHA1())
+                .build(p12_password.encode())
+            )
+        else:
+            p12_encryption = serialization.BestAvailableEncryption(p12_password.encode())
+
+    key_usage = {flag: False for flag in (
+        "digital_signature", "content_commitment", "key_encipherment", "data_encipherment",
+        "key_agreement", "key_cert_sign", "crl_sign", "encipher_only", "decipher_only")}
+    for usage in usages:
+        if usage in KEY_USAGES:
+            key_usage[KEY_USAGES[usage]] = True
+
+    _worker.update(
+        ca_cert=ca_cert,
+        ca_key=ca_key,
+        aki=x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()),
+        key_usage=x509.KeyUsage(**key_usage) if any(key_usage.values()) else None,
+        ext_key_usage=[EXT_KEY_USAGES[u] for u in usages if u in EXT_KEY_USAGES],
+        expiry=expiry,
+        out_dir=out_dir,
+        p12_encryption=p12_encryption,
+    )
+
+
+def generate_key(algo, size):
+    if algo == KEY_RSA:
+        return rsa.generate_private_key(public_exponent=65537, key_size=size)
+    return ec.generate_private_key(CURVES[size]())
+
+
+def build_certificate(job, key):
+    w = _worker
+    subject = x509.Name(
+        [x509.NameAttribute(oid, job["subject"][field]) for field, oid in SUBJECT_FIELDS if field in job["subject"]]
+        + [x509.NameAttribute(NameOID.COMMON_NAME, job["cn"])]
+    )
+    # Backdate slightly to tolerate clock skew, as cfssl does
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(w["ca_cert"].subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + w["expiry"])
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .add_extension(w["aki"], critical=False)
+    )
+    if w["key_usage"] is not None:
+        builder = builder.add_extension(w["key_usage"], critical=True)
+    if w["ext_key_usage"]:
+        builder = builder.add_extension(x509.ExtendedKeyUsage(w["ext_key_usage"]), critical=False)
+    return builder.sign(w["ca_key"], hashes.SHA256())
+
+
+def write_atomic(path, data, mode=0o644):
+    """Write via a temporary file so an interrupted run never leaves a torn file"""
+    tmp = f"{path}.tmp{os.getpid()}"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def issue(job):
+    """Generate, sign and write one certificate; returns its manifest record"""
+    w = _worker
+    key = generate_key(job["algo"], job["size"])
+    cert = build_certificate(job, key)
+
+    cert_der = cert.public_bytes(serialization.Encoding.DER)
+    spki_der = key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    base = os.path.join(w["out_dir"], job["name"])
+    files = {"cert": f"{base}.pem", "key": f"{base}-key.pem"}
+
+    write_atomic(files["key"], key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()), 0o600)
+    write_atomic(files["cert"], cert.public_bytes(serialization.Encoding.PEM))
+    if w["p12_encryption"] is not None:
+        files["p12"] = f"{base}.p12"
+        write_atomic(files["p12"], pkcs12.serialize_key_and_certificates(
+            job["name"].encode(), key, cert, None, w["p12_encryption"]), 0o600)
+
+    return {
+        "name": job["name"],
+        "cn": job["cn"],
+        "serial": format(cert.serial_number, "x"),
+        "sha256": hashlib.sha256(cert_der).hexdigest(),
+        "spki_sha256": hashlib.sha256(spki_der).hexdigest(),
+        "key": f"{job['algo']}-{job['size']}",
+        "not_before": cert.not_valid_before_utc.isoformat(),
+        "not_after": cert.not_valid_after_utc.isoformat(),
+        "files": {kind: os.path.basename(path) for kind, path in files.items()},
+    }
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def run(args):
+    usages, expiry = load_profile(args.config, args.profile)
+    defaults = {
+        "algo": args.key_type,
+        "size": args.key_size or DEFAULT_KEY_SIZES[args.key_type],
+        "subject": load_subject_defaults(args.ca_config),
+    }
+    os.makedirs(args.out, exist_ok=True)
+    manifest_file = os.path.join(args.out, MANIFEST_NAME)
+    jobs, skipped = plan(read_requests(args.manifest), defaults, load_issued(manifest_file))
+
+    print(f"[*] {len(jobs)} certificates to issue, {skipped} already issued, {args.workers} workers")
+    if not jobs:
+        return 0
+
+    p12_password = None if args.no_p12 else args.p12_password
+    initargs = (args.ca_cert, args.ca_key, usages, expiry, args.out, p12_password, args.p12_legacy)
+    # Small chunks keep workers busy evenly; RSA keygen time varies a lot
+    chunksize = max(1, min(16, len(jobs) // (args.workers * 8)))
+
+    issued, start, last_report = 0, time.monotonic(), 0.0
+    with open(manifest_file, "a", encoding="utf-8") as manifest, \
+            multiprocessing.Pool(args.workers, init_worker, initargs) as pool:
+        try:
+            for record in pool.imap_unordered(issue, jobs, chunksize):
+                # Recorded only after the files are written, so a resumed
+                # run reissues anything that was in flight
+                manifest.write(json.dumps(record, separators=(",", ":")) + "\n")
+                manifest.flush()
+                issued += 1
+                now = time.monotonic()
+                if now - last_report >= 1:
+                    last_report = now
+                    rate = issued / (now - start)
+                    print(f"    {issued}/{len(jobs)} issued, {rate:.1f} certs/s", flush=True)
+        except KeyboardInterrupt:
+            pool.terminate()
+            print(f"\n[!] Interrupted after {issued} certificates; rerun to resume", file=sys.stderr)
+            return 130
+
+    elapsed = time.monotonic() - start
+    print(f"[✓] Issued {issued} certificates in {elapsed:.1f}s ({issued / elapsed:.1f} certs/s)")
+    print(f"[✓] Manifest: {manifest_file}")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Issue client certificates in bulk from a CSV or JSONL manifest",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("manifest", help="CSV (header row) or .jsonl file with a CN per row")
+    parser.add_argument("--out", default="issued", help="Output directory (default: issued)")
+    parser.add_argument("--ca-cert", default=os.path.join(CERTGEN_DIR, "root.pem"), help="CA certificate")
+    parser.add_argument("--ca-key", default=os.path.join(CERTGEN_DIR, "root-key.pem"), help="CA private key")
+    parser.add_argument("--ca-config", default=os.path.join(CERTGEN_DIR, "ca.json"),
+                        help="cfssl CA config supplying default subject fields")
+    parser.add_argument("--config", default=os.path.join(CERTGEN_DIR, "config.json"),
+                        help="cfssl signing config supplying usages and expiry")
+    parser.add_argument("--profile", default="default", help="Signing profile in --config")
+    parser.add_argument("--key-type", choices=sorted(DEFAULT_KEY_SIZES), default=KEY_RSA,
+                        help="Default key type (default: rsa)")
+    parser.add_argument("--key-size", type=int,
+                        help="Default key size: RSA bits or ECDSA curve size 256/384/521")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument("--p12-password", default="mtls", help="PKCS#12 password (default: mtls)")
+    parser.add_argument("--p12-legacy", action="store_true",
+                        help="Encrypt .p12 files with 3DES/SHA-1 for older Windows/macOS imports")
+    parser.add_argument("--no-p12", action="store_true", help="Skip .p12 output")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        return run(args)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Compile CRLs and serial lists into a revocation set for the servers
+
+The Rust (REVOCATION_FILE) and Go (-revocation-file) servers memory-map the
+output and look certificates up in a hash table keyed by issuer and serial,
+so lookup cost stays flat however many certificates are revoked. Both
+servers reload the file when it changes; it is written to a temporary file
+and renamed into place, never modified in place.
+
+Inputs are CRL files (PEM or DER, several PEM CRLs per file allowed) and
+serial lists: one hex serial per line, or a bulk-issue.py manifest.jsonl
+(its "serial" field), together with the issuing CA certificate via
+--issuer. With --ca, CRLs are only accepted if signed by one of the given
+CAs.
+
+File layout (little endian): magic "MTLSREV1" | slot count u32 (power of
+two) | entry count u32 | created unix u64 | 8 reserved bytes | slots. Each
+16 byte slot holds SHA-256(issuer DER length u32 BE | issuer DER | serial
+magnitude)[:16], all zeros when empty; a key's probe sequence starts at its
+first 8 bytes (u64) masked by the slot count and continues linearly. The
+table is at most half full.
+
+Examples:
+    python certgen/compile-revocations.py crl/*.crl -o revocations.bin
+    python certgen/compile-revocations.py --serials lost.txt --issuer certgen/root.pem
+    python certgen/compile-revocations.py ca.crl --ca ca.pem --serials lost.txt --issuer ca.pem
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+MAGIC = b"MTLSREV1"
+HEADER = struct.Struct("<8sIIQ8x")
+SLOT_LEN = 16
+MIN_SLOTS = 16
+
+
+def revocation_key(issuer_der, serial):
+    """Hash table key of an (issuer, serial) pair"""
+    serial_bytes = serial.to_bytes((serial.bit_length() + 7) // 8, "big")
+    digest = hashlib.sha256(struct.pack(">I", len(issuer_der)) + issuer_der + serial_bytes).digest()
+    return digest[:SLOT_LEN]
+
+
+def issuer_der(name):
+    return name.public_bytes(serialization.Encoding.DER)
+
+
+# ---------------------------------------------------------------------------
+# Inputs
+# ---------------------------------------------------------------------------
+
+def load_crls(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"-----BEGIN X509 CRL-----" not in data:
+        return [x509.load_der_x509_crl(data)]
+    crls, marker = [], b"-----END X509 CRL-----"
+    for block in data.split(marker)[:-1]:
+        crls.append(x509.load_pem_x509_crl(block[block.index(b"-----BEGIN"):] + marker))
+    return crls
+
+
+def load_certificate(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"-----BEGIN" in data:
+        return x509.load_pem_x509_certificate(data)
+    return x509.load_der_x509_certificate(data)
+
+
+def crl_keys(path, cas):
+    """Keys of every revoked certificate in the CRLs in path"""
+    keys = []
+    now = time.time()
+    for crl in load_crls(path):
+        if cas:
+            signers = [ca for ca in cas if ca.subject == crl.issuer]
+            if not any(crl.is_signature_valid(ca.public_key()) for ca in signers):
+                raise ValueError(f"{path}: CRL for {crl.issuer.rfc4514_string()} is not signed by a --ca")
+        next_update = crl.next_update_utc
+        if next_update is not None and next_update.timestamp() < now:
+            print(f"[!] {path}: CRL for {crl.issuer.rfc4514_string()} is past its next update "
+                  f"({next_update.isoformat()})", file=sys.stderr)
+
+        issuer = issuer_der(crl.issuer)
+        keys.extend(revocation_key(issuer, revoked.serial_number) for revoked in crl)
+    return keys
+
+
+def parse_serial(text):
+    text = text.strip().lower().replace(":", "")
+    if text.startswith("0x"):
+        text = text[2:]
+    return int(text, 16)
+
+
+def serial_keys(path, issuer):
+    """Keys of a serial list: hex serials, one per line, or manifest.jsonl"""
+    keys = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                serial = parse_serial(json.loads(line)["serial"] if line.startswith("{") else line)
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"{path}:{lineno}: not a serial: {e}") from None
+            keys.append(revocation_key(issuer, serial))
+    return keys
+
+
+# ---------------------------------------------------------------------------
+# Output
+# ---------------------------------------------------------------------------
+
+def build_table(keys):
+    """Open-addressing table of unique keys, at most half full"""
+    unique = set(keys)
+    slots = MIN_SLOTS
+    while slots < 2 * len(unique) + 1:
+        slots *= 2
+    mask = slots - 1
+    empty = bytes(SLOT_LEN)
+
+    table = bytearray(slots * SLOT_LEN)
+    for key in sorted(unique):
+        if key == empty:
+            raise ValueError("revocation key collides with the empty slot marker")
+        i = int.from_bytes(key[:8], "little") & mask
+        while table[i * SLOT_LEN:(i + 1) * SLOT_LEN] != empty:
+            i = (i + 1) & mask
+        table[i * SLOT_LEN:(i + 1) * SLOT_LEN] = key
+    return HEADER.pack(MAGIC, slots, len(unique), int(time.time())) + table, len(unique)
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compile CRLs and serial lists into a memory-mappable revocation set",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("crls", nargs="*", help="CRL files (PEM or DER)")
+    parser.add_argument("--serials", action="append", default=[],
+                        help="File of hex serials or a bulk-issue manifest.jsonl (repeatable)")
+    parser.add_argument("--issuer", help="CA certificate that issued the --serials certificates")
+    parser.add_argument("--ca", action="append", default=[],
+                        help="Only accept CRLs signed by this CA certificate (repeatable)")
+    parser.add_argument("-o", "--output", default="revocations.bin", help="Output file (default: revocations.bin)")
+    args = parser.parse_args(argv)
+    if args.serials and not args.issuer:
+        parser.error("--serials requires --issuer")
+    if not args.crls and not args.serials:
+        parser.error("nothing to compile: give CRL files and/or --serials")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.monotonic()
+    try:
+        cas = [load_certificate(path) for path in args.ca]
+        keys = []
+        for path in args.crls:
+            keys.extend(crl_keys(path, cas))
+        if args.serials:
+            issuer = issuer_der(load_certificate(args.issuer).subject)
+            for path in args.serials:
+                keys.extend(serial_keys(path, issuer))
+
+        data, entries = build_table(keys)
+        write_atomic(args.output, data)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return 1
+
+    print(f"[✓] {entries} revoked certificates -> {args.output} "
+          f"({len(data) / 1024:.0f} KiB, {time.monotonic() - start:.2f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
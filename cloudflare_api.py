@@ -0,0 +1,264 @@
+"""Shared Cloudflare API client for setup-mtls.py and configure-mtls.py
+
+One pooled requests.Session per client, so every call reuses a kept-alive
+TLS connection instead of opening a new one. On top of that:
+
+- list endpoints are paginated automatically (page/per_page and cursors)
+- 429 responses are retried after Retry-After, and a 429 seen by one thread
+  pauses every thread of the client, so a fan-out does not keep hammering a
+  rate-limited API
+- 5xx responses and connection errors are retried with exponential backoff
+  and jitter for idempotent methods
+- fan_out() runs independent lookups (zone, tunnel, DNS, apps, policies)
+  concurrently on the shared pool
+- get_if_changed() and list_if_changed() send If-None-Match with a cached
+  ETag, so an unchanged resource costs a bodyless 304
+
+Set CLOUDFLARE_API_BASE to point the scripts at cloudflare_standin.py for
+offline testing and benchmarking.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE = "https://api.cloudflare.com/client/v4"
+DEFAULT_PER_PAGE = 50
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class CloudflareError(Exception):
+    """An API call failed; errors is the "errors" list of the response"""
+
+    def __init__(self, method, path, status, errors):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.errors = errors or []
+        detail = "; ".join(f"{e.get('code')}: {e.get('message')}" for e in self.errors) or "no error detail"
+        super().__init__(f"{method} {path} failed with HTTP {status}: {detail}")
+
+
+class CloudflareClient:
+    """Pooled, retrying Cloudflare API v4 client, safe to share across threads"""
+
+    def __init__(self, token=None, email=None, api_key=None, base_url=None,
+                 max_retries=5, backoff=0.5, max_backoff=30.0, timeout=30,
+                 pool_size=16, per_page=DEFAULT_PER_PAGE):
+        self.base_url = (base_url or os.getenv("CLOUDFLARE_API_BASE") or API_BASE).rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.per_page = per_page
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        else:
+            self.session.headers["X-Auth-Email"] = email or ""
+            self.session.headers["X-Auth-Key"] = api_key or ""
+
+        # Monotonic time before which no request may be sent, shared by all
+        # threads after a 429
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Client authenticated with CLOUDFLARE_API_TOKEN, or with
+        CLOUDFLARE_ACCOUNT + CLOUDFLARE_API_KEY (global API key)"""
+        token = os.getenv("CLOUDFLARE_API_TOKEN")
+        if token:
+            return cls(token=token, **kwargs)
+        return cls(email=os.getenv("CLOUDFLARE_ACCOUNT"), api_key=os.getenv("CLOUDFLARE_API_KEY"), **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -----------------------------------------------------------------------
+    # Requests
+    # -----------------------------------------------------------------------
+
+    def request(self, method, path, params=None, json=None, headers=None):
+        """Send a request and return the parsed response envelope"""
+        return self._send(method, path, params, json, headers)[1]
+
+    def _send(self, method, path, params=None, json=None, headers=None):
+        """Send a request, returning (response, envelope); the envelope is
+        None for 304 Not Modified"""
+        method = method.upper()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            self._wait_for_rate_limit()
+            with self._lock:
+                self.requests_sent += 1
+            try:
+                resp = self.session.request(method, url, params=params, json=json, headers=headers,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    raise
+                attempt = self._retry(attempt, None)
+                continue
+
+            if resp.status_code == 429 and attempt < self.max_retries:
+                # Not processed by the API, so safe to retry for any method
+                attempt = self._retry(attempt, resp.headers.get("Retry-After"), rate_limited=True)
+                continue
+            if resp.status_code >= 500 and method in IDEMPOTENT_METHODS and attempt < self.max_retries:
+                attempt = self._retry(attempt, resp.headers.get("Retry-After"))
+                continue
+            if resp.status_code == 304:
+                return resp, None
+
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {"success": False, "errors": [{"code": resp.status_code, "message": resp.text[:200]}]}
+            if not resp.ok or not data.get("success", False):
+                raise CloudflareError(method, path, resp.status_code, data.get("errors"))
+            return resp, data
+
+    def _retry(self, attempt, retry_after, rate_limited=False):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        with self._lock:
+            self.retries += 1
+            if rate_limited:
+                self._not_before = max(self._not_before, time.monotonic() + delay)
+        if not rate_limited:
+            time.sleep(delay)
+        return attempt + 1
+
+    def _wait_for_rate_limit(self):
+        while True:
+            with self._lock:
+                wait = self._not_before - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def get(self, path, params=None):
+        return self.request("GET", path, params=params)["result"]
+
+    def post(self, path, json=None):
+        return self.request("POST", path, json=json)["result"]
+
+    def put(self, path, json=None):
+        return self.request("PUT", path, json=json)["result"]
+
+    def patch(self, path, json=None):
+        return self.request("PATCH", path, json=json)["result"]
+
+    def delete(self, path):
+        return self.request("DELETE", path)["result"]
+
+    # -----------------------------------------------------------------------
+    # Pagination
+    # -----------------------------------------------------------------------
+
+    def paginate(self, path, params=None):
+        """Yield every item of a list endpoint, following page numbers or
+        cursors as the endpoint reports them in result_info"""
+        params = dict(params or {})
+        params.setdefault("per_page", self.per_page)
+        while params is not None:
+            data = self.request("GET", path, params=params)
+            yield from data.get("result") or []
+            params = self._next_page(params, data)
+
+    def _next_page(self, params, data):
+        """Query parameters for the page after data, None after the last"""
+        info = data.get("result_info") or {}
+        cursor = (info.get("cursors") or {}).get("after") or info.get("cursor")
+        if cursor:
+            params = dict(params, cursor=cursor)
+            params.pop("page", None)
+            return params
+        total_pages = info.get("total_pages")
+        if total_pages is None and info.get("total_count") is not None:
+            total_pages = -(-info["total_count"] // max(1, info.get("per_page") or params["per_page"]))
+        page = params.get("page", 1)
+        if total_pages is None or page >= total_pages:
+            return None
+        return dict(params, page=page + 1)
+
+    def list(self, path, params=None):
+        return list(self.paginate(path, params))
+
+    # -----------------------------------------------------------------------
+    # Conditional requests
+    # -----------------------------------------------------------------------
+
+    def get_if_changed(self, path, etag=None, params=None):
+        """GET path unless it still matches etag from an earlier call.
+
+        Returns (result, etag), or (None, etag) on 304 Not Modified. The
+        returned etag is None when the endpoint does not send one, in which
+        case callers fall back to comparing modified_on.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        resp, data = self._send("GET", path, params=params, headers=headers)
+        if data is None:
+            return None, etag
+        return data["result"], resp.headers.get("ETag")
+
+    def list_if_changed(self, path, etag=None, params=None):
+        """list() made conditional on the first page's ETag.
+
+        Returns (items, etag), or (None, etag) on 304 Not Modified. The
+        stand-in's collection ETags cover every page; against endpoints whose
+        ETag only covers one page, pass a per_page large enough for the
+        whole filtered collection.
+        """
+        params = dict(params or {})
+        params.setdefault("per_page", self.per_page)
+        headers = {"If-None-Match": etag} if etag else None
+        resp, data = self._send("GET", path, params=params, headers=headers)
+        if data is None:
+            return None, etag
+        items = list(data.get("result") or [])
+        next_params = self._next_page(params, data)
+        if next_params is not None:
+            items.extend(self.paginate(path, next_params))
+        return items, resp.headers.get("ETag")
+
+    # -----------------------------------------------------------------------
+    # Fan-out
+    # -----------------------------------------------------------------------
+
+    def fan_out(self, calls):
+        """Run independent calls concurrently.
+
+        calls maps a name to a zero-argument callable; returns a dict of the
+        same names to results. The first exception is re-raised after all
+        calls finished.
+        """
+        if not calls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(calls), self.pool_size)) as pool:
+            futures = {name: pool.submit(fn) for name, fn in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Cloudflare API endpoints used by the mTLS scripts
+
+Serves an in-memory copy of the accounts, tunnels, zones, DNS records,
+client certificates, Access apps and Access policies that setup-mtls.py
+and configure-mtls.py touch, with the same response envelope and
+page/per_page pagination as the real API. Point the scripts at it with
+CLOUDFLARE_API_BASE:
+
+    python cloudflare_standin.py --port 8787 --latency 40 &
+    CLOUDFLARE_API_BASE=http://127.0.0.1:8787/client/v4 \\
+        CLOUDFLARE_API_TOKEN=test python configure-mtls.py
+
+--latency adds a fixed delay per request (roughly a round trip to the real
+API) so connection reuse and concurrent fan-out show up in benchmarks, and
+--rate-limit N answers every Nth request with 429 and Retry-After to
+exercise backoff, and --server-errors N every Nth with 503 to exercise
+retries. --apps/--policies/--dns-records pad the lists so pagination is
+exercised too, by page number or, with --cursors, by cursor as some
+endpoints of the real API do.
+
+GET responses carry an ETag (for lists, over the whole filtered collection
+rather than the page) and If-None-Match is answered with 304, so
+reconcile-mtls.py's cached refresh can be exercised.
+"""
+import argparse
+import base64
+import copy
+import datetime
+import hashlib
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = "/client/v4"
+MAX_PER_PAGE = 50
+
+ACCOUNT_ID = "0123456789abcdef0123456789abcdef"
+ZONE_ID = "9b9e2119bd8cf84887e5eaa68fcbe58e"
+ZONE_NAME = "nietst.uk"
+TUNNEL_ID = "2050906e-5e20-4896-8313-44a8fe994a9f"
+TUNNEL_NAME = "mTLS-Tunnel"
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+def etag_of(value):
+    return '"%s"' % hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def pem_fingerprint(pem):
+    """SHA-256 of the DER inside a PEM certificate"""
+    body = "".join(line for line in pem.splitlines() if line and not line.startswith("-----"))
+    return hashlib.sha256(base64.b64decode(body)).hexdigest()
+
+
+def default_state(apps=1, policies=1, dns_records=1):
+    """Seed data matching the production setup, padded with filler entries"""
+    created = now()
+    state = {
+        "accounts": [{"id": ACCOUNT_ID, "name": "mTLS account"}],
+        "tunnels": {
+            TUNNEL_ID: {"id": TUNNEL_ID, "name": TUNNEL_NAME, "created_at": created,
+                        "account_tag": ACCOUNT_ID, "status": "healthy"},
+        },
+        "zones": [{"id": ZONE_ID, "name": ZONE_NAME, "status": "active", "modified_on": created}],
+        "dns_records": {ZONE_ID: []},
+        "client_certificates": {ZONE_ID: []},
+        "apps": {ZONE_ID: []},
+        "policies": {ZONE_ID: []},
+    }
+
+    records = state["dns_records"][ZONE_ID]
+    records.append({"id": new_id(), "type": "CNAME", "name": ZONE_NAME, "content": f"{TUNNEL_ID}.cfargotunnel.com",
+                    "proxied": True, "ttl": 1, "modified_on": created})
+    for i in range(1, dns_records):
+        records.append({"id": new_id(), "type": "A", "name": f"host{i}.{ZONE_NAME}", "content": f"192.0.2.{i % 250 + 1}",
+                        "proxied": False, "ttl": 300, "modified_on": created})
+
+    # Filler apps come first so a client that takes apps[0] picks the wrong one
+    for i in range(1, apps):
+        state["apps"][ZONE_ID].append({"id": new_id(), "name": f"Internal app {i}", "domain": f"app{i}.{ZONE_NAME}",
+                                       "type": "self_hosted", "modified_on": created})
+    state["apps"][ZONE_ID].append({"id": new_id(), "name": "mTLS", "domain": ZONE_NAME,
+                                   "type": "self_hosted", "modified_on": created})
+
+    for i in range(1, policies):
+        state["policies"][ZONE_ID].append({"id": new_id(), "name": f"Allow group {i}", "decision": "allow",
+                                           "include": [{"everyone": {}}], "require": [], "exclude": [],
+                                           "precedence": i + 1, "modified_on": created})
+    state["policies"][ZONE_ID].append({"id": new_id(), "name": "mTLS Policy", "decision": "non_identity",
+                                       "include": [{"certificate": {}}], "require": [], "exclude": [],
+                                       "precedence": 1, "modified_on": created})
+    return state
+
+
+class StandinAPI:
+    """Routing and state for the stand-in; thread safe"""
+
+    def __init__(self, state, latency=0.0, rate_limit=0, retry_after=1, server_errors=0, cursors=False):
+        self.state = state
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.server_errors = server_errors
+        self.cursors = cursors
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        self.stats = {"requests": 0, "rate_limited": 0, "server_errors": 0, "connections": 0, "not_modified": 0,
+                      "mutations": 0}
+        self.routes = [
+            ("GET", r"/accounts", self.list_accounts),
+            ("GET", r"/accounts/(\w+)/cfd_tunnel", self.list_tunnels),
+            ("GET", r"/accounts/(\w+)/cfd_tunnel/([\w-]+)", self.get_tunnel),
+            ("GET", r"/accounts/(\w+)/cfd_tunnel/([\w-]+)/token", self.get_tunnel_token),
+            ("GET", r"/zones", self.list_zones),
+            ("GET", r"/zones/(\w+)/dns_records", self.list_dns_records),
+            ("POST", r"/zones/(\w+)/dns_records", self.create_dns_record),
+            ("GET", r"/zones/(\w+)/dns_records/(\w+)", self.get_dns_record),
+            ("PUT", r"/zones/(\w+)/dns_records/(\w+)", self.update_dns_record),
+            ("GET", r"/zones/(\w+)/client_certificates", self.list_client_certificates),
+            ("POST", r"/zones/(\w+)/client_certificates", self.create_client_certificate),
+            ("GET", r"/zones/(\w+)/client_certificates/(\w+)", self.get_client_certificate),
+            ("GET", r"/zones/(\w+)/access/apps", self.list_apps),
+            ("POST", r"/zones/(\w+)/access/apps", self.create_app),
+            ("GET", r"/zones/(\w+)/access/apps/(\w+)", self.get_app),
+            ("PUT", r"/zones/(\w+)/access/apps/(\w+)", self.update_app),
+            ("GET", r"/zones/(\w+)/access/policies", self.list_policies),
+            ("POST", r"/zones/(\w+)/access/policies", self.create_policy),
+            ("GET", r"/zones/(\w+)/access/policies/(\w+)", self.get_policy),
+            ("PUT", r"/zones/(\w+)/access/policies/(\w+)", self.update_policy),
+            ("GET", r"/_stats", self.get_stats),
+        ]
+
+    def handle(self, method, path, query, body, if_none_match=None):
+        """Return (status, headers, envelope) for a request; envelope is
+        None for 304 Not Modified"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.stats["requests"] += 1
+            n = next(self.counter)
+            if self.rate_limit and n % self.rate_limit == 0:
+                self.stats["rate_limited"] += 1
+                return 429, {"Retry-After": str(self.retry_after)}, error(971, "Please wait and consider throttling your request speed")
+            if self.server_errors and n % self.server_errors == 0:
+                self.stats["server_errors"] += 1
+                return 503, {}, error(10000, "Service temporarily unavailable")
+
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                with self.lock:
+                    status, payload, *rest = handler(query, body, *match.groups())
+                    headers = rest[0] if rest else {}
+                    if method != "GET" and status == 200:
+                        self.stats["mutations"] += 1
+                    if method == "GET" and status == 200 and path != "/_stats":
+                        headers.setdefault("ETag", etag_of(payload["result"]))
+                        if if_none_match == headers["ETag"]:
+                            self.stats["not_modified"] += 1
+                            return 304, headers, None
+                return status, headers, payload
+        return 404, {}, error(7003, f"No route for {method} {path}")
+
+    # Handlers return (status, envelope) or (status, envelope, headers) and
+    # run under self.lock
+
+    def list_accounts(self, query, body):
+        return self.paginate(self.state["accounts"], query)
+
+    def list_tunnels(self, query, body, account_id):
+        tunnels = list(self.state["tunnels"].values()) if account_id == ACCOUNT_ID else []
+        if "name" in query:
+            tunnels = [t for t in tunnels if t["name"] == query["name"]]
+        return self.paginate(tunnels, query)
+
+    def get_tunnel(self, query, body, account_id, tunnel_id):
+        tunnel = self.state["tunnels"].get(tunnel_id)
+        if account_id != ACCOUNT_ID or tunnel is None:
+            return 404, error(1003, "Tunnel not found")
+        return 200, ok(copy.deepcopy(tunnel))
+
+    def get_tunnel_token(self, query, body, account_id, tunnel_id):
+        if account_id != ACCOUNT_ID or tunnel_id not in self.state["tunnels"]:
+            return 404, error(1003, "Tunnel not found")
+        return 200, ok(hashlib.sha256(tunnel_id.encode()).hexdigest())
+
+    def list_zones(self, query, body):
+        zones = self.state["zones"]
+        if "name" in query:
+            zones = [z for z in zones if z["name"] == query["name"]]
+        return self.paginate(zones, query)
+
+    def list_dns_records(self, query, body, zone_id):
+        records = self.state["dns_records"].get(zone_id)
+        if records is None:
+            return 404, error(1001, "Zone not found")
+        for field in ("name", "type"):
+            if field in query:
+                records = [r for r in records if r[field] == query[field]]
+        return self.paginate(records, query)
+
+    def create_dns_record(self, query, body, zone_id):
+        records = self.state["dns_records"].get(zone_id)
+        if records is None:
+            return 404, error(1001, "Zone not found")
+        if not body or not all(body.get(field) for field in ("type", "name", "content")):
+            return 400, error(9000, "type, name and content are required")
+        record = {"id": new_id(), "proxied": False, "ttl": 1, **body, "modified_on": now()}
+        records.append(record)
+        return 200, ok(copy.deepcopy(record))
+
+    def get_dns_record(self, query, body, zone_id, record_id):
+        return get_item(self.state["dns_records"].get(zone_id, []), record_id, 81044, "Record not found")
+
+    def update_dns_record(self, query, body, zone_id, record_id):
+        if not body or not all(body.get(field) for field in ("type", "name", "content")):
+            return 400, error(9000, "type, name and content are required")
+        return update_item(self.state["dns_records"].get(zone_id, []), record_id, body, 81044, "Record not found")
+
+    def list_client_certificates(self, query, body, zone_id):
+        return self.paginate(self.state["client_certificates"].get(zone_id, []), query)
+
+    def create_client_certificate(self, query, body, zone_id):
+        if not body or "BEGIN CERTIFICATE" not in body.get("certificate", ""):
+            return 400, error(1400, "certificate is required")
+        certs = self.state["client_certificates"].setdefault(zone_id, [])
+        cert = {"id": new_id(), "certificate": body["certificate"], "status": "active",
+                "fingerprint_sha256": pem_fingerprint(body["certificate"]),
+                "created_on": now(), "modified_on": now()}
+        certs.append(cert)
+        return 200, ok(copy.deepcopy(cert))
+
+    def get_client_certificate(self, query, body, zone_id, cert_id):
+        return get_item(self.state["client_certificates"].get(zone_id, []), cert_id, 1404, "Certificate not found")
+
+    def list_apps(self, query, body, zone_id):
+        return self.paginate(self.state["apps"].get(zone_id, []), query)
+
+    def create_app(self, query, body, zone_id):
+        if not body or not body.get("domain"):
+            return 400, error(12131, "domain is required")
+        app = {"id": new_id(), "type": "self_hosted", **body, "modified_on": now()}
+        self.state["apps"].setdefault(zone_id, []).append(app)
+        return 200, ok(copy.deepcopy(app))
+
+    def get_app(self, query, body, zone_id, app_id):
+        return get_item(self.state["apps"].get(zone_id, []), app_id, 12130, "access.api.error.not_found")
+
+    def update_app(self, query, body, zone_id, app_id):
+        if not body or not body.get("domain"):
+            return 400, error(12131, "domain is required")
+        return update_item(self.state["apps"].get(zone_id, []), app_id, body, 12130, "access.api.error.not_found")
+
+    def list_policies(self, query, body, zone_id):
+        return self.paginate(self.state["policies"].get(zone_id, []), query)
+
+    def create_policy(self, query, body, zone_id):
+        if not body or "name" not in body or "decision" not in body:
+            return 400, error(12131, "name and decision are required")
+        policy = {"id": new_id(), "include": [], "require": [], "exclude": [], **body, "modified_on": now()}
+        self.state["policies"].setdefault(zone_id, []).append(policy)
+        return 200, ok(copy.deepcopy(policy))
+
+    def get_policy(self, query, body, zone_id, policy_id):
+        return get_item(self.state["policies"].get(zone_id, []), policy_id, 12130, "access.api.error.not_found")
+
+    def update_policy(self, query, body, zone_id, policy_id):
+        if not body or "name" not in body or "decision" not in body:
+            return 400, error(12131, "name and decision are required")
+        return update_item(self.state["policies"].get(zone_id, []), policy_id, body, 12130, "access.api.error.not_found")
+
+    def get_stats(self, query, body):
+        return 200, ok(dict(self.stats))
+
+    def paginate(self, items, query):
+        return paginate_cursor(items, query) if self.cursors else paginate(items, query)
+
+
+def ok(result, result_info=None):
+    envelope = {"success": True, "errors": [], "messages": [], "result": result}
+    if result_info is not None:
+        envelope["result_info"] = result_info
+    return envelope
+
+
+def error(code, message):
+    return {"success": False, "errors": [{"code": code, "message": message}], "messages": [], "result": None}
+
+
+def get_item(items, item_id, code, message):
+    item = next((i for i in items if i["id"] == item_id), None)
+    if item is None:
+        return 404, error(code, message)
+    return 200, ok(copy.deepcopy(item))
+
+
+def update_item(items, item_id, body, code, message):
+    item = next((i for i in items if i["id"] == item_id), None)
+    if item is None:
+        return 404, error(code, message)
+    item.update(body)
+    item["modified_on"] = now()
+    return 200, ok(copy.deepcopy(item))
+
+
+def paginate(items, query):
+    try:
+        page = max(1, int(query.get("page", 1)))
+        per_page = min(MAX_PER_PAGE, max(1, int(query.get("per_page", 20))))
+    except ValueError:
+        return 400, error(1004, "page and per_page must be integers")
+    start = (page - 1) * per_page
+    chunk = copy.deepcopy(items[start:start + per_page])
+    total_pages = max(1, -(-len(items) // per_page))
+    return 200, ok(chunk, {"page": page, "per_page": per_page, "count": len(chunk),
+                           "total_count": len(items), "total_pages": total_pages}), {"ETag": etag_of(items)}
+
+
+def paginate_cursor(items, query):
+    """Cursor pagination: result_info.cursors.after points past the page and
+    is absent on the last one; there are no page numbers or totals"""
+    try:
+        start = int(base64.urlsafe_b64decode(query["cursor"]).decode()) if "cursor" in query else 0
+        per_page = min(MAX_PER_PAGE, max(1, int(query.get("per_page", 20))))
+    except ValueError:
+        return 400, error(1004, "invalid cursor or per_page")
+    chunk = copy.deepcopy(items[start:start + per_page])
+    info = {"per_page": per_page, "count": len(chunk), "cursors": {}}
+    if start + per_page < len(items):
+        info["cursors"]["after"] = base64.urlsafe_b64encode(str(start + per_page).encode()).decode()
+    return 200, ok(chunk, info), {"ETag": etag_of(items)}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def setup(self):
+            super().setup()
+            with api.lock:
+                api.stats["connections"] += 1
+
+        def dispatch(self):
+            url = urlsplit(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            body = None
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                try:
+                    body = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self.respond(400, {}, error(6007, "Malformed JSON in request body"))
+                    return
+            if not (self.headers.get("Authorization") or self.headers.get("X-Auth-Key")):
+                self.respond(400, {}, error(9106, "Missing X-Auth-Key, X-Auth-Email or Authorization headers"))
+                return
+            self.respond(*api.handle(self.command, url.path, query, body, self.headers.get("If-None-Match")))
+
+        def respond(self, status, headers, envelope):
+            payload = json.dumps(envelope).encode() if envelope is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=0, **kwargs):
+    """Start the stand-in in a background thread; returns (server, api).
+    The base URL is f"http://{host}:{server.server_port}/client/v4"."""
+    state = kwargs.pop("state", None) or default_state(
+        kwargs.pop("apps", 1), kwargs.pop("policies", 1), kwargs.pop("dns_records", 1))
+    api = StandinAPI(state, **kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Cloudflare API used by the mTLS scripts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0, help="Added delay per request in ms")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Answer every Nth request with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429")
+    parser.add_argument("--server-errors", type=int, default=0, help="Answer every Nth request with 503")
+    parser.add_argument("--cursors", action="store_true", help="Paginate lists by cursor instead of page number")
+    parser.add_argument("--apps", type=int, default=120, help="Access apps in the zone (default: 120)")
+    parser.add_argument("--policies", type=int, default=80, help="Access policies in the zone (default: 80)")
+    parser.add_argument("--dns-records", type=int, default=60, help="DNS records in the zone (default: 60)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server, api = serve(args.host, args.port, latency=args.latency / 1000, rate_limit=args.rate_limit,
+                        retry_after=args.retry_after, server_errors=args.server_errors, cursors=args.cursors,
+                        apps=args.apps, policies=args.policies, dns_records=args.dns_records)
+    print(f"Cloudflare stand-in on http://{args.host}:{server.server_port}{API_PREFIX}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"\n{api.stats}")
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,14 @@
 package main
 
 import (
-	"crypto/x509"
-	"errors"
+	"context"
 	"flag"
 	"log"
 	"os"
+	"os/signal"
+	"strings"
+	"syscall"
+	"time"
 
 	"github.com/diebietse/mtls-server/server"
 )
@@ -15,46 +18,216 @@ const (
 )
 
 func main() {
+	httpAddress := flag.String("http-addr", server.DefaultHTTPAddress, "Listen address for ACME HTTP challenges")
+	httpsAddress := flag.String("https-addr", server.DefaultHTTPSAddress, "Listen address for the site")
 	staging := flag.Bool("staging", false, "Use letsencrypt staging ACME server")
 	indexTemplate := flag.String("index-template", "index.html", "Set the filename for the index template to load")
 	rootCA := flag.String("root-ca", "root.pem", "root CA")
 	clientCert := flag.String("client-cert", "mtls-example-client.p12", "Relative link to the client certificate")
+	responseCacheSize := flag.Int("response-cache-size", server.DefaultResponseCacheSize, "Number of rendered responses to cache, negative to disable")
+	caReloadInterval := flag.Duration("root-ca-reload-interval", server.DefaultClientCAReloadInterval, "How often to check the root CA, revocation, ACL and tenant files for changes, 0 to disable")
+	revocationFile := flag.String("revocation-file", "", "Compiled revocation set (certgen/compile-revocations.py)")
+	aclFile := flag.String("acl-file", "", "Client certificate to route rules (certgen/build-acl.py)")
+	accessLogFile := flag.String("access-log", "", "Append one JSON line per request to this file, - for stdout")
+	certCacheDir := flag.String("cert-cache", "acme-cache", "Directory keeping ACME certificates and account keys across restarts, empty for memory only")
+	acmeDirectory := flag.String("acme-directory", "", "ACME directory URL, overriding Let's Encrypt and -staging (e.g. acme_standin.py)")
+	tenantsFile := flag.String("tenants", "", "SNI hostname to server certificate and client CA map, loaded per tenant on first use")
+	shutdownTimeout := flag.Duration("shutdown-timeout", 30*time.Second, "How long SIGTERM and SIGINT wait for in-flight requests before closing connections")
+	handoffTimeout := flag.Duration("handoff-timeout", server.DefaultHandoffTimeout, "How long SIGUSR2 waits for the new process to take over the listeners")
+	enrollCACert := flag.String("enroll-ca-cert", "", "CA certificate signing EST enrollments, empty to disable enrollment")
+	enrollCAKey := flag.String("enroll-ca-key", "", "Private key of -enroll-ca-cert")
+	enrollWorkers := flag.Int("enroll-workers", 0, "Number of CSRs signed at once, 0 for half the cores")
+	enrollQueue := flag.Int("enroll-queue", server.DefaultEnrollQueueDepth, "Number of CSRs waiting for a signer before enrollment answers 503")
+	enrollValidity := flag.Duration("enroll-validity", server.DefaultEnrollValidity, "Lifetime of enrolled certificates, capped at the CA's")
+	enrollManifest := flag.String("enroll-manifest", "", "Append a manifest.jsonl line for every enrolled certificate")
+	enrollToken := flag.String("enroll-token", "", "Bearer token letting clients enroll new subjects through simpleenroll")
+	enrollAllow := flag.String("enroll-allow", "", "Comma-separated common names, * matching any characters, that -enroll-token may enroll")
 	flag.Parse()
 
-	caCertPool, err := loadClientCA(*rootCA)
+	clientCAs, err := server.LoadClientCAs(*rootCA)
 	if err != nil {
 		log.Fatalf("Could not load client CA: %+v", err)
 	}
+	var revocations *server.Revocations
+	if *revocationFile != "" {
+		if revocations, err = server.LoadRevocations(*revocationFile); err != nil {
+			log.Fatalf("Could not load revocations: %+v", err)
+		}
+		log.Printf("Loaded %d revoked certificates", revocations.Len())
+	}
+	var acl *server.ACL
+	if *aclFile != "" {
+		if acl, err = server.LoadACL(*aclFile); err != nil {
+			log.Fatalf("Could not load ACL: %+v", err)
+		}
+		log.Printf("Loaded %d ACL rules", acl.Len())
+	}
+	var tenants *server.Tenants
+	if *tenantsFile != "" {
+		if tenants, err = server.LoadTenants(*tenantsFile); err != nil {
+			log.Fatalf("Could not load tenants: %+v", err)
+		}
+		log.Printf("Loaded %d tenants", tenants.Len())
+	}
+
+	if *caReloadInterval > 0 {
+		go clientCAs.Watch(context.Background(), *caReloadInterval)
+		if revocations != nil {
+			go revocations.Watch(context.Background(), *caReloadInterval)
+		}
+		if acl != nil {
+			go acl.Watch(context.Background(), *caReloadInterval)
+		}
+		if tenants != nil {
+			go tenants.Watch(context.Background(), *caReloadInterval)
+		}
+	}
+	go reloadOnHangup(clientCAs, revocations, acl, tenants)
+
+	var accessLog *server.AccessLog
+	if *accessLogFile != "" {
+		if accessLog, err = server.OpenAccessLog(*accessLogFile); err != nil {
+			log.Fatalf("Could not open access log: %+v", err)
+		}
+	}
+
+	var enroller *server.Enroller
+	if *enrollCACert != "" {
+		enroller, err = server.NewEnroller(server.EnrollConfig{
+			CACertFile:   *enrollCACert,
+			CAKeyFile:    *enrollCAKey,
+			Workers:      *enrollWorkers,
+			QueueDepth:   *enrollQueue,
+			Validity:     *enrollValidity,
+			ManifestFile: *enrollManifest,
+			Token:        *enrollToken,
+			AllowedNames: splitList(*enrollAllow),
+		})
+		if err != nil {
+			log.Fatalf("Could not set up enrollment: %+v", err)
+		}
+		log.Printf("Enrolling with %d signing workers", enroller.Stats().Workers)
+	}
 
 	fqdn := os.Getenv(fqdnEnv)
-	if len(fqdn) == 0 {
-		log.Fatalf("Please provide an FQDN by setting the environment variable '%s'", fqdnEnv)
+	if len(fqdn) == 0 && tenants == nil {
+		log.Fatalf("Please provide an FQDN by setting the environment variable '%s' or a -tenants file", fqdnEnv)
 	}
 
 	s, err := server.New(server.Config{
 		SiteFQDN:       fqdn,
 		TemplateFile:   *indexTemplate,
 		ClientCertName: *clientCert,
-		ClientCAPool:   caCertPool,
+		ClientCAs:      clientCAs,
+		Revocations:    revocations,
 		UseStaging:     *staging,
+		CertCacheDir:   *certCacheDir,
+		AccessLog:      accessLog,
+		ACL:            acl,
+		Tenants:        tenants,
+		Enroller:       enroller,
+
+		HTTPAddress:       *httpAddress,
+		HTTPSAddress:      *httpsAddress,
+		ResponseCacheSize: *responseCacheSize,
+		ACMEDirectoryURL:  *acmeDirectory,
 	})
 	if err != nil {
 		log.Fatal(err)
 	}
 
-	s.ListenAndServe()
+	serveErr := make(chan error, 1)
+	go func() {
+		serveErr <- s.ListenAndServe()
+	}()
+	serveUntilSignalled(s, serveErr, *handoffTimeout)
+
+	// Let in-flight requests, including those that arrive on keep-alive
+	// connections before they close, finish within the deadline
+	ctx, cancel := context.WithTimeout(context.Background(), *shutdownTimeout)
+	defer cancel()
+	if err := s.Shutdown(ctx); err != nil {
+		log.Printf("Closed connections still in use after %v: %v", *shutdownTimeout, err)
+	} else {
+		log.Printf("Drained all connections")
+	}
+	if enroller != nil {
+		enroller.Close()
+	}
+	if accessLog != nil {
+		accessLog.Close()
+	}
 }
 
-func loadClientCA(rootCA string) (*x509.CertPool, error) {
-	pem, err := os.ReadFile(rootCA)
-	if err != nil {
-		return nil, err
+// serveUntilSignalled returns on SIGTERM or SIGINT, or on SIGUSR2 once a new
+// process has taken over the listeners, for the caller to drain. A server
+// error is fatal.
+func serveUntilSignalled(s *server.MTLSServer, serveErr <-chan error, handoffTimeout time.Duration) {
+	signals := make(chan os.Signal, 1)
+	signal.Notify(signals, append([]os.Signal{syscall.SIGTERM, os.Interrupt}, handoffSignals...)...)
+	defer signal.Stop(signals)
+	for {
+		select {
+		case err := <-serveErr:
+			log.Fatal(err)
+		case sig := <-signals:
+			if sig == syscall.SIGTERM || sig == os.Interrupt {
+				log.Printf("Received %v, shutting down", sig)
+				return
+			}
+			pid, err := s.Handoff(handoffTimeout)
+			if err != nil {
+				log.Printf("%v: could not hand off listeners, still serving: %v", sig, err)
+				continue
+			}
+			log.Printf("%v: handed off listeners to pid %d, shutting down", sig, pid)
+			return
+		}
 	}
+}
 
-	certPool := x509.NewCertPool()
-	if !certPool.AppendCertsFromPEM(pem) {
-		return nil, errors.New("could not decode CA pem")
+// splitList splits a comma-separated flag value, dropping empty entries.
+func splitList(value string) []string {
+	var items []string
+	for _, item := range strings.Split(value, ",") {
+		if item = strings.TrimSpace(item); item != "" {
+			items = append(items, item)
+		}
 	}
+	return items
+}
 
-	return certPool, nil
+// reloadOnHangup reloads the client CA pool, revocation set, ACL and tenants
+// on every SIGHUP.
+func reloadOnHangup(clientCAs *server.ClientCAs, revocations *server.Revocations, acl *server.ACL, tenants *server.Tenants) {
+	hangups := make(chan os.Signal, 1)
+	signal.Notify(hangups, syscall.SIGHUP)
+	for range hangups {
+		if err := clientCAs.Reload(); err != nil {
+			log.Printf("SIGHUP: could not reload client CA, keeping current pool: %v", err)
+		} else {
+			log.Printf("SIGHUP: reloaded client CA")
+		}
+		if revocations != nil {
+			if err := revocations.Reload(); err != nil {
+				log.Printf("SIGHUP: could not reload revocations, keeping current set: %v", err)
+			} else {
+				log.Printf("SIGHUP: reloaded %d revoked certificates", revocations.Len())
+			}
+		}
+		if acl != nil {
+			if err := acl.Reload(); err != nil {
+				log.Printf("SIGHUP: could not reload ACL, keeping current rules: %v", err)
+			} else {
+				log.Printf("SIGHUP: reloaded %d ACL rules", acl.Len())
+			}
+		}
+		if tenants != nil {
+			if err := tenants.Reload(); err != nil {
+				log.Printf("SIGHUP: could not reload tenants, keeping current tenants: %v", err)
+			} else {
+				log.Printf("SIGHUP: reloaded %d tenants", tenants.Len())
+			}
+		}
+	}
 }
@@ -0,0 +1,8 @@
+//go:build !unix
+
+package main
+
+import "os"
+
+// handoffSignals is empty where listeners cannot be inherited.
+var handoffSignals []os.Signal
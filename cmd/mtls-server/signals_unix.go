@@ -0,0 +1,11 @@
+//go:build unix
+
+package main
+
+import (
+	"os"
+	"syscall"
+)
+
+// handoffSignals ask the server to hand its listeners to a new process.
+var handoffSignals = []os.Signal{syscall.SIGUSR2}
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 """
 Configure mTLS CA Certificate for Cloudflare Access
+
+For repeated runs (deploys), reconcile-mtls.py applies mtls-state.json and
+only changes what differs instead of uploading and rewriting every time.
 """
 import os
 import sys
-import json
 import io
-import requests
 from dotenv import load_dotenv
 
+from cloudflare_api import CloudflareClient, CloudflareError
+
 # Force UTF-8 output on Windows
 if sys.platform == "win32":
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
@@ -21,32 +24,28 @@ CLOUDFLARE_EMAIL = os.getenv("CLOUDFLARE_ACCOUNT")
 CLOUDFLARE_API_KEY = os.getenv("CLOUDFLARE_API_KEY")
 DOMAIN = "nietst.uk"
 CA_CERT_FILE = "ca.pem"
-API_BASE = "https://api.cloudflare.com/client/v4"
 
 if not CLOUDFLARE_EMAIL or not CLOUDFLARE_API_KEY:
     print("❌ Error: CLOUDFLARE_ACCOUNT and CLOUDFLARE_API_KEY not set in .env")
     sys.exit(1)
 
-headers = {
-    "X-Auth-Email": CLOUDFLARE_EMAIL,
-    "X-Auth-Key": CLOUDFLARE_API_KEY,
-    "Content-Type": "application/json",
-}
+# One pooled, retrying client for every call
+client = CloudflareClient(email=CLOUDFLARE_EMAIL, api_key=CLOUDFLARE_API_KEY)
 
 def get_zone_id():
     """Get zone ID for domain"""
     print(f"📍 Getting zone ID for {DOMAIN}...")
-    resp = requests.get(
-        f"{API_BASE}/zones?name={DOMAIN}",
-        headers=headers
-    )
-    data = resp.json()
+    try:
+        zones = client.get("zones", params={"name": DOMAIN})
+    except CloudflareError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
 
-    if not data.get("success"):
-        print(f"❌ Error: {data}")
+    if not zones:
+        print(f"❌ Error: zone {DOMAIN} not found")
         sys.exit(1)
 
-    zone_id = data["result"][0]["id"]
+    zone_id = zones[0]["id"]
     print(f"✅ Zone ID: {zone_id}")
     return zone_id
 
@@ -67,61 +66,42 @@ def upload_ca_certificate(zone_id, ca_cert):
         "certificate": ca_cert
     }
 
-    resp = requests.post(
-        f"{API_BASE}/zones/{zone_id}/client_certificates",
-        headers=headers,
-        json=payload
-    )
-
-    data = resp.json()
-    print(f"Response: {json.dumps(data, indent=2)}")
-
-    if data.get("success"):
-        cert_id = data["result"]["id"]
-        print(f"✅ Certificate uploaded with ID: {cert_id}")
-        return cert_id
-    else:
+    try:
+        result = client.post(f"zones/{zone_id}/client_certificates", json=payload)
+    except CloudflareError as e:
+        print(f"Response: {e}")
         print("⚠️  Certificate upload failed - will configure via policy")
         return None
 
-def get_access_apps(zone_id):
-    """Get all Access applications for the zone"""
-    print(f"\n🔍 Fetching Access applications for {DOMAIN}...")
-    resp = requests.get(
-        f"{API_BASE}/zones/{zone_id}/access/apps",
-        headers=headers
-    )
+    cert_id = result["id"]
+    print(f"✅ Certificate uploaded with ID: {cert_id}")
+    return cert_id
 
-    data = resp.json()
-    if not data.get("success"):
-        print(f"❌ Error: {data}")
-        return None
+def fetch_access_apps(zone_id):
+    """Fetch every page of Access applications for the zone"""
+    return client.list(f"zones/{zone_id}/access/apps")
+
+def fetch_policies(zone_id):
+    """Fetch every page of Access policies for the zone"""
+    return client.list(f"zones/{zone_id}/access/policies")
 
-    apps = data.get("result", [])
+def get_access_apps(apps):
+    """Pick the Access application protecting DOMAIN"""
+    print(f"\n🔍 Fetching Access applications for {DOMAIN}...")
     if not apps:
         print("❌ No Access applications found")
         return None
 
-    app = apps[0]
+    # Prefer the app for this domain over whichever the API lists first
+    app = next((a for a in apps if a.get("domain", "").split("/")[0] == DOMAIN), apps[0])
     app_id = app["id"]
-    print(f"✅ Found application: {app['name']}")
+    print(f"✅ Found application: {app['name']} (of {len(apps)})")
     print(f"   ID: {app_id}")
     return app_id
 
-def get_policies(zone_id):
-    """Get policies for zone"""
+def get_policies(policies):
+    """Pick the mTLS policy"""
     print(f"\n📋 Fetching mTLS policies for zone...")
-    resp = requests.get(
-        f"{API_BASE}/zones/{zone_id}/access/policies",
-        headers=headers
-    )
-
-    data = resp.json()
-    if not data.get("success"):
-        print(f"❌ Error: {data}")
-        return None
-
-    policies = data.get("result", [])
     if not policies:
         print("❌ No policies found")
         return None
@@ -137,7 +117,7 @@ def get_policies(zone_id):
         policy = policies[0]
 
     policy_id = policy["id"]
-    print(f"✅ Found policy: {policy['name']}")
+    print(f"✅ Found policy: {policy['name']} (of {len(policies)})")
     print(f"   ID: {policy_id}")
     return policy_id, policy
 
@@ -172,20 +152,15 @@ def update_policy_with_certificate(zone_id, policy_id, policy, ca_cert):
     if "isolation_required" in policy:
         payload["isolation_required"] = policy["isolation_required"]
 
-    resp = requests.put(
-        f"{API_BASE}/zones/{zone_id}/access/policies/{policy_id}",
-        headers=headers,
-        json=payload
-    )
-
-    data = resp.json()
-    if data.get("success"):
-        print("✅ Policy updated successfully")
-        return True
-    else:
-        print(f"⚠️  Policy update response: {json.dumps(data, indent=2)}")
+    try:
+        client.put(f"zones/{zone_id}/access/policies/{policy_id}", json=payload)
+    except CloudflareError as e:
+        print(f"⚠️  Policy update response: {e}")
         return False
 
+    print("✅ Policy updated successfully")
+    return True
+
 def main():
     print("=" * 60)
     print("🔐 Cloudflare mTLS Configuration")
@@ -197,16 +172,25 @@ def main():
     # Step 2: Read CA certificate
     ca_cert = read_ca_certificate()
 
-    # Step 3: Upload CA certificate
-    cert_id = upload_ca_certificate(zone_id, ca_cert)
+    # Steps 3-5 are independent: upload the CA certificate while fetching
+    # the Access apps and policies
+    try:
+        results = client.fan_out({
+            "cert_id": lambda: upload_ca_certificate(zone_id, ca_cert),
+            "apps": lambda: fetch_access_apps(zone_id),
+            "policies": lambda: fetch_policies(zone_id),
+        })
+    except CloudflareError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
 
     # Step 4: Get Access app
-    app_id = get_access_apps(zone_id)
+    app_id = get_access_apps(results["apps"])
     if not app_id:
         sys.exit(1)
 
     # Step 5: Get policies
-    result = get_policies(zone_id)
+    result = get_policies(results["policies"])
     if not result:
         sys.exit(1)
 
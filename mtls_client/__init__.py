@@ -0,0 +1,30 @@
+"""Python client for the mTLS server
+
+Loads a client certificate once (PEM files or a PKCS#12 bundle from
+certgen/gencert.sh), keeps a pool of keep-alive connections that resume
+TLS sessions, and parses /api/certs responses from either server into
+small __slots__ objects. MTLSClient is blocking and thread-safe,
+AsyncMTLSClient is its asyncio counterpart.
+
+    from mtls_client import Credentials, MTLSClient
+
+    creds = Credentials.from_p12("certgen/my-phone-cert.p12", "mtls", ca="certgen/root.pem")
+    with MTLSClient("https://localhost:8443", creds) as client:
+        print(client.get_certs())
+"""
+from .aio import AsyncMTLSClient
+from .client import ClientStats, MTLSClient
+from .credentials import Credentials, ResumingContext
+from .models import CertificateInfo, CertsResponse, HTTPError, Response
+
+__all__ = [
+    "AsyncMTLSClient",
+    "CertificateInfo",
+    "CertsResponse",
+    "ClientStats",
+    "Credentials",
+    "HTTPError",
+    "MTLSClient",
+    "Response",
+    "ResumingContext",
+]
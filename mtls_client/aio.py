@@ -0,0 +1,169 @@
+"""asyncio client with a pool of keep-alive connections
+
+Speaks HTTP/1.1 directly over asyncio streams (content-length and chunked
+bodies), so no third-party HTTP library is needed. Same API as MTLSClient
+with awaitable methods.
+"""
+import asyncio
+
+from .client import IDEMPOTENT_METHODS, ClientStats, split_base_url
+from .models import Response
+
+
+class _Connection:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @property
+    def ssl_object(self):
+        return self.writer.get_extra_info("ssl_object")
+
+    def close(self):
+        self.writer.close()
+
+
+async def _read_body(reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # Trailers until the empty line
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"]))
+    return await reader.read()
+
+
+async def _read_response(reader, method):
+    """(Response, keep_alive) of the next response on reader"""
+    line = await reader.readuntil(b"\r\n")
+    parts = line.decode("latin-1").split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise ConnectionError(f"malformed status line {line!r}")
+    version, status = parts[0], int(parts[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        body = b""
+    else:
+        body = await _read_body(reader, headers)
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    if "content-length" not in headers and "transfer-encoding" not in headers and body:
+        keep_alive = False  # body was delimited by the server closing
+    return Response(status, headers, body), keep_alive
+
+
+class AsyncMTLSClient:
+    """asyncio counterpart of MTLSClient, sharing its pooling, session
+    resumption and retry behaviour. Use from one event loop.
+
+        async with AsyncMTLSClient("https://localhost:8443", creds) as client:
+            results = await asyncio.gather(*(client.get_certs() for _ in range(100)))
+    """
+
+    def __init__(self, base_url, credentials, pool_size=10, timeout=10.0, headers=None):
+        self.host, self.port, self.prefix = split_base_url(base_url)
+        self.context = credentials.context
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.stats = ClientStats()
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+        self._closed = False
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.context, server_hostname=self.host),
+            self.timeout)
+        conn = _Connection(reader, writer)
+        self.stats.connections_opened += 1
+        if conn.ssl_object.session_reused:
+            self.stats.sessions_resumed += 1
+        return conn
+
+    async def _acquire(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn.reader.at_eof():
+                return conn, True
+            conn.close()
+        return await self._connect(), False
+
+    def _release(self, conn, keep_alive):
+        self.context.save_session(self.host, conn.ssl_object.session)
+        if keep_alive and not self._closed:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    async def _exchange(self, conn, method, path, body, headers):
+        head = [f"{method} {self.prefix}{path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        if body is not None:
+            if isinstance(body, str):
+                body = body.encode()
+            head.append(f"Content-Length: {len(body)}")
+        conn.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await conn.writer.drain()
+        return await asyncio.wait_for(_read_response(conn.reader, method), self.timeout)
+
+    async def request(self, method, path, body=None, headers=None):
+        method = method.upper()
+        headers = {**self.headers, **(headers or {})}
+        async with self._slots:
+            conn, reused = await self._acquire()
+            while True:
+                try:
+                    response, keep_alive = await self._exchange(conn, method, path, body, headers)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn.close()
+                    if not reused or method not in IDEMPOTENT_METHODS:
+                        raise
+                    self.stats.retries += 1
+                    conn, reused = await self._connect(), False
+                except BaseException:
+                    conn.close()
+                    raise
+            self.stats.requests += 1
+            self._release(conn, keep_alive)
+            return response
+
+    async def get(self, path, headers=None):
+        return await self.request("GET", path, headers=headers)
+
+    async def get_certs(self, path="/api/certs"):
+        """GET the certificate endpoint and parse it into a CertsResponse"""
+        return (await self.get(path)).raise_for_status().certs()
+
+    async def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        for conn in idle:
+            try:
+                await conn.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,132 @@
+"""Blocking client with a pool of keep-alive connections"""
+import http.client
+import threading
+from urllib.parse import urlsplit
+
+from .models import Response
+
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class ClientStats:
+    __slots__ = ("requests", "connections_opened", "sessions_resumed", "retries")
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.sessions_resumed = 0
+        self.retries = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def split_base_url(base_url):
+    """(host, port, path prefix) of an https:// base URL"""
+    url = urlsplit(base_url)
+    if url.scheme != "https":
+        raise ValueError(f"{base_url}: only https:// URLs are supported")
+    return url.hostname, url.port or 443, url.path.rstrip("/")
+
+
+class MTLSClient:
+    """Thread-safe client for one server.
+
+    Up to pool_size connections are kept open and reused, most recently used
+    first so idle ones time out on the server rather than being picked up
+    just before they do. New connections resume the last TLS session, so
+    after the first handshake a client certificate is not sent or verified
+    again until the server's ticket expires. A request on a reused
+    connection that the server has closed meanwhile is retried once on a
+    fresh connection if the method is idempotent.
+
+        creds = Credentials.from_p12("client.p12", "mtls", ca="ca.pem")
+        with MTLSClient("https://localhost:8443", creds) as client:
+            certs = client.get_certs()
+            print(certs.mtls_valid, certs.subject_cn)
+    """
+
+    def __init__(self, base_url, credentials, pool_size=10, timeout=10.0, headers=None):
+        self.host, self.port, self.prefix = split_base_url(base_url)
+        self.context = credentials.context
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.stats = ClientStats()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._closed = False
+
+    def _connect(self):
+        conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.context)
+        conn.connect()
+        with self._lock:
+            self.stats.connections_opened += 1
+            if conn.sock.session_reused:
+                self.stats.sessions_resumed += 1
+        return conn
+
+    def _acquire(self):
+        """(connection, reused) from the idle pool or a new connection"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _release(self, conn, response):
+        self.context.save_session(self.host, conn.sock.session if conn.sock else None)
+        if response.will_close or conn.sock is None:
+            conn.close()
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        method = method.upper()
+        headers = {**self.headers, **(headers or {})}
+        with self._slots:
+            conn, reused = self._acquire()
+            while True:
+                try:
+                    conn.request(method, self.prefix + path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                    conn.close()
+                    if not reused or method not in IDEMPOTENT_METHODS:
+                        raise
+                    with self._lock:
+                        self.stats.retries += 1
+                    conn, reused = self._connect(), False
+                except BaseException:
+                    conn.close()
+                    raise
+            with self._lock:
+                self.stats.requests += 1
+            result = Response(response.status, {k.lower(): v for k, v in response.getheaders()}, data)
+            self._release(conn, response)
+            return result
+
+    def get(self, path, headers=None):
+        return self.request("GET", path, headers=headers)
+
+    def get_certs(self, path="/api/certs"):
+        """GET the certificate endpoint and parse it into a CertsResponse"""
+        return self.get(path).raise_for_status().certs()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,108 @@
+"""Client certificate loading and a session-resuming SSLContext"""
+import os
+import ssl
+import tempfile
+import threading
+
+
+class ResumingContext(ssl.SSLContext):
+    """SSLContext that offers the most recent TLS session for a server name
+    whenever it wraps a new connection to it.
+
+    Python only resumes sessions that are passed in explicitly, and neither
+    http.client nor asyncio passes one. Overriding wrap_socket (used by
+    http.client) and wrap_bio (used by asyncio) covers both. Sessions are
+    saved by the clients after a response has been read, since TLS 1.3
+    tickets arrive after the handshake.
+    """
+
+    def _session_cache(self):
+        try:
+            return self._sessions, self._sessions_lock
+        except AttributeError:
+            self._sessions, self._sessions_lock = {}, threading.Lock()
+            return self._sessions, self._sessions_lock
+
+    def session_for(self, server_hostname):
+        sessions, lock = self._session_cache()
+        with lock:
+            return sessions.get(server_hostname)
+
+    def save_session(self, server_hostname, session):
+        if session is None:
+            return
+        sessions, lock = self._session_cache()
+        with lock:
+            sessions[server_hostname] = session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None:
+            session = self.session_for(server_hostname)
+        return super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+
+    def wrap_bio(self, incoming, outgoing, *args, server_hostname=None, session=None, **kwargs):
+        if session is None:
+            session = self.session_for(server_hostname)
+        return super().wrap_bio(incoming, outgoing, *args, server_hostname=server_hostname, session=session,
+                                **kwargs)
+
+
+class Credentials:
+    """A client certificate and key plus the roots the server is checked
+    against, loaded from disk once into a ResumingContext that every
+    connection of a client (sync or async) shares"""
+
+    __slots__ = ("context",)
+
+    def __init__(self, context):
+        self.context = context
+
+    @staticmethod
+    def _context(ca, verify):
+        context = ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif ca:
+            context.load_verify_locations(cafile=ca)
+        else:
+            context.load_default_certs()
+        return context
+
+    @classmethod
+    def from_pem(cls, cert, key=None, ca=None, password=None, verify=True):
+        """Certificate and key PEM files (key may be inside cert); ca is a
+        PEM bundle to verify the server with, the system roots if None"""
+        context = cls._context(ca, verify)
+        context.load_cert_chain(cert, key, password=password)
+        return cls(context)
+
+    @classmethod
+    def from_p12(cls, path, password=None, ca=None, verify=True):
+        """PKCS#12 bundle such as the ones certgen/gencert.sh and
+        bulk-issue.py write (password "mtls"). Needs the cryptography
+        package; the ssl module only loads PEM files, so the key and chain
+        pass through a private temporary file that is removed straight
+        after loading."""
+        from cryptography.hazmat.primitives.serialization import (
+            Encoding, NoEncryption, PrivateFormat, pkcs12)
+
+        with open(path, "rb") as f:
+            data = f.read()
+        if isinstance(password, str):
+            password = password.encode()
+        key, cert, extra = pkcs12.load_key_and_certificates(data, password)
+        if key is None or cert is None:
+            raise ValueError(f"{path}: no private key and certificate in the PKCS#12 bundle")
+
+        pem = key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+        pem += b"".join(c.public_bytes(Encoding.PEM) for c in [cert] + list(extra or []))
+        context = cls._context(ca, verify)
+        fd, tmp = tempfile.mkstemp(suffix=".pem")  # created 0600
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(pem)
+            context.load_cert_chain(tmp)
+        finally:
+            os.unlink(tmp)
+        return cls(context)
@@ -0,0 +1,99 @@
+"""Lightweight response objects
+
+__slots__ classes rather than dicts or dataclasses: a service parsing
+thousands of /api/certs responses a minute keeps them small and cheap to
+build. Both servers' field names are accepted (Rust: subject_cn,
+verified_chains; Go: subject_common_name, verified_certificate_chains).
+"""
+import json
+
+
+class HTTPError(Exception):
+    """Non-2xx response, raised by Response.raise_for_status()"""
+
+    def __init__(self, response):
+        self.response = response
+        super().__init__(f"HTTP {response.status}: {response.body[:200]!r}")
+
+
+class CertificateInfo:
+    __slots__ = ("subject_cn", "issuer_cn", "not_before", "not_after", "is_ca")
+
+    def __init__(self, subject_cn, issuer_cn, not_before, not_after, is_ca):
+        self.subject_cn = subject_cn
+        self.issuer_cn = issuer_cn
+        self.not_before = not_before
+        self.not_after = not_after
+        self.is_ca = is_ca
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data.get("subject_cn", data.get("subject_common_name")),
+            data.get("issuer_cn", data.get("issuer_common_name")),
+            data.get("not_before"),
+            data.get("not_after"),
+            bool(data.get("is_ca")),
+        )
+
+    def __repr__(self):
+        return f"CertificateInfo(subject_cn={self.subject_cn!r}, issuer_cn={self.issuer_cn!r}, " \
+               f"not_after={self.not_after!r}, is_ca={self.is_ca})"
+
+
+class CertsResponse:
+    """Parsed /api/certs response"""
+
+    __slots__ = ("mtls_valid", "presented_certificates", "verified_chains")
+
+    def __init__(self, mtls_valid, presented_certificates, verified_chains):
+        self.mtls_valid = mtls_valid
+        self.presented_certificates = presented_certificates
+        self.verified_chains = verified_chains
+
+    @classmethod
+    def from_json(cls, data):
+        chains = data.get("verified_chains", data.get("verified_certificate_chains")) or ()
+        return cls(
+            bool(data.get("mtls_valid")),
+            tuple(CertificateInfo.from_json(c) for c in data.get("presented_certificates") or ()),
+            tuple(tuple(CertificateInfo.from_json(c) for c in chain) for chain in chains),
+        )
+
+    @property
+    def subject_cn(self):
+        """CN of the presented leaf certificate, None without one"""
+        return self.presented_certificates[0].subject_cn if self.presented_certificates else None
+
+    def __repr__(self):
+        return f"CertsResponse(mtls_valid={self.mtls_valid}, subject_cn={self.subject_cn!r}, " \
+               f"presented={len(self.presented_certificates)}, chains={len(self.verified_chains)})"
+
+
+class Response:
+    """Status, headers (lower-cased names) and body of one response"""
+
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(self)
+        return self
+
+    def json(self):
+        return json.loads(self.body)
+
+    def certs(self):
+        return CertsResponse.from_json(self.json())
+
+    def __repr__(self):
+        return f"Response(status={self.status}, body={len(self.body)} bytes)"
@@ -0,0 +1,425 @@
+"""Desired state and cached remote state for the Cloudflare mTLS setup
+
+mtls-state.json declares what the zone should look like: the domain, the CA
+certificates clients are checked against, the Access application and
+policies, the tunnel and the DNS records pointing at it. The Reconciler
+diffs that against a snapshot of the matching remote objects kept in
+.mtls-state-cache.json between runs, and only creates or updates what
+differs. Objects not named in the state file are never touched.
+
+The snapshot is refreshed with conditional requests rather than refetched:
+
+- the zone and account IDs never change for a domain and are looked up once
+- objects already matched are re-read by ID with If-None-Match, so an
+  unchanged object costs a bodyless 304; endpoints that send no ETag are
+  compared by modified_on, which also flags objects changed by someone else
+  since the last run
+- collections are only listed for objects not matched yet, again with
+  If-None-Match against the ETag of the previous listing
+- all of these run concurrently on the client's pool, so a refresh is one
+  round trip of wall time however many objects are managed
+
+Remote objects are matched by a natural key: CA certificates by SHA-256
+fingerprint (so ca.pem is never uploaded twice), the Access app by domain,
+policies and the tunnel by name, DNS records by type and name. "{tunnel_id}"
+in a DNS record is replaced with the tunnel's ID.
+"""
+import base64
+import hashlib
+import json
+import os
+import time
+
+from cloudflare_api import CloudflareError
+
+DEFAULT_STATE_FILE = "mtls-state.json"
+DEFAULT_CACHE_FILE = ".mtls-state-cache.json"
+CACHE_VERSION = 1
+
+# Managed kinds, in plan order
+KINDS = ("tunnels", "certificates", "apps", "policies", "dns_records")
+LABELS = {"tunnels": "tunnel", "certificates": "CA certificate", "apps": "Access app",
+          "policies": "Access policy", "dns_records": "DNS record"}
+
+
+def pem_fingerprint(pem):
+    """SHA-256 of the DER of the first certificate in a PEM string"""
+    lines = pem.strip().splitlines()
+    start = lines.index("-----BEGIN CERTIFICATE-----")
+    end = lines.index("-----END CERTIFICATE-----", start)
+    return hashlib.sha256(base64.b64decode("".join(lines[start + 1:end]))).hexdigest()
+
+
+def match_key(kind, obj):
+    """Natural key pairing a desired object with a remote one"""
+    if kind == "certificates":
+        if obj.get("fingerprint"):
+            return obj["fingerprint"]
+        if obj.get("certificate"):
+            return pem_fingerprint(obj["certificate"])
+        return obj.get("fingerprint_sha256")
+    if kind == "apps":
+        return obj.get("domain")
+    if kind == "dns_records":
+        return f"{obj.get('type')} {obj.get('name')}"
+    return obj.get("name")
+
+
+def slim(kind, obj):
+    """The part of a remote object worth caching"""
+    if kind == "certificates":
+        return {"id": obj["id"], "fingerprint": match_key(kind, obj), "modified_on": obj.get("modified_on")}
+    return obj
+
+
+# ---------------------------------------------------------------------------
+# Desired state
+# ---------------------------------------------------------------------------
+
+def load_desired(path=DEFAULT_STATE_FILE, certificates=True):
+    """Read and check a desired-state file; CA certificate paths are
+    resolved relative to it and replaced by their PEM contents, or left
+    out without certificates for callers that don't manage them"""
+    with open(path, encoding="utf-8") as f:
+        desired = json.load(f)
+    if not desired.get("domain"):
+        raise ValueError(f"{path}: domain is required")
+    if not (desired.get("tunnel") or {}).get("name"):
+        raise ValueError(f"{path}: tunnel.name is required")
+
+    base = os.path.dirname(os.path.abspath(path))
+    loaded = []
+    for cert_path in desired.get("ca_certificates", []) if certificates else ():
+        with open(os.path.join(base, cert_path), encoding="utf-8") as f:
+            pem = f.read()
+        loaded.append({"path": cert_path, "certificate": pem, "fingerprint": pem_fingerprint(pem)})
+    desired["ca_certificates"] = loaded
+
+    for policy in desired.get("policies", []):
+        if not policy.get("name") or not policy.get("decision"):
+            raise ValueError(f"{path}: every policy needs a name and a decision")
+    for record in desired.get("dns", []):
+        if not all(record.get(field) for field in ("type", "name", "content")):
+            raise ValueError(f"{path}: every DNS record needs a type, name and content")
+    return desired
+
+
+def desired_objects(desired, tunnel_id=None):
+    """Map kind -> {match key: (label, payload)} for a loaded desired state"""
+    objects = {kind: {} for kind in KINDS}
+    tunnel = desired["tunnel"]
+    objects["tunnels"][tunnel["name"]] = (tunnel["name"], {"name": tunnel["name"]})
+    for cert in desired["ca_certificates"]:
+        objects["certificates"][cert["fingerprint"]] = (
+            f"{cert['path']} (sha256 {cert['fingerprint'][:16]})", {"certificate": cert["certificate"]})
+    app = desired.get("access_app")
+    if app:
+        app = dict(app)
+        app.setdefault("domain", desired["domain"])
+        objects["apps"][app["domain"]] = (app["domain"], app)
+    for policy in desired.get("policies", []):
+        objects["policies"][policy["name"]] = (policy["name"], dict(policy))
+    for record in desired.get("dns", []):
+        record = dict(record)
+        if tunnel_id:
+            record["content"] = record["content"].replace("{tunnel_id}", tunnel_id)
+        key = match_key("dns_records", record)
+        objects["dns_records"][key] = (key, record)
+    return objects
+
+
+def changed_fields(payload, remote):
+    """Names of the payload fields remote does not match"""
+    return sorted(field for field, value in payload.items() if remote.get(field) != value)
+
+
+# ---------------------------------------------------------------------------
+# Cached remote state
+# ---------------------------------------------------------------------------
+
+class Snapshot:
+    """Remote objects matched on the last run, with the ETags they came with"""
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.zone_id = None
+        self.account_id = None
+        self.refreshed_at = 0.0
+        # kind -> {match key: remote object}
+        self.resources = {kind: {} for kind in KINDS}
+        # "<kind>/<id>" -> ETag of that object; kind -> [match keys, ETag]
+        # of the last listing, only reusable when looking for the same keys
+        self.etags = {}
+        self.list_etags = {}
+
+    @classmethod
+    def load(cls, path, domain):
+        """The cached snapshot for domain, or an empty one if the cache is
+        missing, unreadable or for another domain"""
+        snapshot = cls(domain)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return snapshot
+        if data.get("version") != CACHE_VERSION or data.get("domain") != domain:
+            return snapshot
+        snapshot.zone_id = data.get("zone_id")
+        snapshot.account_id = data.get("account_id")
+        snapshot.refreshed_at = data.get("refreshed_at", 0.0)
+        for kind in KINDS:
+            snapshot.resources[kind] = data.get("resources", {}).get(kind, {})
+        snapshot.etags = data.get("etags", {})
+        snapshot.list_etags = data.get("list_etags", {})
+        return snapshot
+
+    def save(self, path):
+        data = {"version": CACHE_VERSION, "domain": self.domain, "zone_id": self.zone_id,
+                "account_id": self.account_id, "refreshed_at": self.refreshed_at,
+                "resources": self.resources, "etags": self.etags, "list_etags": self.list_etags}
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    def tunnel_id(self, name):
+        tunnel = self.resources["tunnels"].get(name)
+        return tunnel["id"] if tunnel else None
+
+    def forget(self, kind, key=None):
+        """Drop cached knowledge of kind (or one object of it) so the next
+        refresh lists it again"""
+        self.list_etags.pop(kind, None)
+        if key is not None:
+            remote = self.resources[kind].pop(key, None)
+            if remote:
+                self.etags.pop(f"{kind}/{remote['id']}", None)
+
+
+# ---------------------------------------------------------------------------
+# Lookups shared with setup-mtls.py
+# ---------------------------------------------------------------------------
+
+def lookup_zone_id(client, domain):
+    zones = client.get("zones", params={"name": domain})
+    if not zones:
+        raise CloudflareError("GET", "zones", 404, [{"code": 1001, "message": f"zone {domain} not found"}])
+    return zones[0]["id"]
+
+
+def lookup_account_id(client):
+    accounts = client.get("accounts")
+    if not accounts:
+        raise CloudflareError("GET", "accounts", 404, [{"code": 1001, "message": "no accounts for these credentials"}])
+    return accounts[0]["id"]
+
+
+def lookup_tunnel_id(client, account_id, name):
+    tunnels = client.list(f"accounts/{account_id}/cfd_tunnel", params={"name": name, "is_deleted": "false"})
+    if not tunnels:
+        raise CloudflareError("GET", "cfd_tunnel", 404, [{"code": 1003, "message": f"tunnel {name} not found"}])
+    return tunnels[0]["id"]
+
+
+# ---------------------------------------------------------------------------
+# Reconciler
+# ---------------------------------------------------------------------------
+
+class Action:
+    """One entry of a plan: create, update or leave a remote object"""
+
+    SYMBOLS = {"create": "+", "update": "~", "noop": "=", "missing": "!"}
+
+    def __init__(self, op, kind, key, label, payload=None, remote=None, changes=(), drifted=False):
+        self.op = op
+        self.kind = kind
+        self.key = key
+        self.label = label
+        self.payload = payload
+        self.remote = remote
+        self.changes = list(changes)
+        self.drifted = drifted
+
+    def describe(self):
+        line = f"  {self.SYMBOLS[self.op]} {LABELS[self.kind]} {self.label}"
+        if self.op == "update":
+            line += ": " + ", ".join(
+                f"{field} {json.dumps(self.remote.get(field))} -> {json.dumps(self.payload[field])}"
+                for field in self.changes)
+        elif self.op == "missing":
+            line += ": not found and cannot be created here"
+        if self.drifted:
+            line += " (changed remotely since the last run)"
+        return line
+
+
+class Reconciler:
+    """Plan and apply the difference between a desired state and Cloudflare"""
+
+    def __init__(self, client, desired, snapshot):
+        self.client = client
+        self.desired = desired
+        self.snapshot = snapshot
+        self.drifted = set()
+        self.not_modified = 0
+
+    def collection(self, kind):
+        zone = f"zones/{self.snapshot.zone_id}"
+        return {
+            "tunnels": f"accounts/{self.snapshot.account_id}/cfd_tunnel",
+            "certificates": f"{zone}/client_certificates",
+            "apps": f"{zone}/access/apps",
+            "policies": f"{zone}/access/policies",
+            "dns_records": f"{zone}/dns_records",
+        }[kind]
+
+    def list_params(self, kind, keys):
+        if kind == "tunnels":
+            return {"name": keys[0], "is_deleted": "false"}
+        if kind == "dns_records":
+            names = {key.split(" ", 1)[1] for key in keys}
+            if len(names) == 1:
+                return {"name": names.pop()}
+        return None
+
+    # -- refresh -------------------------------------------------------------
+
+    def resolve_ids(self):
+        """Zone and account IDs, looked up only if not cached"""
+        snapshot = self.snapshot
+        account_id = self.desired.get("account_id") or os.getenv("CLOUDFLARE_ACCOUNT_ID")
+        if account_id:
+            snapshot.account_id = account_id
+        calls = {}
+        if not snapshot.zone_id:
+            calls["zone_id"] = lambda: lookup_zone_id(self.client, snapshot.domain)
+        if not snapshot.account_id:
+            calls["account_id"] = lambda: lookup_account_id(self.client)
+        for name, value in self.client.fan_out(calls).items():
+            setattr(snapshot, name, value)
+
+        tunnel = self.desired["tunnel"]
+        if tunnel.get("id") and snapshot.tunnel_id(tunnel["name"]) != tunnel["id"]:
+            # Pinned in the state file: seed the cache so it is read by ID
+            snapshot.resources["tunnels"] = {tunnel["name"]: {"id": tunnel["id"], "name": tunnel["name"]}}
+
+    def refresh(self):
+        """Bring the snapshot up to date with as few requests as possible"""
+        self.resolve_ids()
+        wanted = {kind: sorted(objects) for kind, objects in desired_objects(self.desired).items()}
+
+        calls = {}
+        for kind, keys in wanted.items():
+            if not keys:
+                continue
+            cached = self.snapshot.resources[kind]
+            if all(key in cached for key in keys):
+                for key in keys:
+                    calls[(kind, key)] = lambda kind=kind, key=key: self._fetch(kind, key)
+            else:
+                calls[kind] = lambda kind=kind, keys=keys: self._list(kind, keys)
+        results = self.client.fan_out(calls)
+
+        # Objects deleted remotely may have been recreated under a new ID
+        relist = {call[0] for call, gone in results.items() if isinstance(call, tuple) and gone}
+        self.client.fan_out({kind: lambda kind=kind: self._list(kind, wanted[kind]) for kind in relist})
+        self.snapshot.refreshed_at = time.time()
+
+    def _fetch(self, kind, key):
+        """Re-read one matched object by ID; True if it no longer exists"""
+        cached = self.snapshot.resources[kind][key]
+        etag_key = f"{kind}/{cached['id']}"
+        try:
+            obj, etag = self.client.get_if_changed(f"{self.collection(kind)}/{cached['id']}",
+                                                   self.snapshot.etags.get(etag_key))
+        except CloudflareError as e:
+            if e.status != 404:
+                raise
+            self.snapshot.forget(kind, key)
+            return True
+        if obj is None:
+            self.not_modified += 1
+            return False
+        self._store(kind, key, obj, etag)
+        return False
+
+    def _list(self, kind, keys):
+        """Match the collection against keys, unless it is unchanged since it
+        was last matched against the same keys"""
+        previous = self.snapshot.list_etags.get(kind)
+        etag = previous[1] if previous and previous[0] == keys else None
+        items, etag = self.client.list_if_changed(self.collection(kind), etag, self.list_params(kind, keys))
+        if items is None:
+            self.not_modified += 1
+            return
+        found = {}
+        for obj in items:
+            key = match_key(kind, obj)
+            if key in keys and key not in found:
+                found[key] = obj
+        for key in list(self.snapshot.resources[kind]):
+            if key not in found:
+                self.snapshot.forget(kind, key)
+        for key, obj in found.items():
+            self._store(kind, key, obj, None)
+        if etag:
+            self.snapshot.list_etags[kind] = [keys, etag]
+        else:
+            self.snapshot.list_etags.pop(kind, None)
+
+    def _store(self, kind, key, obj, etag):
+        cached = self.snapshot.resources[kind].get(key)
+        if cached and cached.get("id") == obj["id"] and cached.get("modified_on") != obj.get("modified_on"):
+            self.drifted.add((kind, key))
+        self.snapshot.resources[kind][key] = slim(kind, obj)
+        etag_key = f"{kind}/{obj['id']}"
+        if etag:
+            self.snapshot.etags[etag_key] = etag
+        else:
+            self.snapshot.etags.pop(etag_key, None)
+
+    # -- plan and apply ------------------------------------------------------
+
+    def plan(self):
+        """Actions turning the snapshot into the desired state"""
+        tunnel_id = self.snapshot.tunnel_id(self.desired["tunnel"]["name"])
+        actions = []
+        for kind, objects in desired_objects(self.desired, tunnel_id).items():
+            for key, (label, payload) in objects.items():
+                remote = self.snapshot.resources[kind].get(key)
+                drifted = (kind, key) in self.drifted
+                if remote is None:
+                    op = "missing" if kind == "tunnels" else "create"
+                    actions.append(Action(op, kind, key, label, payload))
+                    continue
+                # Certificates and tunnels are matched by content/name alone
+                changes = [] if kind in ("certificates", "tunnels") else changed_fields(payload, remote)
+                op = "update" if changes else "noop"
+                actions.append(Action(op, kind, key, label, payload, remote, changes, drifted))
+        return actions
+
+    def apply(self, actions):
+        """Run the create and update actions concurrently; returns the
+        actions that failed, with their errors"""
+        todo = [a for a in actions if a.op in ("create", "update")]
+        results = self.client.fan_out({i: lambda a=a: self._apply(a) for i, a in enumerate(todo)})
+        failed = []
+        for i, action in enumerate(todo):
+            result = results[i]
+            if isinstance(result, CloudflareError):
+                self.snapshot.forget(action.kind, action.key)
+                failed.append((action, result))
+                continue
+            self._store(action.kind, action.key, result, None)
+            self.drifted.discard((action.kind, action.key))
+            self.snapshot.list_etags.pop(action.kind, None)
+        return failed
+
+    def _apply(self, action):
+        path = self.collection(action.kind)
+        try:
+            if action.op == "create":
+                return self.client.post(path, json=action.payload)
+            return self.client.put(f"{path}/{action.remote['id']}", json=action.payload)
+        except CloudflareError as e:
+            return e
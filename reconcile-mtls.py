@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Reconcile the Cloudflare mTLS setup with mtls-state.json
+
+Reads the desired state (domain, CA certificates, Access app, policies,
+tunnel, DNS records), refreshes the cached snapshot of the matching remote
+objects with conditional requests and creates or updates only what differs.
+See mtls_state.py for how objects are matched and the cache is refreshed.
+Replaces the fetch-everything-and-rewrite approach of configure-mtls.py for
+deploys; the cache (.mtls-state-cache.json) can be kept between CI runs.
+
+Exit codes: 0 in sync (or changes applied), 1 error, 2 changes pending
+(only with --dry-run --detailed-exitcode).
+
+Examples:
+    python reconcile-mtls.py --dry-run
+    python reconcile-mtls.py
+    python reconcile-mtls.py --state staging-state.json --cache .staging-cache.json
+    CLOUDFLARE_API_BASE=http://127.0.0.1:8787/client/v4 CLOUDFLARE_API_TOKEN=test python reconcile-mtls.py
+"""
+import argparse
+import io
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from cloudflare_api import CloudflareClient, CloudflareError
+from mtls_state import DEFAULT_CACHE_FILE, DEFAULT_STATE_FILE, Reconciler, Snapshot, load_desired
+
+# Force UTF-8 output on Windows
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reconcile the Cloudflare mTLS setup with a desired-state file",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Examples:" + __doc__.split("Examples:")[1],
+    )
+    parser.add_argument("--state", default=DEFAULT_STATE_FILE, help=f"Desired-state file (default: {DEFAULT_STATE_FILE})")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help=f"Remote state cache (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--dry-run", action="store_true", help="Print the plan without changing anything")
+    parser.add_argument("--detailed-exitcode", action="store_true",
+                        help="With --dry-run, exit 2 when changes are pending")
+    parser.add_argument("--max-age", type=float, default=0,
+                        help="Trust a cache refreshed less than this many seconds ago without any requests")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the cache and list everything again")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    start = time.monotonic()
+    try:
+        desired = load_desired(args.state)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return 1
+
+    snapshot = Snapshot(desired["domain"]) if args.no_cache else Snapshot.load(args.cache, desired["domain"])
+    with CloudflareClient.from_env() as client:
+        reconciler = Reconciler(client, desired, snapshot)
+        try:
+            if time.time() - snapshot.refreshed_at >= args.max_age:
+                reconciler.refresh()
+            actions = reconciler.plan()
+        except CloudflareError as e:
+            print(f"[!] Refresh failed: {e}", file=sys.stderr)
+            return 1
+
+        print(f"[*] {desired['domain']} (zone {snapshot.zone_id}): {client.requests_sent} requests, "
+              f"{reconciler.not_modified} not modified")
+        for action in actions:
+            print(action.describe())
+        pending = [a for a in actions if a.op in ("create", "update")]
+        missing = [a for a in actions if a.op == "missing"]
+        print(f"[*] Plan: {sum(a.op == 'create' for a in actions)} to create, "
+              f"{sum(a.op == 'update' for a in actions)} to update, "
+              f"{sum(a.op == 'noop' for a in actions)} unchanged")
+
+        if missing:
+            snapshot.save(args.cache)
+            print(f"[!] {len(missing)} required object(s) missing, nothing applied", file=sys.stderr)
+            return 1
+        if args.dry_run:
+            snapshot.save(args.cache)
+            return 2 if pending and args.detailed_exitcode else 0
+
+        failed = reconciler.apply(pending)
+        snapshot.save(args.cache)
+        for action, error in failed:
+            print(f"[!] {action.op} {action.label}: {error}", file=sys.stderr)
+        if failed:
+            return 1
+        print(f"[✓] {len(pending)} change(s) applied with {client.requests_sent} requests "
+              f"in {time.monotonic() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,11 +4,15 @@
  * renew-cert.js - Check certificate expiry and renew if needed
  *
  * Checks if cert.pem expires within 30 days.
- * If yes, runs issue-cert.js and restarts the server.
+ * If yes, runs issue-cert.js. The running server watches cert.pem/key.pem
+ * and hot-reloads them (TLS_RELOAD_INTERVAL_SECS, default 10s), so no
+ * restart is needed and in-flight connections are not dropped.
  *
- * Usage: node scripts/renew-cert.js [--force]
+ * Usage: node scripts/renew-cert.js [--force] [--restart]
  *
  * --force: Renew regardless of expiry date
+ * --restart: Kill and restart mtls-server and cloudflared after renewal
+ *            (for servers built without hot reload)
  */
 
 const fs = require('fs');
@@ -23,6 +27,7 @@ const CERT_PATH = path.join(__dirname, '..', 'cert.pem');
 const PROJECT_DIR = path.join(__dirname, '..');
 const DAYS_BEFORE_EXPIRY = 30;
 const FORCE = process.argv.includes('--force');
+const RESTART = process.argv.includes('--restart');
 
 const CLOUDFLARED_EXE = 'C:\\Program Files (x86)\\cloudflared\\cloudflared.exe';
 const CLOUDFLARED_CONFIG = path.join(PROJECT_DIR, 'cloudflared-config.yml');
@@ -133,6 +138,13 @@ async function renewCertificate() {
     console.log(result.stdout);
     if (result.stderr) console.warn(result.stderr);
 
+    if (!RESTART) {
+      console.log('\n' + '='.repeat(60));
+      console.log('✓ Certificate renewed; the server reloads it without a restart');
+      console.log('='.repeat(60) + '\n');
+      return;
+    }
+
     // Ensure log directory exists
     fs.mkdirSync(LOG_DIR, { recursive: true });
 
@@ -0,0 +1,179 @@
+package server
+
+import (
+	"bufio"
+	"crypto/sha256"
+	"crypto/x509"
+	"encoding/hex"
+	"encoding/json"
+	"io"
+	"log"
+	"net/http"
+	"os"
+	"sync/atomic"
+	"time"
+)
+
+const (
+	// accessLogQueueDepth is the number of records buffered between request
+	// goroutines and the writer; when the writer falls behind, new records
+	// are dropped rather than blocking a request.
+	accessLogQueueDepth = 16384
+	accessLogBufferSize = 256 * 1024
+)
+
+// accessRecord is one line of the access log. The format matches the Rust
+// server's, so analyze-access-log.py reads either:
+//
+//	{"ts":1767225600.123456,"method":"GET","route":"/json","status":200,
+//	 "latency_us":87,"bytes":412,"resumed":true,"fingerprint":"9f86...","cn":"client"}
+type accessRecord struct {
+	TS          float64 `json:"ts"`
+	Method      string  `json:"method"`
+	Route       string  `json:"route"`
+	Status      int     `json:"status"`
+	LatencyUS   int64   `json:"latency_us"`
+	Bytes       int64   `json:"bytes"`
+	Resumed     bool    `json:"resumed"`
+	Fingerprint *string `json:"fingerprint"`
+	CN          *string `json:"cn"`
+
+	// leaf is turned into Fingerprint and CN by the writer goroutine, so the
+	// request only pays for a channel send
+	leaf *x509.Certificate
+}
+
+// AccessLog writes one JSON line per request from a background goroutine
+// through a buffered writer.
+type AccessLog struct {
+	records chan accessRecord
+	out     io.Writer
+	done    chan struct{}
+	dropped atomic.Uint64
+}
+
+// NewAccessLog starts an access log writing to w.
+func NewAccessLog(w io.Writer) *AccessLog {
+	a := &AccessLog{
+		records: make(chan accessRecord, accessLogQueueDepth),
+		out:     w,
+		done:    make(chan struct{}),
+	}
+	go a.write()
+	return a
+}
+
+// OpenAccessLog starts an access log appending to the file at path, or
+// writing to stdout when path is "-".
+func OpenAccessLog(path string) (*AccessLog, error) {
+	if path == "-" {
+		return NewAccessLog(os.Stdout), nil
+	}
+	file, err := os.OpenFile(path, os.O_WRONLY|os.O_CREATE|os.O_APPEND, 0o644)
+	if err != nil {
+		return nil, err
+	}
+	return NewAccessLog(file), nil
+}
+
+// Handler wraps next so every request it serves is logged.
+func (a *AccessLog) Handler(next http.Handler) http.Handler {
+	return http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		start := time.Now()
+		rec := &recordingWriter{ResponseWriter: w, status: http.StatusOK}
+		next.ServeHTTP(rec, r)
+
+		record := accessRecord{
+			TS:        float64(start.UnixMicro()) / 1e6,
+			Method:    r.Method,
+			Route:     r.URL.Path,
+			Status:    rec.status,
+			LatencyUS: time.Since(start).Microseconds(),
+			Bytes:     rec.bytes,
+		}
+		if r.TLS != nil {
+			record.Resumed = r.TLS.DidResume
+			if len(r.TLS.PeerCertificates) > 0 {
+				record.leaf = r.TLS.PeerCertificates[0]
+			}
+		}
+		select {
+		case a.records <- record:
+		default:
+			a.dropped.Add(1)
+		}
+	})
+}
+
+// Dropped returns the number of records discarded because the queue was full.
+func (a *AccessLog) Dropped() uint64 {
+	return a.dropped.Load()
+}
+
+// Close writes out the queued records and closes the underlying file. The
+// handler must no longer be serving requests.
+func (a *AccessLog) Close() error {
+	close(a.records)
+	<-a.done
+	if closer, ok := a.out.(io.Closer); ok && a.out != os.Stdout {
+		return closer.Close()
+	}
+	return nil
+}
+
+func (a *AccessLog) write() {
+	defer close(a.done)
+	buf := bufio.NewWriterSize(a.out, accessLogBufferSize)
+	enc := json.NewEncoder(buf)
+	for record := range a.records {
+		a.encode(enc, record)
+		// Batch whatever else is already queued into the same flush
+		for pending := len(a.records); pending > 0; pending-- {
+			a.encode(enc, <-a.records)
+		}
+		if err := buf.Flush(); err != nil {
+			log.Printf("Access log write failed: %v", err)
+		}
+	}
+}
+
+func (a *AccessLog) encode(enc *json.Encoder, record accessRecord) {
+	if record.leaf != nil {
+		sum := sha256.Sum256(record.leaf.Raw)
+		fingerprint := hex.EncodeToString(sum[:])
+		record.Fingerprint = &fingerprint
+		if cn := record.leaf.Subject.CommonName; cn != "" {
+			record.CN = &cn
+		}
+	}
+	if err := enc.Encode(record); err != nil {
+		log.Printf("Access log encode failed: %v", err)
+	}
+}
+
+// recordingWriter captures the status code and body size of a response.
+type recordingWriter struct {
+	http.ResponseWriter
+	status      int
+	bytes       int64
+	wroteHeader bool
+}
+
+func (w *recordingWriter) WriteHeader(status int) {
+	if !w.wroteHeader {
+		w.status, w.wroteHeader = status, true
+	}
+	w.ResponseWriter.WriteHeader(status)
+}
+
+func (w *recordingWriter) Write(p []byte) (int, error) {
+	w.wroteHeader = true
+	n, err := w.ResponseWriter.Write(p)
+	w.bytes += int64(n)
+	return n, err
+}
+
+// Unwrap lets http.ResponseController reach the underlying writer.
+func (w *recordingWriter) Unwrap() http.ResponseWriter {
+	return w.ResponseWriter
+}
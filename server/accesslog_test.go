@@ -0,0 +1,73 @@
+package server
+
+import (
+	"bytes"
+	"crypto/sha256"
+	"crypto/tls"
+	"crypto/x509"
+	"encoding/hex"
+	"encoding/json"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+)
+
+func Test_accessLogRecords(t *testing.T) {
+	var out bytes.Buffer
+	accessLog := NewAccessLog(&out)
+	handler := accessLog.Handler(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		if r.URL.Path == "/missing" {
+			http.NotFound(w, r)
+			return
+		}
+		w.Write([]byte("hello"))
+	}))
+
+	cert := clientCert
+	cert.Raw = []byte("leaf")
+	withCert := httptest.NewRequest(http.MethodGet, "/json", nil)
+	withCert.TLS = &tls.ConnectionState{DidResume: true, PeerCertificates: []*x509.Certificate{&cert}}
+	handler.ServeHTTP(httptest.NewRecorder(), withCert)
+	handler.ServeHTTP(httptest.NewRecorder(), httptest.NewRequest(http.MethodGet, "/missing", nil))
+
+	if err := accessLog.Close(); err != nil {
+		t.Fatal(err)
+	}
+
+	var records []map[string]any
+	dec := json.NewDecoder(&out)
+	for dec.More() {
+		var record map[string]any
+		if err := dec.Decode(&record); err != nil {
+			t.Fatal(err)
+		}
+		records = append(records, record)
+	}
+	if len(records) != 2 {
+		t.Fatalf("expected 2 records, got %d", len(records))
+	}
+
+	sum := sha256.Sum256([]byte("leaf"))
+	first, second := records[0], records[1]
+	if first["route"] != "/json" || first["status"] != 200.0 || first["bytes"] != 5.0 || first["resumed"] != true {
+		t.Errorf("unexpected record %v", first)
+	}
+	if first["fingerprint"] != hex.EncodeToString(sum[:]) || first["cn"] != clientCert.Subject.CommonName {
+		t.Errorf("unexpected client identity in %v", first)
+	}
+	if second["status"] != 404.0 || second["fingerprint"] != nil || second["cn"] != nil {
+		t.Errorf("unexpected record %v", second)
+	}
+}
+
+func Test_accessLogDropsWhenFull(t *testing.T) {
+	// A log whose writer never drains: the queue fills and requests go on
+	accessLog := &AccessLog{records: make(chan accessRecord, 1)}
+	handler := accessLog.Handler(http.HandlerFunc(func(http.ResponseWriter, *http.Request) {}))
+	for i := 0; i < 3; i++ {
+		handler.ServeHTTP(httptest.NewRecorder(), httptest.NewRequest(http.MethodGet, "/", nil))
+	}
+	if accessLog.Dropped() != 2 {
+		t.Errorf("expected 2 dropped records, got %d", accessLog.Dropped())
+	}
+}
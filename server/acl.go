@@ -0,0 +1,355 @@
+package server
+
+import (
+	"bufio"
+	"bytes"
+	"context"
+	"crypto/sha256"
+	"encoding/hex"
+	"encoding/json"
+	"fmt"
+	"log"
+	"net"
+	"net/http"
+	"net/url"
+	"os"
+	"sort"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"time"
+)
+
+// ACL file format, shared with the Rust server and written by
+// certgen/build-acl.py. One rule per line, # starts a comment:
+//
+//	public <route>...             open to every client, with or without a certificate
+//	spki <sha256 hex> <route>...  leaf SubjectPublicKeyInfo fingerprint
+//	cert <sha256 hex> <route>...  leaf certificate fingerprint
+//	cn <pattern> <route>...       subject CN, exact or with * wildcards, %-encoded
+//
+// A route is an exact path, a prefix ending in *, or * for every path.
+// Fingerprint rules for the same client are merged; CN rules only apply to
+// clients without a fingerprint rule, exact CNs before patterns and
+// patterns in file order.
+
+// routeSet is the sorted route patterns granted by a rule. Identical sets
+// are shared between rules, so a large ACL costs little more than its
+// fingerprints.
+type routeSet []string
+
+func (s routeSet) allows(route string) bool {
+	for _, pattern := range s {
+		if pattern == "*" || pattern == route ||
+			strings.HasSuffix(pattern, "*") && strings.HasPrefix(route, pattern[:len(pattern)-1]) {
+			return true
+		}
+	}
+	return false
+}
+
+type cnPattern struct {
+	pattern string
+	routes  routeSet
+}
+
+// aclIndex is a parsed ACL file.
+type aclIndex struct {
+	fingerprints map[[sha256.Size]byte]routeSet
+	cns          map[string]routeSet
+	cnPatterns   []cnPattern
+	public       routeSet
+}
+
+func parseACL(data []byte) (*aclIndex, error) {
+	index := &aclIndex{
+		fingerprints: make(map[[sha256.Size]byte]routeSet),
+		cns:          make(map[string]routeSet),
+	}
+	interned := make(map[string]routeSet)
+	intern := func(existing routeSet, routes []string) routeSet {
+		merged := append(append([]string{}, existing...), routes...)
+		sort.Strings(merged)
+		unique := merged[:0]
+		for i, route := range merged {
+			if i == 0 || route != merged[i-1] {
+				unique = append(unique, route)
+			}
+		}
+		key := strings.Join(unique, " ")
+		if set, ok := interned[key]; ok {
+			return set
+		}
+		interned[key] = routeSet(unique)
+		return interned[key]
+	}
+
+	scanner := bufio.NewScanner(bytes.NewReader(data))
+	for number := 1; scanner.Scan(); number++ {
+		fields := strings.Fields(scanner.Text())
+		for i, field := range fields {
+			if strings.HasPrefix(field, "#") {
+				fields = fields[:i]
+				break
+			}
+		}
+		if len(fields) == 0 {
+			continue
+		}
+
+		switch kind := fields[0]; kind {
+		case "public":
+			index.public = intern(index.public, fields[1:])
+		case "spki", "cert":
+			var fingerprint [sha256.Size]byte
+			if len(fields) < 2 || len(fields[1]) != hex.EncodedLen(sha256.Size) {
+				return nil, fmt.Errorf("line %d: expected a 64 hex digit SHA-256 fingerprint", number)
+			}
+			if _, err := hex.Decode(fingerprint[:], []byte(fields[1])); err != nil {
+				return nil, fmt.Errorf("line %d: expected a 64 hex digit SHA-256 fingerprint", number)
+			}
+			index.fingerprints[fingerprint] = intern(index.fingerprints[fingerprint], fields[2:])
+		case "cn":
+			if len(fields) < 2 {
+				return nil, fmt.Errorf("line %d: expected a CN pattern", number)
+			}
+			pattern, err := url.PathUnescape(fields[1])
+			if err != nil {
+				return nil, fmt.Errorf("line %d: invalid %%-escape in CN pattern", number)
+			}
+			if strings.Contains(pattern, "*") {
+				index.cnPatterns = append(index.cnPatterns, cnPattern{pattern, intern(nil, fields[2:])})
+			} else {
+				index.cns[pattern] = intern(index.cns[pattern], fields[2:])
+			}
+		default:
+			return nil, fmt.Errorf("line %d: unknown rule %q", number, kind)
+		}
+	}
+	return index, scanner.Err()
+}
+
+// Len returns the number of fingerprint and CN rules.
+func (x *aclIndex) Len() int {
+	return len(x.fingerprints) + len(x.cns) + len(x.cnPatterns)
+}
+
+// grant returns the routes granted to id, and false if no rule matches.
+func (x *aclIndex) grant(id *clientIdentity) (routeSet, bool) {
+	byCert, certOK := x.fingerprints[id.cert]
+	bySPKI, spkiOK := x.fingerprints[id.spki]
+	switch {
+	case certOK && spkiOK:
+		return append(append(routeSet{}, byCert...), bySPKI...), true
+	case certOK:
+		return byCert, true
+	case spkiOK:
+		return bySPKI, true
+	}
+	if id.cn == "" {
+		return nil, false
+	}
+	if routes, ok := x.cns[id.cn]; ok {
+		return routes, true
+	}
+	for _, p := range x.cnPatterns {
+		if globMatch(p.pattern, id.cn) {
+			return p.routes, true
+		}
+	}
+	return nil, false
+}
+
+// globMatch matches text against pattern, where * matches any run of
+// characters.
+func globMatch(pattern, text string) bool {
+	parts := strings.Split(pattern, "*")
+	if !strings.HasPrefix(text, parts[0]) {
+		return false
+	}
+	rest := text[len(parts[0]):]
+	if len(parts) == 1 {
+		return rest == ""
+	}
+	last := parts[len(parts)-1]
+	for _, part := range parts[1 : len(parts)-1] {
+		i := strings.Index(rest, part)
+		if i < 0 {
+			return false
+		}
+		rest = rest[i+len(part):]
+	}
+	return len(rest) >= len(last) && strings.HasSuffix(rest, last)
+}
+
+// check returns http.StatusOK if the request is allowed, otherwise the
+// status to refuse it with.
+func (x *aclIndex) check(id *clientIdentity, route string) int {
+	if x.public.allows(route) {
+		return http.StatusOK
+	}
+	if id == nil {
+		return http.StatusUnauthorized
+	}
+	if routes, ok := x.grant(id); ok && routes.allows(route) {
+		return http.StatusOK
+	}
+	return http.StatusForbidden
+}
+
+// clientIdentity is the verified leaf certificate of a connection.
+type clientIdentity struct {
+	cert, spki [sha256.Size]byte
+	cn         string
+}
+
+// connIdentity caches a connection's clientIdentity so the certificate is
+// hashed on its first request only.
+type connIdentity struct {
+	once sync.Once
+	id   *clientIdentity
+}
+
+type connIdentityKey struct{}
+
+func identityOf(r *http.Request) *clientIdentity {
+	compute := func() *clientIdentity {
+		if r.TLS == nil || len(r.TLS.VerifiedChains) == 0 {
+			return nil
+		}
+		leaf := r.TLS.PeerCertificates[0]
+		return &clientIdentity{
+			cert: sha256.Sum256(leaf.Raw),
+			spki: sha256.Sum256(leaf.RawSubjectPublicKeyInfo),
+			cn:   leaf.Subject.CommonName,
+		}
+	}
+	cached, ok := r.Context().Value(connIdentityKey{}).(*connIdentity)
+	if !ok {
+		return compute()
+	}
+	cached.once.Do(func() { cached.id = compute() })
+	return cached.id
+}
+
+// ACL restricts routes by client certificate, loaded from a file that can
+// be replaced while the server is running.
+type ACL struct {
+	path   string
+	index  atomic.Pointer[aclIndex]
+	denied atomic.Uint64
+
+	mu      sync.Mutex
+	modTime time.Time
+	size    int64
+}
+
+// LoadACL reads the ACL file at path.
+func LoadACL(path string) (*ACL, error) {
+	a := &ACL{path: path}
+	if err := a.Reload(); err != nil {
+		return nil, err
+	}
+	return a, nil
+}
+
+// Len returns the number of fingerprint and CN rules currently loaded.
+func (a *ACL) Len() int {
+	return a.index.Load().Len()
+}
+
+// Denied returns the number of requests refused so far.
+func (a *ACL) Denied() uint64 {
+	return a.denied.Load()
+}
+
+// Reload re-reads the ACL file unconditionally. On error the current ACL is
+// kept.
+func (a *ACL) Reload() error {
+	a.mu.Lock()
+	defer a.mu.Unlock()
+	return a.reloadLocked()
+}
+
+// ReloadIfChanged reloads the ACL file if its modification time or size
+// changed since the last successful load, and reports whether it did.
+func (a *ACL) ReloadIfChanged() (bool, error) {
+	a.mu.Lock()
+	defer a.mu.Unlock()
+
+	info, err := os.Stat(a.path)
+	if err != nil {
+		return false, err
+	}
+	if info.ModTime().Equal(a.modTime) && info.Size() == a.size {
+		return false, nil
+	}
+	return true, a.reloadLocked()
+}
+
+func (a *ACL) reloadLocked() error {
+	info, err := os.Stat(a.path)
+	if err != nil {
+		return err
+	}
+	data, err := os.ReadFile(a.path)
+	if err != nil {
+		return err
+	}
+	index, err := parseACL(data)
+	if err != nil {
+		return fmt.Errorf("%s: %w", a.path, err)
+	}
+
+	a.index.Store(index)
+	a.modTime, a.size = info.ModTime(), info.Size()
+	return nil
+}
+
+// Watch checks the ACL file every interval and reloads it when it changes,
+// until ctx is cancelled.
+func (a *ACL) Watch(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+
+	for {
+		select {
+		case <-ctx.Done():
+			return
+		case <-ticker.C:
+			reloaded, err := a.ReloadIfChanged()
+			if err != nil {
+				log.Printf("Could not reload ACL %s, keeping current rules: %v", a.path, err)
+			} else if reloaded {
+				log.Printf("Reloaded %d ACL rules from %s", a.Len(), a.path)
+			}
+		}
+	}
+}
+
+// connContext gives every connection a slot for its client identity; set
+// as http.Server.ConnContext.
+func (a *ACL) connContext(ctx context.Context, _ net.Conn) context.Context {
+	return context.WithValue(ctx, connIdentityKey{}, &connIdentity{})
+}
+
+// Handler refuses requests the ACL does not allow with 401 (no client
+// certificate) or 403 (certificate not granted the route).
+func (a *ACL) Handler(next http.Handler) http.Handler {
+	return http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		status := a.index.Load().check(identityOf(r), r.URL.Path)
+		if status == http.StatusOK {
+			next.ServeHTTP(w, r)
+			return
+		}
+
+		a.denied.Add(1)
+		message := "client certificate not allowed"
+		if status == http.StatusUnauthorized {
+			message = "client certificate required"
+		}
+		w.Header().Set("Content-Type", "application/json")
+		w.WriteHeader(status)
+		json.NewEncoder(w).Encode(map[string]string{"error": message, "route": r.URL.Path})
+	})
+}
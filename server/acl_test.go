@@ -0,0 +1,125 @@
+package server
+
+import (
+	"context"
+	"crypto/sha256"
+	"crypto/tls"
+	"crypto/x509"
+	"fmt"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"testing"
+)
+
+func aclRequest(path string, raw, spki []byte, cn string) *http.Request {
+	r := httptest.NewRequest(http.MethodGet, path, nil)
+	if raw != nil {
+		cert := clientCert
+		cert.Raw, cert.RawSubjectPublicKeyInfo, cert.Subject.CommonName = raw, spki, cn
+		r.TLS = &tls.ConnectionState{
+			PeerCertificates: []*x509.Certificate{&cert},
+			VerifiedChains:   [][]*x509.Certificate{{&cert, &caCert}},
+		}
+	}
+	return r
+}
+
+func Test_aclCheck(t *testing.T) {
+	spki := sha256.Sum256([]byte("dev-1 key"))
+	cert := sha256.Sum256([]byte("dev-2 cert"))
+	index, err := parseACL([]byte(fmt.Sprintf(`# generated
+public /health
+spki %x /json   # dev-1
+spki %x /metrics
+cert %x /images/*
+cn ops-* *
+cn build%%20agent /metrics
+`, spki, spki, cert)))
+	if err != nil {
+		t.Fatal(err)
+	}
+	if index.Len() != 4 {
+		t.Errorf("expected 4 rules, got %d", index.Len())
+	}
+
+	tests := []struct {
+		name   string
+		req    *http.Request
+		status int
+	}{
+		{"public route", aclRequest("/health", nil, nil, ""), http.StatusOK},
+		{"no certificate", aclRequest("/json", nil, nil, ""), http.StatusUnauthorized},
+		{"spki rule", aclRequest("/json", []byte("x"), []byte("dev-1 key"), "ops-1"), http.StatusOK},
+		{"merged spki rules", aclRequest("/metrics", []byte("x"), []byte("dev-1 key"), "ops-1"), http.StatusOK},
+		{"fingerprint rule wins over CN", aclRequest("/", []byte("x"), []byte("dev-1 key"), "ops-1"), http.StatusForbidden},
+		{"cert prefix rule", aclRequest("/images/mtls-on.svg", []byte("dev-2 cert"), []byte("y"), ""), http.StatusOK},
+		{"cert rule other route", aclRequest("/json", []byte("dev-2 cert"), []byte("y"), ""), http.StatusForbidden},
+		{"CN pattern", aclRequest("/anything", []byte("x"), []byte("y"), "ops-7"), http.StatusOK},
+		{"escaped CN", aclRequest("/metrics", []byte("x"), []byte("y"), "build agent"), http.StatusOK},
+		{"unknown client", aclRequest("/json", []byte("x"), []byte("y"), "stranger"), http.StatusForbidden},
+	}
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			if status := index.check(identityOf(tt.req), tt.req.URL.Path); status != tt.status {
+				t.Errorf("expected %d, got %d", tt.status, status)
+			}
+		})
+	}
+}
+
+func Test_parseACLErrors(t *testing.T) {
+	for input, prefix := range map[string]string{
+		"spki abc /health": "line 1:",
+		"\n\nallow x":      "line 3:",
+		"cn bad%2 *":       "line 1:",
+	} {
+		if _, err := parseACL([]byte(input)); err == nil || !strings.HasPrefix(err.Error(), prefix) {
+			t.Errorf("%q: expected an error starting with %q, got %v", input, prefix, err)
+		}
+	}
+}
+
+func Test_globMatch(t *testing.T) {
+	for _, tt := range []struct {
+		pattern, text string
+		match         bool
+	}{
+		{"ops-*", "ops-1", true},
+		{"*-prod-*", "api-prod-3", true},
+		{"a*a", "aa", true},
+		{"a*a", "a", false},
+		{"ops-*", "dev-ops-1", false},
+		{"exact", "exact", true},
+		{"exact", "exactly", false},
+	} {
+		if globMatch(tt.pattern, tt.text) != tt.match {
+			t.Errorf("globMatch(%q, %q) != %v", tt.pattern, tt.text, tt.match)
+		}
+	}
+}
+
+func Test_aclHandler(t *testing.T) {
+	acl := &ACL{}
+	index, _ := parseACL([]byte("cn testClient /json\n"))
+	acl.index.Store(index)
+	handler := acl.Handler(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {}))
+
+	// The identity is computed once per connection and reused
+	conn := &connIdentity{}
+	ctx := context.WithValue(context.Background(), connIdentityKey{}, conn)
+	for _, path := range []string{"/json", "/", "/json"} {
+		w := httptest.NewRecorder()
+		handler.ServeHTTP(w, aclRequest(path, []byte("x"), []byte("y"), "testClient").WithContext(ctx))
+		want := http.StatusOK
+		if path == "/" {
+			want = http.StatusForbidden
+		}
+		if w.Code != want {
+			t.Errorf("%s: expected %d, got %d", path, want, w.Code)
+		}
+	}
+	if conn.id == nil || conn.id.cn != "testClient" || acl.Denied() != 1 {
+		t.Errorf("unexpected identity %+v or denied count %d", conn.id, acl.Denied())
+	}
+}
@@ -0,0 +1,166 @@
+package server
+
+import (
+	"container/list"
+	"crypto/sha256"
+	"encoding/binary"
+	"net/http"
+	"sync"
+	"sync/atomic"
+)
+
+type responseFormat uint8
+
+const (
+	formatJSON responseFormat = iota
+	formatHTML
+	formatCompactJSON
+	formatCBOR
+	formatMsgpack
+)
+
+// cacheKey identifies a rendered response: the presented peer chain, whether
+// it verified, the output format and selected fields and, as tenants trust
+// different CAs, the SNI hostname.
+type cacheKey struct {
+	chain      [sha256.Size]byte
+	verified   bool
+	format     responseFormat
+	fields     fieldSet
+	serverName string
+}
+
+// renderedResponse is a ready-to-write response body and status code.
+type renderedResponse struct {
+	status int
+	body   []byte
+}
+
+type cacheEntry struct {
+	key      cacheKey
+	response renderedResponse
+}
+
+// CacheStats reports response cache effectiveness.
+type CacheStats struct {
+	Hits     uint64
+	Misses   uint64
+	Entries  int
+	Capacity int
+}
+
+// responseCache is a bounded LRU of rendered responses. Client fleets are
+// small, so the same peer chain always renders to the same bytes; caching
+// skips building the response struct, date formatting, JSON marshalling and
+// template execution. A nil *responseCache renders every request.
+type responseCache struct {
+	mu       sync.Mutex
+	capacity int
+	items    map[cacheKey]*list.Element
+	order    *list.List
+
+	hits   atomic.Uint64
+	misses atomic.Uint64
+}
+
+func newResponseCache(capacity int) *responseCache {
+	if capacity <= 0 {
+		return nil
+	}
+	return &responseCache{
+		capacity: capacity,
+		items:    make(map[cacheKey]*list.Element, capacity),
+		order:    list.New(),
+	}
+}
+
+// responseCacheKey hashes the raw DER of every presented certificate. Each
+// certificate is length-prefixed so different chain splits cannot collide.
+func responseCacheKey(r *http.Request, format responseFormat) (cacheKey, bool) {
+	if r.TLS == nil {
+		return cacheKey{}, false
+	}
+
+	h := sha256.New()
+	var length [4]byte
+	for _, cert := range r.TLS.PeerCertificates {
+		binary.BigEndian.PutUint32(length[:], uint32(len(cert.Raw)))
+		h.Write(length[:])
+		h.Write(cert.Raw)
+	}
+
+	key := cacheKey{
+		verified:   len(r.TLS.VerifiedChains) > 0,
+		format:     format,
+		serverName: r.TLS.ServerName,
+	}
+	h.Sum(key.chain[:0])
+	return key, true
+}
+
+// get returns the cached response for key, calling render on a miss. Render
+// errors are returned and not cached.
+func (c *responseCache) get(key cacheKey, render func() (renderedResponse, error)) (renderedResponse, error) {
+	if c == nil {
+		return render()
+	}
+
+	c.mu.Lock()
+	if elem, ok := c.items[key]; ok {
+		c.order.MoveToFront(elem)
+		resp := elem.Value.(*cacheEntry).response
+		c.mu.Unlock()
+		c.hits.Add(1)
+		return resp, nil
+	}
+	c.mu.Unlock()
+	c.misses.Add(1)
+
+	// Render outside the lock; concurrent misses for the same key render
+	// twice and the last one wins, which is harmless for identical output.
+	resp, err := render()
+	if err != nil {
+		return resp, err
+	}
+
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if elem, ok := c.items[key]; ok {
+		elem.Value.(*cacheEntry).response = resp
+		c.order.MoveToFront(elem)
+		return resp, nil
+	}
+	c.items[key] = c.order.PushFront(&cacheEntry{key: key, response: resp})
+	if c.order.Len() > c.capacity {
+		oldest := c.order.Back()
+		c.order.Remove(oldest)
+		delete(c.items, oldest.Value.(*cacheEntry).key)
+	}
+	return resp, nil
+}
+
+// purge drops every cached response, e.g. after the client CA changed.
+func (c *responseCache) purge() {
+	if c == nil {
+		return
+	}
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	c.items = make(map[cacheKey]*list.Element, c.capacity)
+	c.order.Init()
+}
+
+func (c *responseCache) stats() CacheStats {
+	if c == nil {
+		return CacheStats{}
+	}
+	c.mu.Lock()
+	entries := c.order.Len()
+	c.mu.Unlock()
+	return CacheStats{
+		Hits:     c.hits.Load(),
+		Misses:   c.misses.Load(),
+		Entries:  entries,
+		Capacity: c.capacity,
+	}
+}
@@ -0,0 +1,134 @@
+package server
+
+import (
+	"crypto/tls"
+	"crypto/x509"
+	"html/template"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+)
+
+func cachedRequest(raw []byte, verified bool) *http.Request {
+	cert := clientCert
+	cert.Raw = raw
+	state := &tls.ConnectionState{PeerCertificates: []*x509.Certificate{&cert}}
+	if verified {
+		state.VerifiedChains = [][]*x509.Certificate{{&cert, &caCert}}
+	}
+	return &http.Request{TLS: state}
+}
+
+func Test_responseCacheKey(t *testing.T) {
+	a, _ := responseCacheKey(cachedRequest([]byte("a"), true), formatJSON)
+	b, _ := responseCacheKey(cachedRequest([]byte("b"), true), formatJSON)
+	unverified, _ := responseCacheKey(cachedRequest([]byte("a"), false), formatJSON)
+	html, _ := responseCacheKey(cachedRequest([]byte("a"), true), formatHTML)
+
+	if a == b || a == unverified || a == html {
+		t.Errorf("expected distinct keys for chain, verification status and format")
+	}
+	if again, _ := responseCacheKey(cachedRequest([]byte("a"), true), formatJSON); again != a {
+		t.Errorf("expected the same chain to produce the same key")
+	}
+	if _, ok := responseCacheKey(&http.Request{}, formatJSON); ok {
+		t.Errorf("expected no key for a request without TLS")
+	}
+}
+
+func Test_responseCacheEviction(t *testing.T) {
+	cache := newResponseCache(2)
+	renders := 0
+	render := func() (renderedResponse, error) {
+		renders++
+		return renderedResponse{status: http.StatusOK, body: []byte("body")}, nil
+	}
+
+	keyA, _ := responseCacheKey(cachedRequest([]byte("a"), true), formatJSON)
+	keyB, _ := responseCacheKey(cachedRequest([]byte("b"), true), formatJSON)
+	keyC, _ := responseCacheKey(cachedRequest([]byte("c"), true), formatJSON)
+
+	for _, key := range []cacheKey{keyA, keyB, keyA, keyC, keyA, keyB} {
+		if _, err := cache.get(key, render); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	// A, B miss; A hits; C evicts B; A hits; B misses again and evicts C
+	stats := cache.stats()
+	if renders != 4 || stats.Hits != 2 || stats.Misses != 4 || stats.Entries != 2 {
+		t.Errorf("unexpected cache behaviour: renders=%d stats=%+v", renders, stats)
+	}
+}
+
+func Test_requestHandlerJSONCached(t *testing.T) {
+	cache := newResponseCache(8)
+	for i := 0; i < 3; i++ {
+		w := httptest.NewRecorder()
+		requestHandlerJSON(w, httptest.NewRequest(http.MethodGet, "/json", nil), "path", cache)
+		if w.Code != http.StatusUnauthorized {
+			t.Errorf("expected %d for a request without TLS, got %d", http.StatusUnauthorized, w.Code)
+		}
+	}
+
+	for i := 0; i < 3; i++ {
+		r := httptest.NewRequest(http.MethodGet, "/json", nil)
+		r.TLS = verifiedTLS()
+		w := httptest.NewRecorder()
+		requestHandlerJSON(w, r, "path", cache)
+		if w.Code != http.StatusOK {
+			t.Errorf("expected %d, got %d", http.StatusOK, w.Code)
+		}
+		if ct := w.Header().Get("Content-Type"); ct != "application/json" {
+			t.Errorf("unexpected content type %q", ct)
+		}
+	}
+
+	if stats := cache.stats(); stats.Hits != 2 || stats.Misses != 1 {
+		t.Errorf("unexpected stats %+v", stats)
+	}
+}
+
+func benchmarkRequestHandlerJSON(b *testing.B, cache *responseCache) {
+	r := httptest.NewRequest(http.MethodGet, "/json", nil)
+	r.TLS = cachedRequest([]byte("benchmark-client-certificate"), true).TLS
+
+	b.ReportAllocs()
+	b.ResetTimer()
+	b.RunParallel(func(pb *testing.PB) {
+		for pb.Next() {
+			requestHandlerJSON(httptest.NewRecorder(), r, "path", cache)
+		}
+	})
+}
+
+func BenchmarkRequestHandlerJSONUncached(b *testing.B) {
+	benchmarkRequestHandlerJSON(b, nil)
+}
+
+func BenchmarkRequestHandlerJSONCached(b *testing.B) {
+	benchmarkRequestHandlerJSON(b, newResponseCache(DefaultResponseCacheSize))
+}
+
+func benchmarkRequestHandlerHTML(b *testing.B, cache *responseCache) {
+	webTemplate := template.Must(template.New("index").Parse(
+		`{{if .MTLSValid}}verified{{else}}not verified{{end}}{{range .PresentedCertificates}}<li>{{.SubjectCommonName}} {{.NotAfter}}</li>{{end}}`))
+	r := httptest.NewRequest(http.MethodGet, "/", nil)
+	r.TLS = cachedRequest([]byte("benchmark-client-certificate"), true).TLS
+
+	b.ReportAllocs()
+	b.ResetTimer()
+	b.RunParallel(func(pb *testing.PB) {
+		for pb.Next() {
+			requestHandlerHTML(httptest.NewRecorder(), r, webTemplate, "path", cache)
+		}
+	})
+}
+
+func BenchmarkRequestHandlerHTMLUncached(b *testing.B) {
+	benchmarkRequestHandlerHTML(b, nil)
+}
+
+func BenchmarkRequestHandlerHTMLCached(b *testing.B) {
+	benchmarkRequestHandlerHTML(b, newResponseCache(DefaultResponseCacheSize))
+}
@@ -0,0 +1,138 @@
+package server
+
+import (
+	"context"
+	"crypto/tls"
+	"errors"
+	"fmt"
+	"log"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"golang.org/x/crypto/acme/autocert"
+)
+
+// prewarmHello is the ClientHello used to prewarm certificates. It offers
+// ECDSA, as every current browser and client library does, so autocert
+// loads or obtains the ECDSA certificate those handshakes will ask for.
+var prewarmHello = tls.ClientHelloInfo{
+	CipherSuites:     []uint16{tls.TLS_ECDHE_ECDSA_WITH_AES_128_GCM_SHA256},
+	SignatureSchemes: []tls.SignatureScheme{tls.ECDSAWithP256AndSHA256},
+	SupportedCurves:  []tls.CurveID{tls.X25519, tls.CurveP256},
+}
+
+// certCache is an autocert.Cache that keeps ACME account keys and
+// certificates in memory in front of an optional directory, so they survive
+// restarts without costing a disk read on every lookup. A nil dir keeps
+// them in memory only.
+type certCache struct {
+	dir autocert.Cache
+
+	mu      sync.RWMutex
+	entries map[string][]byte
+
+	hits   atomic.Uint64
+	misses atomic.Uint64
+}
+
+func newCertCache(dir string) *certCache {
+	c := &certCache{entries: make(map[string][]byte)}
+	if dir != "" {
+		c.dir = autocert.DirCache(dir)
+	}
+	return c
+}
+
+// Get returns the entry for key from memory, else from the directory.
+func (c *certCache) Get(ctx context.Context, key string) ([]byte, error) {
+	c.mu.RLock()
+	data, ok := c.entries[key]
+	c.mu.RUnlock()
+	if ok {
+		c.hits.Add(1)
+		return data, nil
+	}
+	c.misses.Add(1)
+
+	if c.dir == nil {
+		return nil, autocert.ErrCacheMiss
+	}
+	data, err := c.dir.Get(ctx, key)
+	if err != nil {
+		return nil, err
+	}
+	c.mu.Lock()
+	c.entries[key] = data
+	c.mu.Unlock()
+	return data, nil
+}
+
+// Put writes the entry for key to the directory, then to memory.
+func (c *certCache) Put(ctx context.Context, key string, data []byte) error {
+	if c.dir != nil {
+		if err := c.dir.Put(ctx, key, data); err != nil {
+			return err
+		}
+	}
+	c.mu.Lock()
+	c.entries[key] = data
+	c.mu.Unlock()
+	return nil
+}
+
+// Delete removes the entry for key from memory and the directory.
+func (c *certCache) Delete(ctx context.Context, key string) error {
+	c.mu.Lock()
+	delete(c.entries, key)
+	c.mu.Unlock()
+	if c.dir != nil {
+		return c.dir.Delete(ctx, key)
+	}
+	return nil
+}
+
+func (c *certCache) stats() CacheStats {
+	c.mu.RLock()
+	entries := len(c.entries)
+	c.mu.RUnlock()
+	return CacheStats{
+		Hits:    c.hits.Load(),
+		Misses:  c.misses.Load(),
+		Entries: entries,
+	}
+}
+
+// prewarmCertificates loads, or obtains from the ACME CA, the certificate of
+// every host in parallel, so no client handshake has to wait for it. Loading
+// a certificate also starts autocert's renewal timer for it.
+func prewarmCertificates(ctx context.Context, manager *autocert.Manager, hosts []string) error {
+	errs := make([]error, len(hosts))
+	var wg sync.WaitGroup
+	for i, host := range hosts {
+		wg.Add(1)
+		go func(i int, host string) {
+			defer wg.Done()
+			start := time.Now()
+			hello := prewarmHello
+			hello.ServerName = host
+			done := make(chan error, 1)
+			go func() {
+				_, err := manager.GetCertificate(&hello)
+				done <- err
+			}()
+			select {
+			case err := <-done:
+				if err != nil {
+					errs[i] = fmt.Errorf("%s: %w", host, err)
+					return
+				}
+				log.Printf("Certificate for %s ready after %v", host, time.Since(start).Round(time.Millisecond))
+			case <-ctx.Done():
+				errs[i] = fmt.Errorf("%s: %w", host, ctx.Err())
+			}
+		}(i, host)
+	}
+	wg.Wait()
+	return errors.Join(errs...)
+}
@@ -0,0 +1,114 @@
+package server
+
+import (
+	"bytes"
+	"context"
+	"crypto/ecdsa"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/x509"
+	"crypto/x509/pkix"
+	"encoding/pem"
+	"math/big"
+	"testing"
+	"time"
+
+	"golang.org/x/crypto/acme/autocert"
+)
+
+func Test_certCachePersists(t *testing.T) {
+	ctx := context.Background()
+	dir := t.TempDir()
+
+	cache := newCertCache(dir)
+	if _, err := cache.Get(ctx, "example.com"); err != autocert.ErrCacheMiss {
+		t.Fatalf("expected a cache miss, got %v", err)
+	}
+	if err := cache.Put(ctx, "example.com", []byte("cert")); err != nil {
+		t.Fatal(err)
+	}
+	if data, err := cache.Get(ctx, "example.com"); err != nil || string(data) != "cert" {
+		t.Fatalf("expected the stored entry, got %q %v", data, err)
+	}
+	if stats := cache.stats(); stats.Hits != 1 || stats.Misses != 1 || stats.Entries != 1 {
+		t.Errorf("expected 1 hit, 1 miss and 1 entry, got %+v", stats)
+	}
+
+	// A restarted server reads the entry from disk once, then from memory
+	restarted := newCertCache(dir)
+	for i := 0; i < 2; i++ {
+		if data, err := restarted.Get(ctx, "example.com"); err != nil || string(data) != "cert" {
+			t.Fatalf("expected the entry to survive a restart, got %q %v", data, err)
+		}
+	}
+	if stats := restarted.stats(); stats.Hits != 1 || stats.Misses != 1 {
+		t.Errorf("expected the second lookup to hit memory, got %+v", stats)
+	}
+
+	if err := restarted.Delete(ctx, "example.com"); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := newCertCache(dir).Get(ctx, "example.com"); err != autocert.ErrCacheMiss {
+		t.Errorf("expected Delete to remove the entry from disk, got %v", err)
+	}
+
+	memory := newCertCache("")
+	if err := memory.Put(ctx, "acme_account+key", []byte("key")); err != nil {
+		t.Fatal(err)
+	}
+	if data, err := memory.Get(ctx, "acme_account+key"); err != nil || string(data) != "key" {
+		t.Errorf("expected a memory-only cache to keep entries, got %q %v", data, err)
+	}
+}
+
+// cachedACMECert encodes a self-signed ECDSA certificate for host the way
+// autocert stores it: the private key followed by the chain.
+func cachedACMECert(t *testing.T, host string) []byte {
+	t.Helper()
+	key, err := ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	template := &x509.Certificate{
+		SerialNumber: big.NewInt(3),
+		Subject:      pkix.Name{CommonName: host},
+		DNSNames:     []string{host},
+		NotBefore:    time.Now().Add(-time.Hour),
+		NotAfter:     time.Now().Add(90 * 24 * time.Hour),
+	}
+	der, err := x509.CreateCertificate(rand.Reader, template, template, &key.PublicKey, key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	keyDER, err := x509.MarshalECPrivateKey(key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	var buf bytes.Buffer
+	pem.Encode(&buf, &pem.Block{Type: "EC PRIVATE KEY", Bytes: keyDER})
+	pem.Encode(&buf, &pem.Block{Type: "CERTIFICATE", Bytes: der})
+	return buf.Bytes()
+}
+
+func Test_prewarmCertificatesFromCache(t *testing.T) {
+	ctx := context.Background()
+	cache := newCertCache(t.TempDir())
+	if err := cache.Put(ctx, "mtls.example.com", cachedACMECert(t, "mtls.example.com")); err != nil {
+		t.Fatal(err)
+	}
+	manager := &autocert.Manager{
+		Prompt:     autocert.AcceptTOS,
+		HostPolicy: autocert.HostWhitelist("mtls.example.com"),
+		Cache:      cache,
+	}
+	// No ACME directory is reachable here, so this only passes from cache
+	if err := prewarmCertificates(ctx, manager, []string{"mtls.example.com"}); err != nil {
+		t.Fatal(err)
+	}
+
+	ctx, cancel := context.WithTimeout(ctx, 50*time.Millisecond)
+	defer cancel()
+	if err := prewarmCertificates(ctx, manager, []string{"mtls.example.com", "other.example.com"}); err == nil {
+		t.Errorf("expected a host outside the policy to fail")
+	}
+}
@@ -0,0 +1,119 @@
+package server
+
+import (
+	"context"
+	"crypto/x509"
+	"errors"
+	"log"
+	"os"
+	"sync"
+	"sync/atomic"
+	"time"
+)
+
+// DefaultClientCAReloadInterval is how often Watch checks the CA file.
+const DefaultClientCAReloadInterval = 10 * time.Second
+
+// ClientCAs is a client CA pool loaded from a PEM file that can be reloaded
+// while the server is running. Handshakes started after a reload verify
+// against the new pool; established connections are unaffected.
+type ClientCAs struct {
+	path string
+	pool atomic.Pointer[x509.CertPool]
+
+	mu       sync.Mutex
+	modTime  time.Time
+	size     int64
+	onReload []func(*x509.CertPool)
+}
+
+// LoadClientCAs reads the CA certificates in path.
+func LoadClientCAs(path string) (*ClientCAs, error) {
+	c := &ClientCAs{path: path}
+	if err := c.Reload(); err != nil {
+		return nil, err
+	}
+	return c, nil
+}
+
+// Pool returns the current CA pool.
+func (c *ClientCAs) Pool() *x509.CertPool {
+	return c.pool.Load()
+}
+
+// Reload re-reads the CA file unconditionally. On error the current pool is
+// kept.
+func (c *ClientCAs) Reload() error {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	return c.reloadLocked()
+}
+
+// ReloadIfChanged reloads the CA file if its modification time or size
+// changed since the last successful load, and reports whether it did.
+func (c *ClientCAs) ReloadIfChanged() (bool, error) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	info, err := os.Stat(c.path)
+	if err != nil {
+		return false, err
+	}
+	if info.ModTime().Equal(c.modTime) && info.Size() == c.size {
+		return false, nil
+	}
+	return true, c.reloadLocked()
+}
+
+func (c *ClientCAs) reloadLocked() error {
+	// Stat before reading so a write that lands mid-reload shows up as a
+	// change on the next check
+	info, err := os.Stat(c.path)
+	if err != nil {
+		return err
+	}
+	pem, err := os.ReadFile(c.path)
+	if err != nil {
+		return err
+	}
+
+	pool := x509.NewCertPool()
+	if !pool.AppendCertsFromPEM(pem) {
+		return errors.New("could not decode CA pem")
+	}
+
+	c.pool.Store(pool)
+	c.modTime, c.size = info.ModTime(), info.Size()
+	for _, fn := range c.onReload {
+		fn(pool)
+	}
+	return nil
+}
+
+// notify registers fn to be called with the new pool after every reload.
+func (c *ClientCAs) notify(fn func(*x509.CertPool)) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	c.onReload = append(c.onReload, fn)
+}
+
+// Watch checks the CA file every interval and reloads it when it changes,
+// until ctx is cancelled.
+func (c *ClientCAs) Watch(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+
+	for {
+		select {
+		case <-ctx.Done():
+			return
+		case <-ticker.C:
+			reloaded, err := c.ReloadIfChanged()
+			if err != nil {
+				log.Printf("Could not reload client CA %s, keeping current pool: %v", c.path, err)
+			} else if reloaded {
+				log.Printf("Reloaded client CA %s", c.path)
+			}
+		}
+	}
+}
@@ -0,0 +1,117 @@
+package server
+
+import (
+	"crypto/ecdsa"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/tls"
+	"crypto/x509"
+	"crypto/x509/pkix"
+	"encoding/pem"
+	"math/big"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+)
+
+func testCAPEM(t *testing.T, name string) []byte {
+	t.Helper()
+	key, err := ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	template := &x509.Certificate{
+		SerialNumber:          big.NewInt(1),
+		Subject:               pkix.Name{CommonName: name},
+		NotBefore:             testDate,
+		NotAfter:              testDate.Add(time.Hour * 24),
+		IsCA:                  true,
+		BasicConstraintsValid: true,
+		KeyUsage:              x509.KeyUsageCertSign,
+	}
+	der, err := x509.CreateCertificate(rand.Reader, template, template, &key.PublicKey, key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return pem.EncodeToMemory(&pem.Block{Type: "CERTIFICATE", Bytes: der})
+}
+
+func writeCA(t *testing.T, path string, body []byte, modTime time.Time) {
+	t.Helper()
+	if err := os.WriteFile(path, body, 0o644); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.Chtimes(path, modTime, modTime); err != nil {
+		t.Fatal(err)
+	}
+}
+
+func Test_ClientCAsReloadIfChanged(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "root.pem")
+	writeCA(t, path, testCAPEM(t, "Old CA"), testDate)
+
+	cas, err := LoadClientCAs(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	first := cas.Pool()
+
+	if reloaded, err := cas.ReloadIfChanged(); reloaded || err != nil {
+		t.Errorf("expected no reload for an unchanged file, got %v %v", reloaded, err)
+	}
+
+	// A broken file keeps the current pool and is retried on the next check
+	writeCA(t, path, []byte("not a certificate"), testDate.Add(time.Hour))
+	if _, err := cas.ReloadIfChanged(); err == nil || cas.Pool() != first {
+		t.Fatalf("expected a failed reload to keep the current pool, got %v", err)
+	}
+
+	writeCA(t, path, testCAPEM(t, "New CA"), testDate.Add(2*time.Hour))
+	if reloaded, err := cas.ReloadIfChanged(); !reloaded || err != nil {
+		t.Fatalf("expected a reload, got %v %v", reloaded, err)
+	}
+	if cas.Pool() == first || cas.Pool().Equal(first) {
+		t.Errorf("expected a new pool after reload")
+	}
+}
+
+func Test_reloadClientCAs(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "root.pem")
+	writeCA(t, path, testCAPEM(t, "Old CA"), testDate)
+	cas, err := LoadClientCAs(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	cache := newResponseCache(8)
+	tlsConfig := &tls.Config{ClientCAs: cas.Pool(), ClientAuth: tls.VerifyClientCertIfGiven}
+	reloadClientCAs(tlsConfig, cas, cache)
+
+	before, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{})
+	if before.ClientCAs != cas.Pool() || before.GetConfigForClient != nil {
+		t.Fatalf("expected a snapshot of the initial config")
+	}
+	if again, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{}); again != before {
+		t.Errorf("expected the snapshot to be reused until the pool changes")
+	}
+
+	if _, err := cache.get(cacheKey{}, func() (renderedResponse, error) { return renderedResponse{}, nil }); err != nil {
+		t.Fatal(err)
+	}
+	writeCA(t, path, testCAPEM(t, "New CA"), testDate.Add(time.Hour))
+	if err := cas.Reload(); err != nil {
+		t.Fatal(err)
+	}
+
+	after, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{})
+	if after.ClientCAs != cas.Pool() || after.ClientCAs == before.ClientCAs {
+		t.Errorf("expected handshakes after a reload to use the new pool")
+	}
+	if after.ClientAuth != tls.VerifyClientCertIfGiven {
+		t.Errorf("expected the rest of the config to be kept")
+	}
+	if stats := cache.stats(); stats.Entries != 0 {
+		t.Errorf("expected the response cache to be purged, got %d entries", stats.Entries)
+	}
+}
@@ -0,0 +1,336 @@
+package server
+
+import (
+	"encoding/binary"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"math"
+	"strconv"
+	"strings"
+)
+
+// Media types /json can be served as, in addition to the default indented
+// JSON. MessagePack has no registered type, so the common variants are all
+// accepted.
+var encodingMediaTypes = map[string]responseFormat{
+	"application/json":        formatCompactJSON,
+	"application/cbor":        formatCBOR,
+	"application/msgpack":     formatMsgpack,
+	"application/x-msgpack":   formatMsgpack,
+	"application/vnd.msgpack": formatMsgpack,
+	"application/*":           formatJSON,
+	"*/*":                     formatJSON,
+}
+
+var contentTypes = map[responseFormat]string{
+	formatJSON:        "application/json",
+	formatCompactJSON: "application/json",
+	formatCBOR:        "application/cbor",
+	formatMsgpack:     "application/msgpack",
+}
+
+// errNotAcceptable is returned by negotiateFormat when the Accept header
+// rules out every format /json can produce.
+var errNotAcceptable = errors.New("none of the accepted media types can be produced")
+
+// negotiateFormat picks the response format for an Accept header. Explicit
+// application/json gets compact JSON, while a missing header and wildcards,
+// as sent by browsers and curl, keep the indented JSON for humans. Among
+// acceptable types the highest q-value wins, then the first listed.
+func negotiateFormat(accept string) (responseFormat, error) {
+	if strings.TrimSpace(accept) == "" {
+		return formatJSON, nil
+	}
+	best, bestQ := formatJSON, -1.0
+	for _, item := range strings.Split(accept, ",") {
+		mediaType, params, _ := strings.Cut(item, ";")
+		mediaType = strings.ToLower(strings.TrimSpace(mediaType))
+		format, ok := encodingMediaTypes[mediaType]
+		if !ok {
+			continue
+		}
+		q := 1.0
+		for _, param := range strings.Split(params, ";") {
+			name, value, _ := strings.Cut(strings.TrimSpace(param), "=")
+			if strings.EqualFold(name, "q") {
+				if parsed, err := strconv.ParseFloat(value, 64); err == nil {
+					q = parsed
+				}
+			}
+		}
+		if q > 0 && q > bestQ {
+			best, bestQ = format, q
+		}
+	}
+	if bestQ < 0 {
+		return 0, errNotAcceptable
+	}
+	return best, nil
+}
+
+// fieldSet selects the top-level members of a /json response.
+type fieldSet uint8
+
+const (
+	fieldMTLSValid fieldSet = 1 << iota
+	fieldClientCertificatePath
+	fieldPresentedCertificates
+	fieldVerifiedChains
+	// fieldLeafCommonName is the subject CN of the presented leaf, only
+	// included when asked for
+	fieldLeafCommonName
+
+	defaultFields = fieldMTLSValid | fieldClientCertificatePath | fieldPresentedCertificates | fieldVerifiedChains
+)
+
+var fieldNames = []struct {
+	name  string
+	field fieldSet
+}{
+	{"mtls_valid", fieldMTLSValid},
+	{"leaf_common_name", fieldLeafCommonName},
+	{"client_certificate_path", fieldClientCertificatePath},
+	{"presented_certificates", fieldPresentedCertificates},
+	{"verified_certificate_chains", fieldVerifiedChains},
+}
+
+// parseFields parses a ?fields= list of top-level member names; an empty
+// list selects the default members.
+func parseFields(list string) (fieldSet, error) {
+	var fields fieldSet
+	for _, name := range strings.Split(list, ",") {
+		name = strings.TrimSpace(name)
+		if name == "" {
+			continue
+		}
+		found := false
+		for _, f := range fieldNames {
+			if f.name == name {
+				fields |= f.field
+				found = true
+				break
+			}
+		}
+		if !found {
+			return 0, fmt.Errorf("unknown field %q", name)
+		}
+	}
+	if fields == 0 {
+		return defaultFields, nil
+	}
+	return fields, nil
+}
+
+// jsonProjection holds the selected fields of a response for encoding/json.
+// Unselected fields are nil and omitted; a selected field that points to a
+// nil value is encoded as null.
+type jsonProjection struct {
+	MTLSValid             *bool               `json:"mtls_valid,omitempty"`
+	LeafCommonName        **string            `json:"leaf_common_name,omitempty"`
+	ClientCertificatePath *string             `json:"client_certificate_path,omitempty"`
+	PresentedCertificates *[]certificate      `json:"presented_certificates,omitempty"`
+	VerifiedChains        *[]certificateChain `json:"verified_certificate_chains,omitempty"`
+}
+
+func projectJSON(resp response, fields fieldSet) jsonProjection {
+	var p jsonProjection
+	if fields&fieldMTLSValid != 0 {
+		p.MTLSValid = &resp.MTLSValid
+	}
+	if fields&fieldLeafCommonName != 0 {
+		var leaf *string
+		if len(resp.PresentedCertificates) > 0 {
+			leaf = &resp.PresentedCertificates[0].SubjectCommonName
+		}
+		p.LeafCommonName = &leaf
+	}
+	if fields&fieldClientCertificatePath != 0 {
+		p.ClientCertificatePath = &resp.ClientCertificatePath
+	}
+	if fields&fieldPresentedCertificates != 0 {
+		p.PresentedCertificates = &resp.PresentedCertificates
+	}
+	if fields&fieldVerifiedChains != 0 {
+		p.VerifiedChains = &resp.VerifiedChains
+	}
+	return p
+}
+
+// encodeResponse serializes the selected fields of resp. Every format keeps
+// the member order and null for absent lists of the indented JSON.
+func encodeResponse(resp response, fields fieldSet, format responseFormat) ([]byte, error) {
+	var w valueWriter
+	switch format {
+	case formatJSON:
+		return json.MarshalIndent(projectJSON(resp, fields), "", "  ")
+	case formatCompactJSON:
+		return json.Marshal(projectJSON(resp, fields))
+	case formatCBOR:
+		w = &cborWriter{}
+	case formatMsgpack:
+		w = &msgpackWriter{}
+	default:
+		return nil, fmt.Errorf("format %d is not an encoding", format)
+	}
+
+	members := 0
+	for _, f := range fieldNames {
+		if fields&f.field != 0 {
+			members++
+		}
+	}
+	w.beginMap(members)
+	for _, f := range fieldNames {
+		if fields&f.field == 0 {
+			continue
+		}
+		w.key(f.name)
+		switch f.field {
+		case fieldMTLSValid:
+			w.bool(resp.MTLSValid)
+		case fieldLeafCommonName:
+			if len(resp.PresentedCertificates) == 0 {
+				w.null()
+			} else {
+				w.string(resp.PresentedCertificates[0].SubjectCommonName)
+			}
+		case fieldClientCertificatePath:
+			w.string(resp.ClientCertificatePath)
+		case fieldPresentedCertificates:
+			writeCertificates(w, resp.PresentedCertificates)
+		case fieldVerifiedChains:
+			if resp.VerifiedChains == nil {
+				w.null()
+				break
+			}
+			w.beginArray(len(resp.VerifiedChains))
+			for _, chain := range resp.VerifiedChains {
+				writeCertificates(w, chain)
+			}
+			w.end()
+		}
+	}
+	w.end()
+	return w.bytes(), nil
+}
+
+func writeCertificates(w valueWriter, certs []certificate) {
+	if certs == nil {
+		w.null()
+		return
+	}
+	w.beginArray(len(certs))
+	for _, cert := range certs {
+		w.beginMap(5)
+		w.key("issuer_common_name")
+		w.string(cert.IssuerCommonName)
+		w.key("subject_common_name")
+		w.string(cert.SubjectCommonName)
+		w.key("not_before")
+		w.string(cert.NotBefore)
+		w.key("not_after")
+		w.string(cert.NotAfter)
+		w.key("is_ca")
+		w.bool(cert.IsCA)
+		w.end()
+	}
+	w.end()
+}
+
+// valueWriter appends the handful of value types a response consists of in
+// CBOR or MessagePack. Maps and arrays are announced with their length and
+// closed with end.
+type valueWriter interface {
+	beginMap(n int)
+	beginArray(n int)
+	end()
+	key(s string)
+	string(s string)
+	bool(b bool)
+	null()
+	bytes() []byte
+}
+
+// cborWriter writes definite-length CBOR (RFC 8949).
+type cborWriter struct{ buf []byte }
+
+func (w *cborWriter) head(major byte, n uint64) {
+	switch {
+	case n < 24:
+		w.buf = append(w.buf, major<<5|byte(n))
+	case n <= math.MaxUint8:
+		w.buf = append(w.buf, major<<5|24, byte(n))
+	case n <= math.MaxUint16:
+		w.buf = binary.BigEndian.AppendUint16(append(w.buf, major<<5|25), uint16(n))
+	case n <= math.MaxUint32:
+		w.buf = binary.BigEndian.AppendUint32(append(w.buf, major<<5|26), uint32(n))
+	default:
+		w.buf = binary.BigEndian.AppendUint64(append(w.buf, major<<5|27), n)
+	}
+}
+
+func (w *cborWriter) beginMap(n int)   { w.head(5, uint64(n)) }
+func (w *cborWriter) beginArray(n int) { w.head(4, uint64(n)) }
+func (w *cborWriter) end()             {}
+func (w *cborWriter) key(s string)     { w.string(s) }
+
+func (w *cborWriter) string(s string) {
+	w.head(3, uint64(len(s)))
+	w.buf = append(w.buf, s...)
+}
+
+func (w *cborWriter) bool(b bool) {
+	if b {
+		w.buf = append(w.buf, 0xf5)
+	} else {
+		w.buf = append(w.buf, 0xf4)
+	}
+}
+
+func (w *cborWriter) null()         { w.buf = append(w.buf, 0xf6) }
+func (w *cborWriter) bytes() []byte { return w.buf }
+
+// msgpackWriter writes MessagePack.
+type msgpackWriter struct{ buf []byte }
+
+func (w *msgpackWriter) container(fix, b16 byte, n int) {
+	switch {
+	case n < 16:
+		w.buf = append(w.buf, fix|byte(n))
+	case n <= math.MaxUint16:
+		w.buf = binary.BigEndian.AppendUint16(append(w.buf, b16), uint16(n))
+	default:
+		w.buf = binary.BigEndian.AppendUint32(append(w.buf, b16+1), uint32(n))
+	}
+}
+
+func (w *msgpackWriter) beginMap(n int)   { w.container(0x80, 0xde, n) }
+func (w *msgpackWriter) beginArray(n int) { w.container(0x90, 0xdc, n) }
+func (w *msgpackWriter) end()             {}
+func (w *msgpackWriter) key(s string)     { w.string(s) }
+
+func (w *msgpackWriter) string(s string) {
+	switch n := len(s); {
+	case n < 32:
+		w.buf = append(w.buf, 0xa0|byte(n))
+	case n <= math.MaxUint8:
+		w.buf = append(w.buf, 0xd9, byte(n))
+	case n <= math.MaxUint16:
+		w.buf = binary.BigEndian.AppendUint16(append(w.buf, 0xda), uint16(n))
+	default:
+		w.buf = binary.BigEndian.AppendUint32(append(w.buf, 0xdb), uint32(n))
+	}
+	w.buf = append(w.buf, s...)
+}
+
+func (w *msgpackWriter) bool(b bool) {
+	if b {
+		w.buf = append(w.buf, 0xc3)
+	} else {
+		w.buf = append(w.buf, 0xc2)
+	}
+}
+
+func (w *msgpackWriter) null()         { w.buf = append(w.buf, 0xc0) }
+func (w *msgpackWriter) bytes() []byte { return w.buf }
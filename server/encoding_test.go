@@ -0,0 +1,237 @@
+package server
+
+import (
+	"bytes"
+	"encoding/json"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+)
+
+func Test_negotiateFormat(t *testing.T) {
+	tests := []struct {
+		accept string
+		want   responseFormat
+	}{
+		{"", formatJSON},
+		{"*/*", formatJSON},
+		{"text/html,application/xhtml+xml,*/*;q=0.8", formatJSON},
+		{"application/json", formatCompactJSON},
+		{"Application/JSON; charset=utf-8", formatCompactJSON},
+		{"application/cbor", formatCBOR},
+		{"application/x-msgpack", formatMsgpack},
+		{"application/json;q=0.5, application/cbor", formatCBOR},
+		{"application/msgpack, application/cbor", formatMsgpack},
+		{"application/cbor;q=0, application/json", formatCompactJSON},
+	}
+	for _, tt := range tests {
+		if got, err := negotiateFormat(tt.accept); err != nil || got != tt.want {
+			t.Errorf("negotiateFormat(%q) = %v, %v, want %v", tt.accept, got, err, tt.want)
+		}
+	}
+	for _, accept := range []string{"text/html", "application/cbor;q=0"} {
+		if _, err := negotiateFormat(accept); err != errNotAcceptable {
+			t.Errorf("negotiateFormat(%q) error = %v, want errNotAcceptable", accept, err)
+		}
+	}
+}
+
+func Test_parseFields(t *testing.T) {
+	if fields, err := parseFields(""); err != nil || fields != defaultFields {
+		t.Errorf("parseFields(\"\") = %v, %v, want the default fields", fields, err)
+	}
+	fields, err := parseFields("mtls_valid, leaf_common_name")
+	if err != nil || fields != fieldMTLSValid|fieldLeafCommonName {
+		t.Errorf("parseFields() = %v, %v", fields, err)
+	}
+	if _, err := parseFields("mtls_valid,serial"); err == nil {
+		t.Errorf("expected an error for an unknown field")
+	}
+}
+
+func Test_encodeResponseJSON(t *testing.T) {
+	responses := []response{
+		{},
+		generateResponse(&http.Request{TLS: noVerifiedTLS()}, "path"),
+		generateResponse(&http.Request{TLS: verifiedTLS()}, `"<path>" & more`),
+	}
+	for _, resp := range responses {
+		compact, err := encodeResponse(resp, defaultFields, formatCompactJSON)
+		if err != nil {
+			t.Fatal(err)
+		}
+		if want, _ := json.Marshal(resp); !bytes.Equal(compact, want) {
+			t.Errorf("compact JSON\n%s\nwant\n%s", compact, want)
+		}
+		indented, err := encodeResponse(resp, defaultFields, formatJSON)
+		if err != nil {
+			t.Fatal(err)
+		}
+		if want, _ := json.MarshalIndent(resp, "", "  "); !bytes.Equal(indented, want) {
+			t.Errorf("indented JSON\n%s\nwant\n%s", indented, want)
+		}
+	}
+}
+
+func Test_encodeResponseJSONFields(t *testing.T) {
+	resp := generateResponse(&http.Request{TLS: verifiedTLS()}, "path")
+	got, err := encodeResponse(resp, fieldMTLSValid|fieldLeafCommonName, formatCompactJSON)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if want := `{"mtls_valid":true,"leaf_common_name":"testClient"}`; string(got) != want {
+		t.Errorf("got %s, want %s", got, want)
+	}
+	// Selected fields are null when absent, not omitted
+	got, err = encodeResponse(response{}, fieldLeafCommonName|fieldVerifiedChains, formatCompactJSON)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if want := `{"leaf_common_name":null,"verified_certificate_chains":null}`; string(got) != want {
+		t.Errorf("got %s, want %s", got, want)
+	}
+}
+
+func Test_encodeResponseBinary(t *testing.T) {
+	resp := generateResponse(&http.Request{TLS: verifiedTLS()}, "path")
+	fields := fieldMTLSValid | fieldLeafCommonName
+
+	cbor, err := encodeResponse(resp, fields, formatCBOR)
+	if err != nil {
+		t.Fatal(err)
+	}
+	// {"mtls_valid": true, "leaf_common_name": "testClient"}
+	want := append([]byte{0xa2, 0x6a}, "mtls_valid"...)
+	want = append(append(want, 0xf5, 0x70), "leaf_common_name"...)
+	want = append(append(want, 0x6a), "testClient"...)
+	if !bytes.Equal(cbor, want) {
+		t.Errorf("CBOR % x\nwant % x", cbor, want)
+	}
+
+	msgpack, err := encodeResponse(resp, fields, formatMsgpack)
+	if err != nil {
+		t.Fatal(err)
+	}
+	want = append([]byte{0x82, 0xaa}, "mtls_valid"...)
+	want = append(append(want, 0xc3, 0xb0), "leaf_common_name"...)
+	want = append(append(want, 0xaa), "testClient"...)
+	if !bytes.Equal(msgpack, want) {
+		t.Errorf("MessagePack % x\nwant % x", msgpack, want)
+	}
+
+	// Absent lists are null, as in JSON
+	empty, err := encodeResponse(response{}, fieldVerifiedChains, formatCBOR)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if want := append(append([]byte{0xa1, 0x78, 27}, "verified_certificate_chains"...), 0xf6); !bytes.Equal(empty, want) {
+		t.Errorf("CBOR % x\nwant % x", empty, want)
+	}
+}
+
+func Test_requestHandlerJSONNegotiation(t *testing.T) {
+	serve := func(method, target, accept string) *httptest.ResponseRecorder {
+		r := httptest.NewRequest(method, target, nil)
+		r.TLS = verifiedTLS()
+		if accept != "" {
+			r.Header.Set("Accept", accept)
+		}
+		w := httptest.NewRecorder()
+		requestHandlerJSON(w, r, "path", newResponseCache(8))
+		return w
+	}
+
+	w := serve(http.MethodGet, "/json?fields=mtls_valid", "application/json")
+	if w.Code != http.StatusOK || w.Body.String() != `{"mtls_valid":true}` {
+		t.Errorf("unexpected response %d %q", w.Code, w.Body.String())
+	}
+	if w := serve(http.MethodGet, "/json", "application/cbor"); w.Header().Get("Content-Type") != "application/cbor" {
+		t.Errorf("unexpected content type %q", w.Header().Get("Content-Type"))
+	}
+	if w := serve(http.MethodGet, "/json", "text/html"); w.Code != http.StatusNotAcceptable {
+		t.Errorf("expected %d, got %d", http.StatusNotAcceptable, w.Code)
+	}
+	if w := serve(http.MethodGet, "/json?fields=serial", ""); w.Code != http.StatusBadRequest {
+		t.Errorf("expected %d, got %d", http.StatusBadRequest, w.Code)
+	}
+	if w := serve(http.MethodHead, "/json", ""); w.Code != http.StatusOK || w.Body.Len() != 0 {
+		t.Errorf("unexpected HEAD response %d with %d bytes", w.Code, w.Body.Len())
+	}
+}
+
+func Test_requestHandlerValid(t *testing.T) {
+	tests := []struct {
+		method string
+		state  *http.Request
+		want   int
+	}{
+		{http.MethodGet, &http.Request{TLS: verifiedTLS()}, http.StatusNoContent},
+		{http.MethodHead, &http.Request{TLS: verifiedTLS()}, http.StatusNoContent},
+		{http.MethodGet, &http.Request{TLS: noVerifiedTLS()}, http.StatusUnauthorized},
+		{http.MethodGet, &http.Request{}, http.StatusUnauthorized},
+		{http.MethodPost, &http.Request{TLS: verifiedTLS()}, http.StatusMethodNotAllowed},
+	}
+	for _, tt := range tests {
+		r := httptest.NewRequest(tt.method, "/json/valid", nil)
+		r.TLS = tt.state.TLS
+		w := httptest.NewRecorder()
+		requestHandlerValid(w, r)
+		if w.Code != tt.want {
+			t.Errorf("%s with TLS %v: expected %d, got %d", tt.method, r.TLS != nil, tt.want, w.Code)
+		}
+	}
+}
+
+// benchmarkEncoding reports the serialization cost and, as bytes/op, the
+// payload size of a verified response in one format.
+func benchmarkEncoding(b *testing.B, format responseFormat, fields fieldSet) {
+	r := &http.Request{TLS: verifiedTLS()}
+	var size int
+	b.ReportAllocs()
+	for i := 0; i < b.N; i++ {
+		body, err := encodeResponse(generateFields(r, "path", fields), fields, format)
+		if err != nil {
+			b.Fatal(err)
+		}
+		size = len(body)
+	}
+	b.ReportMetric(float64(size), "bytes/op")
+}
+
+func BenchmarkEncodingMarshalIndent(b *testing.B) {
+	r := &http.Request{TLS: verifiedTLS()}
+	var size int
+	b.ReportAllocs()
+	for i := 0; i < b.N; i++ {
+		body, err := json.MarshalIndent(generateResponse(r, "path"), "", "  ")
+		if err != nil {
+			b.Fatal(err)
+		}
+		size = len(body)
+	}
+	b.ReportMetric(float64(size), "bytes/op")
+}
+
+func BenchmarkEncodingJSON(b *testing.B) {
+	benchmarkEncoding(b, formatJSON, defaultFields)
+}
+
+func BenchmarkEncodingCompactJSON(b *testing.B) {
+	benchmarkEncoding(b, formatCompactJSON, defaultFields)
+}
+
+func BenchmarkEncodingCBOR(b *testing.B) {
+	benchmarkEncoding(b, formatCBOR, defaultFields)
+}
+
+func BenchmarkEncodingMsgpack(b *testing.B) {
+	benchmarkEncoding(b, formatMsgpack, defaultFields)
+}
+
+func BenchmarkEncodingCompactJSONValidOnly(b *testing.B) {
+	benchmarkEncoding(b, formatCompactJSON, fieldMTLSValid|fieldLeafCommonName)
+}
+
+func BenchmarkEncodingCBORValidOnly(b *testing.B) {
+	benchmarkEncoding(b, formatCBOR, fieldMTLSValid|fieldLeafCommonName)
+}
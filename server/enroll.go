@@ -0,0 +1,571 @@
+package server
+
+import (
+	"bytes"
+	"context"
+	"crypto"
+	"crypto/ecdsa"
+	"crypto/ed25519"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/rsa"
+	"crypto/sha256"
+	"crypto/subtle"
+	"crypto/tls"
+	"crypto/x509"
+	"encoding/asn1"
+	"encoding/base64"
+	"encoding/hex"
+	"encoding/json"
+	"encoding/pem"
+	"errors"
+	"fmt"
+	"io"
+	"log"
+	"math/big"
+	"net/http"
+	"os"
+	"runtime"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"time"
+)
+
+// EST (RFC 7030) paths served when enrollment is enabled.
+const (
+	estCACertsPath        = "/.well-known/est/cacerts"
+	estSimpleEnrollPath   = "/.well-known/est/simpleenroll"
+	estSimpleReenrollPath = "/.well-known/est/simplereenroll"
+)
+
+const (
+	// DefaultEnrollQueueDepth is the number of CSRs that may wait for a
+	// signing worker when EnrollConfig.QueueDepth is left at zero.
+	DefaultEnrollQueueDepth = 64
+
+	// DefaultEnrollValidity is the lifetime of enrolled certificates when
+	// EnrollConfig.Validity is left at zero.
+	DefaultEnrollValidity = 365 * 24 * time.Hour
+
+	// maxCSRSize bounds enrollment request bodies.
+	maxCSRSize = 64 << 10
+
+	// enrollBackdate tolerates clock skew, as cfssl and bulk-issue.py do.
+	enrollBackdate = 5 * time.Minute
+
+	pemCertificateChain = "application/pem-certificate-chain"
+	pkcs7CertsOnly      = "application/pkcs7-mime; smime-type=certs-only"
+)
+
+// errEnrollBusy is returned when the signing queue is full.
+var errEnrollBusy = errors.New("enrollment queue is full")
+
+// errEnrollSubject is returned for a CSR whose subject the client may not
+// enroll.
+var errEnrollSubject = errors.New("subject not allowed for enrollment")
+
+// EnrollConfig configures certificate enrollment.
+type EnrollConfig struct {
+	// CACertFile and CAKeyFile are the issuing CA, loaded once.
+	CACertFile string
+	CAKeyFile  string
+	// Workers is the number of CSRs signed at once. Zero uses half the
+	// cores, so a wave of enrollments leaves the rest to handshakes and
+	// /json.
+	Workers int
+	// QueueDepth bounds the CSRs waiting for a worker; when it is full,
+	// enrollment answers 503 with Retry-After. Zero uses
+	// DefaultEnrollQueueDepth.
+	QueueDepth int
+	// Validity is the certificate lifetime, capped at the CA's. Zero uses
+	// DefaultEnrollValidity.
+	Validity time.Duration
+	// ManifestFile, when set, gets a bulk-issue.py manifest.jsonl line for
+	// every issued certificate, before it is returned.
+	ManifestFile string
+	// Token, when set, lets clients enroll new subjects through
+	// simpleenroll with "Authorization: Bearer <token>"; with an ACL, make
+	// simpleenroll public for clients without a certificate. It needs
+	// AllowedNames.
+	Token string
+	// AllowedNames are the common names, with * matching any run of
+	// characters, that token enrollment may issue. Clients authenticated by
+	// a certificate from the enrollment CA can only renew its subject.
+	AllowedNames []string
+}
+
+// EnrollStats reports enrollment activity.
+type EnrollStats struct {
+	Issued   uint64
+	Rejected uint64
+	Busy     uint64
+	Failed   uint64
+	Queued   int
+	Workers  int
+}
+
+// Enroller signs certificate signing requests on a bounded pool of workers,
+// separate from the goroutines serving requests: simpleenroll for new
+// clients with the token and an allowed name, and simpleenroll and
+// simplereenroll, authenticated by a current certificate from the
+// enrollment CA, to renew it under the same subject.
+type Enroller struct {
+	caCert       *x509.Certificate
+	caDER        []byte
+	caPool       *x509.CertPool
+	signer       crypto.Signer
+	validity     time.Duration
+	token        string
+	allowedNames []string
+	workers      int
+
+	// jobsMu keeps handlers that outlive a timed out Shutdown from
+	// enqueueing after Close.
+	jobsMu sync.RWMutex
+	jobs   chan *signJob
+	closed bool
+	wg     sync.WaitGroup
+
+	manifestMu sync.Mutex
+	manifest   *os.File
+
+	issued   atomic.Uint64
+	rejected atomic.Uint64
+	busy     atomic.Uint64
+	failed   atomic.Uint64
+}
+
+// signJob is one CSR waiting for a worker.
+type signJob struct {
+	ctx       context.Context
+	template  *x509.Certificate
+	publicKey crypto.PublicKey
+	request   string
+	replaces  *big.Int
+	done      chan signResult
+}
+
+type signResult struct {
+	der []byte
+	err error
+}
+
+// NewEnroller loads the CA and starts the signing workers.
+func NewEnroller(config EnrollConfig) (*Enroller, error) {
+	if config.Token != "" && len(config.AllowedNames) == 0 {
+		return nil, errors.New("an enrollment token needs the names it may enroll")
+	}
+	pair, err := tls.LoadX509KeyPair(config.CACertFile, config.CAKeyFile)
+	if err != nil {
+		return nil, fmt.Errorf("loading enrollment CA: %w", err)
+	}
+	caCert, err := x509.ParseCertificate(pair.Certificate[0])
+	if err != nil {
+		return nil, fmt.Errorf("parsing enrollment CA: %w", err)
+	}
+	if !caCert.IsCA {
+		return nil, fmt.Errorf("%s is not a CA certificate", config.CACertFile)
+	}
+	signer, ok := pair.PrivateKey.(crypto.Signer)
+	if !ok {
+		return nil, fmt.Errorf("%s: unsupported CA key type", config.CAKeyFile)
+	}
+
+	e := &Enroller{
+		caCert:       caCert,
+		caDER:        pair.Certificate[0],
+		caPool:       x509.NewCertPool(),
+		signer:       signer,
+		validity:     config.Validity,
+		token:        config.Token,
+		allowedNames: config.AllowedNames,
+		workers:      config.Workers,
+	}
+	e.caPool.AddCert(caCert)
+	if e.validity <= 0 {
+		e.validity = DefaultEnrollValidity
+	}
+	if e.workers <= 0 {
+		e.workers = max(1, runtime.NumCPU()/2)
+	}
+	queueDepth := config.QueueDepth
+	if queueDepth <= 0 {
+		queueDepth = DefaultEnrollQueueDepth
+	}
+	if config.ManifestFile != "" {
+		if e.manifest, err = os.OpenFile(config.ManifestFile, os.O_CREATE|os.O_APPEND|os.O_WRONLY, 0o644); err != nil {
+			return nil, err
+		}
+	}
+
+	e.jobs = make(chan *signJob, queueDepth)
+	for i := 0; i < e.workers; i++ {
+		e.wg.Add(1)
+		go e.work()
+	}
+	return e, nil
+}
+
+// Close stops the workers once the queued CSRs are signed and closes the
+// manifest. Call it after the server has shut down.
+func (e *Enroller) Close() error {
+	e.jobsMu.Lock()
+	e.closed = true
+	close(e.jobs)
+	e.jobsMu.Unlock()
+	e.wg.Wait()
+	if e.manifest != nil {
+		return e.manifest.Close()
+	}
+	return nil
+}
+
+// Stats returns enrollment counters.
+func (e *Enroller) Stats() EnrollStats {
+	return EnrollStats{
+		Issued:   e.issued.Load(),
+		Rejected: e.rejected.Load(),
+		Busy:     e.busy.Load(),
+		Failed:   e.failed.Load(),
+		Queued:   len(e.jobs),
+		Workers:  e.workers,
+	}
+}
+
+func (e *Enroller) register(mux *http.ServeMux) {
+	mux.HandleFunc(estCACertsPath, e.handleCACerts)
+	mux.HandleFunc(estSimpleEnrollPath, func(w http.ResponseWriter, r *http.Request) {
+		e.handleEnroll(w, r, false)
+	})
+	mux.HandleFunc(estSimpleReenrollPath, func(w http.ResponseWriter, r *http.Request) {
+		e.handleEnroll(w, r, true)
+	})
+}
+
+func (e *Enroller) work() {
+	defer e.wg.Done()
+	for job := range e.jobs {
+		// Skip requests whose client gave up while queued
+		if err := job.ctx.Err(); err != nil {
+			job.done <- signResult{err: err}
+			continue
+		}
+		der, err := x509.CreateCertificate(rand.Reader, job.template, e.caCert, job.publicKey, e.signer)
+		if err == nil {
+			err = e.record(job, der)
+		}
+		job.done <- signResult{der: der, err: err}
+	}
+}
+
+func (e *Enroller) handleCACerts(w http.ResponseWriter, r *http.Request) {
+	defer r.Body.Close()
+	if r.Method != http.MethodGet && r.Method != http.MethodHead {
+		w.Header().Set("Allow", "GET, HEAD")
+		http.Error(w, http.StatusText(http.StatusMethodNotAllowed), http.StatusMethodNotAllowed)
+		return
+	}
+	writeEnrolled(w, r, e.caDER)
+}
+
+func (e *Enroller) handleEnroll(w http.ResponseWriter, r *http.Request, reenroll bool) {
+	defer r.Body.Close()
+	if r.Method != http.MethodPost {
+		w.Header().Set("Allow", "POST")
+		http.Error(w, http.StatusText(http.StatusMethodNotAllowed), http.StatusMethodNotAllowed)
+		return
+	}
+
+	current := e.enrolledClient(r)
+	token := !reenroll && e.token != "" && e.validToken(r)
+	if current == nil && !token {
+		e.rejected.Add(1)
+		http.Error(w, "client certificate from the enrollment CA required", http.StatusUnauthorized)
+		return
+	}
+
+	csr, err := readCSR(r)
+	if err != nil {
+		e.rejected.Add(1)
+		http.Error(w, err.Error(), http.StatusBadRequest)
+		return
+	}
+	// A certificate renews its own subject; new subjects need the token
+	renewal := current != nil && csr.Subject.String() == current.Subject.String()
+	if !renewal && (!token || !e.allowedName(csr.Subject.CommonName)) {
+		e.rejected.Add(1)
+		http.Error(w, fmt.Sprintf("%v: %q", errEnrollSubject, csr.Subject.String()), http.StatusForbidden)
+		return
+	}
+
+	template, err := e.template(csr)
+	if err != nil {
+		e.failed.Add(1)
+		log.Printf("Could not issue certificate for %q: %v", csr.Subject.CommonName, err)
+		http.Error(w, "could not issue certificate", http.StatusInternalServerError)
+		return
+	}
+	job := &signJob{
+		ctx:       r.Context(),
+		template:  template,
+		publicKey: csr.PublicKey,
+		request:   "simpleenroll",
+		done:      make(chan signResult, 1),
+	}
+	if reenroll {
+		job.request, job.replaces = "simplereenroll", current.SerialNumber
+	}
+	if !e.enqueue(job) {
+		e.busy.Add(1)
+		w.Header().Set("Retry-After", "1")
+		http.Error(w, errEnrollBusy.Error(), http.StatusServiceUnavailable)
+		return
+	}
+
+	var result signResult
+	select {
+	case result = <-job.done:
+	case <-r.Context().Done():
+		return
+	}
+	if result.err != nil {
+		e.failed.Add(1)
+		log.Printf("Could not issue certificate for %q: %v", csr.Subject.CommonName, result.err)
+		http.Error(w, "could not issue certificate", http.StatusInternalServerError)
+		return
+	}
+	e.issued.Add(1)
+	writeEnrolled(w, r, result.der)
+}
+
+// enqueue hands job to the signing workers unless the queue is full, so a
+// wave of enrollments is turned away instead of piling up goroutines.
+func (e *Enroller) enqueue(job *signJob) bool {
+	e.jobsMu.RLock()
+	defer e.jobsMu.RUnlock()
+	if e.closed {
+		return false
+	}
+	select {
+	case e.jobs <- job:
+		return true
+	default:
+		return false
+	}
+}
+
+// enrolledClient returns the client certificate when it chains to the
+// enrollment CA. Certificates of other client CAs, such as a tenant's, are
+// verified for the connection but do not authenticate enrollment.
+func (e *Enroller) enrolledClient(r *http.Request) *x509.Certificate {
+	if r.TLS == nil || len(r.TLS.VerifiedChains) == 0 {
+		return nil
+	}
+	chain := r.TLS.VerifiedChains[0]
+	intermediates := x509.NewCertPool()
+	for _, cert := range chain[1:] {
+		intermediates.AddCert(cert)
+	}
+	_, err := chain[0].Verify(x509.VerifyOptions{
+		Roots:         e.caPool,
+		Intermediates: intermediates,
+		KeyUsages:     []x509.ExtKeyUsage{x509.ExtKeyUsageClientAuth},
+	})
+	if err != nil {
+		return nil
+	}
+	return chain[0]
+}
+
+func (e *Enroller) allowedName(cn string) bool {
+	for _, pattern := range e.allowedNames {
+		if globMatch(pattern, cn) {
+			return true
+		}
+	}
+	return false
+}
+
+func (e *Enroller) validToken(r *http.Request) bool {
+	token, ok := strings.CutPrefix(r.Header.Get("Authorization"), "Bearer ")
+	return ok && subtle.ConstantTimeCompare([]byte(token), []byte(e.token)) == 1
+}
+
+// template is the client certificate for csr, as bulk-issue.py issues them
+// with the default cfssl profile.
+func (e *Enroller) template(csr *x509.CertificateRequest) (*x509.Certificate, error) {
+	now := time.Now().Truncate(time.Second)
+	notAfter := now.Add(e.validity)
+	if notAfter.After(e.caCert.NotAfter) {
+		notAfter = e.caCert.NotAfter
+	}
+	keyUsage := x509.KeyUsageDigitalSignature
+	if _, ok := csr.PublicKey.(*rsa.PublicKey); ok {
+		keyUsage |= x509.KeyUsageKeyEncipherment
+	}
+	serial, err := rand.Int(rand.Reader, new(big.Int).Lsh(big.NewInt(1), 159))
+	if err != nil {
+		return nil, fmt.Errorf("generating serial: %w", err)
+	}
+	return &x509.Certificate{
+		SerialNumber: serial,
+		// Keep the subject as encoded, as pkix.Name would reorder it
+		RawSubject:            csr.RawSubject,
+		NotBefore:             now.Add(-enrollBackdate),
+		NotAfter:              notAfter,
+		KeyUsage:              keyUsage,
+		ExtKeyUsage:           []x509.ExtKeyUsage{x509.ExtKeyUsageClientAuth},
+		BasicConstraintsValid: true,
+	}, nil
+}
+
+// record appends the manifest line of an issued certificate.
+func (e *Enroller) record(job *signJob, der []byte) error {
+	if e.manifest == nil {
+		return nil
+	}
+	cert, err := x509.ParseCertificate(der)
+	if err != nil {
+		return err
+	}
+	certSum := sha256.Sum256(der)
+	spkiSum := sha256.Sum256(cert.RawSubjectPublicKeyInfo)
+	record := map[string]string{
+		"name":        cert.Subject.CommonName,
+		"cn":          cert.Subject.CommonName,
+		"serial":      cert.SerialNumber.Text(16),
+		"sha256":      hex.EncodeToString(certSum[:]),
+		"spki_sha256": hex.EncodeToString(spkiSum[:]),
+		"key":         keyDescription(cert.PublicKey),
+		"not_before":  cert.NotBefore.UTC().Format(time.RFC3339),
+		"not_after":   cert.NotAfter.UTC().Format(time.RFC3339),
+		"enrolled":    job.request,
+	}
+	if job.replaces != nil {
+		record["replaces"] = job.replaces.Text(16)
+	}
+	line, err := json.Marshal(record)
+	if err != nil {
+		return err
+	}
+
+	e.manifestMu.Lock()
+	defer e.manifestMu.Unlock()
+	_, err = e.manifest.Write(append(line, '\n'))
+	return err
+}
+
+// readCSR decodes a PKCS#10 request, base64 DER as EST sends it or PEM, and
+// checks its signature and key.
+func readCSR(r *http.Request) (*x509.CertificateRequest, error) {
+	body, err := io.ReadAll(io.LimitReader(r.Body, maxCSRSize+1))
+	if err != nil {
+		return nil, err
+	}
+	if len(body) > maxCSRSize {
+		return nil, errors.New("certificate request too large")
+	}
+	var der []byte
+	if block, _ := pem.Decode(body); block != nil {
+		der = block.Bytes
+	} else if der, err = base64.StdEncoding.DecodeString(string(bytes.Join(bytes.Fields(body), nil))); err != nil {
+		return nil, errors.New("certificate request is neither PEM nor base64 DER")
+	}
+
+	csr, err := x509.ParseCertificateRequest(der)
+	if err != nil {
+		return nil, err
+	}
+	if err := csr.CheckSignature(); err != nil {
+		return nil, err
+	}
+	if csr.Subject.CommonName == "" {
+		return nil, errors.New("certificate request has no common name")
+	}
+	switch key := csr.PublicKey.(type) {
+	case *rsa.PublicKey:
+		if key.N.BitLen() < 2048 {
+			return nil, errors.New("RSA keys must have at least 2048 bits")
+		}
+	case *ecdsa.PublicKey:
+		if key.Curve != elliptic.P256() && key.Curve != elliptic.P384() && key.Curve != elliptic.P521() {
+			return nil, errors.New("unsupported ECDSA curve")
+		}
+	case ed25519.PublicKey:
+	default:
+		return nil, errors.New("unsupported key type")
+	}
+	return csr, nil
+}
+
+// keyDescription names a key the way bulk-issue.py manifests do.
+func keyDescription(key crypto.PublicKey) string {
+	switch key := key.(type) {
+	case *rsa.PublicKey:
+		return fmt.Sprintf("rsa-%d", key.N.BitLen())
+	case *ecdsa.PublicKey:
+		return fmt.Sprintf("ecdsa-%d", key.Curve.Params().BitSize)
+	default:
+		return "ed25519"
+	}
+}
+
+// writeEnrolled answers with DER certificates as EST does, a base64
+// certs-only PKCS#7, or as PEM when the client accepts
+// application/pem-certificate-chain.
+func writeEnrolled(w http.ResponseWriter, r *http.Request, certs ...[]byte) {
+	var body []byte
+	if strings.Contains(r.Header.Get("Accept"), pemCertificateChain) {
+		w.Header().Set("Content-Type", pemCertificateChain)
+		for _, der := range certs {
+			body = append(body, pem.EncodeToMemory(&pem.Block{Type: "CERTIFICATE", Bytes: der})...)
+		}
+	} else {
+		pkcs7, err := certsOnlyPKCS7(certs...)
+		if err != nil {
+			http.Error(w, err.Error(), http.StatusInternalServerError)
+			return
+		}
+		w.Header().Set("Content-Type", pkcs7CertsOnly)
+		w.Header().Set("Content-Transfer-Encoding", "base64")
+		body = []byte(base64.StdEncoding.EncodeToString(pkcs7) + "\n")
+	}
+	if _, err := w.Write(body); err != nil {
+		log.Printf("Write error: %v", err)
+	}
+}
+
+var (
+	oidPKCS7Data       = asn1.ObjectIdentifier{1, 2, 840, 113549, 1, 7, 1}
+	oidPKCS7SignedData = asn1.ObjectIdentifier{1, 2, 840, 113549, 1, 7, 2}
+)
+
+// certsOnlyPKCS7 wraps DER certificates in a degenerate PKCS#7 SignedData
+// (RFC 2315) without signers, the certs-only format of EST replies.
+func certsOnlyPKCS7(certs ...[]byte) ([]byte, error) {
+	emptySet := asn1.RawValue{Class: asn1.ClassUniversal, Tag: asn1.TagSet, IsCompound: true}
+	signedData, err := asn1.Marshal(struct {
+		Version          int
+		DigestAlgorithms asn1.RawValue
+		ContentInfo      struct{ ContentType asn1.ObjectIdentifier }
+		Certificates     asn1.RawValue
+		SignerInfos      asn1.RawValue
+	}{
+		Version:          1,
+		DigestAlgorithms: emptySet,
+		ContentInfo:      struct{ ContentType asn1.ObjectIdentifier }{oidPKCS7Data},
+		Certificates:     asn1.RawValue{Class: asn1.ClassContextSpecific, Tag: 0, IsCompound: true, Bytes: bytes.Join(certs, nil)},
+		SignerInfos:      emptySet,
+	})
+	if err != nil {
+		return nil, err
+	}
+	return asn1.Marshal(struct {
+		ContentType asn1.ObjectIdentifier
+		Content     asn1.RawValue
+	}{
+		ContentType: oidPKCS7SignedData,
+		Content:     asn1.RawValue{Class: asn1.ClassContextSpecific, Tag: 0, IsCompound: true, Bytes: signedData},
+	})
+}
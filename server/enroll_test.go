@@ -0,0 +1,313 @@
+package server
+
+import (
+	"bytes"
+	"context"
+	"crypto/ecdsa"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/tls"
+	"crypto/x509"
+	"crypto/x509/pkix"
+	"encoding/asn1"
+	"encoding/base64"
+	"encoding/json"
+	"encoding/pem"
+	"math/big"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"path/filepath"
+	"strings"
+	"testing"
+	"time"
+)
+
+// testEnroller starts an Enroller with a new CA, writing its manifest to
+// config.ManifestFile when set.
+func testEnroller(t *testing.T, config EnrollConfig) (*Enroller, *x509.CertPool) {
+	t.Helper()
+	key, err := ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	template := &x509.Certificate{
+		SerialNumber:          big.NewInt(1),
+		Subject:               pkix.Name{CommonName: "Enrollment CA"},
+		NotBefore:             time.Now().Add(-time.Hour),
+		NotAfter:              time.Now().Add(30 * 24 * time.Hour),
+		IsCA:                  true,
+		BasicConstraintsValid: true,
+		KeyUsage:              x509.KeyUsageCertSign,
+	}
+	der, err := x509.CreateCertificate(rand.Reader, template, template, &key.PublicKey, key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	keyDER, err := x509.MarshalPKCS8PrivateKey(key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	dir := t.TempDir()
+	config.CACertFile = filepath.Join(dir, "ca.pem")
+	config.CAKeyFile = filepath.Join(dir, "ca-key.pem")
+	writeCA(t, config.CACertFile, pem.EncodeToMemory(&pem.Block{Type: "CERTIFICATE", Bytes: der}), testDate)
+	writeCA(t, config.CAKeyFile, pem.EncodeToMemory(&pem.Block{Type: "PRIVATE KEY", Bytes: keyDER}), testDate)
+
+	e, err := NewEnroller(config)
+	if err != nil {
+		t.Fatal(err)
+	}
+	t.Cleanup(func() { e.Close() })
+	roots := x509.NewCertPool()
+	roots.AddCert(e.caCert)
+	return e, roots
+}
+
+// testCSR returns a base64 DER certificate request for cn, as EST clients
+// send them.
+func testCSR(t *testing.T, cn string) string {
+	t.Helper()
+	key, err := ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	der, err := x509.CreateCertificateRequest(rand.Reader, &x509.CertificateRequest{Subject: pkix.Name{CommonName: cn}}, key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return base64.StdEncoding.EncodeToString(der)
+}
+
+func enroll(e *Enroller, path, csr string, client *x509.Certificate, header http.Header) *httptest.ResponseRecorder {
+	r := httptest.NewRequest(http.MethodPost, path, strings.NewReader(csr))
+	for name, values := range header {
+		r.Header[name] = values
+	}
+	if client != nil {
+		r.TLS = &tls.ConnectionState{VerifiedChains: [][]*x509.Certificate{{client}}}
+	}
+	w := httptest.NewRecorder()
+	mux := http.NewServeMux()
+	e.register(mux)
+	mux.ServeHTTP(w, r)
+	return w
+}
+
+// parseCertsOnly returns the certificates of a base64 certs-only PKCS#7.
+func parseCertsOnly(t *testing.T, body []byte) []*x509.Certificate {
+	t.Helper()
+	der, err := base64.StdEncoding.DecodeString(strings.TrimSpace(string(body)))
+	if err != nil {
+		t.Fatal(err)
+	}
+	var contentInfo struct {
+		ContentType asn1.ObjectIdentifier
+		Content     asn1.RawValue `asn1:"explicit,tag:0"`
+	}
+	if _, err := asn1.Unmarshal(der, &contentInfo); err != nil {
+		t.Fatal(err)
+	}
+	var signedData struct {
+		Version          int
+		DigestAlgorithms asn1.RawValue
+		ContentInfo      asn1.RawValue
+		Certificates     asn1.RawValue `asn1:"tag:0"`
+		SignerInfos      asn1.RawValue
+	}
+	if _, err := asn1.Unmarshal(contentInfo.Content.Bytes, &signedData); err != nil {
+		t.Fatal(err)
+	}
+	if !contentInfo.ContentType.Equal(oidPKCS7SignedData) || signedData.Version != 1 {
+		t.Fatalf("expected a SignedData, got %v version %d", contentInfo.ContentType, signedData.Version)
+	}
+	certs, err := x509.ParseCertificates(signedData.Certificates.Bytes)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return certs
+}
+
+func Test_enrollAndReenroll(t *testing.T) {
+	manifest := filepath.Join(t.TempDir(), "manifest.jsonl")
+	e, roots := testEnroller(t, EnrollConfig{Token: "secret", AllowedNames: []string{"device-*"}, ManifestFile: manifest, Validity: time.Hour})
+	verify := x509.VerifyOptions{Roots: roots, KeyUsages: []x509.ExtKeyUsage{x509.ExtKeyUsageClientAuth}}
+
+	w := enroll(e, estSimpleEnrollPath, testCSR(t, "device-1"), nil, http.Header{"Authorization": {"Bearer secret"}})
+	if w.Code != http.StatusOK || w.Header().Get("Content-Type") != pkcs7CertsOnly {
+		t.Fatalf("simpleenroll: %d %q %s", w.Code, w.Header().Get("Content-Type"), w.Body)
+	}
+	certs := parseCertsOnly(t, w.Body.Bytes())
+	if len(certs) != 1 || certs[0].Subject.CommonName != "device-1" {
+		t.Fatalf("expected the certificate of device-1, got %v", certs)
+	}
+	issued := certs[0]
+	if _, err := issued.Verify(verify); err != nil {
+		t.Errorf("issued certificate does not verify: %v", err)
+	}
+	if lifetime := issued.NotAfter.Sub(issued.NotBefore); lifetime != time.Hour+enrollBackdate {
+		t.Errorf("expected a lifetime of %v, got %v", time.Hour+enrollBackdate, lifetime)
+	}
+
+	// Re-enrollment keeps the subject of the current certificate
+	if w := enroll(e, estSimpleReenrollPath, testCSR(t, "device-2"), issued, nil); w.Code != http.StatusForbidden {
+		t.Errorf("expected 403 for a new subject, got %d", w.Code)
+	}
+	w = enroll(e, estSimpleReenrollPath, testCSR(t, "device-1"), issued, http.Header{"Accept": {pemCertificateChain}})
+	if w.Code != http.StatusOK || w.Header().Get("Content-Type") != pemCertificateChain {
+		t.Fatalf("simplereenroll: %d %q %s", w.Code, w.Header().Get("Content-Type"), w.Body)
+	}
+	block, _ := pem.Decode(w.Body.Bytes())
+	renewed, err := x509.ParseCertificate(block.Bytes)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if renewed.SerialNumber.Cmp(issued.SerialNumber) == 0 {
+		t.Errorf("expected a new serial")
+	}
+
+	data, err := os.ReadFile(manifest)
+	if err != nil {
+		t.Fatal(err)
+	}
+	var records []map[string]string
+	for _, line := range bytes.Split(bytes.TrimSpace(data), []byte("\n")) {
+		var record map[string]string
+		if err := json.Unmarshal(line, &record); err != nil {
+			t.Fatal(err)
+		}
+		records = append(records, record)
+	}
+	if len(records) != 2 {
+		t.Fatalf("expected 2 manifest lines, got %d", len(records))
+	}
+	if records[0]["serial"] != issued.SerialNumber.Text(16) || records[0]["key"] != "ecdsa-256" || records[0]["enrolled"] != "simpleenroll" {
+		t.Errorf("unexpected manifest line %v", records[0])
+	}
+	if records[1]["serial"] != renewed.SerialNumber.Text(16) || records[1]["replaces"] != issued.SerialNumber.Text(16) {
+		t.Errorf("unexpected manifest line %v", records[1])
+	}
+	if stats := e.Stats(); stats.Issued != 2 || stats.Rejected != 1 {
+		t.Errorf("unexpected stats %+v", stats)
+	}
+}
+
+func Test_enrollRejects(t *testing.T) {
+	e, _ := testEnroller(t, EnrollConfig{Token: "secret", AllowedNames: []string{"device"}})
+	csr := testCSR(t, "device")
+	tests := []struct {
+		name   string
+		path   string
+		body   string
+		header http.Header
+		want   int
+	}{
+		{"no credentials", estSimpleEnrollPath, csr, nil, http.StatusUnauthorized},
+		{"wrong token", estSimpleEnrollPath, csr, http.Header{"Authorization": {"Bearer wrong"}}, http.StatusUnauthorized},
+		{"token re-enrollment", estSimpleReenrollPath, csr, http.Header{"Authorization": {"Bearer secret"}}, http.StatusUnauthorized},
+		{"not a CSR", estSimpleEnrollPath, "bm90IGEgQ1NS", http.Header{"Authorization": {"Bearer secret"}}, http.StatusBadRequest},
+		{"not base64", estSimpleEnrollPath, "%%%", http.Header{"Authorization": {"Bearer secret"}}, http.StatusBadRequest},
+		{"no common name", estSimpleEnrollPath, testCSR(t, ""), http.Header{"Authorization": {"Bearer secret"}}, http.StatusBadRequest},
+		{"name not allowed", estSimpleEnrollPath, testCSR(t, "admin"), http.Header{"Authorization": {"Bearer secret"}}, http.StatusForbidden},
+	}
+	for _, tt := range tests {
+		if w := enroll(e, tt.path, tt.body, nil, tt.header); w.Code != tt.want {
+			t.Errorf("%s: expected %d, got %d %s", tt.name, tt.want, w.Code, w.Body)
+		}
+	}
+
+	r := httptest.NewRequest(http.MethodGet, estSimpleEnrollPath, nil)
+	w := httptest.NewRecorder()
+	e.handleEnroll(w, r, false)
+	if w.Code != http.StatusMethodNotAllowed || w.Header().Get("Allow") != "POST" {
+		t.Errorf("GET: expected 405, got %d", w.Code)
+	}
+}
+
+func Test_enrollSubjectPolicy(t *testing.T) {
+	e, _ := testEnroller(t, EnrollConfig{Token: "secret", AllowedNames: []string{"device-*"}})
+	token := http.Header{"Authorization": {"Bearer secret"}}
+	w := enroll(e, estSimpleEnrollPath, testCSR(t, "device-1"), nil, token)
+	if w.Code != http.StatusOK {
+		t.Fatalf("simpleenroll: %d %s", w.Code, w.Body)
+	}
+	issued := parseCertsOnly(t, w.Body.Bytes())[0]
+	block, _ := pem.Decode(testCAPEM(t, "Tenant CA"))
+	foreign, err := x509.ParseCertificate(block.Bytes)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	tests := []struct {
+		name   string
+		path   string
+		cn     string
+		client *x509.Certificate
+		header http.Header
+		want   int
+	}{
+		{"certificate, other name", estSimpleEnrollPath, "admin", issued, nil, http.StatusForbidden},
+		{"certificate, allowed name", estSimpleEnrollPath, "device-2", issued, nil, http.StatusForbidden},
+		{"certificate and token, other name", estSimpleEnrollPath, "admin", issued, token, http.StatusForbidden},
+		{"certificate, same name", estSimpleEnrollPath, "device-1", issued, nil, http.StatusOK},
+		{"certificate and token, allowed name", estSimpleEnrollPath, "device-2", issued, token, http.StatusOK},
+		{"other CA", estSimpleEnrollPath, "Tenant CA", foreign, nil, http.StatusUnauthorized},
+		{"other CA re-enrollment", estSimpleReenrollPath, "Tenant CA", foreign, nil, http.StatusUnauthorized},
+	}
+	for _, tt := range tests {
+		if w := enroll(e, tt.path, testCSR(t, tt.cn), tt.client, tt.header); w.Code != tt.want {
+			t.Errorf("%s: expected %d, got %d %s", tt.name, tt.want, w.Code, w.Body)
+		}
+	}
+
+	if _, err := NewEnroller(EnrollConfig{Token: "secret"}); err == nil || !strings.Contains(err.Error(), "token") {
+		t.Errorf("expected an error for a token without allowed names, got %v", err)
+	}
+}
+
+func Test_enrollQueueFull(t *testing.T) {
+	e, _ := testEnroller(t, EnrollConfig{Token: "secret", AllowedNames: []string{"device"}, Workers: 1, QueueDepth: 1})
+
+	// Hold the only worker on a job it cannot hand back, and fill the queue
+	ctx, cancel := context.WithCancel(context.Background())
+	cancel()
+	held := &signJob{ctx: ctx, done: make(chan signResult)}
+	queued := &signJob{ctx: ctx, done: make(chan signResult, 1)}
+	if !e.enqueue(held) {
+		t.Fatal("could not enqueue")
+	}
+	for len(e.jobs) > 0 {
+		time.Sleep(time.Millisecond)
+	}
+	if !e.enqueue(queued) {
+		t.Fatal("could not enqueue")
+	}
+
+	w := enroll(e, estSimpleEnrollPath, testCSR(t, "device"), nil, http.Header{"Authorization": {"Bearer secret"}})
+	if w.Code != http.StatusServiceUnavailable || w.Header().Get("Retry-After") == "" {
+		t.Errorf("expected 503 with Retry-After, got %d %v", w.Code, w.Header())
+	}
+	if stats := e.Stats(); stats.Busy != 1 || stats.Queued != 1 {
+		t.Errorf("unexpected stats %+v", stats)
+	}
+
+	// Jobs whose client went away are skipped, not signed
+	for _, job := range []*signJob{held, queued} {
+		if result := <-job.done; result.err != context.Canceled {
+			t.Errorf("expected the cancelled job to be skipped, got %v", result.err)
+		}
+	}
+	if w := enroll(e, estSimpleEnrollPath, testCSR(t, "device"), nil, http.Header{"Authorization": {"Bearer secret"}}); w.Code != http.StatusOK {
+		t.Errorf("expected 200 once the queue drained, got %d", w.Code)
+	}
+}
+
+func Test_enrollCACerts(t *testing.T) {
+	e, _ := testEnroller(t, EnrollConfig{})
+	r := httptest.NewRequest(http.MethodGet, estCACertsPath, nil)
+	w := httptest.NewRecorder()
+	e.handleCACerts(w, r)
+	if certs := parseCertsOnly(t, w.Body.Bytes()); len(certs) != 1 || !certs[0].Equal(e.caCert) {
+		t.Errorf("expected the CA certificate, got %v", certs)
+	}
+}
@@ -0,0 +1,137 @@
+package server
+
+import (
+	"errors"
+	"fmt"
+	"log"
+	"net"
+	"os"
+	"os/exec"
+	"strconv"
+	"strings"
+	"time"
+)
+
+// Environment of a server started by Handoff: the inherited listeners as
+// name=fd pairs ("https=3,http=4") and the descriptor it reports readiness
+// on.
+const (
+	listenFDsEnv = "MTLS_LISTEN_FDS"
+	readyFDEnv   = "MTLS_READY_FD"
+)
+
+// DefaultHandoffTimeout bounds how long Handoff waits for the new server to
+// report that it is serving.
+const DefaultHandoffTimeout = 30 * time.Second
+
+// inheritedListeners returns the listeners handed off by a previous server,
+// by name, or nil when this process was started normally. The variable is
+// cleared so later handoffs do not pass it on.
+func inheritedListeners() (map[string]net.Listener, error) {
+	value := os.Getenv(listenFDsEnv)
+	if value == "" {
+		return nil, nil
+	}
+	os.Unsetenv(listenFDsEnv)
+
+	listeners := make(map[string]net.Listener)
+	for _, pair := range strings.Split(value, ",") {
+		name, fdText, ok := strings.Cut(pair, "=")
+		fd, err := strconv.Atoi(fdText)
+		if !ok || err != nil || fd < 3 {
+			return nil, fmt.Errorf("%s: invalid entry %q", listenFDsEnv, pair)
+		}
+		file := os.NewFile(uintptr(fd), name)
+		listener, err := net.FileListener(file)
+		file.Close()
+		if err != nil {
+			return nil, fmt.Errorf("%s: inheriting %s listener: %w", listenFDsEnv, name, err)
+		}
+		listeners[name] = listener
+	}
+	return listeners, nil
+}
+
+// notifyReady tells the server that started this one through Handoff that
+// it is serving, so the old server can start draining.
+func notifyReady() {
+	value := os.Getenv(readyFDEnv)
+	if value == "" {
+		return
+	}
+	os.Unsetenv(readyFDEnv)
+	fd, err := strconv.Atoi(value)
+	if err != nil || fd < 3 {
+		return
+	}
+	ready := os.NewFile(uintptr(fd), "ready")
+	defer ready.Close()
+	if _, err := ready.Write([]byte{1}); err != nil {
+		log.Printf("Could not report readiness to the previous server: %v", err)
+	}
+}
+
+// Handoff starts a new copy of this executable, with the same arguments,
+// serving the bound HTTP and HTTPS sockets, and returns its process ID once
+// it reports that it is serving. Connections keep queueing on the shared
+// sockets throughout, so none are refused; the caller then drains this
+// server with Shutdown. On error the new process is stopped and this server
+// keeps serving.
+func (m *MTLSServer) Handoff(timeout time.Duration) (int, error) {
+	m.mu.Lock()
+	listeners := []struct {
+		name     string
+		listener net.Listener
+	}{{"https", m.httpsListener}, {"http", m.httpListener}}
+	m.mu.Unlock()
+
+	var files []*os.File
+	defer func() {
+		for _, file := range files {
+			file.Close()
+		}
+	}()
+	var fds []string
+	for _, l := range listeners {
+		tcp, ok := l.listener.(*net.TCPListener)
+		if !ok {
+			return 0, errors.New("handoff needs both servers listening on TCP")
+		}
+		file, err := tcp.File()
+		if err != nil {
+			return 0, err
+		}
+		fds = append(fds, fmt.Sprintf("%s=%d", l.name, 3+len(files)))
+		files = append(files, file)
+	}
+
+	ready, readyWriter, err := os.Pipe()
+	if err != nil {
+		return 0, err
+	}
+	defer ready.Close()
+	files = append(files, readyWriter)
+
+	cmd := exec.Command(os.Args[0], os.Args[1:]...)
+	cmd.Env = append(os.Environ(),
+		listenFDsEnv+"="+strings.Join(fds, ","),
+		fmt.Sprintf("%s=%d", readyFDEnv, 2+len(files)))
+	cmd.Stdout, cmd.Stderr = os.Stdout, os.Stderr
+	cmd.ExtraFiles = files
+	if err := cmd.Start(); err != nil {
+		return 0, err
+	}
+	// Only the new process may hold the write end, so its exit reads as EOF
+	readyWriter.Close()
+	files = files[:len(files)-1]
+
+	ready.SetReadDeadline(time.Now().Add(timeout))
+	if _, err := ready.Read(make([]byte, 1)); err != nil {
+		cmd.Process.Kill()
+		cmd.Wait()
+		return 0, fmt.Errorf("new server did not report ready: %w", err)
+	}
+	pid := cmd.Process.Pid
+	cmd.Process.Release()
+	return pid, nil
+}
@@ -0,0 +1,102 @@
+package server
+
+import (
+	"context"
+	"fmt"
+	"io"
+	"net"
+	"net/http"
+	"strconv"
+	"testing"
+	"time"
+)
+
+func Test_inheritedListeners(t *testing.T) {
+	t.Setenv(listenFDsEnv, "")
+	if listeners, err := inheritedListeners(); err != nil || listeners != nil {
+		t.Fatalf("expected no listeners without %s, got %v, %v", listenFDsEnv, listeners, err)
+	}
+
+	original, err := net.Listen("tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer original.Close()
+	file, err := original.(*net.TCPListener).File()
+	if err != nil {
+		t.Fatal(err)
+	}
+	t.Setenv(listenFDsEnv, "https="+strconv.Itoa(int(file.Fd())))
+
+	listeners, err := inheritedListeners()
+	if err != nil {
+		t.Fatal(err)
+	}
+	inherited := listeners["https"]
+	if inherited == nil || inherited.Addr().String() != original.Addr().String() {
+		t.Fatalf("expected the listener on %v, got %v", original.Addr(), listeners)
+	}
+	defer inherited.Close()
+
+	// Closing the original leaves the socket open for the inherited copy
+	original.Close()
+	go func() {
+		if conn, err := net.Dial("tcp", inherited.Addr().String()); err == nil {
+			conn.Close()
+		}
+	}()
+	conn, err := inherited.Accept()
+	if err != nil {
+		t.Fatalf("inherited listener did not accept: %v", err)
+	}
+	conn.Close()
+
+	t.Setenv(listenFDsEnv, "https=x")
+	if _, err := inheritedListeners(); err == nil {
+		t.Errorf("expected an error for an invalid descriptor")
+	}
+}
+
+func Test_shutdownDrainsInFlightRequests(t *testing.T) {
+	started := make(chan struct{})
+	handler := http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		close(started)
+		time.Sleep(200 * time.Millisecond)
+		fmt.Fprint(w, "done")
+	})
+	m := &MTLSServer{httpsServer: &http.Server{Handler: handler}, httpServer: &http.Server{}}
+	listener, err := net.Listen("tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	go m.httpsServer.Serve(listener)
+
+	type result struct {
+		body string
+		err  error
+	}
+	results := make(chan result, 1)
+	go func() {
+		resp, err := http.Get("http://" + listener.Addr().String())
+		if err != nil {
+			results <- result{err: err}
+			return
+		}
+		defer resp.Body.Close()
+		body, err := io.ReadAll(resp.Body)
+		results <- result{string(body), err}
+	}()
+
+	<-started
+	ctx, cancel := context.WithTimeout(context.Background(), 5*time.Second)
+	defer cancel()
+	if err := m.Shutdown(ctx); err != nil {
+		t.Fatalf("Shutdown: %v", err)
+	}
+	if r := <-results; r.err != nil || r.body != "done" {
+		t.Errorf("in-flight request got %q, %v", r.body, r.err)
+	}
+	if _, err := net.DialTimeout("tcp", listener.Addr().String(), time.Second); err == nil {
+		t.Errorf("expected the listener to be closed after Shutdown")
+	}
+}
@@ -0,0 +1,14 @@
+//go:build !unix
+
+package server
+
+import "os"
+
+// mapFile reads path into memory on platforms without syscall.Mmap.
+func mapFile(path string) ([]byte, func() error, error) {
+	data, err := os.ReadFile(path)
+	if err != nil {
+		return nil, nil, err
+	}
+	return data, func() error { return nil }, nil
+}
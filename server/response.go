@@ -24,6 +24,12 @@ type response struct {
 }
 
 func generateResponse(r *http.Request, certificatePath string) response {
+	return generateFields(r, certificatePath, defaultFields)
+}
+
+// generateFields builds only the parts of the response that fields selects;
+// mtls_valid and the certificate path are always filled in.
+func generateFields(r *http.Request, certificatePath string, fields fieldSet) response {
 	if r.TLS == nil {
 		return response{}
 	}
@@ -32,7 +38,15 @@ func generateResponse(r *http.Request, certificatePath string) response {
 		ClientCertificatePath: certificatePath,
 	}
 
-	for _, cert := range r.TLS.PeerCertificates {
+	presented := r.TLS.PeerCertificates
+	if fields&fieldPresentedCertificates == 0 && len(presented) > 0 {
+		// leaf_common_name only needs the leaf
+		presented = presented[:1]
+		if fields&fieldLeafCommonName == 0 {
+			presented = nil
+		}
+	}
+	for _, cert := range presented {
 		certInfo := certificate{
 			IssuerCommonName:  cert.Issuer.CommonName,
 			SubjectCommonName: cert.Subject.CommonName,
@@ -45,6 +59,9 @@ func generateResponse(r *http.Request, certificatePath string) response {
 
 	if len(r.TLS.VerifiedChains) > 0 {
 		resp.MTLSValid = true
+		if fields&fieldVerifiedChains == 0 {
+			return resp
+		}
 		for _, chain := range r.TLS.VerifiedChains {
 			chainInfo := certificateChain{}
 			for _, cert := range chain {
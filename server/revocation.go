@@ -0,0 +1,220 @@
+package server
+
+import (
+	"bytes"
+	"context"
+	"crypto/sha256"
+	"crypto/tls"
+	"crypto/x509"
+	"encoding/binary"
+	"errors"
+	"fmt"
+	"log"
+	"math/bits"
+	"os"
+	"runtime"
+	"sync"
+	"sync/atomic"
+	"time"
+)
+
+// Compiled revocation set layout, shared with the Rust server and written by
+// certgen/compile-revocations.py (little endian):
+//
+//	magic "MTLSREV1" | slot count uint32 (power of two) | entry count uint32 |
+//	created unix uint64 | reserved [8]byte | slots [slot count][16]byte
+//
+// Each slot holds the first 16 bytes of SHA-256(issuer DER length uint32 BE |
+// issuer DER | serial magnitude), or zeros when empty. Slots are probed
+// linearly from the first 8 key bytes masked by the slot count.
+const (
+	revocationMagic     = "MTLSREV1"
+	revocationHeaderLen = 32
+	revocationSlotLen   = 16
+)
+
+// ErrRevoked is returned from the TLS handshake for revoked client certificates.
+var ErrRevoked = errors.New("client certificate revoked")
+
+// RevocationSet is a memory-mapped, compiled revocation set. A lookup costs
+// one hash and typically one or two slot probes, independent of the number
+// of entries.
+type RevocationSet struct {
+	slots   []byte
+	mask    uint64
+	entries int
+	unmap   func() error
+}
+
+// OpenRevocationSet maps the compiled revocation set at path.
+func OpenRevocationSet(path string) (*RevocationSet, error) {
+	data, unmap, err := mapFile(path)
+	if err != nil {
+		return nil, err
+	}
+
+	if len(data) < revocationHeaderLen || string(data[:8]) != revocationMagic {
+		unmap()
+		return nil, fmt.Errorf("%s: not a compiled revocation set", path)
+	}
+	slots := uint64(binary.LittleEndian.Uint32(data[8:12]))
+	entries := uint64(binary.LittleEndian.Uint32(data[12:16]))
+	if bits.OnesCount64(slots) != 1 || entries >= slots || uint64(len(data)) != revocationHeaderLen+slots*revocationSlotLen {
+		unmap()
+		return nil, fmt.Errorf("%s: corrupt revocation set header", path)
+	}
+
+	s := &RevocationSet{
+		slots:   data[revocationHeaderLen:],
+		mask:    slots - 1,
+		entries: int(entries),
+		unmap:   unmap,
+	}
+	// Sets are swapped while handshakes may still be reading the old one, so
+	// the mapping is released by the garbage collector, not on swap
+	runtime.SetFinalizer(s, func(s *RevocationSet) { s.unmap() })
+	return s, nil
+}
+
+// Len returns the number of revoked certificates in the set.
+func (s *RevocationSet) Len() int {
+	return s.entries
+}
+
+// Contains reports whether the certificate with serial (big-endian bytes)
+// issued by issuer (raw DER Name) is revoked.
+func (s *RevocationSet) Contains(issuer, serial []byte) bool {
+	key := revocationKey(issuer, serial)
+	var empty [revocationSlotLen]byte
+	found := false
+	for i := binary.LittleEndian.Uint64(key[:8]) & s.mask; ; i = (i + 1) & s.mask {
+		slot := s.slots[i*revocationSlotLen : (i+1)*revocationSlotLen]
+		if bytes.Equal(slot, key[:]) {
+			found = true
+			break
+		}
+		if bytes.Equal(slot, empty[:]) {
+			break
+		}
+	}
+	// The slots live outside the Go heap; keep s, and with it the mapping,
+	// alive until the probe is done
+	runtime.KeepAlive(s)
+	return found
+}
+
+func revocationKey(issuer, serial []byte) [revocationSlotLen]byte {
+	serial = bytes.TrimLeft(serial, "\x00")
+	h := sha256.New()
+	var length [4]byte
+	binary.BigEndian.PutUint32(length[:], uint32(len(issuer)))
+	h.Write(length[:])
+	h.Write(issuer)
+	h.Write(serial)
+
+	var key [revocationSlotLen]byte
+	copy(key[:], h.Sum(nil))
+	return key
+}
+
+// Revocations holds the revocation set in force, loaded from a compiled file
+// that can be replaced while the server is running.
+type Revocations struct {
+	path string
+	set  atomic.Pointer[RevocationSet]
+
+	mu      sync.Mutex
+	modTime time.Time
+	size    int64
+}
+
+// LoadRevocations maps the compiled revocation set at path.
+func LoadRevocations(path string) (*Revocations, error) {
+	r := &Revocations{path: path}
+	if err := r.Reload(); err != nil {
+		return nil, err
+	}
+	return r, nil
+}
+
+// Len returns the number of revoked certificates currently loaded.
+func (r *Revocations) Len() int {
+	return r.set.Load().Len()
+}
+
+// IsRevoked reports whether cert is in the current revocation set.
+func (r *Revocations) IsRevoked(cert *x509.Certificate) bool {
+	return r.set.Load().Contains(cert.RawIssuer, cert.SerialNumber.Bytes())
+}
+
+// Reload re-maps the revocation file unconditionally. On error the current
+// set is kept.
+func (r *Revocations) Reload() error {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	return r.reloadLocked()
+}
+
+// ReloadIfChanged reloads the revocation file if its modification time or
+// size changed since the last successful load, and reports whether it did.
+func (r *Revocations) ReloadIfChanged() (bool, error) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	info, err := os.Stat(r.path)
+	if err != nil {
+		return false, err
+	}
+	if info.ModTime().Equal(r.modTime) && info.Size() == r.size {
+		return false, nil
+	}
+	return true, r.reloadLocked()
+}
+
+func (r *Revocations) reloadLocked() error {
+	info, err := os.Stat(r.path)
+	if err != nil {
+		return err
+	}
+	set, err := OpenRevocationSet(r.path)
+	if err != nil {
+		return err
+	}
+
+	r.set.Store(set)
+	r.modTime, r.size = info.ModTime(), info.Size()
+	return nil
+}
+
+// Watch checks the revocation file every interval and reloads it when it
+// changes, until ctx is cancelled.
+func (r *Revocations) Watch(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+
+	for {
+		select {
+		case <-ctx.Done():
+			return
+		case <-ticker.C:
+			reloaded, err := r.ReloadIfChanged()
+			if err != nil {
+				log.Printf("Could not reload revocations %s, keeping current set: %v", r.path, err)
+			} else if reloaded {
+				log.Printf("Reloaded %d revoked certificates from %s", r.Len(), r.path)
+			}
+		}
+	}
+}
+
+// verifyConnection rejects handshakes whose client chain contains a revoked
+// certificate. It runs for resumed sessions too, so revoking a certificate
+// also stops resumption of sessions established with it.
+func (r *Revocations) verifyConnection(cs tls.ConnectionState) error {
+	for _, cert := range cs.PeerCertificates {
+		if r.IsRevoked(cert) {
+			return ErrRevoked
+		}
+	}
+	return nil
+}
@@ -0,0 +1,134 @@
+package server
+
+import (
+	"crypto/tls"
+	"crypto/x509"
+	"encoding/binary"
+	"errors"
+	"math/big"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+)
+
+var testIssuer = []byte("\x30\x12\x31\x10\x30\x0e\x06\x03\x55\x04\x03\x0c\x07Test CA")
+
+// writeRevocationSet compiles serials 1..n of testIssuer the same way
+// certgen/compile-revocations.py does.
+func writeRevocationSet(tb testing.TB, path string, n int) {
+	tb.Helper()
+	slots := 16
+	for slots < 2*n+1 {
+		slots *= 2
+	}
+	data := make([]byte, revocationHeaderLen+slots*revocationSlotLen)
+	copy(data, revocationMagic)
+	binary.LittleEndian.PutUint32(data[8:], uint32(slots))
+	binary.LittleEndian.PutUint32(data[12:], uint32(n))
+
+	table := data[revocationHeaderLen:]
+	var empty [revocationSlotLen]byte
+	for serial := 1; serial <= n; serial++ {
+		key := revocationKey(testIssuer, big.NewInt(int64(serial)).Bytes())
+		i := binary.LittleEndian.Uint64(key[:8]) & uint64(slots-1)
+		for string(table[i*revocationSlotLen:(i+1)*revocationSlotLen]) != string(empty[:]) {
+			i = (i + 1) & uint64(slots-1)
+		}
+		copy(table[i*revocationSlotLen:], key[:])
+	}
+	if err := os.WriteFile(path, data, 0o644); err != nil {
+		tb.Fatal(err)
+	}
+}
+
+func Test_RevocationSetContains(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "revocations.bin")
+	writeRevocationSet(t, path, 1000)
+	set, err := OpenRevocationSet(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	if set.Len() != 1000 {
+		t.Errorf("expected 1000 entries, got %d", set.Len())
+	}
+	tests := []struct {
+		issuer []byte
+		serial []byte
+		want   bool
+	}{
+		{testIssuer, []byte{0x01}, true},
+		{testIssuer, []byte{0x00, 0x00, 0x03, 0xe8}, true},
+		{testIssuer, []byte{0x03, 0xe9}, false},
+		{[]byte("other issuer"), []byte{0x01}, false},
+	}
+	for _, tt := range tests {
+		if got := set.Contains(tt.issuer, tt.serial); got != tt.want {
+			t.Errorf("Contains(%x) = %v, want %v", tt.serial, got, tt.want)
+		}
+	}
+}
+
+func Test_OpenRevocationSetInvalid(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "revocations.bin")
+	if err := os.WriteFile(path, []byte("not a revocation set, not at all"), 0o644); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := OpenRevocationSet(path); err == nil {
+		t.Errorf("expected an error for a file without the magic")
+	}
+}
+
+func Test_RevocationsReloadAndVerify(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "revocations.bin")
+	writeRevocationSet(t, path, 1)
+	revocations, err := LoadRevocations(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	cert := &x509.Certificate{RawIssuer: testIssuer, SerialNumber: big.NewInt(2)}
+	cs := tls.ConnectionState{PeerCertificates: []*x509.Certificate{cert}}
+	if err := revocations.verifyConnection(cs); err != nil {
+		t.Fatalf("expected serial 2 to be accepted, got %v", err)
+	}
+
+	writeRevocationSet(t, path, 2)
+	later := time.Now().Add(time.Hour)
+	if err := os.Chtimes(path, later, later); err != nil {
+		t.Fatal(err)
+	}
+	if reloaded, err := revocations.ReloadIfChanged(); !reloaded || err != nil {
+		t.Fatalf("expected a reload, got %v %v", reloaded, err)
+	}
+	if err := revocations.verifyConnection(cs); !errors.Is(err, ErrRevoked) {
+		t.Errorf("expected serial 2 to be revoked after reload, got %v", err)
+	}
+	if err := revocations.verifyConnection(tls.ConnectionState{}); err != nil {
+		t.Errorf("expected connections without a client cert to pass, got %v", err)
+	}
+}
+
+func benchmarkRevocationLookup(b *testing.B, entries int) {
+	path := filepath.Join(b.TempDir(), "revocations.bin")
+	writeRevocationSet(b, path, entries)
+	set, err := OpenRevocationSet(path)
+	if err != nil {
+		b.Fatal(err)
+	}
+	serial := big.NewInt(int64(entries) + 1).Bytes()
+
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		set.Contains(testIssuer, serial)
+	}
+}
+
+func BenchmarkRevocationLookup1k(b *testing.B) {
+	benchmarkRevocationLookup(b, 1000)
+}
+
+func BenchmarkRevocationLookup500k(b *testing.B) {
+	benchmarkRevocationLookup(b, 500000)
+}
@@ -1,28 +1,53 @@
 package server
 
 import (
+	"bytes"
+	"context"
 	"crypto/tls"
 	"crypto/x509"
-	"encoding/json"
+	"errors"
 	"fmt"
 	"html/template"
 	"log"
+	"net"
 	"net/http"
 	"os"
+	"sync"
+	"sync/atomic"
+	"time"
 
 	"golang.org/x/crypto/acme"
 	"golang.org/x/crypto/acme/autocert"
 )
 
 type MTLSServer struct {
-	httpsServer *http.Server
-	httpServer  *http.Server
+	httpsServer   *http.Server
+	httpServer    *http.Server
+	responseCache *responseCache
+	certManager   *autocert.Manager
+	certCache     *certCache
+	prewarmHosts  []string
+
+	mu            sync.Mutex
+	httpListener  net.Listener
+	httpsListener net.Listener
 }
 
 const (
 	stagingACMEDirectoryURL = "https://acme-staging-v02.api.letsencrypt.org/directory"
-	httpAddress             = ":80"
-	httpsAddress            = ":443"
+
+	// DefaultHTTPAddress and DefaultHTTPSAddress are used when
+	// Config.HTTPAddress and Config.HTTPSAddress are left empty.
+	DefaultHTTPAddress  = ":80"
+	DefaultHTTPSAddress = ":443"
+
+	// DefaultResponseCacheSize is the number of rendered responses kept
+	// when Config.ResponseCacheSize is left at zero.
+	DefaultResponseCacheSize = 1024
+
+	// prewarmTimeout bounds how long ListenAndServe spends obtaining missing
+	// certificates at startup; handshakes retry after it.
+	prewarmTimeout = 5 * time.Minute
 )
 
 // Config contains the configuration forht the mTLS server instance.
@@ -31,25 +56,74 @@ type Config struct {
 	TemplateFile   string
 	ClientCertName string
 	ClientCAPool   *x509.CertPool
-	UseStaging     bool
+	// ClientCAs, when set, replaces ClientCAPool with a pool that can be
+	// reloaded at runtime.
+	ClientCAs *ClientCAs
+	// Revocations, when set, rejects client certificates in the compiled
+	// revocation set.
+	Revocations *Revocations
+	UseStaging  bool
+	// ACMEDirectoryURL, when set, overrides the Let's Encrypt (or staging)
+	// directory, e.g. with acme_standin.py for offline tests.
+	ACMEDirectoryURL string
+	// CertCacheDir, when set, keeps ACME account keys and certificates in
+	// this directory so restarts reuse them instead of ordering new ones.
+	// They are always cached in memory.
+	CertCacheDir string
+	// HTTPAddress and HTTPSAddress are the listen addresses of the ACME
+	// challenge server and the site.
+	HTTPAddress  string
+	HTTPSAddress string
+	// ResponseCacheSize bounds the rendered response cache. Zero uses
+	// DefaultResponseCacheSize, a negative value disables caching.
+	ResponseCacheSize int
+	// AccessLog, when set, logs every HTTPS request.
+	AccessLog *AccessLog
+	// ACL, when set, restricts routes by client certificate.
+	ACL *ACL
+	// Tenants, when set, gives the hostnames in it their own server
+	// certificate and client CA; other hostnames use SiteFQDN and
+	// ClientCAPool.
+	Tenants *Tenants
+	// Enroller, when set, serves EST enrollment under /.well-known/est/.
+	Enroller *Enroller
 }
 
 // New create a mTLS server with an ACME certificate manager.
 func New(config Config) (*MTLSServer, error) {
 	// Setup ACME client
+	certCache := newCertCache(config.CertCacheDir)
 	certManager := &autocert.Manager{
 		Prompt:     autocert.AcceptTOS,
 		HostPolicy: autocert.HostWhitelist(config.SiteFQDN),
+		Cache:      certCache,
+	}
+	var prewarmHosts []string
+	if config.SiteFQDN != "" {
+		prewarmHosts = append(prewarmHosts, config.SiteFQDN)
+	}
+	if config.Tenants != nil {
+		certManager.HostPolicy = config.Tenants.hostPolicy(certManager.HostPolicy)
+		prewarmHosts = append(prewarmHosts, config.Tenants.acmeHosts()...)
 	}
 
-	if config.UseStaging {
+	switch {
+	case config.ACMEDirectoryURL != "":
+		certManager.Client = &acme.Client{DirectoryURL: config.ACMEDirectoryURL}
+	case config.UseStaging:
 		certManager.Client = &acme.Client{DirectoryURL: stagingACMEDirectoryURL}
 	}
 	tlsConfig := certManager.TLSConfig()
 
 	// Setup client certificate verification
+	if config.ClientCAs != nil {
+		config.ClientCAPool = config.ClientCAs.Pool()
+	}
 	tlsConfig.ClientCAs = config.ClientCAPool
 	tlsConfig.ClientAuth = tls.VerifyClientCertIfGiven
+	if config.Revocations != nil {
+		tlsConfig.VerifyConnection = config.Revocations.verifyConnection
+	}
 
 	// Load index web template
 	webTemplate, err := loadWebTemplate(config.TemplateFile)
@@ -57,89 +131,315 @@ func New(config Config) (*MTLSServer, error) {
 		return nil, err
 	}
 
+	var handler http.Handler = http.DefaultServeMux
+	if config.ACL != nil {
+		handler = config.ACL.Handler(handler)
+	}
+	if config.AccessLog != nil {
+		handler = config.AccessLog.Handler(handler)
+	}
+
 	httpsServer := &http.Server{
-		Addr:      httpsAddress,
+		Addr:      orDefault(config.HTTPSAddress, DefaultHTTPSAddress),
+		Handler:   handler,
 		TLSConfig: tlsConfig,
 	}
+	if config.ACL != nil {
+		httpsServer.ConnContext = config.ACL.connContext
+	}
 
 	httpServer := &http.Server{
-		Addr:    httpAddress,
+		Addr:    orDefault(config.HTTPAddress, DefaultHTTPAddress),
 		Handler: certManager.HTTPHandler(nil),
 	}
 
+	cacheSize := config.ResponseCacheSize
+	if cacheSize == 0 {
+		cacheSize = DefaultResponseCacheSize
+	}
+
 	mTLSServer := &MTLSServer{
-		httpServer:  httpServer,
-		httpsServer: httpsServer,
+		httpServer:    httpServer,
+		httpsServer:   httpsServer,
+		responseCache: newResponseCache(cacheSize),
+		certManager:   certManager,
+		certCache:     certCache,
+		prewarmHosts:  prewarmHosts,
+	}
+
+	if config.ClientCAs != nil {
+		reloadClientCAs(tlsConfig, config.ClientCAs, mTLSServer.responseCache)
+	}
+	if config.Tenants != nil {
+		config.Tenants.serve(tlsConfig, mTLSServer.responseCache)
 	}
 
 	// Setup handlers for the web endpoints
-	setupHandlers(config.ClientCertName, webTemplate)
+	setupHandlers(config.ClientCertName, webTemplate, mTLSServer.responseCache)
+	if config.Enroller != nil {
+		config.Enroller.register(http.DefaultServeMux)
+	}
 
 	return mTLSServer, nil
 }
 
-// ListenAndServe sets both the HTTP and HTTPS server to listen and serve
-func (m *MTLSServer) ListenAndServe() {
+// ListenAndServe sets both the HTTP and HTTPS server to listen and serve,
+// on the sockets handed off by a previous server (see Handoff) when there
+// are any. Once both listen, and so can answer ACME challenges, the site and
+// ACME tenant certificates are prewarmed in the background.
+//
+// It returns the first error of either server. After Shutdown that is
+// http.ErrServerClosed, returned straight away; wait for Shutdown to return
+// for the connections to be drained.
+func (m *MTLSServer) ListenAndServe() error {
+	httpListener, httpsListener, err := m.listen()
+	if err != nil {
+		return err
+	}
+	m.mu.Lock()
+	m.httpListener, m.httpsListener = httpListener, httpsListener
+	m.mu.Unlock()
+
+	errs := make(chan error, 2)
 	go func() {
 		// serve HTTP, which will redirect automatically to HTTPS
-		if err := m.httpServer.ListenAndServe(); err != nil {
-			log.Fatalf("HTTP server failed: %v", err)
+		if err := m.httpServer.Serve(httpListener); err != http.ErrServerClosed {
+			err = fmt.Errorf("HTTP server failed: %w", err)
+		}
+		errs <- err
+	}()
+	go func() {
+		if err := m.httpsServer.ServeTLS(httpsListener, "", ""); err != http.ErrServerClosed {
+			err = fmt.Errorf("HTTPS server failed: %w", err)
+		}
+		errs <- err
+	}()
+	notifyReady()
+
+	go func() {
+		ctx, cancel := context.WithTimeout(context.Background(), prewarmTimeout)
+		defer cancel()
+		if err := m.Prewarm(ctx); err != nil {
+			log.Printf("Could not prewarm certificates, handshakes will retry: %v", err)
 		}
 	}()
 
-	if err := m.httpsServer.ListenAndServeTLS("", ""); err != nil {
-		log.Fatalf("HTTPS server failed: %v", err)
+	return <-errs
+}
+
+// listen binds the HTTP and HTTPS addresses, or takes over the listeners
+// of the server that started this one through Handoff.
+func (m *MTLSServer) listen() (httpListener, httpsListener net.Listener, err error) {
+	inherited, err := inheritedListeners()
+	if err != nil {
+		return nil, nil, err
+	}
+	if inherited != nil {
+		httpListener, httpsListener = inherited["http"], inherited["https"]
+		if httpListener == nil || httpsListener == nil {
+			return nil, nil, fmt.Errorf("%s must name an http and an https listener", listenFDsEnv)
+		}
+		log.Printf("Serving listeners handed off by the previous server")
+		return httpListener, httpsListener, nil
+	}
+
+	if httpListener, err = net.Listen("tcp", m.httpServer.Addr); err != nil {
+		return nil, nil, fmt.Errorf("HTTP server failed: %w", err)
 	}
+	if httpsListener, err = net.Listen("tcp", m.httpsServer.Addr); err != nil {
+		httpListener.Close()
+		return nil, nil, fmt.Errorf("HTTPS server failed: %w", err)
+	}
+	return httpListener, httpsListener, nil
+}
+
+// Shutdown stops both servers accepting connections, closes idle keep-alive
+// connections, and waits for in-flight requests to finish, closing the
+// connections as they go idle. Responses sent while draining ask the client
+// to close the connection, and HTTP/2 clients get a GOAWAY. When ctx ends
+// first, the remaining connections are closed and ctx's error returned.
+func (m *MTLSServer) Shutdown(ctx context.Context) error {
+	errs := make(chan error, 2)
+	for _, s := range []*http.Server{m.httpsServer, m.httpServer} {
+		go func(s *http.Server) {
+			err := s.Shutdown(ctx)
+			if err != nil {
+				s.Close()
+			}
+			errs <- err
+		}(s)
+	}
+	return errors.Join(<-errs, <-errs)
+}
+
+// Prewarm loads the ACME certificates of the site and of ACME tenants from
+// the cache, or obtains them, so the first handshakes do not wait on the
+// ACME CA. The HTTP and HTTPS listeners must be up to answer challenges.
+func (m *MTLSServer) Prewarm(ctx context.Context) error {
+	return prewarmCertificates(ctx, m.certManager, m.prewarmHosts)
 }
 
-func setupHandlers(clientCert string, webTemplate *template.Template) {
+// ResponseCacheStats returns hit/miss counters of the rendered response cache.
+func (m *MTLSServer) ResponseCacheStats() CacheStats {
+	return m.responseCache.stats()
+}
+
+// CertCacheStats returns hit/miss counters of the in-memory layer of the
+// ACME certificate cache.
+func (m *MTLSServer) CertCacheStats() CacheStats {
+	return m.certCache.stats()
+}
+
+func orDefault(value, fallback string) string {
+	if value == "" {
+		return fallback
+	}
+	return value
+}
+
+// reloadClientCAs makes tlsConfig verify client certificates against the
+// current pool of cas. Each handshake gets a config snapshot that is only
+// rebuilt when the pool changes, and cached responses, which embed the
+// verification result, are dropped on every change.
+func reloadClientCAs(tlsConfig *tls.Config, cas *ClientCAs, cache *responseCache) {
+	base := tlsConfig.Clone()
+	var current atomic.Pointer[tls.Config]
+	current.Store(base)
+
+	cas.notify(func(pool *x509.CertPool) {
+		next := base.Clone()
+		next.ClientCAs = pool
+		current.Store(next)
+		cache.purge()
+	})
+	tlsConfig.GetConfigForClient = func(*tls.ClientHelloInfo) (*tls.Config, error) {
+		return current.Load(), nil
+	}
+}
+
+func setupHandlers(clientCert string, webTemplate *template.Template, cache *responseCache) {
 	clientCertPath := fmt.Sprintf("/%s", clientCert)
 	http.HandleFunc("/", func(w http.ResponseWriter, r *http.Request) {
-		requestHandlerHTML(w, r, webTemplate, clientCertPath)
+		requestHandlerHTML(w, r, webTemplate, clientCertPath, cache)
 	})
 	http.HandleFunc("/json", func(w http.ResponseWriter, r *http.Request) {
-		requestHandlerJSON(w, r, clientCertPath)
-	})
-	http.HandleFunc("/images/mtls-on.svg", func(w http.ResponseWriter, r *http.Request) {
-		http.ServeFile(w, r, "images/mtls-on.svg")
-	})
-	http.HandleFunc("/images/mtls-off.svg", func(w http.ResponseWriter, r *http.Request) {
-		http.ServeFile(w, r, "images/mtls-off.svg")
-	})
-	http.HandleFunc(clientCertPath, func(w http.ResponseWriter, r *http.Request) {
-		http.ServeFile(w, r, clientCert)
+		requestHandlerJSON(w, r, clientCertPath, cache)
 	})
+	http.HandleFunc("/json/valid", requestHandlerValid)
+
+	// Static assets are served from memory and reloaded when changed on disk
+	assets := map[string]*staticAsset{
+		"/images/mtls-on.svg":  newStaticAsset("images/mtls-on.svg", imageCacheControl),
+		"/images/mtls-off.svg": newStaticAsset("images/mtls-off.svg", imageCacheControl),
+		clientCertPath:         newStaticAsset(clientCert, downloadCacheControl),
+	}
+	for pattern, asset := range assets {
+		asset.load()
+		http.Handle(pattern, asset)
+	}
 }
 
-func requestHandlerHTML(w http.ResponseWriter, r *http.Request, webTemplate *template.Template, downloadLink string) {
+func requestHandlerHTML(w http.ResponseWriter, r *http.Request, webTemplate *template.Template, downloadLink string, cache *responseCache) {
 	defer r.Body.Close()
-	resp := generateResponse(r, downloadLink)
 
-	err := webTemplate.Execute(w, resp)
+	rendered, err := cachedRender(r, formatHTML, 0, cache, func() (renderedResponse, error) {
+		var buf bytes.Buffer
+		if err := webTemplate.Execute(&buf, generateResponse(r, downloadLink)); err != nil {
+			return renderedResponse{}, err
+		}
+		return renderedResponse{status: http.StatusOK, body: buf.Bytes()}, nil
+	})
 	if err != nil {
 		log.Printf("Could not generate response page: %v", err)
+		http.Error(w, "Could not generate response page", http.StatusInternalServerError)
+		return
+	}
+
+	w.Header().Set("Content-Type", "text/html; charset=utf-8")
+	if _, err := w.Write(rendered.body); err != nil {
+		log.Printf("Write error: %v", err)
 	}
 }
 
-func requestHandlerJSON(w http.ResponseWriter, r *http.Request, downloadLink string) {
+func requestHandlerJSON(w http.ResponseWriter, r *http.Request, downloadLink string, cache *responseCache) {
 	defer r.Body.Close()
 
-	resp := generateResponse(r, downloadLink)
-	info, err := json.MarshalIndent(resp, "", "  ")
+	format, err := negotiateFormat(r.Header.Get("Accept"))
 	if err != nil {
-		http.Error(w, err.Error(), http.StatusInternalServerError)
+		http.Error(w, err.Error(), http.StatusNotAcceptable)
 		return
 	}
-	if !resp.MTLSValid {
-		w.WriteHeader(http.StatusUnauthorized)
+	fields, err := parseFields(r.URL.Query().Get("fields"))
+	if err != nil {
+		http.Error(w, err.Error(), http.StatusBadRequest)
+		return
 	}
-	w.Header().Set("Content-Type", "application/json")
-	_, err = w.Write(info)
+	w.Header().Set("Content-Type", contentTypes[format])
+	w.Header().Add("Vary", "Accept")
+
+	// The status only depends on the handshake, so HEAD skips rendering
+	if r.Method == http.MethodHead {
+		w.WriteHeader(validityStatus(r, http.StatusOK))
+		return
+	}
+
+	rendered, err := cachedRender(r, format, fields, cache, func() (renderedResponse, error) {
+		resp := generateFields(r, downloadLink, fields)
+		info, err := encodeResponse(resp, fields, format)
+		if err != nil {
+			return renderedResponse{}, err
+		}
+		status := http.StatusOK
+		if !resp.MTLSValid {
+			status = http.StatusUnauthorized
+		}
+		return renderedResponse{status: status, body: info}, nil
+	})
 	if err != nil {
+		http.Error(w, err.Error(), http.StatusInternalServerError)
+		return
+	}
+
+	w.WriteHeader(rendered.status)
+	if _, err := w.Write(rendered.body); err != nil {
 		log.Printf("Write error: %v", err)
 	}
 }
 
+// requestHandlerValid answers /json/valid with the verification result in
+// the status code alone, for health checks and gateways that only need to
+// know whether the client certificate verified.
+func requestHandlerValid(w http.ResponseWriter, r *http.Request) {
+	defer r.Body.Close()
+
+	if r.Method != http.MethodGet && r.Method != http.MethodHead {
+		w.Header().Set("Allow", "GET, HEAD")
+		http.Error(w, http.StatusText(http.StatusMethodNotAllowed), http.StatusMethodNotAllowed)
+		return
+	}
+	w.WriteHeader(validityStatus(r, http.StatusNoContent))
+}
+
+// validityStatus is ok when the client certificate verified and 401
+// otherwise.
+func validityStatus(r *http.Request, ok int) int {
+	if r.TLS != nil && len(r.TLS.VerifiedChains) > 0 {
+		return ok
+	}
+	return http.StatusUnauthorized
+}
+
+// cachedRender serves a rendered response from cache when the request has a
+// TLS state to key on, and renders it directly otherwise.
+func cachedRender(r *http.Request, format responseFormat, fields fieldSet, cache *responseCache, render func() (renderedResponse, error)) (renderedResponse, error) {
+	key, ok := responseCacheKey(r, format)
+	if !ok {
+		return render()
+	}
+	key.fields = fields
+	return cache.get(key, render)
+}
+
 func loadWebTemplate(filename string) (*template.Template, error) {
 	file, err := os.ReadFile(filename)
 	if err != nil {
@@ -0,0 +1,188 @@
+package server
+
+import (
+	"bytes"
+	"compress/gzip"
+	"crypto/sha256"
+	"encoding/hex"
+	"log"
+	"mime"
+	"net/http"
+	"os"
+	"path/filepath"
+	"strconv"
+	"strings"
+	"sync/atomic"
+	"time"
+)
+
+const (
+	// staticCheckInterval is how often an asset is stat'ed for changes on disk.
+	staticCheckInterval = 2 * time.Second
+
+	imageCacheControl    = "public, max-age=3600"
+	downloadCacheControl = "no-cache"
+)
+
+// assetVersion is one loaded revision of a static file and its encodings.
+type assetVersion struct {
+	modTime time.Time
+	size    int64
+	etag    string
+	body    []byte
+	gzip    []byte
+	brotli  []byte
+}
+
+// staticAsset serves a single file from memory. The file is re-read when its
+// modification time or size changes, checked at most once per checkInterval,
+// so requests never touch the disk in the steady state.
+type staticAsset struct {
+	path          string
+	contentType   string
+	cacheControl  string
+	compress      bool
+	checkInterval time.Duration
+
+	current   atomic.Pointer[assetVersion]
+	nextCheck atomic.Int64
+}
+
+func newStaticAsset(path, cacheControl string) *staticAsset {
+	contentType := mime.TypeByExtension(filepath.Ext(path))
+	if contentType == "" {
+		contentType = "application/octet-stream"
+	}
+	return &staticAsset{
+		path:          path,
+		contentType:   contentType,
+		cacheControl:  cacheControl,
+		compress:      isCompressible(contentType),
+		checkInterval: staticCheckInterval,
+	}
+}
+
+func isCompressible(contentType string) bool {
+	return strings.HasPrefix(contentType, "text/") ||
+		strings.HasPrefix(contentType, "image/svg") ||
+		strings.Contains(contentType, "json") ||
+		strings.Contains(contentType, "javascript")
+}
+
+// load returns the current version, reloading it from disk when the check
+// interval elapsed and the file changed. A failed reload keeps serving the
+// previously loaded version.
+func (a *staticAsset) load() *assetVersion {
+	cur := a.current.Load()
+	now := time.Now().UnixNano()
+	next := a.nextCheck.Load()
+	if cur != nil && now < next {
+		return cur
+	}
+	if !a.nextCheck.CompareAndSwap(next, now+int64(a.checkInterval)) && cur != nil {
+		// Another request is already checking
+		return cur
+	}
+
+	info, err := os.Stat(a.path)
+	if err != nil {
+		if cur == nil {
+			log.Printf("Could not load static asset %s: %v", a.path, err)
+		}
+		return cur
+	}
+	if cur != nil && info.ModTime().Equal(cur.modTime) && info.Size() == cur.size {
+		return cur
+	}
+
+	v, err := a.read(info)
+	if err != nil {
+		log.Printf("Could not load static asset %s: %v", a.path, err)
+		return cur
+	}
+	a.current.Store(v)
+	return v
+}
+
+func (a *staticAsset) read(info os.FileInfo) (*assetVersion, error) {
+	body, err := os.ReadFile(a.path)
+	if err != nil {
+		return nil, err
+	}
+
+	sum := sha256.Sum256(body)
+	v := &assetVersion{
+		modTime: info.ModTime(),
+		size:    info.Size(),
+		etag:    hex.EncodeToString(sum[:16]),
+		body:    body,
+	}
+
+	if a.compress {
+		var buf bytes.Buffer
+		zw, _ := gzip.NewWriterLevel(&buf, gzip.BestCompression)
+		if _, err := zw.Write(body); err == nil && zw.Close() == nil && buf.Len() < len(body) {
+			v.gzip = buf.Bytes()
+		}
+
+		// Brotli is not in the standard library; use a precompressed sibling
+		// (e.g. images/mtls-on.svg.br) when the build produced one.
+		if br, err := os.ReadFile(a.path + ".br"); err == nil && len(br) < len(body) {
+			v.brotli = br
+		}
+	}
+	return v, nil
+}
+
+func (a *staticAsset) ServeHTTP(w http.ResponseWriter, r *http.Request) {
+	v := a.load()
+	if v == nil {
+		http.NotFound(w, r)
+		return
+	}
+
+	body, encoding := v.body, ""
+	if v.brotli != nil || v.gzip != nil {
+		w.Header().Add("Vary", "Accept-Encoding")
+		acceptEncoding := r.Header.Get("Accept-Encoding")
+		switch {
+		case v.brotli != nil && acceptsEncoding(acceptEncoding, "br"):
+			body, encoding = v.brotli, "br"
+		case v.gzip != nil && acceptsEncoding(acceptEncoding, "gzip"):
+			body, encoding = v.gzip, "gzip"
+		}
+	}
+
+	// Each encoding is a different representation and gets its own strong ETag
+	etag := v.etag
+	if encoding != "" {
+		etag += "-" + encoding
+		w.Header().Set("Content-Encoding", encoding)
+	}
+
+	w.Header().Set("Content-Type", a.contentType)
+	w.Header().Set("Cache-Control", a.cacheControl)
+	w.Header().Set("ETag", strconv.Quote(etag))
+
+	// ServeContent answers If-None-Match/If-Modified-Since with 304, handles
+	// HEAD and ranges, and never touches the disk.
+	http.ServeContent(w, r, "", v.modTime, bytes.NewReader(body))
+}
+
+// acceptsEncoding reports whether an Accept-Encoding header allows coding.
+func acceptsEncoding(header, coding string) bool {
+	for _, part := range strings.Split(header, ",") {
+		name, params, _ := strings.Cut(strings.TrimSpace(part), ";")
+		if !strings.EqualFold(strings.TrimSpace(name), coding) {
+			continue
+		}
+		params = strings.ReplaceAll(params, " ", "")
+		if q, ok := strings.CutPrefix(params, "q="); ok {
+			if f, err := strconv.ParseFloat(q, 64); err == nil && f == 0 {
+				return false
+			}
+		}
+		return true
+	}
+	return false
+}
@@ -0,0 +1,130 @@
+package server
+
+import (
+	"bytes"
+	"compress/gzip"
+	"io"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"path/filepath"
+	"strings"
+	"testing"
+	"time"
+)
+
+var testSVG = []byte(`<svg xmlns="http://www.w3.org/2000/svg">` + strings.Repeat(`<rect width="1" height="1"/>`, 50) + `</svg>`)
+
+func writeAsset(t *testing.T, name string, body []byte, modTime time.Time) string {
+	t.Helper()
+	path := filepath.Join(t.TempDir(), name)
+	if err := os.WriteFile(path, body, 0o644); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.Chtimes(path, modTime, modTime); err != nil {
+		t.Fatal(err)
+	}
+	return path
+}
+
+func serveAsset(asset *staticAsset, header http.Header) *httptest.ResponseRecorder {
+	r := httptest.NewRequest(http.MethodGet, "/images/test.svg", nil)
+	for k, v := range header {
+		r.Header[k] = v
+	}
+	w := httptest.NewRecorder()
+	asset.ServeHTTP(w, r)
+	return w
+}
+
+func Test_staticAssetETag(t *testing.T) {
+	asset := newStaticAsset(writeAsset(t, "test.svg", testSVG, testDate), imageCacheControl)
+
+	w := serveAsset(asset, nil)
+	if w.Code != http.StatusOK || !bytes.Equal(w.Body.Bytes(), testSVG) {
+		t.Fatalf("unexpected response %d %q", w.Code, w.Body.String())
+	}
+	if w.Header().Get("Content-Type") != "image/svg+xml" || w.Header().Get("Cache-Control") != imageCacheControl {
+		t.Errorf("unexpected headers %v", w.Header())
+	}
+
+	etag := w.Header().Get("ETag")
+	w = serveAsset(asset, http.Header{"If-None-Match": {etag}})
+	if w.Code != http.StatusNotModified {
+		t.Errorf("expected %d for matching ETag, got %d", http.StatusNotModified, w.Code)
+	}
+}
+
+func Test_staticAssetGzip(t *testing.T) {
+	asset := newStaticAsset(writeAsset(t, "test.svg", testSVG, testDate), imageCacheControl)
+
+	w := serveAsset(asset, http.Header{"Accept-Encoding": {"gzip, deflate"}})
+	if w.Header().Get("Content-Encoding") != "gzip" {
+		t.Fatalf("expected gzip encoding, got headers %v", w.Header())
+	}
+	zr, err := gzip.NewReader(w.Body)
+	if err != nil {
+		t.Fatal(err)
+	}
+	body, err := io.ReadAll(zr)
+	if err != nil || !bytes.Equal(body, testSVG) {
+		t.Errorf("gzip body does not round trip: %v", err)
+	}
+
+	identity := serveAsset(asset, http.Header{"Accept-Encoding": {"gzip;q=0"}})
+	if identity.Header().Get("Content-Encoding") != "" || identity.Header().Get("ETag") == w.Header().Get("ETag") {
+		t.Errorf("expected identity encoding with its own ETag, got %v", identity.Header())
+	}
+}
+
+func Test_staticAssetReload(t *testing.T) {
+	path := writeAsset(t, "test.svg", testSVG, testDate)
+	asset := newStaticAsset(path, imageCacheControl)
+	first := serveAsset(asset, nil)
+
+	updated := append([]byte("<!-- v2 -->"), testSVG...)
+	if err := os.WriteFile(path, updated, 0o644); err != nil {
+		t.Fatal(err)
+	}
+	later := testDate.Add(time.Hour)
+	if err := os.Chtimes(path, later, later); err != nil {
+		t.Fatal(err)
+	}
+
+	// Within the check interval the cached copy is still served
+	if w := serveAsset(asset, nil); !bytes.Equal(w.Body.Bytes(), testSVG) {
+		t.Errorf("expected cached body before the check interval elapsed")
+	}
+
+	asset.nextCheck.Store(0)
+	w := serveAsset(asset, nil)
+	if !bytes.Equal(w.Body.Bytes(), updated) || w.Header().Get("ETag") == first.Header().Get("ETag") {
+		t.Errorf("expected reloaded body and new ETag")
+	}
+}
+
+func Test_staticAssetMissing(t *testing.T) {
+	asset := newStaticAsset(filepath.Join(t.TempDir(), "missing.svg"), imageCacheControl)
+	if w := serveAsset(asset, nil); w.Code != http.StatusNotFound {
+		t.Errorf("expected %d, got %d", http.StatusNotFound, w.Code)
+	}
+}
+
+func Test_acceptsEncoding(t *testing.T) {
+	tests := []struct {
+		header string
+		want   bool
+	}{
+		{"gzip", true},
+		{"br, gzip;q=0.5", true},
+		{"GZIP", true},
+		{"gzip;q=0", false},
+		{"deflate, br", false},
+		{"", false},
+	}
+	for _, tt := range tests {
+		if got := acceptsEncoding(tt.header, "gzip"); got != tt.want {
+			t.Errorf("acceptsEncoding(%q) = %v, want %v", tt.header, got, tt.want)
+		}
+	}
+}
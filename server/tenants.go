@@ -0,0 +1,406 @@
+package server
+
+import (
+	"bufio"
+	"bytes"
+	"context"
+	"crypto/tls"
+	"crypto/x509"
+	"errors"
+	"fmt"
+	"log"
+	"os"
+	"path/filepath"
+	"sort"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"golang.org/x/crypto/acme/autocert"
+)
+
+// Tenant file format, shared with the Rust server. One tenant per line, #
+// starts a comment:
+//
+//	<hostname>[,<hostname>...] <cert.pem> <key.pem> <client-ca.pem>
+//
+// A hostname is exact or *.<domain>, which matches one extra label. Exact
+// names win over wildcards. Relative paths are resolved against the
+// directory of the tenant file. The Go server also takes "acme" as both
+// cert and key to get the certificate from the ACME manager (exact
+// hostnames only). Connections whose SNI matches no tenant are served with
+// the default site certificate and client CA.
+
+const tenantACME = "acme"
+
+// fileStamp is the modification time and size of a file, zero if it could
+// not be stat'ed.
+type fileStamp struct {
+	modTime time.Time
+	size    int64
+}
+
+func statFile(path string) fileStamp {
+	info, err := os.Stat(path)
+	if err != nil {
+		return fileStamp{}
+	}
+	return fileStamp{info.ModTime(), info.Size()}
+}
+
+// tenantConfig is a tenant's loaded TLS config, or the error loading it
+// failed with. Either is kept until one of the files changes.
+type tenantConfig struct {
+	config *tls.Config
+	err    error
+	stamps [3]fileStamp
+}
+
+// tenant is one line of the tenant file. Its certificate and CA bundle are
+// only read on the first handshake that needs them.
+type tenant struct {
+	names                     string
+	certFile, keyFile, caFile string
+
+	mu     sync.Mutex
+	loaded atomic.Pointer[tenantConfig]
+}
+
+func (t *tenant) acme() bool {
+	return t.certFile == tenantACME
+}
+
+func (t *tenant) files() [3]string {
+	return [3]string{t.certFile, t.keyFile, t.caFile}
+}
+
+// configFor returns the tenant's TLS config derived from base, loading the
+// tenant's files on first use. Concurrent handshakes for the same tenant
+// wait for one load; other tenants are not blocked.
+func (t *tenant) configFor(base *tls.Config) (*tls.Config, error) {
+	if loaded := t.loaded.Load(); loaded != nil {
+		return loaded.config, loaded.err
+	}
+
+	t.mu.Lock()
+	defer t.mu.Unlock()
+	if loaded := t.loaded.Load(); loaded != nil {
+		return loaded.config, loaded.err
+	}
+
+	loaded := &tenantConfig{}
+	for i, path := range t.files() {
+		if path != tenantACME {
+			loaded.stamps[i] = statFile(path)
+		}
+	}
+	loaded.config, loaded.err = t.load(base)
+	if loaded.err != nil {
+		loaded.err = fmt.Errorf("tenant %s: %w", t.names, loaded.err)
+		log.Printf("Could not load %v", loaded.err)
+	}
+	t.loaded.Store(loaded)
+	return loaded.config, loaded.err
+}
+
+func (t *tenant) load(base *tls.Config) (*tls.Config, error) {
+	pem, err := os.ReadFile(t.caFile)
+	if err != nil {
+		return nil, err
+	}
+	pool := x509.NewCertPool()
+	if !pool.AppendCertsFromPEM(pem) {
+		return nil, errors.New("could not decode CA pem")
+	}
+
+	config := base.Clone()
+	config.GetConfigForClient = nil
+	config.ClientCAs = pool
+	if !t.acme() {
+		cert, err := tls.LoadX509KeyPair(t.certFile, t.keyFile)
+		if err != nil {
+			return nil, err
+		}
+		config.Certificates = []tls.Certificate{cert}
+		config.GetCertificate = nil
+	}
+	return config, nil
+}
+
+// stale reports whether a loaded tenant's files changed since they were
+// read.
+func (t *tenant) stale() bool {
+	loaded := t.loaded.Load()
+	if loaded == nil {
+		return false
+	}
+	for i, path := range t.files() {
+		if path != tenantACME && statFile(path) != loaded.stamps[i] {
+			return true
+		}
+	}
+	return false
+}
+
+// tenantIndex is a parsed tenant file.
+type tenantIndex struct {
+	hosts   map[string]*tenant
+	tenants []*tenant
+}
+
+// parseTenants parses a tenant file, resolving relative paths against dir.
+// Tenants of previous whose line is unchanged are carried over with their
+// loaded configs.
+func parseTenants(data []byte, dir string, previous *tenantIndex) (*tenantIndex, error) {
+	reuse := make(map[[4]string]*tenant)
+	if previous != nil {
+		for _, t := range previous.tenants {
+			reuse[[4]string{t.names, t.certFile, t.keyFile, t.caFile}] = t
+		}
+	}
+	resolve := func(path string) string {
+		if path == tenantACME || filepath.IsAbs(path) {
+			return path
+		}
+		return filepath.Join(dir, path)
+	}
+
+	index := &tenantIndex{hosts: make(map[string]*tenant)}
+	scanner := bufio.NewScanner(bytes.NewReader(data))
+	for number := 1; scanner.Scan(); number++ {
+		fields := strings.Fields(scanner.Text())
+		for i, field := range fields {
+			if strings.HasPrefix(field, "#") {
+				fields = fields[:i]
+				break
+			}
+		}
+		if len(fields) == 0 {
+			continue
+		}
+		if len(fields) != 4 {
+			return nil, fmt.Errorf("line %d: expected <hostnames> <cert> <key> <client-ca>", number)
+		}
+
+		names := strings.ToLower(fields[0])
+		key := [4]string{names, resolve(fields[1]), resolve(fields[2]), resolve(fields[3])}
+		t, ok := reuse[key]
+		if !ok {
+			t = &tenant{names: key[0], certFile: key[1], keyFile: key[2], caFile: key[3]}
+		}
+		if (fields[1] == tenantACME) != (fields[2] == tenantACME) || fields[3] == tenantACME {
+			return nil, fmt.Errorf("line %d: use acme for both the cert and the key, and not for the client CA", number)
+		}
+
+		for _, host := range strings.Split(names, ",") {
+			host = strings.TrimSuffix(host, ".")
+			wildcard := strings.HasPrefix(host, "*.")
+			if host == "" || strings.Contains(strings.TrimPrefix(host, "*."), "*") {
+				return nil, fmt.Errorf("line %d: invalid hostname %q", number, host)
+			}
+			if wildcard && t.acme() {
+				return nil, fmt.Errorf("line %d: ACME certificates need an exact hostname, not %q", number, host)
+			}
+			if _, dup := index.hosts[host]; dup {
+				return nil, fmt.Errorf("line %d: duplicate hostname %q", number, host)
+			}
+			index.hosts[host] = t
+		}
+		index.tenants = append(index.tenants, t)
+	}
+	return index, scanner.Err()
+}
+
+// lookup returns the tenant for an SNI hostname: an exact match, else the
+// wildcard for its parent domain, else nil.
+func (x *tenantIndex) lookup(serverName string) *tenant {
+	if serverName == "" {
+		return nil
+	}
+	host := strings.ToLower(strings.TrimSuffix(serverName, "."))
+	if t, ok := x.hosts[host]; ok {
+		return t
+	}
+	if i := strings.IndexByte(host, '.'); i > 0 {
+		return x.hosts["*"+host[i:]]
+	}
+	return nil
+}
+
+// Tenants maps SNI hostnames to their own server certificate and client CA
+// bundle, loaded from a file that can be replaced while the server is
+// running. Only the file is read up front; each tenant's certificate and CA
+// bundle are loaded on its first handshake and cached until they change.
+type Tenants struct {
+	path  string
+	index atomic.Pointer[tenantIndex]
+
+	mu       sync.Mutex
+	modTime  time.Time
+	size     int64
+	onChange []func()
+}
+
+// LoadTenants reads the tenant file at path.
+func LoadTenants(path string) (*Tenants, error) {
+	t := &Tenants{path: path}
+	if err := t.Reload(); err != nil {
+		return nil, err
+	}
+	return t, nil
+}
+
+// Len returns the number of tenants in the file.
+func (t *Tenants) Len() int {
+	return len(t.index.Load().tenants)
+}
+
+// Loaded returns the number of tenants whose certificate and CA bundle have
+// been loaded.
+func (t *Tenants) Loaded() int {
+	n := 0
+	for _, tenant := range t.index.Load().tenants {
+		if tenant.loaded.Load() != nil {
+			n++
+		}
+	}
+	return n
+}
+
+// Reload re-reads the tenant file unconditionally and starts over with no
+// tenant loaded, so the next handshake for each reads its files again. On
+// error the current tenants are kept.
+func (t *Tenants) Reload() error {
+	t.mu.Lock()
+	defer t.mu.Unlock()
+	if err := t.reloadLocked(nil); err != nil {
+		return err
+	}
+	t.changedLocked()
+	return nil
+}
+
+// ReloadIfChanged reloads the tenant file if its modification time or size
+// changed, and unloads tenants whose certificate, key or CA file changed.
+// Unchanged tenants keep their loaded configs. It reports whether anything
+// changed.
+func (t *Tenants) ReloadIfChanged() (bool, error) {
+	t.mu.Lock()
+	defer t.mu.Unlock()
+
+	changed := false
+	for _, tenant := range t.index.Load().tenants {
+		if tenant.stale() {
+			tenant.loaded.Store(nil)
+			changed = true
+		}
+	}
+
+	info, err := os.Stat(t.path)
+	if err == nil && !(info.ModTime().Equal(t.modTime) && info.Size() == t.size) {
+		if err = t.reloadLocked(t.index.Load()); err == nil {
+			changed = true
+		}
+	}
+	if changed {
+		t.changedLocked()
+	}
+	return changed, err
+}
+
+func (t *Tenants) reloadLocked(previous *tenantIndex) error {
+	info, err := os.Stat(t.path)
+	if err != nil {
+		return err
+	}
+	data, err := os.ReadFile(t.path)
+	if err != nil {
+		return err
+	}
+	index, err := parseTenants(data, filepath.Dir(t.path), previous)
+	if err != nil {
+		return fmt.Errorf("%s: %w", t.path, err)
+	}
+	t.index.Store(index)
+	t.modTime, t.size = info.ModTime(), info.Size()
+	return nil
+}
+
+func (t *Tenants) changedLocked() {
+	for _, fn := range t.onChange {
+		fn()
+	}
+}
+
+// notify registers fn to be called after tenants were reloaded or unloaded.
+func (t *Tenants) notify(fn func()) {
+	t.mu.Lock()
+	defer t.mu.Unlock()
+	t.onChange = append(t.onChange, fn)
+}
+
+// Watch checks the tenant file and the files of loaded tenants every
+// interval, until ctx is cancelled.
+func (t *Tenants) Watch(ctx context.Context, interval time.Duration) {
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+
+	for {
+		select {
+		case <-ctx.Done():
+			return
+		case <-ticker.C:
+			changed, err := t.ReloadIfChanged()
+			if err != nil {
+				log.Printf("Could not reload tenants %s, keeping current tenants: %v", t.path, err)
+			} else if changed {
+				log.Printf("Reloaded tenants from %s: %d configured, %d loaded", t.path, t.Len(), t.Loaded())
+			}
+		}
+	}
+}
+
+// serve makes tlsConfig pick a tenant's config by SNI. Hostnames without a
+// tenant fall through to tlsConfig's own GetConfigForClient, if any.
+// Cached responses, which embed the verification result, are dropped
+// whenever tenants change.
+func (t *Tenants) serve(tlsConfig *tls.Config, cache *responseCache) {
+	base := tlsConfig.Clone()
+	fallback := tlsConfig.GetConfigForClient
+	t.notify(cache.purge)
+
+	tlsConfig.GetConfigForClient = func(hello *tls.ClientHelloInfo) (*tls.Config, error) {
+		if tenant := t.index.Load().lookup(hello.ServerName); tenant != nil {
+			return tenant.configFor(base)
+		}
+		if fallback != nil {
+			return fallback(hello)
+		}
+		return nil, nil
+	}
+}
+
+// acmeHosts returns the hostnames of tenants that take their certificate
+// from ACME.
+func (t *Tenants) acmeHosts() []string {
+	var hosts []string
+	for host, tenant := range t.index.Load().hosts {
+		if tenant.acme() {
+			hosts = append(hosts, host)
+		}
+	}
+	sort.Strings(hosts)
+	return hosts
+}
+
+// hostPolicy extends an ACME host policy to the hostnames of tenants that
+// take their certificate from ACME.
+func (t *Tenants) hostPolicy(fallback autocert.HostPolicy) autocert.HostPolicy {
+	return func(ctx context.Context, host string) error {
+		if tenant := t.index.Load().lookup(host); tenant != nil && tenant.acme() {
+			return nil
+		}
+		return fallback(ctx, host)
+	}
+}
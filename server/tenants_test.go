@@ -0,0 +1,188 @@
+package server
+
+import (
+	"crypto/ecdsa"
+	"crypto/elliptic"
+	"crypto/rand"
+	"crypto/tls"
+	"crypto/x509"
+	"crypto/x509/pkix"
+	"encoding/pem"
+	"math/big"
+	"os"
+	"path/filepath"
+	"strings"
+	"testing"
+	"time"
+)
+
+// writeTenant writes a self-signed server certificate, its key and a client
+// CA for host into dir.
+func writeTenant(t *testing.T, dir, host string) {
+	t.Helper()
+	key, err := ecdsa.GenerateKey(elliptic.P256(), rand.Reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	template := &x509.Certificate{
+		SerialNumber: big.NewInt(2),
+		Subject:      pkix.Name{CommonName: host},
+		DNSNames:     []string{host},
+		NotBefore:    testDate,
+		NotAfter:     testDate.Add(time.Hour * 24),
+	}
+	der, err := x509.CreateCertificate(rand.Reader, template, template, &key.PublicKey, key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	keyDER, err := x509.MarshalPKCS8PrivateKey(key)
+	if err != nil {
+		t.Fatal(err)
+	}
+	name := strings.ReplaceAll(host, "*", "wildcard")
+	writeCA(t, filepath.Join(dir, name+"-cert.pem"), pem.EncodeToMemory(&pem.Block{Type: "CERTIFICATE", Bytes: der}), testDate)
+	writeCA(t, filepath.Join(dir, name+"-key.pem"), pem.EncodeToMemory(&pem.Block{Type: "PRIVATE KEY", Bytes: keyDER}), testDate)
+	writeCA(t, filepath.Join(dir, name+"-ca.pem"), testCAPEM(t, host+" CA"), testDate)
+}
+
+func Test_tenantLookup(t *testing.T) {
+	index, err := parseTenants([]byte(`# hostnames   cert  key  client CA
+nietst.uk,mtls.nietst.uk  a.pem  a.key  a-ca.pem
+*.nietst.uk               b.pem  b.key  /etc/b-ca.pem  # every other subdomain
+shop.example              acme   acme   c-ca.pem
+`), "/srv/tenants", nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(index.tenants) != 3 {
+		t.Fatalf("expected 3 tenants, got %d", len(index.tenants))
+	}
+
+	tests := []struct {
+		serverName string
+		certFile   string
+	}{
+		{"nietst.uk", "/srv/tenants/a.pem"},
+		{"MTLS.nietst.uk.", "/srv/tenants/a.pem"},
+		{"api.nietst.uk", "/srv/tenants/b.pem"},
+		{"a.b.nietst.uk", ""},
+		{"shop.example", "acme"},
+		{"other.example", ""},
+		{"", ""},
+	}
+	for _, tt := range tests {
+		t.Run(tt.serverName, func(t *testing.T) {
+			got := index.lookup(tt.serverName)
+			if got == nil && tt.certFile != "" || got != nil && got.certFile != tt.certFile {
+				t.Errorf("expected %q, got %+v", tt.certFile, got)
+			}
+		})
+	}
+	if ca := index.lookup("api.nietst.uk").caFile; ca != "/etc/b-ca.pem" {
+		t.Errorf("expected absolute paths to be kept, got %s", ca)
+	}
+}
+
+func Test_parseTenantsErrors(t *testing.T) {
+	for _, text := range []string{
+		"nietst.uk a.pem a.key",
+		"nietst.uk a.pem a.key ca.pem\nnietst.uk b.pem b.key ca.pem",
+		"*.*.nietst.uk a.pem a.key ca.pem",
+		"*.nietst.uk acme acme ca.pem",
+		"nietst.uk acme a.key ca.pem",
+	} {
+		if _, err := parseTenants([]byte(text), ".", nil); err == nil {
+			t.Errorf("expected an error for %q", text)
+		}
+	}
+}
+
+func Test_TenantsLazyLoadAndReload(t *testing.T) {
+	dir := t.TempDir()
+	writeTenant(t, dir, "nietst.uk")
+	writeTenant(t, dir, "*.nietst.uk")
+	path := filepath.Join(dir, "tenants.txt")
+	writeCA(t, path, []byte(`nietst.uk nietst.uk-cert.pem nietst.uk-key.pem nietst.uk-ca.pem
+*.nietst.uk wildcard.nietst.uk-cert.pem wildcard.nietst.uk-key.pem wildcard.nietst.uk-ca.pem
+`), testDate)
+
+	tenants, err := LoadTenants(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if tenants.Len() != 2 || tenants.Loaded() != 0 {
+		t.Fatalf("expected 2 tenants and none loaded, got %d/%d", tenants.Len(), tenants.Loaded())
+	}
+
+	cache := newResponseCache(8)
+	fallback := &tls.Config{ClientAuth: tls.VerifyClientCertIfGiven}
+	tlsConfig := &tls.Config{ClientAuth: tls.VerifyClientCertIfGiven}
+	tlsConfig.GetConfigForClient = func(*tls.ClientHelloInfo) (*tls.Config, error) { return fallback, nil }
+	tenants.serve(tlsConfig, cache)
+
+	apex, err := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{ServerName: "nietst.uk"})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if apex == fallback || len(apex.Certificates) != 1 || apex.ClientCAs == nil || apex.GetConfigForClient != nil {
+		t.Fatalf("expected the tenant's own config")
+	}
+	if apex.ClientAuth != tls.VerifyClientCertIfGiven {
+		t.Errorf("expected the tenant config to keep the base client auth")
+	}
+	if tenants.Loaded() != 1 {
+		t.Errorf("expected only the requested tenant to be loaded, got %d", tenants.Loaded())
+	}
+	if again, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{ServerName: "nietst.uk"}); again != apex {
+		t.Errorf("expected the loaded config to be reused")
+	}
+	sub, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{ServerName: "api.nietst.uk"})
+	if sub == apex || sub.ClientCAs.Equal(apex.ClientCAs) {
+		t.Errorf("expected the wildcard tenant to have its own client CA")
+	}
+	if other, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{ServerName: "example.com"}); other != fallback {
+		t.Errorf("expected unknown hostnames to use the fallback config")
+	}
+
+	// A changed CA bundle unloads only its tenant and purges the cache
+	if _, err := cache.get(cacheKey{}, func() (renderedResponse, error) { return renderedResponse{}, nil }); err != nil {
+		t.Fatal(err)
+	}
+	writeCA(t, filepath.Join(dir, "nietst.uk-ca.pem"), testCAPEM(t, "New CA"), testDate.Add(time.Hour))
+	if changed, err := tenants.ReloadIfChanged(); !changed || err != nil {
+		t.Fatalf("expected a change, got %v %v", changed, err)
+	}
+	if tenants.Loaded() != 1 || cache.stats().Entries != 0 {
+		t.Errorf("expected the changed tenant to be unloaded and the cache purged")
+	}
+	if reloaded, _ := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{ServerName: "nietst.uk"}); reloaded == apex {
+		t.Errorf("expected a new config after the CA changed")
+	}
+
+	// Editing the tenant file keeps the loaded configs of unchanged lines
+	f, err := os.OpenFile(path, os.O_APPEND|os.O_WRONLY, 0)
+	if err != nil {
+		t.Fatal(err)
+	}
+	f.WriteString("example.com missing.pem missing.key missing-ca.pem\n")
+	f.Close()
+	if changed, err := tenants.ReloadIfChanged(); !changed || err != nil {
+		t.Fatalf("expected a change, got %v %v", changed, err)
+	}
+	if tenants.Len() != 3 || tenants.Loaded() != 2 {
+		t.Errorf("expected 3 tenants with 2 still loaded, got %d/%d", tenants.Len(), tenants.Loaded())
+	}
+	if _, err := tlsConfig.GetConfigForClient(&tls.ClientHelloInfo{ServerName: "example.com"}); err == nil {
+		t.Errorf("expected a tenant with missing files to fail its handshakes")
+	}
+
+	// A broken tenant file keeps the current tenants
+	writeCA(t, path, []byte("nietst.uk only-a-cert.pem\n"), testDate.Add(2*time.Hour))
+	if _, err := tenants.ReloadIfChanged(); err == nil || tenants.Len() != 3 {
+		t.Errorf("expected a failed reload to keep the current tenants, got %v", err)
+	}
+
+	if err := tenants.Reload(); err == nil {
+		t.Errorf("expected an unconditional reload of a broken file to fail")
+	}
+}
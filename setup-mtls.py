@@ -3,10 +3,13 @@
 
 import os
 import json
-import requests
 import sys
 from dotenv import load_dotenv
 
+from cloudflare_api import CloudflareClient, CloudflareError
+from mtls_state import (DEFAULT_CACHE_FILE, DEFAULT_STATE_FILE, Snapshot, load_desired,
+                        lookup_tunnel_id, lookup_zone_id)
+
 # Fix encoding on Windows
 if sys.platform == 'win32':
     import io
@@ -17,53 +20,87 @@ load_dotenv()
 
 CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
 ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID', '')  # Will try to get from API if not set
-ZONE_ID = '9b9e2119bd8cf84887e5eaa68fcbe58e'
-TUNNEL_NAME = 'mTLS-Tunnel'
-TUNNEL_ID = '2050906e-5e20-4896-8313-44a8fe994a9f'
 
-BASE_URL = 'https://api.cloudflare.com/client/v4'
-HEADERS = {
-    'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-    'Content-Type': 'application/json'
-}
+# Domain and tunnel come from the desired-state file; their IDs from the
+# reconcile-mtls.py cache when it has them, otherwise from the API. Set by
+# load_state() in main().
+DESIRED = DOMAIN = TUNNEL_NAME = SNAPSHOT = None
+
+# One pooled, retrying client for every call
+client = CloudflareClient(token=CLOUDFLARE_API_TOKEN)
+
+def load_state():
+    """Read the domain and tunnel from the desired-state file, and their
+    cached IDs"""
+    global DESIRED, DOMAIN, TUNNEL_NAME, SNAPSHOT
+    try:
+        DESIRED = load_desired(os.getenv('MTLS_STATE_FILE', DEFAULT_STATE_FILE), certificates=False)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}")
+        return False
+    DOMAIN = DESIRED['domain']
+    TUNNEL_NAME = DESIRED['tunnel']['name']
+    SNAPSHOT = Snapshot.load(os.getenv('MTLS_STATE_CACHE', DEFAULT_CACHE_FILE), DOMAIN)
+    return True
 
 def get_account_id():
     """Get account ID from Cloudflare API"""
+    if ACCOUNT_ID or SNAPSHOT.account_id:
+        return ACCOUNT_ID or SNAPSHOT.account_id
     print("[*] Getting account ID...")
-    resp = requests.get(f'{BASE_URL}/accounts', headers=HEADERS)
-    if resp.status_code != 200:
-        print(f"[!] Failed to get account ID: {resp.text}")
+    try:
+        accounts = client.get('accounts')
+    except CloudflareError as e:
+        print(f"[!] Failed to get account ID: {e}")
         return None
-    accounts = resp.json()['result']
     if accounts:
         account_id = accounts[0]['id']
         print(f"[✓] Account ID: {account_id}")
         return account_id
     return None
 
-def get_tunnel_token(account_id):
-    """Get tunnel token from Cloudflare"""
-    print(f"[*] Getting tunnel token for {TUNNEL_ID}...")
-    resp = requests.get(
-        f'{BASE_URL}/accounts/{account_id}/cfd_tunnel/{TUNNEL_ID}/token',
-        headers=HEADERS
-    )
-    if resp.status_code != 200:
-        print(f"[!] Failed to get tunnel token: {resp.text}")
+def fetch(path, params=None):
+    """GET path, returning the CloudflareError instead of raising it so
+    concurrent lookups can be reported in order afterwards"""
+    try:
+        return client.get(path, params=params)
+    except CloudflareError as e:
+        return e
+
+def get_zone_id():
+    """Zone ID of DOMAIN, from the cache if possible"""
+    return SNAPSHOT.zone_id or lookup_zone_id(client, DOMAIN)
+
+def get_tunnel_id(account_id):
+    """ID of TUNNEL_NAME: pinned in the state file, cached, or looked up"""
+    tunnel_id = DESIRED['tunnel'].get('id') or SNAPSHOT.tunnel_id(TUNNEL_NAME)
+    if tunnel_id:
+        return tunnel_id
+    print(f"[*] Looking up tunnel {TUNNEL_NAME}...")
+    try:
+        return lookup_tunnel_id(client, account_id, TUNNEL_NAME)
+    except CloudflareError as e:
+        print(f"[!] Tunnel not found: {e}")
+        return None
+
+def get_tunnel_token(token, tunnel_id):
+    """Report the tunnel token fetched from Cloudflare"""
+    print(f"[*] Getting tunnel token for {tunnel_id}...")
+    if isinstance(token, CloudflareError):
+        print(f"[!] Failed to get tunnel token: {token}")
         return None
 
-    token = resp.json()['result']
     print(f"[✓] Got tunnel token: {token[:20]}...")
     return token
 
-def create_credentials_file(account_id, token):
+def create_credentials_file(account_id, token, tunnel_id):
     """Create Cloudflare tunnel credentials file"""
     print("[*] Creating credentials file...")
 
     credentials = {
         "AccountTag": account_id,
         "TunnelSecret": token,
-        "TunnelID": TUNNEL_ID,
+        "TunnelID": tunnel_id,
         "TunnelName": TUNNEL_NAME
     }
 
@@ -74,41 +111,36 @@ def create_credentials_file(account_id, token):
     print(f"[✓] Created {credentials_path}")
     return credentials_path
 
-def verify_tunnel(account_id):
-    """Verify tunnel exists and get details"""
-    print(f"[*] Verifying tunnel {TUNNEL_ID}...")
-    resp = requests.get(
-        f'{BASE_URL}/accounts/{account_id}/cfd_tunnel/{TUNNEL_ID}',
-        headers=HEADERS
-    )
-    if resp.status_code == 200:
-        tunnel = resp.json()['result']
-        print(f"[✓] Tunnel exists: {tunnel['name']}")
-        print(f"    - ID: {tunnel['id']}")
-        print(f"    - Created: {tunnel['created_at']}")
-        return True
-    else:
-        print(f"[!] Tunnel not found: {resp.text}")
+def verify_tunnel(tunnel, tunnel_id):
+    """Verify tunnel exists and report its details"""
+    print(f"[*] Verifying tunnel {tunnel_id}...")
+    if isinstance(tunnel, CloudflareError):
+        print(f"[!] Tunnel not found: {tunnel}")
         return False
 
-def check_dns_records(zone_id):
-    """Check DNS records for the domain"""
+    print(f"[✓] Tunnel exists: {tunnel['name']}")
+    print(f"    - ID: {tunnel['id']}")
+    print(f"    - Created: {tunnel['created_at']}")
+    return True
+
+def fetch_dns_records():
+    """Fetch every page of DNS records for the domain"""
+    try:
+        return client.list(f'zones/{get_zone_id()}/dns_records', params={'name': DOMAIN})
+    except CloudflareError as e:
+        return e
+
+def check_dns_records(records):
+    """Report the DNS records for the domain"""
     print("[*] Checking DNS records...")
-    resp = requests.get(
-        f'{BASE_URL}/zones/{zone_id}/dns_records',
-        headers=HEADERS,
-        params={'name': 'nietst.uk'}
-    )
-    if resp.status_code == 200:
-        records = resp.json()['result']
-        if records:
-            print(f"[✓] Found {len(records)} DNS record(s):")
-            for record in records:
-                print(f"    - {record['type']} {record['name']} -> {record['content']}")
-        else:
-            print("[!] No DNS records found for nietst.uk")
+    if isinstance(records, CloudflareError):
+        print(f"[!] Failed to get DNS records: {records}")
+    elif records:
+        print(f"[✓] Found {len(records)} DNS record(s):")
+        for record in records:
+            print(f"    - {record['type']} {record['name']} -> {record['content']}")
     else:
-        print(f"[!] Failed to get DNS records: {resp.text}")
+        print(f"[!] No DNS records found for {DOMAIN}")
 
 def main():
     print("=" * 60)
@@ -118,26 +150,42 @@ def main():
     if not CLOUDFLARE_API_TOKEN:
         print("[!] CLOUDFLARE_API_TOKEN not found in .env file")
         sys.exit(1)
+    if not load_state():
+        sys.exit(1)
 
-    # Step 1: Get account ID
-    account_id = get_account_id()
+    # Step 1: Get account ID, fetching the DNS records (which only need the
+    # zone) at the same time
+    first = client.fan_out({
+        'account_id': get_account_id,
+        'dns_records': fetch_dns_records,
+    })
+    account_id = first['account_id']
     if not account_id:
         sys.exit(1)
+    tunnel_id = get_tunnel_id(account_id)
+    if not tunnel_id:
+        sys.exit(1)
+
+    # Steps 2 and 3 both only need the account: fetch them concurrently
+    second = client.fan_out({
+        'tunnel': lambda: fetch(f'accounts/{account_id}/cfd_tunnel/{tunnel_id}'),
+        'token': lambda: fetch(f'accounts/{account_id}/cfd_tunnel/{tunnel_id}/token'),
+    })
 
     # Step 2: Verify tunnel exists
-    if not verify_tunnel(account_id):
+    if not verify_tunnel(second['tunnel'], tunnel_id):
         sys.exit(1)
 
     # Step 3: Get tunnel token
-    token = get_tunnel_token(account_id)
+    token = get_tunnel_token(second['token'], tunnel_id)
     if not token:
         sys.exit(1)
 
     # Step 4: Create credentials file
-    creds_path = create_credentials_file(account_id, token)
+    creds_path = create_credentials_file(account_id, token, tunnel_id)
 
     # Step 5: Check DNS records
-    check_dns_records(ZONE_ID)
+    check_dns_records(first['dns_records'])
 
     print("\n" + "=" * 60)
     print("✓ Configuration complete!")
@@ -0,0 +1,184 @@
+use aws_lc_rs::digest::{digest, SHA256};
+use std::fmt::Write as _;
+use std::fs::OpenOptions;
+use std::io::{self, BufWriter, Write};
+use std::sync::atomic::Ordering;
+use std::sync::mpsc::{sync_channel, Receiver, SyncSender, TrySendError};
+use std::sync::OnceLock;
+use std::thread;
+use std::time::{Duration, SystemTime, UNIX_EPOCH};
+
+use crate::metrics::metrics;
+
+/// Records buffered between request threads and the writer thread; when the
+/// writer falls behind, new records are dropped rather than blocking a worker
+const QUEUE_DEPTH: usize = 16384;
+/// Write buffer of the log file; a burst of records goes out in one write
+const WRITE_BUFFER: usize = 256 * 1024;
+
+static ACCESS_LOG: OnceLock<SyncSender<String>> = OnceLock::new();
+
+/// Per-connection details for the access log, computed once in on_connect
+/// and stored in the connection extensions
+#[derive(Debug, Clone, Default)]
+pub struct ConnectionInfo {
+    /// The handshake resumed an earlier session
+    pub resumed: bool,
+    /// Lower-case hex SHA-256 of the client's leaf certificate DER
+    pub fingerprint: Option<String>,
+    pub subject_cn: Option<String>,
+}
+
+/// One request, written as a JSON line:
+///
+/// {"ts":1767225600.123456,"method":"GET","route":"/api/certs","status":200,
+///  "latency_us":87,"bytes":412,"resumed":true,"fingerprint":"9f86...","cn":"client"}
+///
+/// fingerprint and cn are null for connections without a client
+/// certificate. analyze-access-log.py reads the same format from the Go
+/// server.
+pub struct AccessRecord<'a> {
+    pub method: &'a str,
+    pub route: &'a str,
+    pub status: u16,
+    pub latency: Duration,
+    pub bytes: u64,
+    pub connection: Option<&'a ConnectionInfo>,
+}
+
+impl AccessRecord<'_> {
+    pub fn to_line(&self, timestamp: SystemTime) -> String {
+        let ts = timestamp.duration_since(UNIX_EPOCH).unwrap_or_default();
+        let mut line = String::with_capacity(256);
+        let _ = write!(line, "{{\"ts\":{}.{:06},\"method\":", ts.as_secs(), ts.subsec_micros());
+        push_json_str(&mut line, self.method);
+        line.push_str(",\"route\":");
+        push_json_str(&mut line, self.route);
+        let _ = write!(line, ",\"status\":{},\"latency_us\":{},\"bytes\":{},\"resumed\":{},\"fingerprint\":",
+                       self.status, self.latency.as_micros(), self.bytes,
+                       self.connection.map_or(false, |c| c.resumed));
+        push_json_opt(&mut line, self.connection.and_then(|c| c.fingerprint.as_deref()));
+        line.push_str(",\"cn\":");
+        push_json_opt(&mut line, self.connection.and_then(|c| c.subject_cn.as_deref()));
+        line.push_str("}\n");
+        line
+    }
+}
+
+/// Lower-case hex SHA-256 of a certificate's DER, the fingerprint written to
+/// the access log (`openssl x509 -noout -fingerprint -sha256` without colons)
+pub fn fingerprint(der: &[u8]) -> String {
+    let mut hex = String::with_capacity(64);
+    for byte in digest(&SHA256, der).as_ref() {
+        let _ = write!(hex, "{:02x}", byte);
+    }
+    hex
+}
+
+fn push_json_opt(out: &mut String, value: Option<&str>) {
+    match value {
+        Some(value) => push_json_str(out, value),
+        None => out.push_str("null"),
+    }
+}
+
+/// Append `value` as a JSON string literal
+fn push_json_str(out: &mut String, value: &str) {
+    out.push('"');
+    for c in value.chars() {
+        match c {
+            '"' => out.push_str("\\\""),
+            '\\' => out.push_str("\\\\"),
+            '\n' => out.push_str("\\n"),
+            '\r' => out.push_str("\\r"),
+            '\t' => out.push_str("\\t"),
+            c if c < ' ' => {
+                let _ = write!(out, "\\u{:04x}", c as u32);
+            }
+            c => out.push(c),
+        }
+    }
+    out.push('"');
+}
+
+/// Whether init() has started the access log
+pub fn enabled() -> bool {
+    ACCESS_LOG.get().is_some()
+}
+
+/// Queue a record for the writer thread; a no-op when the access log is off
+pub fn record(record: &AccessRecord<'_>) {
+    let Some(tx) = ACCESS_LOG.get() else { return };
+    if let Err(TrySendError::Full(_)) = tx.try_send(record.to_line(SystemTime::now())) {
+        metrics().access_log_dropped.fetch_add(1, Ordering::Relaxed);
+    }
+}
+
+fn write_records(rx: Receiver<String>, out: Box<dyn Write + Send>) {
+    let mut out = BufWriter::with_capacity(WRITE_BUFFER, out);
+    while let Ok(line) = rx.recv() {
+        let _ = out.write_all(line.as_bytes());
+        // Batch whatever else is already queued into the same flush
+        while let Ok(line) = rx.try_recv() {
+            let _ = out.write_all(line.as_bytes());
+        }
+        if let Err(e) = out.flush() {
+            log::warn!("Access log write failed: {}", e);
+        }
+    }
+}
+
+/// Start writing the access log to `path` (appended to; "-" for stdout)
+/// from a background thread
+pub fn init(path: &str) -> io::Result<()> {
+    let out: Box<dyn Write + Send> = if path == "-" {
+        Box::new(io::stdout())
+    } else {
+        Box::new(OpenOptions::new().create(true).append(true).open(path)?)
+    };
+    let (tx, rx) = sync_channel(QUEUE_DEPTH);
+    thread::Builder::new()
+        .name("access-log".to_string())
+        .spawn(move || write_records(rx, out))?;
+    ACCESS_LOG
+        .set(tx)
+        .map_err(|_| io::Error::new(io::ErrorKind::AlreadyExists, "access log already initialized"))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_record_line() {
+        let connection = ConnectionInfo {
+            resumed: true,
+            fingerprint: Some("ab".repeat(32)),
+            subject_cn: Some("client \"one\"".to_string()),
+        };
+        let record = AccessRecord {
+            method: "GET",
+            route: "/api/certs",
+            status: 200,
+            latency: Duration::from_micros(1234),
+            bytes: 412,
+            connection: Some(&connection),
+        };
+        let line = record.to_line(UNIX_EPOCH + Duration::from_micros(1_767_225_600_000_042));
+        assert_eq!(line, format!(
+            "{{\"ts\":1767225600.000042,\"method\":\"GET\",\"route\":\"/api/certs\",\"status\":200,\
+             \"latency_us\":1234,\"bytes\":412,\"resumed\":true,\"fingerprint\":\"{}\",\
+             \"cn\":\"client \\\"one\\\"\"}}\n",
+            "ab".repeat(32)));
+
+        let anonymous = AccessRecord { connection: None, route: "/x\n", ..record };
+        let line = anonymous.to_line(UNIX_EPOCH);
+        assert!(line.contains("\"route\":\"/x\\n\""));
+        assert!(line.ends_with("\"resumed\":false,\"fingerprint\":null,\"cn\":null}\n"));
+    }
+
+    #[test]
+    fn test_fingerprint() {
+        assert_eq!(fingerprint(b"abc"), "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad");
+    }
+}
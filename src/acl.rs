@@ -0,0 +1,315 @@
+use aws_lc_rs::digest::{digest, SHA256};
+use std::collections::HashMap;
+use std::fs;
+use std::path::Path;
+use std::sync::{Arc, RwLock};
+
+use crate::metrics::ROUTES;
+use crate::revocation::der_element;
+
+pub type Fingerprint = [u8; 32];
+
+/// Allowed routes as a bit per entry in metrics::ROUTES plus a last bit for
+/// every other path, so a route check is a single AND
+type RouteMask = u32;
+const ALL_ROUTES: RouteMask = (1 << (ROUTES.len() + 1)) - 1;
+
+/// The verified client certificate of a connection, hashed once in
+/// on_connect and stored in the connection extensions when an ACL is loaded
+#[derive(Debug, Clone)]
+pub struct ClientIdentity {
+    /// SHA-256 of the leaf certificate DER
+    pub cert_sha256: Fingerprint,
+    /// SHA-256 of the leaf's SubjectPublicKeyInfo DER; stays the same when a
+    /// certificate is re-issued for the same key
+    pub spki_sha256: Option<Fingerprint>,
+    pub subject_cn: Option<String>,
+}
+
+impl ClientIdentity {
+    pub fn new(leaf_der: &[u8], subject_cn: Option<String>) -> Self {
+        Self {
+            cert_sha256: sha256(leaf_der),
+            spki_sha256: subject_public_key_info(leaf_der).map(sha256),
+            subject_cn,
+        }
+    }
+}
+
+pub(crate) fn sha256(data: &[u8]) -> Fingerprint {
+    let mut out = [0u8; 32];
+    out.copy_from_slice(digest(&SHA256, data).as_ref());
+    out
+}
+
+/// Raw SubjectPublicKeyInfo of a DER certificate, found by walking the
+/// TBSCertificate fields that precede it
+fn subject_public_key_info(der: &[u8]) -> Option<&[u8]> {
+    let (cert, _) = der_element(der, 0x30)?;
+    let (tbs, _) = der_element(cert.1, 0x30)?;
+    let mut rest = tbs.1;
+    if rest.first() == Some(&0xa0) {
+        rest = der_element(rest, 0xa0)?.1;
+    }
+    // serial, signature algorithm, issuer, validity, subject
+    let (_, rest) = der_element(rest, 0x02)?;
+    let (_, rest) = der_element(rest, 0x30)?;
+    let (_, rest) = der_element(rest, 0x30)?;
+    let (_, rest) = der_element(rest, 0x30)?;
+    let (_, rest) = der_element(rest, 0x30)?;
+    let (spki, _) = der_element(rest, 0x30)?;
+    Some(spki.0)
+}
+
+/// A compiled ACL file. The text format, written by certgen/build-acl.py
+/// and shared with the Go server, has one rule per line:
+///
+/// ```text
+/// public <route>...            open to every client, with or without a certificate
+/// spki <sha256 hex> <route>... leaf SubjectPublicKeyInfo fingerprint
+/// cert <sha256 hex> <route>... leaf certificate fingerprint
+/// cn <pattern> <route>...      subject CN, exact or with * wildcards, %-encoded
+/// ```
+///
+/// A route is an exact path, a prefix ending in `*`, or `*` for every path;
+/// paths this server does not serve are ignored. `#` starts a comment.
+/// Fingerprint rules for the same client are merged; CN rules only apply
+/// to clients without a fingerprint rule, exact CNs before patterns and
+/// patterns in file order.
+#[derive(Debug, Default)]
+pub struct AclIndex {
+    fingerprints: HashMap<Fingerprint, RouteMask>,
+    cns: HashMap<String, RouteMask>,
+    cn_patterns: Vec<(String, RouteMask)>,
+    public: RouteMask,
+}
+
+impl AclIndex {
+    pub fn load(path: &Path) -> Result<Self, Box<dyn std::error::Error>> {
+        let text = fs::read_to_string(path)?;
+        Self::parse(&text).map_err(|e| format!("{}: {}", path.display(), e).into())
+    }
+
+    pub fn parse(text: &str) -> Result<Self, String> {
+        let mut index = AclIndex::default();
+        for (number, line) in text.lines().enumerate() {
+            let mut fields = line.split_whitespace().take_while(|f| !f.starts_with('#'));
+            let Some(kind) = fields.next() else { continue };
+            let error = |msg: &str| format!("line {}: {}", number + 1, msg);
+            match kind {
+                "public" => index.public |= route_mask(fields),
+                "spki" | "cert" => {
+                    let fingerprint = fields
+                        .next()
+                        .and_then(parse_fingerprint)
+                        .ok_or_else(|| error("expected a 64 hex digit SHA-256 fingerprint"))?;
+                    *index.fingerprints.entry(fingerprint).or_default() |= route_mask(fields);
+                }
+                "cn" => {
+                    let pattern = fields
+                        .next()
+                        .map(percent_decode)
+                        .ok_or_else(|| error("expected a CN pattern"))?
+                        .ok_or_else(|| error("invalid %-escape in CN pattern"))?;
+                    let mask = route_mask(fields);
+                    if pattern.contains('*') {
+                        index.cn_patterns.push((pattern, mask));
+                    } else {
+                        *index.cns.entry(pattern).or_default() |= mask;
+                    }
+                }
+                other => return Err(error(&format!("unknown rule {:?}", other))),
+            }
+        }
+        Ok(index)
+    }
+
+    /// Number of fingerprint and CN rules
+    pub fn len(&self) -> usize {
+        self.fingerprints.len() + self.cns.len() + self.cn_patterns.len()
+    }
+
+    fn grant(&self, identity: &ClientIdentity) -> Option<RouteMask> {
+        let by_cert = self.fingerprints.get(&identity.cert_sha256);
+        let by_spki = identity.spki_sha256.and_then(|spki| self.fingerprints.get(&spki));
+        if by_cert.is_some() || by_spki.is_some() {
+            return Some(by_cert.copied().unwrap_or(0) | by_spki.copied().unwrap_or(0));
+        }
+        let cn = identity.subject_cn.as_deref()?;
+        self.cns.get(cn).copied().or_else(|| {
+            self.cn_patterns
+                .iter()
+                .find(|(pattern, _)| glob_match(pattern, cn))
+                .map(|&(_, mask)| mask)
+        })
+    }
+
+    pub fn check(&self, identity: Option<&ClientIdentity>, route_index: usize) -> AclDecision {
+        let bit = 1 << route_index.min(ROUTES.len());
+        if self.public & bit != 0 {
+            return AclDecision::Allow;
+        }
+        match identity {
+            None => AclDecision::Unauthenticated,
+            Some(identity) if self.grant(identity).unwrap_or(0) & bit != 0 => AclDecision::Allow,
+            Some(_) => AclDecision::Forbidden,
+        }
+    }
+}
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum AclDecision {
+    Allow,
+    /// No verified client certificate on a route that needs one
+    Unauthenticated,
+    /// The client certificate is not granted the route
+    Forbidden,
+}
+
+fn route_mask<'a>(routes: impl Iterator<Item = &'a str>) -> RouteMask {
+    routes.fold(0, |mask, route| {
+        mask | match route {
+            "*" => ALL_ROUTES,
+            prefix if prefix.ends_with('*') => {
+                let prefix = &prefix[..prefix.len() - 1];
+                ROUTES
+                    .iter()
+                    .enumerate()
+                    .filter(|(_, r)| r.starts_with(prefix))
+                    .fold(0, |m, (i, _)| m | 1 << i)
+            }
+            exact => ROUTES.iter().position(|&r| r == exact).map_or(0, |i| 1 << i),
+        }
+    })
+}
+
+fn parse_fingerprint(hex: &str) -> Option<Fingerprint> {
+    if hex.len() != 64 {
+        return None;
+    }
+    let mut out = [0u8; 32];
+    for (i, byte) in out.iter_mut().enumerate() {
+        *byte = u8::from_str_radix(hex.get(i * 2..i * 2 + 2)?, 16).ok()?;
+    }
+    Some(out)
+}
+
+fn percent_decode(s: &str) -> Option<String> {
+    let mut out = Vec::with_capacity(s.len());
+    let mut bytes = s.bytes();
+    while let Some(b) = bytes.next() {
+        if b == b'%' {
+            let hex = [bytes.next()?, bytes.next()?];
+            out.push(u8::from_str_radix(std::str::from_utf8(&hex).ok()?, 16).ok()?);
+        } else {
+            out.push(b);
+        }
+    }
+    String::from_utf8(out).ok()
+}
+
+/// Match `text` against `pattern`, where `*` matches any run of characters
+fn glob_match(pattern: &str, text: &str) -> bool {
+    let mut parts = pattern.split('*');
+    let first = parts.next().unwrap_or("");
+    let Some(mut rest) = text.strip_prefix(first) else { return false };
+    let mut parts: Vec<&str> = parts.collect();
+    let Some(last) = parts.pop() else { return rest.is_empty() };
+    for part in parts {
+        match rest.find(part) {
+            Some(i) => rest = &rest[i + part.len()..],
+            None => return false,
+        }
+    }
+    rest.len() >= last.len() && rest.ends_with(last)
+}
+
+/// The ACL in force, swapped on reload. Without an ACL file every request
+/// is allowed, as before ACLs existed.
+#[derive(Default)]
+pub struct Acl {
+    index: RwLock<Option<Arc<AclIndex>>>,
+}
+
+impl Acl {
+    pub fn swap(&self, index: Option<AclIndex>) {
+        *self.index.write().unwrap() = index.map(Arc::new);
+    }
+
+    /// Whether an ACL is loaded, i.e. connections need a ClientIdentity
+    pub fn enabled(&self) -> bool {
+        self.index.read().unwrap().is_some()
+    }
+
+    pub fn check(&self, identity: Option<&ClientIdentity>, route_index: usize) -> AclDecision {
+        match &*self.index.read().unwrap() {
+            Some(index) => index.check(identity, route_index),
+            None => AclDecision::Allow,
+        }
+    }
+}
+
+impl std::fmt::Debug for Acl {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        let entries = self.index.read().unwrap().as_ref().map(|index| index.len());
+        f.debug_struct("Acl").field("entries", &entries).finish()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn identity(cert: u8, spki: u8, cn: &str) -> ClientIdentity {
+        ClientIdentity { cert_sha256: [cert; 32], spki_sha256: Some([spki; 32]), subject_cn: Some(cn.to_string()) }
+    }
+
+    #[test]
+    fn test_acl_rules() {
+        let acl = AclIndex::parse(&format!(
+            "# generated\n\
+             public /health\n\
+             spki {} /api/certs   # dev-1\n\
+             spki {} /metrics\n\
+             cert {} /api/*\n\
+             cn ops-* *\n\
+             cn build%20agent /metrics\n",
+            "01".repeat(32), "01".repeat(32), "02".repeat(32),
+        )).unwrap();
+        let (health, certs, metrics, other) = (0, 1, 2, 3);
+        assert_eq!(acl.len(), 4);
+
+        assert_eq!(acl.check(None, health), AclDecision::Allow);
+        assert_eq!(acl.check(None, certs), AclDecision::Unauthenticated);
+
+        // Both spki lines are merged; CN rules do not apply to known keys
+        let dev1 = identity(9, 1, "ops-1");
+        assert_eq!(acl.check(Some(&dev1), certs), AclDecision::Allow);
+        assert_eq!(acl.check(Some(&dev1), metrics), AclDecision::Allow);
+        assert_eq!(acl.check(Some(&dev1), other), AclDecision::Forbidden);
+
+        assert_eq!(acl.check(Some(&identity(2, 9, "x")), certs), AclDecision::Allow);
+        assert_eq!(acl.check(Some(&identity(2, 9, "x")), metrics), AclDecision::Forbidden);
+        assert_eq!(acl.check(Some(&identity(9, 9, "ops-7")), other), AclDecision::Allow);
+        assert_eq!(acl.check(Some(&identity(9, 9, "build agent")), metrics), AclDecision::Allow);
+        assert_eq!(acl.check(Some(&identity(9, 9, "stranger")), certs), AclDecision::Forbidden);
+    }
+
+    #[test]
+    fn test_acl_errors() {
+        assert!(AclIndex::parse("spki abc /health").unwrap_err().starts_with("line 1:"));
+        assert!(AclIndex::parse("\n\nallow x").unwrap_err().starts_with("line 3:"));
+        assert!(AclIndex::parse("cn bad%2 *").is_err());
+    }
+
+    #[test]
+    fn test_glob_match() {
+        assert!(glob_match("ops-*", "ops-1"));
+        assert!(glob_match("*-prod-*", "api-prod-3"));
+        assert!(glob_match("a*a", "aa"));
+        assert!(!glob_match("a*a", "a"));
+        assert!(!glob_match("ops-*", "dev-ops-1"));
+        assert!(glob_match("exact", "exact"));
+        assert!(!glob_match("exact", "exactly"));
+    }
+}
@@ -0,0 +1,612 @@
+use rustls::crypto::WebPkiSupportedAlgorithms;
+use rustls::pki_types::{CertificateDer, TrustAnchor, UnixTime};
+use std::collections::HashMap;
+use std::sync::atomic::Ordering;
+use std::sync::{Arc, RwLock};
+use std::time::Duration;
+
+use crate::acl::{sha256, Fingerprint};
+use crate::metrics::metrics;
+use crate::response::CertificateInfo;
+use crate::revocation::der_element;
+
+/// Longest chain built, leaf and root included
+const MAX_DEPTH: usize = 8;
+/// Chains kept per client certificate; cross-signed intermediates can give
+/// more than one
+const MAX_CHAINS: usize = 4;
+/// Memoized presented chains; the cache starts over when it is full
+const CACHE_CAPACITY: usize = 10_000;
+
+/// Issuer and subject DN, key identifiers and expiry of a certificate
+#[derive(Debug, Default, PartialEq)]
+struct Names<'a> {
+    issuer: &'a [u8],
+    subject: &'a [u8],
+    subject_key_id: Option<&'a [u8]>,
+    authority_key_id: Option<&'a [u8]>,
+    not_after: Option<UnixTime>,
+}
+
+/// Two ASCII digits at `i`
+fn two_digits(digits: &[u8], i: usize) -> Option<i64> {
+    match digits.get(i..i + 2)? {
+        [a @ b'0'..=b'9', b @ b'0'..=b'9'] => Some(i64::from(a - b'0') * 10 + i64::from(b - b'0')),
+        _ => None,
+    }
+}
+
+/// Days from 1970-01-01 to a proleptic Gregorian date
+fn days_from_civil(year: i64, month: i64, day: i64) -> i64 {
+    let year = if month <= 2 { year - 1 } else { year };
+    let era = year.div_euclid(400);
+    let year_of_era = year - era * 400;
+    let day_of_year = (153 * ((month + 9) % 12) + 2) / 5 + day - 1;
+    let day_of_era = year_of_era * 365 + year_of_era / 4 - year_of_era / 100 + day_of_year;
+    era * 146_097 + day_of_era - 719_468
+}
+
+/// A DER UTCTime or GeneralizedTime, in the `YYMMDDHHMMSSZ` and
+/// `YYYYMMDDHHMMSSZ` forms RFC 5280 requires of certificates
+fn der_time(input: &[u8]) -> Option<(UnixTime, &[u8])> {
+    let tag = *input.first()?;
+    let ((_, time), rest) = der_element(input, tag)?;
+    let (year, digits) = match tag {
+        0x17 => {
+            let year = two_digits(time, 0)?;
+            (if year < 50 { 2000 + year } else { 1900 + year }, &time[2..])
+        }
+        0x18 => (two_digits(time, 0)? * 100 + two_digits(time, 2)?, time.get(4..)?),
+        _ => return None,
+    };
+    if digits.len() != 11 || digits[10] != b'Z' {
+        return None;
+    }
+    let [month, day, hour, minute, second] = [0, 2, 4, 6, 8].map(|i| two_digits(digits, i));
+    let days = days_from_civil(year, month?, day?);
+    let secs = days * 86_400 + hour? * 3_600 + minute? * 60 + second?;
+    Some((UnixTime::since_unix_epoch(Duration::from_secs(u64::try_from(secs).ok()?)), rest))
+}
+
+/// Walk a DER certificate for the fields path building needs, without
+/// parsing the rest of it
+fn names(der: &[u8]) -> Option<Names<'_>> {
+    let (cert, _) = der_element(der, 0x30)?;
+    let (tbs, _) = der_element(cert.1, 0x30)?;
+    let mut rest = tbs.1;
+    if rest.first() == Some(&0xa0) {
+        rest = der_element(rest, 0xa0)?.1;
+    }
+    // serial, signature algorithm, issuer, validity, subject, key
+    let (_, rest) = der_element(rest, 0x02)?;
+    let (_, rest) = der_element(rest, 0x30)?;
+    let (issuer, rest) = der_element(rest, 0x30)?;
+    let (validity, rest) = der_element(rest, 0x30)?;
+    let (subject, rest) = der_element(rest, 0x30)?;
+    let (_, mut rest) = der_element(rest, 0x30)?;
+    let not_after = der_time(validity.1).and_then(|(_, rest)| der_time(rest)).map(|(time, _)| time);
+    let mut names = Names { issuer: issuer.0, subject: subject.0, not_after, ..Names::default() };
+
+    // Optional unique identifiers, then the explicit [3] extensions
+    for tag in [0x81, 0x82] {
+        if rest.first() == Some(&tag) {
+            rest = der_element(rest, tag)?.1;
+        }
+    }
+    let Some((extensions, _)) = der_element(rest, 0xa3) else {
+        return Some(names);
+    };
+    let (extensions, _) = der_element(extensions.1, 0x30)?;
+    let mut rest = extensions.1;
+    while !rest.is_empty() {
+        let (extension, next) = der_element(rest, 0x30)?;
+        rest = next;
+        let (oid, mut value) = der_element(extension.1, 0x06)?;
+        if value.first() == Some(&0x01) {
+            value = der_element(value, 0x01)?.1;
+        }
+        let (value, _) = der_element(value, 0x04)?;
+        match oid.1 {
+            // 2.5.29.14 subjectKeyIdentifier ::= OCTET STRING
+            [0x55, 0x1d, 0x0e] => names.subject_key_id = Some(der_element(value.1, 0x04)?.0 .1),
+            // 2.5.29.35 authorityKeyIdentifier ::= SEQUENCE { keyIdentifier [0] IMPLICIT OCTET STRING OPTIONAL, ... }
+            [0x55, 0x1d, 0x23] => {
+                let (aki, _) = der_element(value.1, 0x30)?;
+                names.authority_key_id = der_element(aki.1, 0x80).map(|(id, _)| id.1);
+            }
+            _ => {}
+        }
+    }
+    Some(names)
+}
+
+/// A trusted root or configured intermediate
+#[derive(Debug)]
+struct Issuer {
+    der: CertificateDer<'static>,
+    issuer: Vec<u8>,
+    subject: Vec<u8>,
+    authority_key_id: Option<Vec<u8>>,
+    /// Set for trusted roots
+    anchor: Option<TrustAnchor<'static>>,
+}
+
+/// A certificate on a path being built: one of the index's issuers or one
+/// of the certificates the client presented
+#[derive(Debug, Clone, Copy)]
+enum Node {
+    Indexed(usize),
+    Presented(usize),
+}
+
+/// The trusted roots and configured intermediates, indexed by subject DN
+/// and subject key identifier so that finding the issuers of a certificate
+/// is a hash lookup rather than a scan of every CA.
+#[derive(Debug)]
+pub struct ChainIndex {
+    issuers: Vec<Issuer>,
+    by_subject: HashMap<Vec<u8>, Vec<usize>>,
+    by_key_id: HashMap<Vec<u8>, Vec<usize>>,
+    intermediates: usize,
+    algorithms: WebPkiSupportedAlgorithms,
+}
+
+impl ChainIndex {
+    pub fn new(
+        roots: Vec<CertificateDer<'static>>,
+        intermediates: Vec<CertificateDer<'static>>,
+        algorithms: WebPkiSupportedAlgorithms,
+    ) -> Result<Self, Box<dyn std::error::Error>> {
+        let mut index = Self {
+            issuers: Vec::with_capacity(roots.len() + intermediates.len()),
+            by_subject: HashMap::new(),
+            by_key_id: HashMap::new(),
+            intermediates: intermediates.len(),
+            algorithms,
+        };
+        let certs = roots.into_iter().map(|der| (der, true))
+            .chain(intermediates.into_iter().map(|der| (der, false)));
+        for (der, is_root) in certs {
+            let names = names(&der).ok_or("Could not parse CA certificate")?;
+            let id = index.issuers.len();
+            index.by_subject.entry(names.subject.to_vec()).or_default().push(id);
+            if let Some(key_id) = names.subject_key_id {
+                index.by_key_id.entry(key_id.to_vec()).or_default().push(id);
+            }
+            let anchor = match is_root {
+                true => Some(webpki::anchor_from_trusted_cert(&der)?.to_owned()),
+                false => None,
+            };
+            let issuer = Issuer {
+                issuer: names.issuer.to_vec(),
+                subject: names.subject.to_vec(),
+                authority_key_id: names.authority_key_id.map(<[u8]>::to_vec),
+                anchor,
+                der,
+            };
+            index.issuers.push(issuer);
+        }
+        Ok(index)
+    }
+
+    pub fn len(&self) -> usize {
+        self.issuers.len()
+    }
+
+    fn der<'a>(&'a self, node: Node, presented: &'a [CertificateDer<'a>]) -> &'a CertificateDer<'a> {
+        match node {
+            Node::Indexed(id) => &self.issuers[id].der,
+            Node::Presented(i) => &presented[i],
+        }
+    }
+
+    /// Candidate issuers of the certificate with `issuer` DN and
+    /// `authority_key_id`. The presented intermediates are few and checked
+    /// directly; the index is searched by key identifier when there is one,
+    /// falling back to the DN when nothing matches it. A configured CA the
+    /// client also sent is only tried once.
+    fn issuers_of(&self, issuer: &[u8], authority_key_id: Option<&[u8]>,
+                  presented: &[CertificateDer<'_>], names: &[Option<Names<'_>>]) -> Vec<Node> {
+        let mut candidates = Vec::new();
+        for (i, names) in names.iter().enumerate().skip(1) {
+            let Some(names) = names else { continue };
+            let key_ids_match = match (authority_key_id, names.subject_key_id) {
+                (Some(aki), Some(ski)) => aki == ski,
+                _ => true,
+            };
+            if names.subject == issuer && key_ids_match {
+                candidates.push(Node::Presented(i));
+            }
+        }
+        let sent = candidates.len();
+
+        let mut indexed: Vec<usize> = authority_key_id
+            .and_then(|key_id| self.by_key_id.get(key_id))
+            .into_iter()
+            .flatten()
+            .copied()
+            .filter(|&id| self.issuers[id].subject == issuer)
+            .collect();
+        if indexed.is_empty() {
+            indexed.extend(self.by_subject.get(issuer).into_iter().flatten().copied());
+        }
+        for id in indexed {
+            let der = &self.issuers[id].der;
+            if !candidates[..sent].iter().any(|&node| self.der(node, presented) == der) {
+                candidates.push(Node::Indexed(id));
+            }
+        }
+        candidates
+    }
+
+    /// Depth-first search from the last certificate of `path` up to the
+    /// roots, collecting every path that ends at a trusted root
+    fn candidate_paths(&self, path: &mut Vec<Node>, presented: &[CertificateDer<'_>],
+                       names: &[Option<Names<'_>>], out: &mut Vec<Vec<Node>>) {
+        if out.len() >= MAX_CHAINS || path.len() >= MAX_DEPTH {
+            return;
+        }
+        let (issuer, authority_key_id) = match *path.last().expect("paths start at the leaf") {
+            Node::Indexed(id) if self.issuers[id].anchor.is_some() => {
+                out.push(path.clone());
+                return;
+            }
+            Node::Indexed(id) => (&self.issuers[id].issuer[..], self.issuers[id].authority_key_id.as_deref()),
+            Node::Presented(i) => match &names[i] {
+                Some(names) => (names.issuer, names.authority_key_id),
+                None => return,
+            },
+        };
+        for candidate in self.issuers_of(issuer, authority_key_id, presented, names) {
+            // A CA can be both configured and presented; comparing DER
+            // catches a loop through either copy
+            let der = self.der(candidate, presented);
+            if path.iter().any(|&node| self.der(node, presented) == der) {
+                continue;
+            }
+            path.push(candidate);
+            self.candidate_paths(path, presented, names, out);
+            path.pop();
+        }
+    }
+
+    /// Configured intermediates on a path from the presented leaf to a
+    /// root, for the handshake verifier to use along with the ones the
+    /// client sent. Not verified here; that is the verifier's job.
+    pub fn configured_intermediates(&self, presented: &[CertificateDer<'_>]) -> Vec<CertificateDer<'static>> {
+        if self.intermediates == 0 || presented.is_empty() {
+            return Vec::new();
+        }
+        let names: Vec<Option<Names<'_>>> = presented.iter().map(|der| names(der)).collect();
+        let mut paths = Vec::new();
+        self.candidate_paths(&mut vec![Node::Presented(0)], presented, &names, &mut paths);
+
+        let mut ids: Vec<usize> = paths.iter().flatten()
+            .filter_map(|node| match *node {
+                Node::Indexed(id) if self.issuers[id].anchor.is_none() => Some(id),
+                _ => None,
+            })
+            .collect();
+        ids.sort_unstable();
+        ids.dedup();
+        ids.into_iter().map(|id| self.issuers[id].der.clone()).collect()
+    }
+
+    /// Chains from the presented leaf to a trusted root, leaf first and
+    /// root last as Go reports `VerifiedChains`. Each candidate path is
+    /// verified by webpki (signatures, validity, constraints and client auth
+    /// usage) against just its own root and intermediates, at `now`.
+    pub fn verified_chains(&self, presented: &[CertificateDer<'_>], now: UnixTime)
+                           -> Vec<Vec<CertificateDer<'static>>> {
+        let Some(leaf) = presented.first() else {
+            return Vec::new();
+        };
+        let Ok(end_entity) = webpki::EndEntityCert::try_from(leaf) else {
+            return Vec::new();
+        };
+        let names: Vec<Option<Names<'_>>> = presented.iter().map(|der| names(der)).collect();
+        let mut paths = Vec::new();
+        self.candidate_paths(&mut vec![Node::Presented(0)], presented, &names, &mut paths);
+
+        paths.into_iter()
+            .filter(|path| {
+                let Some(&Node::Indexed(root)) = path.last() else { return false };
+                let anchors = [self.issuers[root].anchor.clone().expect("paths end at a root")];
+                let intermediates: Vec<CertificateDer<'_>> = path[1..path.len() - 1].iter()
+                    .map(|&node| self.der(node, presented).clone())
+                    .collect();
+                end_entity
+                    .verify_for_usage(self.algorithms.all, &anchors, &intermediates, now,
+                                      webpki::KeyUsage::client_auth(), None, None)
+                    .is_ok()
+            })
+            .map(|path| path.into_iter().map(|node| self.der(node, presented).clone().into_owned()).collect())
+            .collect()
+    }
+}
+
+/// Verified chains of a presented chain, kept until the first certificate
+/// on them expires
+struct Memo {
+    chains: Arc<[Vec<CertificateInfo>]>,
+    expires: UnixTime,
+}
+
+/// Chain index that can be swapped on reload, with the verified chains
+/// memoized per presented chain: a client reconnecting, or the same
+/// certificates on many connections, cost a hash of the chain and a lookup
+/// instead of a path search and signature checks. Only chains that verified
+/// are memoized, until the first certificate on them expires, so a client
+/// that failed can retry with a better chain and an expired one is not
+/// served from the cache. Swapping in a new index drops the memoized chains.
+#[derive(Default)]
+pub struct Chains {
+    index: RwLock<Option<Arc<ChainIndex>>>,
+    cache: RwLock<HashMap<Fingerprint, Memo>>,
+}
+
+/// Fingerprint of a whole presented chain, leaf first
+fn chain_fingerprint(presented: &[CertificateDer<'_>]) -> Fingerprint {
+    let digests: Vec<u8> = presented.iter().flat_map(|der| sha256(der)).collect();
+    sha256(&digests)
+}
+
+/// When the first certificate on `chains` expires, or None when one of
+/// their expiry dates cannot be read
+fn earliest_expiry(chains: &[Vec<CertificateDer<'_>>]) -> Option<UnixTime> {
+    chains.iter().flatten()
+        .map(|der| names(der).and_then(|names| names.not_after))
+        .try_fold(None, |earliest: Option<UnixTime>, not_after| {
+            let not_after = not_after?;
+            Some(Some(earliest.map_or(not_after, |earliest| earliest.min(not_after))))
+        })
+        .flatten()
+}
+
+impl Chains {
+    pub fn swap(&self, index: ChainIndex) {
+        *self.index.write().unwrap() = Some(Arc::new(index));
+        self.cache.write().unwrap().clear();
+    }
+
+    /// Verified chains of a presented certificate chain, each parsed by
+    /// `parse`
+    pub fn verified_chains(
+        &self,
+        presented: &[CertificateDer<'_>],
+        parse: impl Fn(&[CertificateDer<'_>]) -> Vec<CertificateInfo>,
+    ) -> Arc<[Vec<CertificateInfo>]> {
+        self.verified_chains_at(presented, parse, UnixTime::now())
+    }
+
+    fn verified_chains_at(
+        &self,
+        presented: &[CertificateDer<'_>],
+        parse: impl Fn(&[CertificateDer<'_>]) -> Vec<CertificateInfo>,
+        now: UnixTime,
+    ) -> Arc<[Vec<CertificateInfo>]> {
+        if presented.is_empty() {
+            return Arc::new([]);
+        }
+        let fingerprint = chain_fingerprint(presented);
+        if let Some(memo) = self.cache.read().unwrap().get(&fingerprint) {
+            if now < memo.expires {
+                metrics().chain_cache_hits.fetch_add(1, Ordering::Relaxed);
+                return memo.chains.clone();
+            }
+        }
+        metrics().chain_cache_misses.fetch_add(1, Ordering::Relaxed);
+
+        let Some(index) = self.index.read().unwrap().clone() else {
+            return Arc::new([]);
+        };
+        let verified = index.verified_chains(presented, now);
+        let chains: Arc<[Vec<CertificateInfo>]> = verified.iter().map(|chain| parse(chain)).collect();
+
+        // Only cache against the index the chains were built with
+        let current = self.index.read().unwrap().clone();
+        if current.is_some_and(|current| Arc::ptr_eq(&current, &index)) {
+            let mut cache = self.cache.write().unwrap();
+            match earliest_expiry(&verified) {
+                Some(expires) if !chains.is_empty() => {
+                    if cache.len() >= CACHE_CAPACITY {
+                        cache.clear();
+                    }
+                    cache.insert(fingerprint, Memo { chains: chains.clone(), expires });
+                }
+                _ => {
+                    cache.remove(&fingerprint);
+                }
+            }
+        }
+        chains
+    }
+
+    /// See ChainIndex::configured_intermediates
+    pub fn configured_intermediates(
+        &self,
+        end_entity: &CertificateDer<'_>,
+        intermediates: &[CertificateDer<'_>],
+    ) -> Vec<CertificateDer<'static>> {
+        let Some(index) = self.index.read().unwrap().clone() else {
+            return Vec::new();
+        };
+        if index.intermediates == 0 {
+            return Vec::new();
+        }
+        // Borrowed DER, so the clones are cheap
+        let presented: Vec<CertificateDer<'_>> = std::iter::once(end_entity.clone())
+            .chain(intermediates.iter().cloned())
+            .collect();
+        index.configured_intermediates(&presented)
+    }
+}
+
+impl std::fmt::Debug for Chains {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        let issuers = self.index.read().unwrap().as_ref().map(|index| index.len());
+        let cached = self.cache.read().unwrap().len();
+        f.debug_struct("Chains").field("issuers", &issuers).field("cached", &cached).finish()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use rustls::pki_types::pem::PemObject;
+
+    // ECDSA P-256, valid until 2126: Test Root -> Test Intermediate ->
+    // Test Client (clientAuth), and an unrelated Other Root
+    const ROOT: &str = "-----BEGIN CERTIFICATE-----
+MIIBjzCCATWgAwIBAgIUJMFd8zMCF1nvh3zpyxwf9EfT6LgwCgYIKoZIzj0EAwIw
+FDESMBAGA1UEAwwJVGVzdCBSb290MCAXDTI2MTAxNzA3MDkwMloYDzIxMjYwOTIz
+MDcwOTAyWjAUMRIwEAYDVQQDDAlUZXN0IFJvb3QwWTATBgcqhkjOPQIBBggqhkjO
+PQMBBwNCAAS8gf8zbhygYCvBhtaMtpPUTb+lsg0cjnMSBmxZXyL0rqVbKy2xqNqA
+hWRpH6djgciJc7B3zBvO7ylSkD7EbZt3o2MwYTAfBgNVHSMEGDAWgBQ1FRBmlSnZ
+1ygreIarnCrZGEZk0jAPBgNVHRMBAf8EBTADAQH/MA4GA1UdDwEB/wQEAwIBBjAd
+BgNVHQ4EFgQUNRUQZpUp2dcoK3iGq5wq2RhGZNIwCgYIKoZIzj0EAwIDSAAwRQIg
+U2s9q4tf+FkYHuwJdCnPp5s8x7fCdEgoJgGxPmDbUD8CIQD5OxgvAhT3iFUAK6Rl
+EY+BmQ3o4wrwZgiSKjdQ4BvU/A==
+-----END CERTIFICATE-----";
+    const INTERMEDIATE: &str = "-----BEGIN CERTIFICATE-----
+MIIBmjCCAUCgAwIBAgIUYmjAU8HsaHSY88PfCPjT9dLiCocwCgYIKoZIzj0EAwIw
+FDESMBAGA1UEAwwJVGVzdCBSb290MCAXDTI2MTAxNzA3MDkwMloYDzIxMjYwOTIz
+MDcwOTAyWjAcMRowGAYDVQQDDBFUZXN0IEludGVybWVkaWF0ZTBZMBMGByqGSM49
+AgEGCCqGSM49AwEHA0IABDTv7V/+q7+3+DGhZKBK1m+vzfjYGOpZ/g72lxRiosLD
+DhiFrk83dd4EPUqhJgsGJuJIVk+3x4HhZ7xNzfLc7YSjZjBkMBIGA1UdEwEB/wQI
+MAYBAf8CAQAwDgYDVR0PAQH/BAQDAgEGMB0GA1UdDgQWBBS3aaHdbqQhxs5bj6IB
+gqZTE7UhIjAfBgNVHSMEGDAWgBQ1FRBmlSnZ1ygreIarnCrZGEZk0jAKBggqhkjO
+PQQDAgNIADBFAiAmhHZshph4Ah4S+n5Ep412m+mI6Z2M3y2ltOTJxOU6OgIhAPWH
+kugAqnVViTCaIlCzWkiyTHM4d7nSe8EuGkmseQqN
+-----END CERTIFICATE-----";
+    const LEAF: &str = "-----BEGIN CERTIFICATE-----
+MIIBqjCCAVGgAwIBAgIUKdre4n1gwNpT2JTwTyBHiA7GznEwCgYIKoZIzj0EAwIw
+HDEaMBgGA1UEAwwRVGVzdCBJbnRlcm1lZGlhdGUwIBcNMjYxMDE3MDcwOTAyWhgP
+MjEyNjA5MjMwNzA5MDJaMBYxFDASBgNVBAMMC1Rlc3QgQ2xpZW50MFkwEwYHKoZI
+zj0CAQYIKoZIzj0DAQcDQgAEmrW0QxT7m6cD75umCXsqJbz4QDX3/n9PIzybkU7W
+1yJto7D2maBvH2hZ1EsFhCYWEM3eO1P6MpwQiLNx+nrWmKN1MHMwDAYDVR0TAQH/
+BAIwADAOBgNVHQ8BAf8EBAMCB4AwEwYDVR0lBAwwCgYIKwYBBQUHAwIwHQYDVR0O
+BBYEFDI0bU9Eem3lQwFFzPl/QESDY79VMB8GA1UdIwQYMBaAFLdpod1upCHGzluP
+ogGCplMTtSEiMAoGCCqGSM49BAMCA0cAMEQCIHtGeOY0XbPySy2GUq3SrCdQAMfo
+k5ng6wHROhebWVviAiB7EFZJ0DX4lPPdGTVx0M9BIOvZN7MLu17j3E3TTEgg2Q==
+-----END CERTIFICATE-----";
+    const OTHER_ROOT: &str = "-----BEGIN CERTIFICATE-----
+MIIBkjCCATegAwIBAgIUfJ9+WCSfvBURynyzqC9ujWkYW/owCgYIKoZIzj0EAwIw
+FTETMBEGA1UEAwwKT3RoZXIgUm9vdDAgFw0yNjEwMTcwNzA5MDJaGA8yMTI2MDky
+MzA3MDkwMlowFTETMBEGA1UEAwwKT3RoZXIgUm9vdDBZMBMGByqGSM49AgEGCCqG
+SM49AwEHA0IABPQAK0uRB1yShXLVJT22Lepk4RM6vLiuDFWaMDrhnttfrEmO6PdO
+OdEuOkq9mCygMbXlAUBkEV8vVgGe9xHecXejYzBhMB0GA1UdDgQWBBSinaUtLWC+
+XfG1rAHzzbz3rTPukjAfBgNVHSMEGDAWgBSinaUtLWC+XfG1rAHzzbz3rTPukjAP
+BgNVHRMBAf8EBTADAQH/MA4GA1UdDwEB/wQEAwIBBjAKBggqhkjOPQQDAgNJADBG
+AiEAxJ39+dLjsypVawONSdvKhixl1e16FKF4RoiZ9YqGGIcCIQDIcD9THtUwX5t7
+cVgLg723Znzxtk/fCtoeijcIuAexqA==
+-----END CERTIFICATE-----";
+
+    /// 2126-09-23T07:09:02Z, when LEAF and the other certificates expire
+    const LEAF_NOT_AFTER: u64 = 4_945_820_942;
+
+    fn der(pem: &str) -> CertificateDer<'static> {
+        CertificateDer::from_pem_slice(pem.as_bytes()).unwrap()
+    }
+
+    fn index(roots: &[&str], intermediates: &[&str]) -> ChainIndex {
+        let algorithms = rustls::crypto::aws_lc_rs::default_provider().signature_verification_algorithms;
+        ChainIndex::new(roots.iter().map(|p| der(p)).collect(),
+                        intermediates.iter().map(|p| der(p)).collect(), algorithms).unwrap()
+    }
+
+    fn cn(info: &CertificateInfo) -> &str {
+        info.subject_cn.as_deref().unwrap_or("")
+    }
+
+    #[test]
+    fn test_names() {
+        let root = der(ROOT);
+        let intermediate = der(INTERMEDIATE);
+        let root_names = names(&root).unwrap();
+        let int_names = names(&intermediate).unwrap();
+        assert_eq!(root_names.issuer, root_names.subject);
+        assert_eq!(int_names.issuer, root_names.subject);
+        assert!(root_names.subject_key_id.is_some());
+        assert_eq!(int_names.authority_key_id, root_names.subject_key_id);
+        assert_eq!(names(&der(LEAF)).unwrap().not_after,
+                   Some(UnixTime::since_unix_epoch(Duration::from_secs(LEAF_NOT_AFTER))));
+    }
+
+    #[test]
+    fn test_der_time() {
+        let at = |secs| Some(UnixTime::since_unix_epoch(Duration::from_secs(secs)));
+        let time = |der: &[u8]| der_time(der).map(|(time, _)| time);
+        assert_eq!(time(b"\x17\x0d491231235959Z"), at(2_524_607_999));
+        assert_eq!(time(b"\x17\x0d700101000000Z"), at(0));
+        assert_eq!(time(b"\x18\x0f21260923070902Z"), at(LEAF_NOT_AFTER));
+        // Before 1970, fractional seconds, offsets and bad digits
+        assert_eq!(time(b"\x17\x0d500101000000Z"), None);
+        assert_eq!(time(b"\x18\x1121260923070902.5Z"), None);
+        assert_eq!(time(b"\x17\x11491231235959+0100"), None);
+        assert_eq!(time(b"\x17\x0d4912312359x9Z"), None);
+    }
+
+    #[test]
+    fn test_verified_chains() {
+        let leaf = der(LEAF);
+        let intermediate = der(INTERMEDIATE);
+        let root = der(ROOT);
+        let expected = vec![vec![leaf.clone(), intermediate.clone(), root.clone()]];
+        let now = UnixTime::now();
+
+        // Intermediate presented by the client, or configured on the server
+        assert_eq!(index(&[ROOT], &[]).verified_chains(&[leaf.clone(), intermediate.clone()], now), expected);
+        assert_eq!(index(&[ROOT], &[INTERMEDIATE]).verified_chains(&[leaf.clone()], now), expected);
+        assert_eq!(index(&[OTHER_ROOT, ROOT], &[INTERMEDIATE])
+                       .verified_chains(&[leaf.clone(), intermediate.clone()], now), expected);
+
+        // Missing intermediate, untrusted root, no certificate
+        assert!(index(&[ROOT], &[]).verified_chains(&[leaf.clone()], now).is_empty());
+        assert!(index(&[OTHER_ROOT], &[INTERMEDIATE]).verified_chains(&[leaf.clone()], now).is_empty());
+        assert!(index(&[ROOT], &[]).verified_chains(&[], now).is_empty());
+        // The handshake verifier is given the configured intermediate for a
+        // client that sends only its leaf
+        assert_eq!(index(&[ROOT], &[INTERMEDIATE]).configured_intermediates(&[leaf.clone()]), vec![intermediate.clone()]);
+        assert!(index(&[ROOT], &[]).configured_intermediates(&[leaf.clone()]).is_empty());
+
+        // A CA certificate is not a client certificate
+        assert!(index(&[ROOT], &[]).verified_chains(&[intermediate], now).is_empty());
+    }
+
+    #[test]
+    fn test_chains_memoized() {
+        let parse = |chain: &[CertificateDer<'_>]| -> Vec<CertificateInfo> {
+            chain.iter().map(|der| CertificateInfo {
+                subject_cn: names(der).map(|n| format!("{} bytes", n.subject.len())),
+                issuer_cn: None,
+                not_before: String::new(),
+                not_after: String::new(),
+                is_ca: false,
+            }).collect()
+        };
+        let chains = Chains::default();
+        chains.swap(index(&[ROOT], &[INTERMEDIATE]));
+        let first = chains.verified_chains(&[der(LEAF)], parse);
+        assert_eq!(first.len(), 1);
+        assert_eq!(first[0].len(), 3);
+        assert!(!cn(&first[0][0]).is_empty());
+        assert!(Arc::ptr_eq(&first, &chains.verified_chains(&[der(LEAF)], parse)));
+
+        // The memo ends when a certificate on the chain expires
+        let expired = UnixTime::since_unix_epoch(Duration::from_secs(LEAF_NOT_AFTER + 1));
+        assert!(chains.verified_chains_at(&[der(LEAF)], parse, expired).is_empty());
+        assert!(chains.verified_chains_at(&[der(LEAF)], parse, expired).is_empty());
+        assert_eq!(chains.verified_chains(&[der(LEAF)], parse).len(), 1);
+
+        // A new index, say a reloaded CA file without the intermediate,
+        // starts from scratch
+        chains.swap(index(&[ROOT], &[]));
+        assert!(chains.verified_chains(&[der(LEAF)], parse).is_empty());
+        // Failures are not memoized, and the memo is per presented chain, so
+        // the client can retry sending its intermediate
+        assert!(chains.verified_chains(&[der(LEAF)], parse).is_empty());
+        assert_eq!(chains.verified_chains(&[der(LEAF), der(INTERMEDIATE)], parse).len(), 1);
+        assert!(chains.verified_chains(&[der(LEAF)], parse).is_empty());
+    }
+}
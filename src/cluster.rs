@@ -0,0 +1,84 @@
+use socket2::{Domain, Protocol, Socket, Type};
+use std::env;
+use std::io;
+use std::net::{TcpListener, ToSocketAddrs};
+use std::process::{Child, Command, Stdio};
+
+/// Set on processes started by spawn_processes, to their index (1..N)
+const PROCESS_INDEX_VAR: &str = "MTLS_PROCESS_INDEX";
+
+/// Index of this process in multi-process mode: 0 for the process that was
+/// started directly, 1..N for the ones it spawned
+pub fn process_index() -> usize {
+    env::var(PROCESS_INDEX_VAR)
+        .ok()
+        .and_then(|v| v.parse().ok())
+        .unwrap_or(0)
+}
+
+/// Bind every address `addr` resolves to. With `reuse_port` they are bound
+/// with SO_REUSEPORT, so several processes can listen on the same port and
+/// the kernel spreads incoming connections across them instead of one
+/// accept queue feeding every core.
+pub fn bind_listeners(addr: &str, backlog: u32, reuse_port: bool) -> io::Result<Vec<TcpListener>> {
+    let backlog = i32::try_from(backlog).unwrap_or(i32::MAX);
+    addr.to_socket_addrs()?
+        .map(|addr| {
+            let socket = Socket::new(Domain::for_address(addr), Type::STREAM, Some(Protocol::TCP))?;
+            socket.set_reuse_address(true)?;
+            #[cfg(unix)]
+            socket.set_reuse_port(reuse_port)?;
+            #[cfg(not(unix))]
+            let _ = reuse_port;
+            socket.set_nonblocking(true)?;
+            socket.bind(&addr.into())?;
+            socket.listen(backlog)?;
+            Ok(socket.into())
+        })
+        .collect()
+}
+
+/// Start `count` more copies of this executable with the same arguments and
+/// environment. Each child holds the read end of a pipe on stdin and shuts
+/// down once it closes, so the children stop with the parent however it
+/// exits.
+pub fn spawn_processes(count: usize) -> io::Result<Vec<Child>> {
+    let exe = env::current_exe()?;
+    let args: Vec<_> = env::args_os().skip(1).collect();
+    (1..=count)
+        .map(|index| {
+            Command::new(&exe)
+                .args(&args)
+                .env(PROCESS_INDEX_VAR, index.to_string())
+                .stdin(Stdio::piped())
+                .spawn()
+        })
+        .collect()
+}
+
+/// Resolves when the parent closes this process's stdin (see
+/// spawn_processes). Reads on a detached thread so a process stopping for
+/// another reason is not held up by it.
+pub async fn wait_for_parent() {
+    let (tx, rx) = tokio::sync::oneshot::channel();
+    std::thread::spawn(move || {
+        let _ = io::copy(&mut io::stdin().lock(), &mut io::sink());
+        let _ = tx.send(());
+    });
+    let _ = rx.await;
+}
+
+/// Close the children's stdin, which asks them to shut down gracefully,
+/// and wait for them to exit
+pub fn stop_processes(mut children: Vec<Child>) {
+    for child in &mut children {
+        drop(child.stdin.take());
+    }
+    for mut child in children {
+        match child.wait() {
+            Ok(status) if status.success() => {}
+            Ok(status) => log::warn!("Server process {} exited with {}", child.id(), status),
+            Err(e) => log::warn!("Failed to wait for server process {}: {}", child.id(), e),
+        }
+    }
+}
@@ -0,0 +1,423 @@
+//! Response encodings and field selection for /api/certs
+//!
+//! Besides the default JSON, the response can be negotiated through Accept
+//! as CBOR (RFC 8949) or MessagePack, and `?fields=` trims it to the named
+//! top-level members, e.g. `?fields=mtls_valid,leaf_common_name` for a
+//! gateway that only needs to know who the client is. JSON goes through
+//! serde_json; the CBOR and MessagePack encoders are written out for the few
+//! value types a response has, keeping the member order and null for absent
+//! common names of the JSON body.
+
+use serde::Serialize;
+
+use crate::response::CertificateInfo;
+
+/// Formats /api/certs can be served as
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum Format {
+    Json,
+    Cbor,
+    MessagePack,
+}
+
+impl Format {
+    pub fn content_type(self) -> &'static str {
+        match self {
+            Format::Json => "application/json",
+            Format::Cbor => "application/cbor",
+            Format::MessagePack => "application/msgpack",
+        }
+    }
+
+    fn from_media_type(media_type: &str) -> Option<Format> {
+        match media_type {
+            "application/json" | "application/*" | "*/*" => Some(Format::Json),
+            "application/cbor" => Some(Format::Cbor),
+            // MessagePack has no registered type; accept the common variants
+            "application/msgpack" | "application/x-msgpack" | "application/vnd.msgpack" => Some(Format::MessagePack),
+            _ => None,
+        }
+    }
+}
+
+/// Pick the format for an Accept header: the acceptable type with the
+/// highest q-value, the first listed on a tie, and JSON without a header.
+/// None when no listed type can be produced (406).
+pub fn negotiate(accept: Option<&str>) -> Option<Format> {
+    let accept = match accept.map(str::trim) {
+        None | Some("") => return Some(Format::Json),
+        Some(accept) => accept,
+    };
+    let mut best: Option<(Format, f32)> = None;
+    for item in accept.split(',') {
+        let mut parts = item.split(';');
+        let media_type = parts.next().unwrap_or("").trim().to_ascii_lowercase();
+        let Some(format) = Format::from_media_type(&media_type) else {
+            continue;
+        };
+        let q = parts
+            .filter_map(|param| param.trim().split_once('='))
+            .find(|(name, _)| name.trim().eq_ignore_ascii_case("q"))
+            .and_then(|(_, value)| value.trim().parse::<f32>().ok())
+            .unwrap_or(1.0);
+        if q > 0.0 && best.map_or(true, |(_, best_q)| q > best_q) {
+            best = Some((format, q));
+        }
+    }
+    best.map(|(format, _)| format)
+}
+
+/// Top-level members of an /api/certs response, as a bit set
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub struct Fields(u8);
+
+impl Fields {
+    pub const MTLS_VALID: Fields = Fields(1);
+    /// Subject CN of the presented leaf; only included when asked for
+    pub const LEAF_COMMON_NAME: Fields = Fields(1 << 1);
+    pub const PRESENTED_CERTIFICATES: Fields = Fields(1 << 2);
+    pub const VERIFIED_CHAINS: Fields = Fields(1 << 3);
+    /// The members of the default body
+    pub const DEFAULT: Fields = Fields(1 | 1 << 2 | 1 << 3);
+
+    /// Member names in output order
+    const NAMES: [(&'static str, Fields); 4] = [
+        ("mtls_valid", Fields::MTLS_VALID),
+        ("leaf_common_name", Fields::LEAF_COMMON_NAME),
+        ("presented_certificates", Fields::PRESENTED_CERTIFICATES),
+        ("verified_chains", Fields::VERIFIED_CHAINS),
+    ];
+
+    /// Parse a comma-separated `?fields=` list; an empty list selects the
+    /// default members
+    pub fn parse(list: &str) -> Result<Fields, String> {
+        let mut fields = Fields(0);
+        for name in list.split(',').map(str::trim).filter(|name| !name.is_empty()) {
+            match Fields::NAMES.iter().find(|(known, _)| *known == name) {
+                Some((_, field)) => fields.0 |= field.0,
+                None => return Err(format!("unknown field {:?}", name)),
+            }
+        }
+        Ok(if fields.0 == 0 { Fields::DEFAULT } else { fields })
+    }
+
+    pub fn contains(self, other: Fields) -> bool {
+        self.0 & other.0 == other.0
+    }
+}
+
+/// Encode the selected members of a response
+pub fn encode(
+    mtls_valid: bool,
+    presented: &[CertificateInfo],
+    verified_chains: &[Vec<CertificateInfo>],
+    fields: Fields,
+    format: Format,
+) -> Vec<u8> {
+    let mut out = Vec::with_capacity(512);
+    let w: &mut dyn Writer = match format {
+        Format::Json => return encode_json(mtls_valid, presented, verified_chains, fields),
+        Format::Cbor => &mut Cbor(&mut out),
+        Format::MessagePack => &mut MessagePack(&mut out),
+    };
+
+    let selected = Fields::NAMES.iter().filter(|(_, field)| fields.contains(*field));
+    w.begin_map(selected.clone().count());
+    for &(name, field) in selected {
+        w.key(name);
+        match field {
+            Fields::MTLS_VALID => w.bool(mtls_valid),
+            Fields::LEAF_COMMON_NAME => w.opt_str(presented.first().and_then(|leaf| leaf.subject_cn.as_deref())),
+            Fields::PRESENTED_CERTIFICATES => write_certificates(w, presented),
+            _ => {
+                w.begin_array(verified_chains.len());
+                for chain in verified_chains {
+                    write_certificates(w, chain);
+                }
+                w.end();
+            }
+        }
+    }
+    w.end();
+    out
+}
+
+fn encode_json(
+    mtls_valid: bool,
+    presented: &[CertificateInfo],
+    verified_chains: &[Vec<CertificateInfo>],
+    fields: Fields,
+) -> Vec<u8> {
+    let leaf = || presented.first().and_then(|leaf| leaf.subject_cn.as_deref());
+    let selected = JsonProjection {
+        mtls_valid: fields.contains(Fields::MTLS_VALID).then_some(mtls_valid),
+        leaf_common_name: fields.contains(Fields::LEAF_COMMON_NAME).then(leaf),
+        presented_certificates: fields.contains(Fields::PRESENTED_CERTIFICATES).then_some(presented),
+        verified_chains: fields.contains(Fields::VERIFIED_CHAINS).then_some(verified_chains),
+    };
+    serde_json::to_vec(&selected).expect("response serialization cannot fail")
+}
+
+/// The selected members of a response; unselected ones are None and left out
+#[derive(Serialize)]
+struct JsonProjection<'a> {
+    #[serde(skip_serializing_if = "Option::is_none")]
+    mtls_valid: Option<bool>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    leaf_common_name: Option<Option<&'a str>>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    presented_certificates: Option<&'a [CertificateInfo]>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    verified_chains: Option<&'a [Vec<CertificateInfo>]>,
+}
+
+fn write_certificates(w: &mut dyn Writer, certificates: &[CertificateInfo]) {
+    w.begin_array(certificates.len());
+    for cert in certificates {
+        w.begin_map(5);
+        w.key("subject_cn");
+        w.opt_str(cert.subject_cn.as_deref());
+        w.key("issuer_cn");
+        w.opt_str(cert.issuer_cn.as_deref());
+        w.key("not_before");
+        w.str(&cert.not_before);
+        w.key("not_after");
+        w.str(&cert.not_after);
+        w.key("is_ca");
+        w.bool(cert.is_ca);
+        w.end();
+    }
+    w.end();
+}
+
+/// Appends the value types a response consists of in CBOR or MessagePack.
+/// Maps and arrays are announced with their length and closed with `end`.
+trait Writer {
+    fn begin_map(&mut self, len: usize);
+    fn begin_array(&mut self, len: usize);
+    fn end(&mut self);
+    fn key(&mut self, key: &str);
+    fn str(&mut self, value: &str);
+    fn bool(&mut self, value: bool);
+    fn null(&mut self);
+
+    fn opt_str(&mut self, value: Option<&str>) {
+        match value {
+            Some(value) => self.str(value),
+            None => self.null(),
+        }
+    }
+}
+
+/// Definite-length CBOR
+struct Cbor<'a>(&'a mut Vec<u8>);
+
+impl Cbor<'_> {
+    fn head(&mut self, major: u8, len: usize) {
+        let major = major << 5;
+        let len = len as u64;
+        match len {
+            0..=23 => self.0.push(major | len as u8),
+            24..=0xff => self.0.extend_from_slice(&[major | 24, len as u8]),
+            0x100..=0xffff => {
+                self.0.push(major | 25);
+                self.0.extend_from_slice(&(len as u16).to_be_bytes());
+            }
+            0x1_0000..=0xffff_ffff => {
+                self.0.push(major | 26);
+                self.0.extend_from_slice(&(len as u32).to_be_bytes());
+            }
+            _ => {
+                self.0.push(major | 27);
+                self.0.extend_from_slice(&len.to_be_bytes());
+            }
+        }
+    }
+}
+
+impl Writer for Cbor<'_> {
+    fn begin_map(&mut self, len: usize) {
+        self.head(5, len);
+    }
+
+    fn begin_array(&mut self, len: usize) {
+        self.head(4, len);
+    }
+
+    fn end(&mut self) {}
+
+    fn key(&mut self, key: &str) {
+        self.str(key);
+    }
+
+    fn str(&mut self, value: &str) {
+        self.head(3, value.len());
+        self.0.extend_from_slice(value.as_bytes());
+    }
+
+    fn bool(&mut self, value: bool) {
+        self.0.push(if value { 0xf5 } else { 0xf4 });
+    }
+
+    fn null(&mut self) {
+        self.0.push(0xf6);
+    }
+}
+
+/// MessagePack
+struct MessagePack<'a>(&'a mut Vec<u8>);
+
+impl MessagePack<'_> {
+    fn container(&mut self, fix: u8, marker16: u8, len: usize) {
+        match len {
+            0..=15 => self.0.push(fix | len as u8),
+            16..=0xffff => {
+                self.0.push(marker16);
+                self.0.extend_from_slice(&(len as u16).to_be_bytes());
+            }
+            _ => {
+                self.0.push(marker16 + 1);
+                self.0.extend_from_slice(&(len as u32).to_be_bytes());
+            }
+        }
+    }
+}
+
+impl Writer for MessagePack<'_> {
+    fn begin_map(&mut self, len: usize) {
+        self.container(0x80, 0xde, len);
+    }
+
+    fn begin_array(&mut self, len: usize) {
+        self.container(0x90, 0xdc, len);
+    }
+
+    fn end(&mut self) {}
+
+    fn key(&mut self, key: &str) {
+        self.str(key);
+    }
+
+    fn str(&mut self, value: &str) {
+        let len = value.len();
+        match len {
+            0..=31 => self.0.push(0xa0 | len as u8),
+            32..=0xff => self.0.extend_from_slice(&[0xd9, len as u8]),
+            0x100..=0xffff => {
+                self.0.push(0xda);
+                self.0.extend_from_slice(&(len as u16).to_be_bytes());
+            }
+            _ => {
+                self.0.push(0xdb);
+                self.0.extend_from_slice(&(len as u32).to_be_bytes());
+            }
+        }
+        self.0.extend_from_slice(value.as_bytes());
+    }
+
+    fn bool(&mut self, value: bool) {
+        self.0.push(if value { 0xc3 } else { 0xc2 });
+    }
+
+    fn null(&mut self) {
+        self.0.push(0xc0);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::response::MtlsResponse;
+    use std::time::Instant;
+
+    fn client() -> CertificateInfo {
+        CertificateInfo {
+            subject_cn: Some("Test Client".to_string()),
+            issuer_cn: Some("Test CA".to_string()),
+            not_before: "Jan  1 00:00:00 2026 +00:00".to_string(),
+            not_after: "Jan  1 00:00:00 2027 +00:00".to_string(),
+            is_ca: false,
+        }
+    }
+
+    #[test]
+    fn test_negotiate() {
+        assert_eq!(negotiate(None), Some(Format::Json));
+        assert_eq!(negotiate(Some("*/*")), Some(Format::Json));
+        assert_eq!(negotiate(Some("application/CBOR")), Some(Format::Cbor));
+        assert_eq!(negotiate(Some("application/json;q=0.5, application/x-msgpack")), Some(Format::MessagePack));
+        assert_eq!(negotiate(Some("application/msgpack, application/cbor")), Some(Format::MessagePack));
+        assert_eq!(negotiate(Some("application/cbor;q=0, application/json")), Some(Format::Json));
+        assert_eq!(negotiate(Some("text/html")), None);
+    }
+
+    #[test]
+    fn test_fields() {
+        assert_eq!(Fields::parse(""), Ok(Fields::DEFAULT));
+        let fields = Fields::parse("mtls_valid, leaf_common_name").unwrap();
+        assert!(fields.contains(Fields::LEAF_COMMON_NAME) && !fields.contains(Fields::VERIFIED_CHAINS));
+        assert!(Fields::parse("mtls_valid,serial").is_err());
+    }
+
+    #[test]
+    fn test_json() {
+        let root = CertificateInfo { subject_cn: None, is_ca: true, ..client() };
+        let body = encode(true, &[client()], &[vec![client(), root]], Fields::DEFAULT, Format::Json);
+        let value: serde_json::Value = serde_json::from_slice(&body).unwrap();
+        assert_eq!(value["verified_chains"][0][1]["subject_cn"], serde_json::Value::Null);
+        assert_eq!(value["presented_certificates"][0]["subject_cn"], "Test Client");
+
+        let body = encode(false, &[], &[], Fields::parse("mtls_valid,leaf_common_name").unwrap(), Format::Json);
+        assert_eq!(body, br#"{"mtls_valid":false,"leaf_common_name":null}"#);
+
+        let body = encode(true, &[client()], &[vec![client()]], Fields::DEFAULT, Format::Json);
+        let full = MtlsResponse::from_chains(vec![client()], vec![vec![client()]]);
+        assert_eq!(body, serde_json::to_vec(&full).unwrap());
+    }
+
+    #[test]
+    fn test_binary() {
+        let fields = Fields::parse("mtls_valid,leaf_common_name").unwrap();
+        let mut want = vec![0xa2, 0x6a];
+        want.extend_from_slice(b"mtls_valid");
+        want.extend_from_slice(&[0xf5, 0x70]);
+        want.extend_from_slice(b"leaf_common_name");
+        want.push(0x6b);
+        want.extend_from_slice(b"Test Client");
+        assert_eq!(encode(true, &[client()], &[], fields, Format::Cbor), want);
+
+        let mut want = vec![0x82, 0xaa];
+        want.extend_from_slice(b"mtls_valid");
+        want.extend_from_slice(&[0xc3, 0xb0]);
+        want.extend_from_slice(b"leaf_common_name");
+        want.push(0xab);
+        want.extend_from_slice(b"Test Client");
+        assert_eq!(encode(true, &[client()], &[], fields, Format::MessagePack), want);
+    }
+
+    /// Payload size and serialization cost per format; run with
+    /// `cargo test --release encoding_sizes -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn encoding_sizes() {
+        let presented = [client()];
+        let chains = [vec![client(), CertificateInfo { is_ca: true, ..client() }]];
+        let valid_only = Fields::parse("mtls_valid,leaf_common_name").unwrap();
+        let cases = [
+            ("json", Format::Json, Fields::DEFAULT),
+            ("cbor", Format::Cbor, Fields::DEFAULT),
+            ("msgpack", Format::MessagePack, Fields::DEFAULT),
+            ("json valid-only", Format::Json, valid_only),
+            ("cbor valid-only", Format::Cbor, valid_only),
+        ];
+        const ROUNDS: u32 = 100_000;
+        for (name, format, fields) in cases {
+            let start = Instant::now();
+            let mut size = 0;
+            for _ in 0..ROUNDS {
+                size = std::hint::black_box(encode(true, &presented, &chains, fields, format)).len();
+            }
+            println!("{:<16} {:>4} bytes {:>7.0} ns/op", name, size, start.elapsed().as_nanos() as f64 / ROUNDS as f64);
+        }
+    }
+}
@@ -0,0 +1,157 @@
+//! Listener handoff for restarts without refused connections
+//!
+//! On SIGUSR2 the server starts a new copy of itself that inherits the bound
+//! listening sockets, waits for it to report that it is serving, and only
+//! then drains. Connections keep queueing on the shared sockets throughout,
+//! so a deploy refuses none. The protocol is the Go server's:
+//! MTLS_LISTEN_FDS names the inherited descriptors (`https=7,https=8`) and
+//! the new process writes a byte to MTLS_READY_FD once it serves.
+
+use socket2::SockRef;
+use std::env;
+use std::io::{self, Read, Write};
+use std::net::TcpListener;
+use std::os::unix::io::{AsRawFd, FromRawFd};
+use std::os::unix::net::UnixStream;
+use std::process::Command;
+use std::time::Duration;
+
+const LISTEN_FDS_VAR: &str = "MTLS_LISTEN_FDS";
+const READY_FD_VAR: &str = "MTLS_READY_FD";
+
+/// Take the descriptor number in environment variable `name`, clearing it
+/// so processes started later do not see it
+fn take_fd_var(name: &str) -> Option<String> {
+    let value = env::var(name).ok()?;
+    env::remove_var(name);
+    Some(value)
+}
+
+fn parse_fd(value: &str) -> Option<i32> {
+    value.parse().ok().filter(|&fd| fd > 2)
+}
+
+/// Listeners handed off by the server that started this one, or None when
+/// it was started normally
+pub fn inherited_listeners() -> io::Result<Option<Vec<TcpListener>>> {
+    let Some(value) = take_fd_var(LISTEN_FDS_VAR) else {
+        return Ok(None);
+    };
+    let listeners = value
+        .split(',')
+        .map(|entry| {
+            let fd = entry
+                .split_once('=')
+                .filter(|(name, _)| *name == "https")
+                .and_then(|(_, fd)| parse_fd(fd))
+                .ok_or_else(|| {
+                    io::Error::new(io::ErrorKind::InvalidInput, format!("{}: invalid entry {:?}", LISTEN_FDS_VAR, entry))
+                })?;
+            // SAFETY: the previous server passed this descriptor for this
+            // listener alone, and nothing else in this process owns it
+            let listener = unsafe { TcpListener::from_raw_fd(fd) };
+            SockRef::from(&listener).set_cloexec(true)?;
+            listener.set_nonblocking(true)?;
+            Ok(listener)
+        })
+        .collect::<io::Result<Vec<_>>>()?;
+    Ok(Some(listeners))
+}
+
+/// Tell the server that started this one that it is serving, so the old
+/// server can start draining
+pub fn notify_ready() {
+    let Some(fd) = take_fd_var(READY_FD_VAR).as_deref().and_then(parse_fd) else {
+        return;
+    };
+    // SAFETY: as in inherited_listeners
+    let mut ready = unsafe { UnixStream::from_raw_fd(fd) };
+    if let Err(e) = ready.write_all(&[1]) {
+        log::warn!("Could not report readiness to the previous server: {}", e);
+    }
+}
+
+/// Copies of the listening sockets, kept to pass to a successor
+pub struct Handoff {
+    listeners: Vec<TcpListener>,
+}
+
+impl Handoff {
+    pub fn new(listeners: &[TcpListener]) -> io::Result<Self> {
+        let listeners = listeners.iter().map(TcpListener::try_clone).collect::<io::Result<_>>()?;
+        Ok(Self { listeners })
+    }
+
+    /// Start this executable again with the same arguments and environment,
+    /// serving the listeners, and return its process ID once it reports that
+    /// it is serving. On error the new process is stopped and this one keeps
+    /// serving. argv[0] is started rather than current_exe(), which names
+    /// the replaced binary after an upgrade.
+    pub fn start(&self, timeout: Duration) -> io::Result<u32> {
+        let (mut ready, successor_end) = UnixStream::pair()?;
+        let fds: Vec<String> = self.listeners.iter().map(|l| format!("https={}", l.as_raw_fd())).collect();
+
+        // std opens every descriptor close-on-exec; clear it just around the
+        // spawn so these, and only these, are inherited
+        let inherited: Vec<SockRef<'_>> = self.listeners.iter().map(SockRef::from)
+            .chain(std::iter::once(SockRef::from(&successor_end)))
+            .collect();
+        for socket in &inherited {
+            socket.set_cloexec(false)?;
+        }
+        let mut args = env::args_os();
+        let spawned = Command::new(args.next().unwrap_or_else(|| "mtls-server".into()))
+            .args(args)
+            .env(LISTEN_FDS_VAR, fds.join(","))
+            .env(READY_FD_VAR, successor_end.as_raw_fd().to_string())
+            .spawn();
+        for socket in &inherited {
+            let _ = socket.set_cloexec(true);
+        }
+        let mut successor = spawned?;
+        // Only the successor may hold its end, so its exit reads as EOF
+        drop(inherited);
+        drop(successor_end);
+
+        ready.set_read_timeout(Some(timeout))?;
+        let result = match ready.read(&mut [0u8; 1]) {
+            Ok(1) => return Ok(successor.id()),
+            Ok(_) => io::Error::new(io::ErrorKind::UnexpectedEof, "new server exited before reporting ready"),
+            Err(e) => e,
+        };
+        let _ = successor.kill();
+        let _ = successor.wait();
+        Err(result)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::net::TcpStream;
+
+    #[test]
+    fn test_inherited_listeners() {
+        env::remove_var(LISTEN_FDS_VAR);
+        assert!(inherited_listeners().unwrap().is_none());
+
+        let original = TcpListener::bind("127.0.0.1:0").unwrap();
+        let addr = original.local_addr().unwrap();
+        let copy = Handoff::new(std::slice::from_ref(&original)).unwrap();
+        let fd = copy.listeners[0].as_raw_fd();
+        env::set_var(LISTEN_FDS_VAR, format!("https={}", fd));
+        let inherited = inherited_listeners().unwrap().unwrap();
+        assert!(env::var(LISTEN_FDS_VAR).is_err());
+        // The inherited listener now owns the descriptor
+        std::mem::forget(copy);
+
+        drop(original);
+        assert_eq!(inherited[0].local_addr().unwrap(), addr);
+        let _client = TcpStream::connect(addr).unwrap();
+        inherited[0].set_nonblocking(false).unwrap();
+        assert!(inherited[0].accept().is_ok());
+
+        env::set_var(LISTEN_FDS_VAR, "http=1");
+        assert!(inherited_listeners().is_err());
+    }
+}
@@ -0,0 +1,70 @@
+use log::{LevelFilter, Log, Metadata, Record};
+use std::io::{self, BufWriter, Write};
+use std::str::FromStr;
+use std::sync::atomic::Ordering;
+use std::sync::mpsc::{sync_channel, Receiver, SyncSender, TrySendError};
+use std::thread;
+
+use crate::metrics::metrics;
+
+/// Lines buffered between request threads and the writer thread. When the
+/// writer falls behind, new lines are dropped rather than blocking a worker.
+const QUEUE_DEPTH: usize = 8192;
+
+/// Logger that formats on the calling thread and hands the line to a
+/// background thread, so request handling never blocks on stdout.
+struct ChannelLogger {
+    level: LevelFilter,
+    tx: SyncSender<String>,
+}
+
+impl Log for ChannelLogger {
+    fn enabled(&self, metadata: &Metadata) -> bool {
+        metadata.level() <= self.level
+    }
+
+    fn log(&self, record: &Record) {
+        if !self.enabled(record.metadata()) {
+            return;
+        }
+        let line = format!("[{}] {}: {}\n", record.level(), record.target(), record.args());
+        if let Err(TrySendError::Full(_)) = self.tx.try_send(line) {
+            metrics().log_lines_dropped.fetch_add(1, Ordering::Relaxed);
+        }
+    }
+
+    fn flush(&self) {}
+}
+
+fn write_lines(rx: Receiver<String>) {
+    let stdout = io::stdout();
+    let mut out = BufWriter::new(stdout.lock());
+    while let Ok(line) = rx.recv() {
+        let _ = out.write_all(line.as_bytes());
+        // Batch whatever else is already queued into the same flush
+        while let Ok(line) = rx.try_recv() {
+            let _ = out.write_all(line.as_bytes());
+        }
+        let _ = out.flush();
+    }
+}
+
+/// Log level from LOG_LEVEL (error, warn, info, debug, trace, off), default info
+pub fn level_from_env() -> LevelFilter {
+    std::env::var("LOG_LEVEL")
+        .ok()
+        .and_then(|v| LevelFilter::from_str(&v).ok())
+        .unwrap_or(LevelFilter::Info)
+}
+
+/// Install the non-blocking logger as the global `log` backend
+pub fn init(level: LevelFilter) -> Result<(), Box<dyn std::error::Error>> {
+    let (tx, rx) = sync_channel(QUEUE_DEPTH);
+    thread::Builder::new()
+        .name("logger".to_string())
+        .spawn(move || write_lines(rx))?;
+
+    log::set_boxed_logger(Box::new(ChannelLogger { level, tx }))?;
+    log::set_max_level(level);
+    Ok(())
+}
@@ -1,10 +1,46 @@
+mod access_log;
+mod acl;
+mod chain;
+mod cluster;
+mod encoding;
+#[cfg(unix)]
+mod handoff;
+mod logging;
+mod metrics;
+mod ratelimit;
+mod reload;
 mod response;
+mod revocation;
 mod server;
+mod session;
+mod tenant;
+mod tls;
+mod tuning;
 
+use access_log::{AccessRecord, ConnectionInfo};
+use acl::{AclDecision, ClientIdentity};
+use actix_web::body::{BodySize, MessageBody};
+use actix_web::dev::{Service, ServiceResponse};
+#[cfg(unix)]
+use actix_web::dev::ServerHandle;
+use actix_web::http::header;
+use actix_web::http::StatusCode;
 use actix_web::{web, App, HttpRequest, HttpResponse, HttpServer};
-use response::MtlsResponse;
-use server::{build_tls_config, on_connect_handler, parse_certificates, PeerCertificates};
+use encoding::{Fields, Format};
+#[cfg(unix)]
+use handoff::Handoff;
+use metrics::metrics;
+use ratelimit::{RateLimitConfig, Rejection};
+use reload::TlsReloader;
+use serde::Deserialize;
+use server::{build_tls_config, on_connect_handler, PeerCertificates};
+use session::ResumptionConfig;
 use std::env;
+use std::path::PathBuf;
+use std::sync::atomic::Ordering;
+use std::sync::Arc;
+use std::time::{Duration, Instant};
+use tuning::ServerTuning;
 
 /// Handler for /health endpoint (no authentication required)
 async fn health_handler() -> HttpResponse {
@@ -13,29 +49,161 @@ async fn health_handler() -> HttpResponse {
     }))
 }
 
-/// Handler for /api/certs endpoint
-async fn certs_handler(req: HttpRequest) -> HttpResponse {
-    // Try to extract peer certificates from connection data
-    let response = if let Some(peer_certs) = req.conn_data::<PeerCertificates>() {
-        let certificates = parse_certificates(&peer_certs.0);
-        MtlsResponse {
-            mtls_valid: !certificates.is_empty(),
-            presented_certificates: certificates.clone(),
-            verified_chains: if !certificates.is_empty() {
-                vec![certificates]
-            } else {
-                Vec::new()
-            },
+#[derive(Deserialize)]
+struct CertsQuery {
+    /// Comma-separated top-level members to include
+    fields: Option<String>,
+}
+
+/// Handler for /api/certs endpoint. The format follows Accept (JSON, CBOR
+/// or MessagePack) and `?fields=` selects the members.
+async fn certs_handler(req: HttpRequest, query: web::Query<CertsQuery>) -> HttpResponse {
+    let Some(format) = encoding::negotiate(req.headers().get(header::ACCEPT).and_then(|v| v.to_str().ok())) else {
+        return HttpResponse::NotAcceptable().json(serde_json::json!({
+            "error": "supported types are application/json, application/cbor and application/msgpack"
+        }));
+    };
+    let fields = match query.fields.as_deref().map_or(Ok(Fields::DEFAULT), Fields::parse) {
+        Ok(fields) => fields,
+        Err(error) => return HttpResponse::BadRequest().json(serde_json::json!({ "error": error })),
+    };
+
+    let peer_certs = req.conn_data::<Arc<PeerCertificates>>();
+    let body = if format == Format::Json && fields == Fields::DEFAULT {
+        // The body was built once in on_connect_handler; cloning Bytes is a refcount bump
+        match peer_certs {
+            Some(peer_certs) => peer_certs.body.clone(),
+            None => response::unauthenticated_body(),
         }
     } else {
-        MtlsResponse::new(false)
+        let body = match peer_certs {
+            Some(peer) => encoding::encode(peer.verified, &peer.certificates, &peer.verified_chains, fields, format),
+            None => encoding::encode(false, &[], &[], fields, format),
+        };
+        body.into()
     };
 
-    HttpResponse::Ok().json(response)
+    HttpResponse::Ok()
+        .content_type(format.content_type())
+        .insert_header((header::VARY, "Accept"))
+        .body(body)
+}
+
+/// HEAD /api/certs: the headers of a GET without encoding a body
+async fn certs_head_handler(req: HttpRequest) -> HttpResponse {
+    match encoding::negotiate(req.headers().get(header::ACCEPT).and_then(|v| v.to_str().ok())) {
+        Some(format) => HttpResponse::Ok()
+            .content_type(format.content_type())
+            .insert_header((header::VARY, "Accept"))
+            .finish(),
+        None => HttpResponse::NotAcceptable().finish(),
+    }
+}
+
+/// Handler for /api/certs/valid: 204 when the client certificate verified,
+/// 401 otherwise, without a body, for health checks and gateways that only
+/// need the verdict
+async fn certs_valid_handler(req: HttpRequest) -> HttpResponse {
+    let verified = req.conn_data::<Arc<PeerCertificates>>().is_some_and(|peer| peer.verified);
+    HttpResponse::new(if verified { StatusCode::NO_CONTENT } else { StatusCode::UNAUTHORIZED })
+}
+
+/// Response for a request the ACL refuses
+fn acl_denied_response(decision: AclDecision, path: &str) -> HttpResponse {
+    let (mut response, counter, error) = match decision {
+        AclDecision::Unauthenticated => (HttpResponse::Unauthorized(), &metrics().acl_unauthenticated,
+                                         "client certificate required"),
+        _ => (HttpResponse::Forbidden(), &metrics().acl_forbidden, "client certificate not allowed"),
+    };
+    counter.fetch_add(1, Ordering::Relaxed);
+    response.json(serde_json::json!({ "error": error, "route": path }))
+}
+
+/// Response for a request admission control refuses
+fn rejected_response(rejection: Rejection) -> HttpResponse {
+    let (mut response, retry_after, error) = match rejection {
+        Rejection::Overloaded => (HttpResponse::ServiceUnavailable(), 1, "server overloaded"),
+        Rejection::RateLimited(wait) => (HttpResponse::TooManyRequests(), wait.as_secs_f64().ceil().max(1.0) as u64,
+                                         "rate limit exceeded"),
+    };
+    response
+        .insert_header(("Retry-After", retry_after.to_string()))
+        .json(serde_json::json!({ "error": error }))
+}
+
+/// Write the access log record for a completed request
+fn record_access<B: MessageBody>(res: &ServiceResponse<B>, latency: Duration) {
+    let req = res.request();
+    access_log::record(&AccessRecord {
+        method: req.method().as_str(),
+        route: req.path(),
+        status: res.status().as_u16(),
+        latency,
+        bytes: match res.response().body().size() {
+            BodySize::Sized(n) => n,
+            _ => 0,
+        },
+        connection: req.conn_data::<ConnectionInfo>(),
+    });
+}
+
+/// Stop on SIGTERM or SIGINT, and on SIGUSR2 once a new process has taken
+/// over the listeners, letting in-flight requests finish within
+/// SHUTDOWN_TIMEOUT_SECS; SIGQUIT stops at once
+#[cfg(unix)]
+async fn stop_on_signal(handle: ServerHandle, handoff: Option<Arc<Handoff>>, handoff_timeout: Duration) {
+    use tokio::signal::unix::{signal, SignalKind};
+
+    let (Ok(mut term), Ok(mut int), Ok(mut quit), Ok(mut usr2)) = (
+        signal(SignalKind::terminate()),
+        signal(SignalKind::interrupt()),
+        signal(SignalKind::quit()),
+        signal(SignalKind::user_defined2()),
+    ) else {
+        log::error!("Failed to install signal handlers");
+        return;
+    };
+    loop {
+        tokio::select! {
+            _ = term.recv() => log::info!("Received SIGTERM, draining connections"),
+            _ = int.recv() => log::info!("Received SIGINT, draining connections"),
+            _ = quit.recv() => {
+                log::info!("Received SIGQUIT, stopping");
+                return handle.stop(false).await;
+            }
+            _ = usr2.recv() => {
+                let Some(handoff) = handoff.clone() else {
+                    log::warn!("SIGUSR2: listener handoff needs PROCESSES=1; with REUSE_PORT=1 start the new server alongside instead");
+                    continue;
+                };
+                match tokio::task::spawn_blocking(move || handoff.start(handoff_timeout)).await {
+                    Ok(Ok(pid)) => log::info!("SIGUSR2: handed off listeners to pid {}, shutting down", pid),
+                    Ok(Err(e)) => {
+                        log::error!("SIGUSR2: could not hand off listeners, still serving: {}", e);
+                        continue;
+                    }
+                    Err(e) => {
+                        log::error!("SIGUSR2: handoff failed, still serving: {}", e);
+                        continue;
+                    }
+                }
+            }
+        }
+        return handle.stop(true).await;
+    }
+}
+
+/// Handler for /metrics endpoint (Prometheus text format)
+async fn metrics_handler() -> HttpResponse {
+    HttpResponse::Ok()
+        .content_type("text/plain; version=0.0.4; charset=utf-8")
+        .body(metrics().render())
 }
 
 #[actix_web::main]
 async fn main() -> std::io::Result<()> {
+    logging::init(logging::level_from_env()).expect("Failed to initialize logger");
+
     // Get configuration from environment or use defaults
     let addr = env::var("BIND_ADDR").unwrap_or_else(|_| "127.0.0.1".to_string());
     let port = env::var("BIND_PORT").unwrap_or_else(|_| "9443".to_string());
@@ -44,26 +212,205 @@ async fn main() -> std::io::Result<()> {
     let cert_path = env::var("CERT_PATH").unwrap_or_else(|_| "cert.pem".to_string());
     let key_path = env::var("KEY_PATH").unwrap_or_else(|_| "key.pem".to_string());
     let ca_path = env::var("CA_PATH").unwrap_or_else(|_| "ca.pem".to_string());
+    // INTERMEDIATES_PATH: intermediate CAs for building the verified chains
+    // reported by /api/certs, for clients that send only their leaf
+    let intermediates_path = env::var("INTERMEDIATES_PATH").ok();
+
+    // Session resumption: SESSION_CACHE_SIZE=0 disables the stateful cache,
+    // TICKET_ROTATION_SECS=0 disables stateless tickets
+    let defaults = ResumptionConfig::default();
+    let resumption = ResumptionConfig {
+        cache_size: env::var("SESSION_CACHE_SIZE")
+            .ok()
+            .and_then(|v| v.parse().ok())
+            .unwrap_or(defaults.cache_size),
+        ticket_rotation: env::var("TICKET_ROTATION_SECS")
+            .ok()
+            .and_then(|v| v.parse().ok())
+            .map(Duration::from_secs)
+            .unwrap_or(defaults.ticket_rotation),
+        ticket_key_file: env::var("TICKET_KEY_FILE").ok().map(PathBuf::from),
+    };
 
-    println!("Building TLS config from cert={}, key={}, ca={}",
-             cert_path, key_path, ca_path);
+    log::info!("Building TLS config from cert={}, key={}, ca={}",
+               cert_path, key_path, ca_path);
+    log::info!("Session resumption: cache_size={}, ticket_rotation={}s, ticket_key_file={:?}",
+               resumption.cache_size, resumption.ticket_rotation.as_secs(), resumption.ticket_key_file);
 
     // Build TLS configuration
-    let tls_config = build_tls_config(&cert_path, &key_path, &ca_path)
+    // REVOCATION_FILE: compiled revocation set (certgen/compile-revocations.py)
+    // ACL_FILE: client identity to route rules (certgen/build-acl.py)
+    // TENANTS_FILE: SNI hostname to certificate, key and client CA; other
+    // hostnames get CERT_PATH/KEY_PATH/CA_PATH
+    let revocation_path = env::var("REVOCATION_FILE").ok();
+    let acl_path = env::var("ACL_FILE").ok();
+    let tenants_path = env::var("TENANTS_FILE").ok();
+    let reloader = Arc::new(TlsReloader::new(&cert_path, &key_path, &ca_path, intermediates_path.as_deref(),
+                                             revocation_path.as_deref(), acl_path.as_deref(),
+                                             tenants_path.as_deref())
+        .expect("Failed to load TLS certificates"));
+    let tls_config = build_tls_config(&reloader, &resumption)
         .expect("Failed to build TLS config");
 
-    println!("Starting mTLS server on {}", server_addr);
+    // Pick up renewed certificates without a restart: poll the files every
+    // TLS_RELOAD_INTERVAL_SECS (0 disables) and reload on SIGHUP
+    let reload_interval = env::var("TLS_RELOAD_INTERVAL_SECS")
+        .ok()
+        .and_then(|v| v.parse().ok())
+        .map(Duration::from_secs)
+        .unwrap_or(reload::DEFAULT_RELOAD_INTERVAL);
+    if !reload_interval.is_zero() {
+        log::info!("Watching TLS files for changes every {}s", reload_interval.as_secs());
+        actix_web::rt::spawn(reloader.clone().watch(reload_interval));
+    }
+    #[cfg(unix)]
+    actix_web::rt::spawn(reloader.clone().reload_on_sighup());
+
+    let revocations = reloader.revocations();
+    let acl = reloader.acl();
+    let chains = reloader.chains();
+    let tenants = reloader.tenants();
+
+    // ACCESS_LOG: file to append one JSON line per request to ("-" for
+    // stdout), written from a background thread; unset disables it
+    if let Ok(path) = env::var("ACCESS_LOG") {
+        access_log::init(&path)?;
+        log::info!("Writing access log to {}", path);
+    }
+
+    // RATE_LIMIT_RPS/RATE_LIMIT_BURST per client, MAX_REQUESTS_IN_FLIGHT
+    // overall, HANDSHAKE_RATE_LIMIT/HANDSHAKE_BURST per client certificate;
+    // all off by default
+    let rate_limits = RateLimitConfig::from_env();
+    if rate_limits.enabled() {
+        log::info!("Rate limits: {:?}", rate_limits);
+        ratelimit::init(rate_limits);
+        actix_web::rt::spawn(ratelimit::expire_idle());
+    }
+
+    // Workers, backlog, connection limits and timeouts; PROCESSES > 1 starts
+    // that many processes sharing the port through SO_REUSEPORT
+    let tuning = ServerTuning::from_env();
+    let process_index = cluster::process_index();
+    log::info!("Server tuning: {:?}", tuning);
+    if tuning.reuse_port && resumption.ticket_key_file.is_none() && !resumption.ticket_rotation.is_zero() {
+        log::warn!("Each process has its own ticket keys; set TICKET_KEY_FILE so sessions resume across processes");
+    }
+    let children = if process_index == 0 && tuning.processes > 1 {
+        log::info!("Starting {} more server processes", tuning.processes - 1);
+        cluster::spawn_processes(tuning.processes - 1)?
+    } else {
+        Vec::new()
+    };
+
+    log::info!("Starting mTLS server on {} (process {})", server_addr, process_index);
 
     // Create and run HTTP server
-    // NOTE: .on_connect() must be called BEFORE .bind_rustls_0_23() because
-    // bind captures on_connect_fn by value at call time.
-    HttpServer::new(|| {
+    // NOTE: .on_connect() must be called BEFORE .bind_rustls_0_23() /
+    // .listen_rustls_0_23() because they capture on_connect_fn by value at
+    // call time.
+    let request_acl = acl.clone();
+    let server = HttpServer::new(move || {
+        let acl = request_acl.clone();
         App::new()
+            .wrap_fn(move |req, srv| {
+                let route = metrics::route_index(req.path());
+                let start = Instant::now();
+                let identity = req.conn_data::<ClientIdentity>();
+                // /metrics stays reachable so an overload can be observed
+                let admission = if req.path() == "/metrics" {
+                    Ok(None)
+                } else {
+                    ratelimit::admit(identity, req.peer_addr().map(|addr| addr.ip()))
+                };
+                let (fut, denied, in_flight) = match admission {
+                    Err(rejection) => (None, Some(req.into_response(rejected_response(rejection))), None),
+                    Ok(in_flight) => match acl.check(identity, route) {
+                        AclDecision::Allow => (Some(srv.call(req)), None, in_flight),
+                        decision => {
+                            let response = acl_denied_response(decision, req.path());
+                            (None, Some(req.into_response(response)), in_flight)
+                        }
+                    },
+                };
+                async move {
+                    let _in_flight = in_flight;
+                    let res = match fut {
+                        Some(fut) => fut.await.map(ServiceResponse::map_into_boxed_body),
+                        None => Ok(denied.expect("denied requests have a response")),
+                    };
+                    let elapsed = start.elapsed();
+                    metrics().observe_request(route, elapsed);
+                    if let Ok(res) = &res {
+                        record_access(res, elapsed);
+                    }
+                    res
+                }
+            })
             .route("/health", web::get().to(health_handler))
             .route("/api/certs", web::get().to(certs_handler))
+            .route("/api/certs", web::head().to(certs_head_handler))
+            .route("/api/certs/valid", web::get().to(certs_valid_handler))
+            .route("/api/certs/valid", web::head().to(certs_valid_handler))
+            .route("/metrics", web::get().to(metrics_handler))
     })
-    .on_connect(on_connect_handler)
-    .bind_rustls_0_23(&server_addr, tls_config)?
-    .run()
-    .await
+    .workers(tuning.workers)
+    .max_connections(tuning.max_connections)
+    .max_connection_rate(tuning.max_connection_rate)
+    .keep_alive(tuning.keep_alive)
+    .client_request_timeout(tuning.client_request_timeout)
+    .client_disconnect_timeout(tuning.client_disconnect_timeout)
+    .tls_handshake_timeout(tuning.tls_handshake_timeout)
+    .shutdown_timeout(tuning.shutdown_timeout.as_secs())
+    .on_connect(move |connection, data| {
+        on_connect_handler(connection, data, &revocations, &acl, &chains, tenants.as_deref())
+    });
+
+    // Take over the listeners of the server that started this one on
+    // SIGUSR2, or bind them
+    #[cfg(unix)]
+    let inherited = handoff::inherited_listeners()?;
+    #[cfg(not(unix))]
+    let inherited: Option<Vec<std::net::TcpListener>> = None;
+    let listeners = match inherited {
+        Some(listeners) => {
+            log::info!("Serving {} listeners handed off by the previous server", listeners.len());
+            listeners
+        }
+        None => cluster::bind_listeners(&server_addr, tuning.backlog, tuning.reuse_port)?,
+    };
+    // Several processes each hold their own SO_REUSEPORT socket, which a
+    // successor cannot inherit in one piece
+    #[cfg(unix)]
+    let handoff = match tuning.processes {
+        1 => Some(Arc::new(Handoff::new(&listeners)?)),
+        _ => None,
+    };
+
+    let mut server = server;
+    for listener in listeners {
+        server = server.listen_rustls_0_23(listener, tls_config.clone())?;
+    }
+    // Signals are handled by stop_on_signal, which also drains on SIGINT
+    #[cfg(unix)]
+    let server = server.disable_signals();
+    let server = server.run();
+    #[cfg(unix)]
+    {
+        actix_web::rt::spawn(stop_on_signal(server.handle(), handoff, tuning.handoff_timeout));
+        handoff::notify_ready();
+    }
+
+    if process_index > 0 {
+        let handle = server.handle();
+        actix_web::rt::spawn(async move {
+            cluster::wait_for_parent().await;
+            log::info!("Parent process exited, shutting down");
+            handle.stop(true).await;
+        });
+    }
+
+    let result = server.await;
+    cluster::stop_processes(children);
+    result
 }
@@ -0,0 +1,332 @@
+use std::fmt::Write;
+use std::sync::atomic::{AtomicI64, AtomicU64, Ordering};
+use std::time::Duration;
+
+/// Histogram bucket upper bounds in seconds, shared by all latency histograms
+const LATENCY_BUCKETS: [f64; 14] = [
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+];
+
+/// Routes that get their own request latency series; anything else is "other"
+/// so a scanner hitting random paths cannot blow up label cardinality.
+pub const ROUTES: [&str; 4] = ["/health", "/api/certs", "/metrics", "/api/certs/valid"];
+
+/// Lock-free histogram with fixed buckets
+pub struct Histogram {
+    buckets: [AtomicU64; LATENCY_BUCKETS.len()],
+    count: AtomicU64,
+    sum_nanos: AtomicU64,
+}
+
+impl Histogram {
+    const fn new() -> Self {
+        Self {
+            buckets: [const { AtomicU64::new(0) }; LATENCY_BUCKETS.len()],
+            count: AtomicU64::new(0),
+            sum_nanos: AtomicU64::new(0),
+        }
+    }
+
+    pub fn observe(&self, elapsed: Duration) {
+        let secs = elapsed.as_secs_f64();
+        // Buckets are stored non-cumulative and summed when rendering, so an
+        // observation touches a single bucket counter.
+        if let Some(i) = LATENCY_BUCKETS.iter().position(|&le| secs <= le) {
+            self.buckets[i].fetch_add(1, Ordering::Relaxed);
+        }
+        self.count.fetch_add(1, Ordering::Relaxed);
+        self.sum_nanos
+            .fetch_add(u64::try_from(elapsed.as_nanos()).unwrap_or(u64::MAX), Ordering::Relaxed);
+    }
+
+    fn render(&self, out: &mut String, name: &str, labels: &str) {
+        let sep = if labels.is_empty() { "" } else { "," };
+        let mut cumulative = 0;
+        for (le, bucket) in LATENCY_BUCKETS.iter().zip(&self.buckets) {
+            cumulative += bucket.load(Ordering::Relaxed);
+            let _ = writeln!(out, "{}_bucket{{{}{}le=\"{}\"}} {}", name, labels, sep, le, cumulative);
+        }
+        let count = self.count.load(Ordering::Relaxed);
+        let _ = writeln!(out, "{}_bucket{{{}{}le=\"+Inf\"}} {}", name, labels, sep, count);
+        let sum = self.sum_nanos.load(Ordering::Relaxed) as f64 / 1e9;
+        if labels.is_empty() {
+            let _ = writeln!(out, "{}_sum {}", name, sum);
+            let _ = writeln!(out, "{}_count {}", name, count);
+        } else {
+            let _ = writeln!(out, "{}_sum{{{}}} {}", name, labels, sum);
+            let _ = writeln!(out, "{}_count{{{}}} {}", name, labels, count);
+        }
+    }
+}
+
+/// Process-wide server metrics, rendered in the Prometheus text format
+pub struct Metrics {
+    /// ClientHellos received (every TLS connection attempt reaches this point)
+    pub connections_accepted: AtomicU64,
+    /// Handshakes completed with a verified client certificate
+    pub handshakes_succeeded: AtomicU64,
+    /// Handshakes completed without a client certificate
+    pub handshakes_no_client_cert: AtomicU64,
+    /// Handshakes aborted because the client certificate was rejected
+    pub handshakes_failed: AtomicU64,
+    /// Connections whose handshake completed and that are still open
+    pub connections_in_flight: AtomicI64,
+    /// Connections that negotiated HTTP/2 through ALPN
+    pub connections_h2: AtomicU64,
+    /// Connections that negotiated http/1.1 or no ALPN protocol
+    pub connections_http1: AtomicU64,
+    /// Server signature time per handshake (the dominant full-handshake cost)
+    pub handshake_sign: Histogram,
+    /// Client chain verification time per handshake
+    pub client_cert_verify: Histogram,
+    /// Peer certificate parsing time per connection
+    pub cert_parse: Histogram,
+    /// Request latency per entry in ROUTES, plus a trailing "other"
+    pub requests: [Histogram; ROUTES.len() + 1],
+    /// Log lines discarded because the logger queue was full
+    pub log_lines_dropped: AtomicU64,
+    /// Access log records discarded because the writer queue was full
+    pub access_log_dropped: AtomicU64,
+    /// Certificate/key/client CA reloads that were applied
+    pub tls_reloads_succeeded: AtomicU64,
+    /// Reload attempts that failed and kept the previous material
+    pub tls_reloads_failed: AtomicU64,
+    /// Entries in the revocation set currently in force
+    pub revoked_certificates: AtomicU64,
+    /// Fingerprint and CN rules in the ACL currently in force
+    pub acl_rules: AtomicU64,
+    /// Requests refused by the ACL for lack of a client certificate
+    pub acl_unauthenticated: AtomicU64,
+    /// Requests refused by the ACL because the certificate lacks the route
+    pub acl_forbidden: AtomicU64,
+    /// Connections whose verified chains were already memoized for the leaf
+    pub chain_cache_hits: AtomicU64,
+    /// Connections whose verified chains had to be built
+    pub chain_cache_misses: AtomicU64,
+    /// Tenants in the tenant file currently in force
+    pub tenants_configured: AtomicU64,
+    /// Tenants whose certificate and client CAs have been loaded
+    pub tenants_loaded: AtomicU64,
+    /// Handshakes refused because their client certificate exceeded its
+    /// handshake rate
+    pub handshakes_rate_limited: AtomicU64,
+    /// Requests refused with 429 because the client exceeded its rate
+    pub requests_rate_limited: AtomicU64,
+    /// Requests refused with 503 because too many were in flight
+    pub requests_overloaded: AtomicU64,
+    /// Clients with a request rate bucket after the last idle sweep
+    pub rate_limit_request_clients: AtomicU64,
+    /// Certificates with a handshake rate bucket after the last idle sweep
+    pub rate_limit_handshake_clients: AtomicU64,
+}
+
+impl Metrics {
+    const fn new() -> Self {
+        Self {
+            connections_accepted: AtomicU64::new(0),
+            handshakes_succeeded: AtomicU64::new(0),
+            handshakes_no_client_cert: AtomicU64::new(0),
+            handshakes_failed: AtomicU64::new(0),
+            connections_in_flight: AtomicI64::new(0),
+            connections_h2: AtomicU64::new(0),
+            connections_http1: AtomicU64::new(0),
+            handshake_sign: Histogram::new(),
+            client_cert_verify: Histogram::new(),
+            cert_parse: Histogram::new(),
+            requests: [const { Histogram::new() }; ROUTES.len() + 1],
+            log_lines_dropped: AtomicU64::new(0),
+            access_log_dropped: AtomicU64::new(0),
+            tls_reloads_succeeded: AtomicU64::new(0),
+            tls_reloads_failed: AtomicU64::new(0),
+            revoked_certificates: AtomicU64::new(0),
+            acl_rules: AtomicU64::new(0),
+            acl_unauthenticated: AtomicU64::new(0),
+            acl_forbidden: AtomicU64::new(0),
+            chain_cache_hits: AtomicU64::new(0),
+            chain_cache_misses: AtomicU64::new(0),
+            tenants_configured: AtomicU64::new(0),
+            tenants_loaded: AtomicU64::new(0),
+            handshakes_rate_limited: AtomicU64::new(0),
+            requests_rate_limited: AtomicU64::new(0),
+            requests_overloaded: AtomicU64::new(0),
+            rate_limit_request_clients: AtomicU64::new(0),
+            rate_limit_handshake_clients: AtomicU64::new(0),
+        }
+    }
+
+    /// Record the latency of a request to the route at `route_index`
+    pub fn observe_request(&self, route_index: usize, elapsed: Duration) {
+        self.requests[route_index.min(ROUTES.len())].observe(elapsed);
+    }
+
+    /// Render all metrics in the Prometheus text exposition format
+    pub fn render(&self) -> String {
+        let mut out = String::with_capacity(8 * 1024);
+
+        counter(&mut out, "mtls_connections_accepted_total",
+                "TLS connections that reached the ClientHello",
+                self.connections_accepted.load(Ordering::Relaxed));
+
+        let _ = writeln!(out, "# HELP mtls_handshakes_total Completed or rejected TLS handshakes by result. \
+                               Failures for other reasons are accepted minus these.");
+        let _ = writeln!(out, "# TYPE mtls_handshakes_total counter");
+        for (result, value) in [
+            ("success", &self.handshakes_succeeded),
+            ("no_client_cert", &self.handshakes_no_client_cert),
+            ("failed", &self.handshakes_failed),
+            ("rate_limited", &self.handshakes_rate_limited),
+        ] {
+            let _ = writeln!(out, "mtls_handshakes_total{{result=\"{}\"}} {}", result, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_connections_total Connections past the handshake by negotiated protocol");
+        let _ = writeln!(out, "# TYPE mtls_connections_total counter");
+        for (protocol, value) in [("h2", &self.connections_h2), ("http/1.1", &self.connections_http1)] {
+            let _ = writeln!(out, "mtls_connections_total{{protocol=\"{}\"}} {}", protocol, value.load(Ordering::Relaxed));
+        }
+
+        counter(&mut out, "mtls_log_lines_dropped_total",
+                "Log lines dropped because the logger queue was full",
+                self.log_lines_dropped.load(Ordering::Relaxed));
+        counter(&mut out, "mtls_access_log_dropped_total",
+                "Access log records dropped because the writer queue was full",
+                self.access_log_dropped.load(Ordering::Relaxed));
+
+        let _ = writeln!(out, "# HELP mtls_tls_reloads_total Certificate, key and client CA reloads by result");
+        let _ = writeln!(out, "# TYPE mtls_tls_reloads_total counter");
+        for (result, value) in [("success", &self.tls_reloads_succeeded), ("failed", &self.tls_reloads_failed)] {
+            let _ = writeln!(out, "mtls_tls_reloads_total{{result=\"{}\"}} {}", result, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_revoked_certificates Entries in the loaded revocation set");
+        let _ = writeln!(out, "# TYPE mtls_revoked_certificates gauge");
+        let _ = writeln!(out, "mtls_revoked_certificates {}", self.revoked_certificates.load(Ordering::Relaxed));
+
+        let _ = writeln!(out, "# HELP mtls_acl_rules Fingerprint and CN rules in the loaded ACL");
+        let _ = writeln!(out, "# TYPE mtls_acl_rules gauge");
+        let _ = writeln!(out, "mtls_acl_rules {}", self.acl_rules.load(Ordering::Relaxed));
+
+        let _ = writeln!(out, "# HELP mtls_acl_denied_total Requests refused by the ACL by reason");
+        let _ = writeln!(out, "# TYPE mtls_acl_denied_total counter");
+        for (reason, value) in [("unauthenticated", &self.acl_unauthenticated), ("forbidden", &self.acl_forbidden)] {
+            let _ = writeln!(out, "mtls_acl_denied_total{{reason=\"{}\"}} {}", reason, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_chain_cache_total Verified chain lookups per connection by result");
+        let _ = writeln!(out, "# TYPE mtls_chain_cache_total counter");
+        for (result, value) in [("hit", &self.chain_cache_hits), ("miss", &self.chain_cache_misses)] {
+            let _ = writeln!(out, "mtls_chain_cache_total{{result=\"{}\"}} {}", result, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_tenants SNI tenants by state: configured in the tenant file, loaded on demand");
+        let _ = writeln!(out, "# TYPE mtls_tenants gauge");
+        for (state, value) in [("configured", &self.tenants_configured), ("loaded", &self.tenants_loaded)] {
+            let _ = writeln!(out, "mtls_tenants{{state=\"{}\"}} {}", state, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_requests_rejected_total Requests refused by admission control by reason");
+        let _ = writeln!(out, "# TYPE mtls_requests_rejected_total counter");
+        for (reason, value) in [("rate_limited", &self.requests_rate_limited), ("overloaded", &self.requests_overloaded)] {
+            let _ = writeln!(out, "mtls_requests_rejected_total{{reason=\"{}\"}} {}", reason, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_rate_limit_clients Clients tracked by the rate limiters");
+        let _ = writeln!(out, "# TYPE mtls_rate_limit_clients gauge");
+        for (limiter, value) in [("requests", &self.rate_limit_request_clients),
+                                 ("handshakes", &self.rate_limit_handshake_clients)] {
+            let _ = writeln!(out, "mtls_rate_limit_clients{{limiter=\"{}\"}} {}", limiter, value.load(Ordering::Relaxed));
+        }
+
+        let _ = writeln!(out, "# HELP mtls_connections_in_flight Open connections past the handshake");
+        let _ = writeln!(out, "# TYPE mtls_connections_in_flight gauge");
+        let _ = writeln!(out, "mtls_connections_in_flight {}", self.connections_in_flight.load(Ordering::Relaxed));
+
+        histogram(&mut out, "mtls_handshake_sign_seconds",
+                  "Server handshake signature time", &self.handshake_sign);
+        histogram(&mut out, "mtls_client_cert_verify_seconds",
+                  "Client certificate chain verification time", &self.client_cert_verify);
+        histogram(&mut out, "mtls_cert_parse_seconds",
+                  "Peer certificate parsing time per connection", &self.cert_parse);
+
+        let _ = writeln!(out, "# HELP mtls_request_duration_seconds Request latency by route");
+        let _ = writeln!(out, "# TYPE mtls_request_duration_seconds histogram");
+        for (i, hist) in self.requests.iter().enumerate() {
+            let route = ROUTES.get(i).copied().unwrap_or("other");
+            hist.render(&mut out, "mtls_request_duration_seconds", &format!("route=\"{}\"", route));
+        }
+
+        out
+    }
+}
+
+fn counter(out: &mut String, name: &str, help: &str, value: u64) {
+    let _ = writeln!(out, "# HELP {} {}", name, help);
+    let _ = writeln!(out, "# TYPE {} counter", name);
+    let _ = writeln!(out, "{} {}", name, value);
+}
+
+fn histogram(out: &mut String, name: &str, help: &str, hist: &Histogram) {
+    let _ = writeln!(out, "# HELP {} {}", name, help);
+    let _ = writeln!(out, "# TYPE {} histogram", name);
+    hist.render(out, name, "");
+}
+
+/// Index of `path` in ROUTES, or the "other" slot
+pub fn route_index(path: &str) -> usize {
+    ROUTES.iter().position(|&r| r == path).unwrap_or(ROUTES.len())
+}
+
+static METRICS: Metrics = Metrics::new();
+
+/// Global metrics registry
+pub fn metrics() -> &'static Metrics {
+    &METRICS
+}
+
+/// Keeps a connection counted as in flight; stored in the connection
+/// extensions so it is dropped, and the gauge decremented, on close.
+pub struct ConnectionGuard;
+
+impl ConnectionGuard {
+    pub fn new() -> Self {
+        metrics().connections_in_flight.fetch_add(1, Ordering::Relaxed);
+        ConnectionGuard
+    }
+}
+
+impl Drop for ConnectionGuard {
+    fn drop(&mut self) {
+        metrics().connections_in_flight.fetch_sub(1, Ordering::Relaxed);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_histogram_render() {
+        let hist = Histogram::new();
+        hist.observe(Duration::from_micros(80));
+        hist.observe(Duration::from_millis(3));
+        hist.observe(Duration::from_secs(5));
+
+        let mut out = String::new();
+        hist.render(&mut out, "test_seconds", "route=\"/health\"");
+        assert!(out.contains("test_seconds_bucket{route=\"/health\",le=\"0.0001\"} 1\n"));
+        assert!(out.contains("test_seconds_bucket{route=\"/health\",le=\"0.005\"} 2\n"));
+        assert!(out.contains("test_seconds_bucket{route=\"/health\",le=\"+Inf\"} 3\n"));
+        assert!(out.contains("test_seconds_count{route=\"/health\"} 3\n"));
+    }
+
+    #[test]
+    fn test_unknown_routes_share_a_series() {
+        let m = Metrics::new();
+        m.observe_request(route_index("/api/certs"), Duration::from_millis(1));
+        m.observe_request(route_index("/wp-login.php"), Duration::from_millis(1));
+        m.observe_request(route_index("/.env"), Duration::from_millis(1));
+        assert_eq!(m.requests[1].count.load(Ordering::Relaxed), 1);
+        assert_eq!(m.requests[ROUTES.len()].count.load(Ordering::Relaxed), 2);
+        assert!(m.render().contains("mtls_request_duration_seconds_count{route=\"other\"} 2"));
+    }
+}
@@ -0,0 +1,304 @@
+use std::collections::hash_map::RandomState;
+use std::collections::HashMap;
+use std::hash::{BuildHasher, Hash};
+use std::net::IpAddr;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::{Mutex, OnceLock};
+use std::time::{Duration, Instant};
+
+use crate::acl::{sha256, ClientIdentity, Fingerprint};
+use crate::metrics::metrics;
+use crate::tuning::env_or;
+
+/// Default time after which a client's bucket is forgotten
+pub const DEFAULT_IDLE_EXPIRY: Duration = Duration::from_secs(300);
+
+/// Admission control settings; every limit is off at 0
+#[derive(Debug, Clone)]
+pub struct RateLimitConfig {
+    /// Sustained requests per second per client certificate, or per peer
+    /// address without one (RATE_LIMIT_RPS)
+    pub requests_per_sec: f64,
+    /// Requests a client may send at once after being idle
+    /// (RATE_LIMIT_BURST, default twice the rate)
+    pub request_burst: f64,
+    /// Requests being served at once across all clients; more get a 503
+    /// (MAX_REQUESTS_IN_FLIGHT)
+    pub max_in_flight: usize,
+    /// Sustained handshakes per second per presented client certificate,
+    /// checked before its chain is verified (HANDSHAKE_RATE_LIMIT)
+    pub handshakes_per_sec: f64,
+    /// Handshakes a certificate may make at once (HANDSHAKE_BURST, default
+    /// twice the rate)
+    pub handshake_burst: f64,
+    /// Buckets untouched for this long are dropped (RATE_LIMIT_IDLE_SECS)
+    pub idle_expiry: Duration,
+}
+
+impl RateLimitConfig {
+    pub fn from_env() -> Self {
+        let requests_per_sec = env_or("RATE_LIMIT_RPS", 0.0_f64).max(0.0);
+        let handshakes_per_sec = env_or("HANDSHAKE_RATE_LIMIT", 0.0_f64).max(0.0);
+        Self {
+            requests_per_sec,
+            request_burst: env_or("RATE_LIMIT_BURST", requests_per_sec * 2.0).max(1.0),
+            max_in_flight: env_or("MAX_REQUESTS_IN_FLIGHT", 0),
+            handshakes_per_sec,
+            handshake_burst: env_or("HANDSHAKE_BURST", handshakes_per_sec * 2.0).max(1.0),
+            idle_expiry: Duration::from_secs(env_or("RATE_LIMIT_IDLE_SECS", DEFAULT_IDLE_EXPIRY.as_secs())),
+        }
+    }
+
+    pub fn enabled(&self) -> bool {
+        self.requests_per_sec > 0.0 || self.max_in_flight > 0 || self.handshakes_per_sec > 0.0
+    }
+}
+
+struct Bucket {
+    tokens: f64,
+    updated: Instant,
+}
+
+/// Token buckets keyed by client, split over independently locked shards so
+/// concurrent workers rarely contend for the same lock
+pub struct TokenBuckets<K> {
+    rate: f64,
+    burst: f64,
+    idle_expiry: Duration,
+    hasher: RandomState,
+    shards: Box<[Mutex<HashMap<K, Bucket>>]>,
+}
+
+impl<K: Hash + Eq> TokenBuckets<K> {
+    /// Buckets refilling at `rate` tokens per second up to `burst`. An idle
+    /// bucket is full again after burst/rate seconds, so expiring it no
+    /// sooner than that never lets a client exceed its rate.
+    pub fn new(rate: f64, burst: f64, idle_expiry: Duration) -> Self {
+        let cores = std::thread::available_parallelism().map(|n| n.get()).unwrap_or(1);
+        let shards = (cores * 4).next_power_of_two();
+        Self {
+            rate,
+            burst,
+            idle_expiry: idle_expiry.max(Duration::from_secs_f64(burst / rate)),
+            hasher: RandomState::new(),
+            shards: (0..shards).map(|_| Mutex::new(HashMap::new())).collect(),
+        }
+    }
+
+    fn shard(&self, key: &K) -> &Mutex<HashMap<K, Bucket>> {
+        let hash = self.hasher.hash_one(key) as usize;
+        &self.shards[hash & (self.shards.len() - 1)]
+    }
+
+    /// Take a token for `key`, or return how long until one is available
+    pub fn try_acquire(&self, key: K, now: Instant) -> Result<(), Duration> {
+        let mut shard = self.shard(&key).lock().unwrap();
+        let bucket = shard.entry(key).or_insert(Bucket { tokens: self.burst, updated: now });
+        let elapsed = now.saturating_duration_since(bucket.updated).as_secs_f64();
+        bucket.tokens = (bucket.tokens + elapsed * self.rate).min(self.burst);
+        bucket.updated = now;
+        if bucket.tokens >= 1.0 {
+            bucket.tokens -= 1.0;
+            Ok(())
+        } else {
+            Err(Duration::from_secs_f64((1.0 - bucket.tokens) / self.rate))
+        }
+    }
+
+    /// Drop buckets idle for longer than the expiry; returns how many remain
+    pub fn expire_idle(&self, now: Instant) -> usize {
+        self.shards
+            .iter()
+            .map(|shard| {
+                let mut shard = shard.lock().unwrap();
+                shard.retain(|_, bucket| now.saturating_duration_since(bucket.updated) < self.idle_expiry);
+                shard.len()
+            })
+            .sum()
+    }
+}
+
+/// Who a request is charged to
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
+pub enum ClientKey {
+    Certificate(Fingerprint),
+    Address(IpAddr),
+}
+
+/// Why a request was refused
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum Rejection {
+    /// The server is at MAX_REQUESTS_IN_FLIGHT (503)
+    Overloaded,
+    /// The client used up its bucket; a token is available after this (429)
+    RateLimited(Duration),
+}
+
+struct Limits {
+    config: RateLimitConfig,
+    in_flight: AtomicUsize,
+    requests: Option<TokenBuckets<ClientKey>>,
+    handshakes: Option<TokenBuckets<Fingerprint>>,
+}
+
+static LIMITS: OnceLock<Limits> = OnceLock::new();
+
+/// Counts a request as in flight until dropped
+pub struct InFlight(());
+
+impl Drop for InFlight {
+    fn drop(&mut self) {
+        if let Some(limits) = LIMITS.get() {
+            limits.in_flight.fetch_sub(1, Ordering::Relaxed);
+        }
+    }
+}
+
+/// Install the limits for the rest of the process; a no-op when none is
+/// configured, so every check stays a single load
+pub fn init(config: RateLimitConfig) {
+    if !config.enabled() {
+        return;
+    }
+    let limits = Limits {
+        requests: (config.requests_per_sec > 0.0)
+            .then(|| TokenBuckets::new(config.requests_per_sec, config.request_burst, config.idle_expiry)),
+        handshakes: (config.handshakes_per_sec > 0.0)
+            .then(|| TokenBuckets::new(config.handshakes_per_sec, config.handshake_burst, config.idle_expiry)),
+        in_flight: AtomicUsize::new(0),
+        config,
+    };
+    if LIMITS.set(limits).is_err() {
+        log::warn!("Rate limits already initialized");
+    }
+}
+
+/// Whether requests are charged to the client certificate, which on_connect
+/// must then hash into a ClientIdentity
+pub fn keyed_by_certificate() -> bool {
+    LIMITS.get().is_some_and(|limits| limits.requests.is_some())
+}
+
+/// Admit a request from `identity`, else from `peer`: first against the
+/// global in-flight cap, then against the client's bucket. The returned
+/// guard must live until the response is complete.
+pub fn admit(identity: Option<&ClientIdentity>, peer: Option<IpAddr>) -> Result<Option<InFlight>, Rejection> {
+    let Some(limits) = LIMITS.get() else { return Ok(None) };
+
+    let guard = if limits.config.max_in_flight > 0 {
+        if limits.in_flight.fetch_add(1, Ordering::Relaxed) >= limits.config.max_in_flight {
+            limits.in_flight.fetch_sub(1, Ordering::Relaxed);
+            metrics().requests_overloaded.fetch_add(1, Ordering::Relaxed);
+            return Err(Rejection::Overloaded);
+        }
+        Some(InFlight(()))
+    } else {
+        None
+    };
+
+    if let Some(requests) = &limits.requests {
+        let key = match (identity, peer) {
+            (Some(identity), _) => ClientKey::Certificate(identity.cert_sha256),
+            (None, Some(address)) => ClientKey::Address(address),
+            // Nothing to charge the request to
+            (None, None) => return Ok(guard),
+        };
+        if let Err(retry_after) = requests.try_acquire(key, Instant::now()) {
+            metrics().requests_rate_limited.fetch_add(1, Ordering::Relaxed);
+            return Err(Rejection::RateLimited(retry_after));
+        }
+    }
+    Ok(guard)
+}
+
+/// Whether a handshake presenting `end_entity` is within its certificate's
+/// handshake rate. Called by the client certificate verifiers before any
+/// chain building or signature check, so a client replaying one certificate
+/// costs a hash per attempt rather than a verification.
+pub fn admit_handshake(end_entity: &[u8]) -> bool {
+    let Some(handshakes) = LIMITS.get().and_then(|limits| limits.handshakes.as_ref()) else { return true };
+    if handshakes.try_acquire(sha256(end_entity), Instant::now()).is_ok() {
+        return true;
+    }
+    metrics().handshakes_rate_limited.fetch_add(1, Ordering::Relaxed);
+    false
+}
+
+/// Periodically drop idle buckets so memory stays proportional to the
+/// clients seen within the idle expiry
+pub async fn expire_idle() {
+    let Some(limits) = LIMITS.get() else { return };
+    let mut ticker = tokio::time::interval((limits.config.idle_expiry / 2).max(Duration::from_secs(1)));
+    ticker.set_missed_tick_behavior(tokio::time::MissedTickBehavior::Delay);
+    loop {
+        ticker.tick().await;
+        let now = Instant::now();
+        if let Some(requests) = &limits.requests {
+            metrics().rate_limit_request_clients.store(requests.expire_idle(now) as u64, Ordering::Relaxed);
+        }
+        if let Some(handshakes) = &limits.handshakes {
+            metrics().rate_limit_handshake_clients.store(handshakes.expire_idle(now) as u64, Ordering::Relaxed);
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::sync::Arc;
+
+    fn buckets(rate: f64, burst: f64) -> Arc<TokenBuckets<ClientKey>> {
+        Arc::new(TokenBuckets::new(rate, burst, Duration::ZERO))
+    }
+
+    #[test]
+    fn test_bucket_allows_burst_then_refills() {
+        let limiter = buckets(10.0, 3.0);
+        let key = ClientKey::Certificate([1; 32]);
+        let start = Instant::now();
+        for _ in 0..3 {
+            assert!(limiter.try_acquire(key, start).is_ok());
+        }
+        let retry_after = limiter.try_acquire(key, start).unwrap_err();
+        assert!(retry_after > Duration::ZERO && retry_after <= Duration::from_millis(100));
+
+        // Other clients have their own bucket
+        assert!(limiter.try_acquire(ClientKey::Address("192.0.2.1".parse().unwrap()), start).is_ok());
+
+        // 100 ms at 10/s is one token
+        assert!(limiter.try_acquire(key, start + Duration::from_millis(100)).is_ok());
+        assert!(limiter.try_acquire(key, start + Duration::from_millis(100)).is_err());
+    }
+
+    #[test]
+    fn test_idle_buckets_expire_once_full() {
+        // Expiry is never shorter than the refill time (burst/rate = 0.5s)
+        let limiter = buckets(4.0, 2.0);
+        let start = Instant::now();
+        limiter.try_acquire(ClientKey::Certificate([1; 32]), start).unwrap();
+        limiter.try_acquire(ClientKey::Certificate([2; 32]), start + Duration::from_millis(400)).unwrap();
+        assert_eq!(limiter.expire_idle(start + Duration::from_millis(500)), 1);
+        assert_eq!(limiter.expire_idle(start + Duration::from_secs(1)), 0);
+    }
+
+    #[test]
+    fn test_buckets_are_safe_across_threads() {
+        let limiter = buckets(1e-9, 1000.0);
+        let start = Instant::now();
+        let admitted: usize = (0..8)
+            .map(|i| {
+                let limiter = limiter.clone();
+                std::thread::spawn(move || {
+                    (0..500)
+                        .filter(|n| limiter.try_acquire(ClientKey::Certificate([(i + n) as u8 % 2; 32]), start).is_ok())
+                        .count()
+                })
+            })
+            .collect::<Vec<_>>()
+            .into_iter()
+            .map(|t| t.join().unwrap())
+            .sum();
+        // Two clients with a burst of 1000 each, no refill
+        assert_eq!(admitted, 2000);
+    }
+}
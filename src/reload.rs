@@ -0,0 +1,359 @@
+use rustls::crypto::CryptoProvider;
+use rustls::pki_types::{CertificateDer, PrivateKeyDer};
+use rustls::server::danger::ClientCertVerifier;
+use rustls::server::WebPkiClientVerifier;
+use rustls::sign::CertifiedKey;
+use rustls::RootCertStore;
+use rustls_pemfile::{certs, pkcs8_private_keys};
+use std::error::Error;
+use std::fs;
+use std::io::BufReader;
+use std::path::{Path, PathBuf};
+use std::sync::atomic::Ordering;
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, SystemTime};
+
+use crate::acl::{Acl, AclIndex};
+use crate::chain::{ChainIndex, Chains};
+use crate::metrics::metrics;
+use crate::revocation::{RevocationSet, Revocations};
+use crate::tenant::Tenants;
+use crate::tls::{ReloadableResolver, ReloadableVerifier};
+
+/// Default interval between checks of the certificate files for changes
+pub const DEFAULT_RELOAD_INTERVAL: Duration = Duration::from_secs(10);
+
+/// Modification time and size of a watched file
+pub type FileStamp = Option<(SystemTime, u64)>;
+
+/// Owns the swappable server certificate, client CA verifier and chain
+/// index, revocation set, ACL and SNI tenants, and reloads them from their
+/// files. A reload builds the new key and
+/// verifier completely before swapping either in, so a handshake sees the old
+/// or the new material but never a mix; if anything fails to load the old
+/// material stays in place and the next check retries. The revocation set and
+/// the ACL are reloaded on their own, so a bad revocation or ACL file never
+/// holds back a renewed certificate or the other way round; tenants keep
+/// their own stamps (see Tenants). Connections established before a
+/// reload are unaffected.
+pub struct TlsReloader {
+    cert_path: PathBuf,
+    key_path: PathBuf,
+    ca_path: PathBuf,
+    intermediates_path: Option<PathBuf>,
+    revocation_path: Option<PathBuf>,
+    acl_path: Option<PathBuf>,
+    provider: Arc<CryptoProvider>,
+    resolver: Arc<ReloadableResolver>,
+    verifier: Arc<ReloadableVerifier>,
+    chains: Arc<Chains>,
+    revocations: Arc<Revocations>,
+    acl: Arc<Acl>,
+    tenants: Option<Arc<Tenants>>,
+    // cert, key, CA, intermediates, revocation file, ACL file
+    stamps: Mutex<[FileStamp; 6]>,
+}
+
+impl TlsReloader {
+    /// Load the initial certificate, key, client CA and, if given, the
+    /// intermediates, the compiled revocation set, the ACL and the tenant
+    /// file (but none of the tenants' certificates)
+    pub fn new(
+        cert_path: &str,
+        key_path: &str,
+        ca_path: &str,
+        intermediates_path: Option<&str>,
+        revocation_path: Option<&str>,
+        acl_path: Option<&str>,
+        tenants_path: Option<&str>,
+    ) -> Result<Self, Box<dyn Error>> {
+        let provider = CryptoProvider::get_default()
+            .cloned()
+            .unwrap_or_else(|| Arc::new(rustls::crypto::aws_lc_rs::default_provider()));
+        let certified_key = load_certified_key(Path::new(cert_path), Path::new(key_path), &provider)?;
+        let client_verifier = load_client_verifier(Path::new(ca_path), &provider)?;
+        let chains = Arc::new(Chains::default());
+        let chain_index = load_chain_index(Path::new(ca_path), intermediates_path.map(Path::new), &provider)?;
+        log::info!("Indexed {} CA certificates for chain building", chain_index.len());
+        chains.swap(chain_index);
+        let revocations = Arc::new(Revocations::default());
+        if let Some(path) = revocation_path {
+            let set = RevocationSet::open(Path::new(path))?;
+            log::info!("Loaded {} revoked certificates from {}", set.len(), path);
+            metrics().revoked_certificates.store(set.len() as u64, Ordering::Relaxed);
+            revocations.swap(Some(set));
+        }
+        let acl = Arc::new(Acl::default());
+        if let Some(path) = acl_path {
+            let index = AclIndex::load(Path::new(path))?;
+            log::info!("Loaded {} ACL rules from {}", index.len(), path);
+            metrics().acl_rules.store(index.len() as u64, Ordering::Relaxed);
+            acl.swap(Some(index));
+        }
+        let tenants = match tenants_path {
+            Some(path) => Some(Arc::new(Tenants::load(Path::new(path), provider.clone())?)),
+            None => None,
+        };
+
+        let mut reloader = Self {
+            cert_path: PathBuf::from(cert_path),
+            key_path: PathBuf::from(key_path),
+            ca_path: PathBuf::from(ca_path),
+            intermediates_path: intermediates_path.map(PathBuf::from),
+            revocation_path: revocation_path.map(PathBuf::from),
+            acl_path: acl_path.map(PathBuf::from),
+            resolver: Arc::new(ReloadableResolver::new(certified_key)),
+            verifier: Arc::new(ReloadableVerifier::new(client_verifier, revocations.clone(), chains.clone())),
+            chains,
+            revocations,
+            acl,
+            tenants,
+            provider,
+            stamps: Mutex::new([None; 6]),
+        };
+        *reloader.stamps.get_mut().unwrap() = reloader.current_stamps();
+        Ok(reloader)
+    }
+
+    pub fn provider(&self) -> Arc<CryptoProvider> {
+        self.provider.clone()
+    }
+
+    pub fn resolver(&self) -> Arc<ReloadableResolver> {
+        self.resolver.clone()
+    }
+
+    pub fn verifier(&self) -> Arc<ReloadableVerifier> {
+        self.verifier.clone()
+    }
+
+    pub fn chains(&self) -> Arc<Chains> {
+        self.chains.clone()
+    }
+
+    pub fn revocations(&self) -> Arc<Revocations> {
+        self.revocations.clone()
+    }
+
+    pub fn acl(&self) -> Arc<Acl> {
+        self.acl.clone()
+    }
+
+    pub fn tenants(&self) -> Option<Arc<Tenants>> {
+        self.tenants.clone()
+    }
+
+    /// Reload all files unconditionally (SIGHUP)
+    pub fn reload(&self) -> Result<(), Box<dyn Error>> {
+        let mut stamps = self.stamps.lock().unwrap();
+        let revocations = self.reload_revocations_locked(&mut stamps);
+        let acl = self.reload_acl_locked(&mut stamps);
+        let tenants = self.tenants.as_ref().map_or(Ok(()), |tenants| tenants.reload());
+        self.reload_certs_locked(&mut stamps).and(revocations).and(acl).and(tenants)
+    }
+
+    /// Reload whatever changed (modification time or size) since the last
+    /// successful load. Returns whether anything was reloaded.
+    pub fn reload_if_changed(&self) -> Result<bool, Box<dyn Error>> {
+        let mut stamps = self.stamps.lock().unwrap();
+        let current = self.current_stamps();
+        let mut revocations = Ok(false);
+        if current[4] != stamps[4] {
+            revocations = self.reload_revocations_locked(&mut stamps).map(|()| true);
+        }
+        let mut acl = Ok(false);
+        if current[5] != stamps[5] {
+            acl = self.reload_acl_locked(&mut stamps).map(|()| true);
+        }
+        let tenants = self.tenants.as_ref().map_or(Ok(false), |tenants| tenants.reload_if_changed());
+        let mut certs = Ok(false);
+        if current[..4] != stamps[..4] {
+            certs = self.reload_certs_locked(&mut stamps).map(|()| true);
+        }
+        Ok(certs? | revocations? | acl? | tenants?)
+    }
+
+    fn current_stamps(&self) -> [FileStamp; 6] {
+        [
+            file_stamp(&self.cert_path),
+            file_stamp(&self.key_path),
+            file_stamp(&self.ca_path),
+            self.intermediates_path.as_deref().and_then(file_stamp),
+            self.revocation_path.as_deref().and_then(file_stamp),
+            self.acl_path.as_deref().and_then(file_stamp),
+        ]
+    }
+
+    // All reloads stamp before reading: a write landing mid-reload changes
+    // the file again after this point and is picked up by the next check.
+
+    fn reload_certs_locked(&self, stamps: &mut [FileStamp; 6]) -> Result<(), Box<dyn Error>> {
+        let new_stamps = self.current_stamps();
+        let result = load_certified_key(&self.cert_path, &self.key_path, &self.provider)
+            .and_then(|key| Ok((key, load_client_verifier(&self.ca_path, &self.provider)?)))
+            .and_then(|(key, verifier)| {
+                let chain_index = load_chain_index(&self.ca_path, self.intermediates_path.as_deref(), &self.provider)?;
+                Ok((key, verifier, chain_index))
+            });
+
+        match result {
+            Ok((certified_key, client_verifier, chain_index)) => {
+                self.resolver.swap(certified_key);
+                self.chains.swap(chain_index);
+                self.verifier.swap(client_verifier);
+                stamps[..4].copy_from_slice(&new_stamps[..4]);
+                metrics().tls_reloads_succeeded.fetch_add(1, Ordering::Relaxed);
+                Ok(())
+            }
+            Err(e) => {
+                metrics().tls_reloads_failed.fetch_add(1, Ordering::Relaxed);
+                Err(e)
+            }
+        }
+    }
+
+    fn reload_revocations_locked(&self, stamps: &mut [FileStamp; 6]) -> Result<(), Box<dyn Error>> {
+        let Some(path) = &self.revocation_path else {
+            return Ok(());
+        };
+        let new_stamp = file_stamp(path);
+        match RevocationSet::open(path) {
+            Ok(set) => {
+                log::info!("Loaded {} revoked certificates from {}", set.len(), path.display());
+                metrics().revoked_certificates.store(set.len() as u64, Ordering::Relaxed);
+                self.revocations.swap(Some(set));
+                stamps[4] = new_stamp;
+                metrics().tls_reloads_succeeded.fetch_add(1, Ordering::Relaxed);
+                Ok(())
+            }
+            Err(e) => {
+                metrics().tls_reloads_failed.fetch_add(1, Ordering::Relaxed);
+                Err(e)
+            }
+        }
+    }
+
+    fn reload_acl_locked(&self, stamps: &mut [FileStamp; 6]) -> Result<(), Box<dyn Error>> {
+        let Some(path) = &self.acl_path else {
+            return Ok(());
+        };
+        let new_stamp = file_stamp(path);
+        match AclIndex::load(path) {
+            Ok(index) => {
+                log::info!("Loaded {} ACL rules from {}", index.len(), path.display());
+                metrics().acl_rules.store(index.len() as u64, Ordering::Relaxed);
+                self.acl.swap(Some(index));
+                stamps[5] = new_stamp;
+                metrics().tls_reloads_succeeded.fetch_add(1, Ordering::Relaxed);
+                Ok(())
+            }
+            Err(e) => {
+                metrics().tls_reloads_failed.fetch_add(1, Ordering::Relaxed);
+                Err(e)
+            }
+        }
+    }
+
+    /// Check the files every `interval` and reload when they change
+    pub async fn watch(self: Arc<Self>, interval: Duration) {
+        let mut ticker = tokio::time::interval(interval);
+        ticker.set_missed_tick_behavior(tokio::time::MissedTickBehavior::Delay);
+        ticker.tick().await;
+        loop {
+            ticker.tick().await;
+            match self.reload_if_changed() {
+                Ok(true) => log::info!("Reloaded changed TLS files"),
+                Ok(false) => {}
+                // Certificate and key are often replaced by two separate
+                // copies; the pair is mismatched until the second lands
+                Err(e) => log::warn!("TLS reload failed, keeping current certificates: {}", e),
+            }
+        }
+    }
+
+    /// Reload on every SIGHUP
+    #[cfg(unix)]
+    pub async fn reload_on_sighup(self: Arc<Self>) {
+        use tokio::signal::unix::{signal, SignalKind};
+
+        let mut hangups = match signal(SignalKind::hangup()) {
+            Ok(s) => s,
+            Err(e) => {
+                log::warn!("Could not install SIGHUP handler: {}", e);
+                return;
+            }
+        };
+        while hangups.recv().await.is_some() {
+            match self.reload() {
+                Ok(()) => log::info!("SIGHUP: reloaded TLS certificate, key, client CA, intermediates, revocations, ACL and tenants"),
+                Err(e) => log::warn!("SIGHUP: TLS reload failed, keeping current certificates: {}", e),
+            }
+        }
+    }
+}
+
+pub fn file_stamp(path: &Path) -> FileStamp {
+    let meta = fs::metadata(path).ok()?;
+    Some((meta.modified().ok()?, meta.len()))
+}
+
+/// Load the server certificate chain and its PKCS#8 private key. Fails if the
+/// key does not belong to the leaf certificate.
+pub fn load_certified_key(
+    cert_path: &Path,
+    key_path: &Path,
+    provider: &CryptoProvider,
+) -> Result<CertifiedKey, Box<dyn Error>> {
+    let cert_pem = fs::read(cert_path)?;
+    let mut cert_reader = BufReader::new(&cert_pem[..]);
+    let cert_chain = certs(&mut cert_reader).collect::<Result<Vec<CertificateDer>, _>>()?;
+
+    if cert_chain.is_empty() {
+        return Err("No certificates found".into());
+    }
+
+    let key_pem = fs::read(key_path)?;
+    let mut key_reader = BufReader::new(&key_pem[..]);
+    let mut keys = pkcs8_private_keys(&mut key_reader);
+    let key_der = PrivateKeyDer::from(keys.next()
+        .ok_or("No private key found")??);
+
+    Ok(CertifiedKey::from_der(cert_chain, key_der, provider)?)
+}
+
+/// Build the client certificate verifier trusting the CAs in `ca_path`.
+/// Client certificates are optional; unauthenticated connections are accepted.
+pub fn load_client_verifier(
+    ca_path: &Path,
+    provider: &Arc<CryptoProvider>,
+) -> Result<Arc<dyn ClientCertVerifier>, Box<dyn Error>> {
+    let mut root_store = RootCertStore::empty();
+    for cert in load_certificates(ca_path)? {
+        root_store.add(cert)?;
+    }
+
+    Ok(WebPkiClientVerifier::builder_with_provider(Arc::new(root_store), provider.clone())
+        .allow_unauthenticated()
+        .build()?)
+}
+
+/// Index the client CAs in `ca_path` and the intermediates in
+/// `intermediates_path` for building verified chains
+pub fn load_chain_index(
+    ca_path: &Path,
+    intermediates_path: Option<&Path>,
+    provider: &CryptoProvider,
+) -> Result<ChainIndex, Box<dyn Error>> {
+    let intermediates = match intermediates_path {
+        Some(path) => load_certificates(path)?,
+        None => Vec::new(),
+    };
+    ChainIndex::new(load_certificates(ca_path)?, intermediates, provider.signature_verification_algorithms)
+}
+
+/// All certificates in a PEM file
+fn load_certificates(path: &Path) -> Result<Vec<CertificateDer<'static>>, Box<dyn Error>> {
+    let pem = fs::read(path)?;
+    let mut reader = BufReader::new(&pem[..]);
+    Ok(certs(&mut reader).collect::<Result<Vec<_>, _>>()?)
+}
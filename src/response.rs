@@ -1,4 +1,6 @@
+use actix_web::web::Bytes;
 use serde::{Deserialize, Serialize};
+use std::sync::OnceLock;
 
 #[derive(Debug, Clone, Serialize, Deserialize)]
 pub struct CertificateInfo {
@@ -24,4 +26,58 @@ impl MtlsResponse {
             verified_chains: Vec::new(),
         }
     }
+
+    /// Response for a presented chain and the chains it verified to. Like
+    /// the Go server, the client counts as mTLS-valid when there is at
+    /// least one verified chain.
+    pub fn from_chains(presented: Vec<CertificateInfo>, verified_chains: Vec<Vec<CertificateInfo>>) -> Self {
+        Self {
+            mtls_valid: !verified_chains.is_empty(),
+            presented_certificates: presented,
+            verified_chains,
+        }
+    }
+
+    /// Serialize to a JSON body that can be shared between requests
+    pub fn to_body(&self) -> Bytes {
+        Bytes::from(serde_json::to_vec(self).expect("MtlsResponse serialization cannot fail"))
+    }
+}
+
+/// Shared body for connections without a client certificate
+pub fn unauthenticated_body() -> Bytes {
+    static BODY: OnceLock<Bytes> = OnceLock::new();
+    BODY.get_or_init(|| MtlsResponse::new(false).to_body()).clone()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_from_chains() {
+        let cert = CertificateInfo {
+            subject_cn: Some("Test Client".to_string()),
+            issuer_cn: Some("Test CA".to_string()),
+            not_before: "Jan  1 00:00:00 2026 +00:00".to_string(),
+            not_after: "Jan  1 00:00:00 2027 +00:00".to_string(),
+            is_ca: false,
+        };
+        let root = CertificateInfo {
+            subject_cn: Some("Test CA".to_string()),
+            issuer_cn: Some("Test CA".to_string()),
+            is_ca: true,
+            ..cert.clone()
+        };
+        let response = MtlsResponse::from_chains(vec![cert.clone()], vec![vec![cert.clone(), root]]);
+        assert!(response.mtls_valid);
+        assert_eq!(response.verified_chains[0].len(), 2);
+        assert!(!MtlsResponse::from_chains(vec![cert], Vec::new()).mtls_valid);
+
+        let body: serde_json::Value = serde_json::from_slice(&response.to_body()).unwrap();
+        assert_eq!(body["presented_certificates"][0]["subject_cn"], "Test Client");
+
+        let empty: serde_json::Value = serde_json::from_slice(&unauthenticated_body()).unwrap();
+        assert_eq!(empty["mtls_valid"], false);
+    }
 }
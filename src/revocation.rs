@@ -0,0 +1,192 @@
+use aws_lc_rs::digest::{digest, SHA256};
+use memmap2::Mmap;
+use rustls::pki_types::CertificateDer;
+use std::fs::File;
+use std::path::Path;
+use std::sync::{Arc, RwLock};
+
+/// File magic of a compiled revocation set (see certgen/compile-revocations.py)
+const MAGIC: &[u8; 8] = b"MTLSREV1";
+const HEADER_LEN: usize = 32;
+const SLOT_LEN: usize = 16;
+
+/// Revoked certificates compiled into an open-addressing hash table and
+/// memory-mapped, so loading is instant and a lookup costs one hash plus a
+/// probe or two regardless of how many entries the set holds.
+///
+/// Layout (little endian): magic(8) | slot count u32 (power of two) |
+/// entry count u32 | created unix u64 | reserved(8) | slots. Each slot is the
+/// first 16 bytes of SHA-256(issuer DER length u32 BE | issuer DER | serial),
+/// with the serial as its big-endian magnitude (no leading zero bytes); all
+/// zero marks an empty slot. Slots are probed linearly starting at the first
+/// 8 key bytes masked by the slot count.
+pub struct RevocationSet {
+    map: Mmap,
+    mask: usize,
+    entries: usize,
+}
+
+impl RevocationSet {
+    pub fn open(path: &Path) -> Result<Self, Box<dyn std::error::Error>> {
+        let file = File::open(path)?;
+        // Safety: the file is replaced by rename, never modified in place, so
+        // the mapped pages do not change under us
+        let map = unsafe { Mmap::map(&file)? };
+
+        if map.len() < HEADER_LEN || &map[..8] != MAGIC {
+            return Err(format!("{}: not a compiled revocation set", path.display()).into());
+        }
+        let slots = u32::from_le_bytes(map[8..12].try_into()?) as usize;
+        let entries = u32::from_le_bytes(map[12..16].try_into()?) as usize;
+        if !slots.is_power_of_two() || entries >= slots || map.len() != HEADER_LEN + slots * SLOT_LEN {
+            return Err(format!("{}: corrupt revocation set header", path.display()).into());
+        }
+
+        Ok(Self { map, mask: slots - 1, entries })
+    }
+
+    pub fn len(&self) -> usize {
+        self.entries
+    }
+
+    /// Whether the certificate with `serial` issued by `issuer` (raw DER of
+    /// the issuer Name) is revoked
+    pub fn contains(&self, issuer: &[u8], serial: &[u8]) -> bool {
+        let key = revocation_key(issuer, serial);
+        let slots = &self.map[HEADER_LEN..];
+        let mut i = u64::from_le_bytes(key[..8].try_into().unwrap()) as usize & self.mask;
+        loop {
+            let slot = &slots[i * SLOT_LEN..(i + 1) * SLOT_LEN];
+            if slot == key {
+                return true;
+            }
+            if slot.iter().all(|&b| b == 0) {
+                return false;
+            }
+            i = (i + 1) & self.mask;
+        }
+    }
+}
+
+/// Hash table key of an (issuer, serial) pair
+pub fn revocation_key(issuer: &[u8], serial: &[u8]) -> [u8; SLOT_LEN] {
+    let first_nonzero = serial.iter().position(|&b| b != 0).unwrap_or(serial.len());
+    let mut input = Vec::with_capacity(4 + issuer.len() + serial.len());
+    input.extend_from_slice(&(issuer.len() as u32).to_be_bytes());
+    input.extend_from_slice(issuer);
+    input.extend_from_slice(&serial[first_nonzero..]);
+
+    let mut key = [0u8; SLOT_LEN];
+    key.copy_from_slice(&digest(&SHA256, &input).as_ref()[..SLOT_LEN]);
+    key
+}
+
+/// The revocation set currently in force; swapped when the file changes.
+/// Sets still in use by an in-progress lookup stay mapped until released.
+#[derive(Default)]
+pub struct Revocations {
+    set: RwLock<Option<Arc<RevocationSet>>>,
+}
+
+impl Revocations {
+    pub fn swap(&self, set: Option<RevocationSet>) {
+        *self.set.write().unwrap() = set.map(Arc::new);
+    }
+
+    /// Whether any certificate in `chain` is revoked. Certificates that do not
+    /// parse are left to chain verification to reject.
+    pub fn is_revoked<'a>(&self, chain: impl IntoIterator<Item = &'a CertificateDer<'a>>) -> bool {
+        let Some(set) = self.set.read().unwrap().clone() else {
+            return false;
+        };
+        chain.into_iter().any(|der| match issuer_and_serial(der) {
+            Some((issuer, serial)) => set.contains(issuer, serial),
+            None => false,
+        })
+    }
+}
+
+/// Raw issuer Name and serial number bytes of a DER certificate. Walks just
+/// the start of the TBSCertificate instead of parsing the whole certificate,
+/// since this runs on every handshake.
+fn issuer_and_serial(der: &[u8]) -> Option<(&[u8], &[u8])> {
+    let (cert, _) = der_element(der, 0x30)?;
+    let (tbs, _) = der_element(cert.1, 0x30)?;
+    let mut rest = tbs.1;
+    if rest.first() == Some(&0xa0) {
+        // Explicit [0] version
+        rest = der_element(rest, 0xa0)?.1;
+    }
+    let (serial, rest) = der_element(rest, 0x02)?;
+    let (_signature, rest) = der_element(rest, 0x30)?;
+    let (issuer, _) = der_element(rest, 0x30)?;
+    Some((issuer.0, serial.1))
+}
+
+/// Split the DER element with `tag` off the front of `input`. Returns
+/// ((whole element, contents), remaining input).
+pub(crate) fn der_element(input: &[u8], tag: u8) -> Option<((&[u8], &[u8]), &[u8])> {
+    if *input.first()? != tag {
+        return None;
+    }
+    let (len, header) = match *input.get(1)? {
+        n if n < 0x80 => (n as usize, 2),
+        n @ 0x81..=0x84 => {
+            let bytes = input.get(2..2 + (n & 0x7f) as usize)?;
+            (bytes.iter().fold(0usize, |acc, &b| acc << 8 | b as usize), 2 + bytes.len())
+        }
+        _ => return None,
+    };
+    let end = header.checked_add(len)?;
+    let element = input.get(..end)?;
+    Some(((element, &element[header..]), &input[end..]))
+}
+
+impl std::fmt::Debug for Revocations {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        let entries = self.set.read().unwrap().as_ref().map(|set| set.len());
+        f.debug_struct("Revocations").field("entries", &entries).finish()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::Write;
+
+    /// Compile a set the same way certgen/compile-revocations.py does
+    fn compile(keys: &[[u8; SLOT_LEN]], slots: usize) -> Vec<u8> {
+        let mut out = MAGIC.to_vec();
+        out.extend_from_slice(&(slots as u32).to_le_bytes());
+        out.extend_from_slice(&(keys.len() as u32).to_le_bytes());
+        out.extend_from_slice(&[0u8; 16]);
+        let mut table = vec![0u8; slots * SLOT_LEN];
+        for key in keys {
+            let mut i = u64::from_le_bytes(key[..8].try_into().unwrap()) as usize & (slots - 1);
+            while table[i * SLOT_LEN..(i + 1) * SLOT_LEN] != [0u8; SLOT_LEN] {
+                i = (i + 1) & (slots - 1);
+            }
+            table[i * SLOT_LEN..(i + 1) * SLOT_LEN].copy_from_slice(key);
+        }
+        out.extend_from_slice(&table);
+        out
+    }
+
+    #[test]
+    fn test_revocation_set_lookup() {
+        let issuer = b"\x30\x12\x31\x10\x30\x0e\x06\x03\x55\x04\x03\x0c\x07Test CA";
+        let keys: Vec<_> = (1u32..=1000).map(|n| revocation_key(issuer, &n.to_be_bytes())).collect();
+
+        let path = std::env::temp_dir().join(format!("revocations-{}.bin", std::process::id()));
+        File::create(&path).unwrap().write_all(&compile(&keys, 2048)).unwrap();
+        let set = RevocationSet::open(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+
+        assert_eq!(set.len(), 1000);
+        // Leading zero bytes of DER INTEGER serials do not matter
+        assert!(set.contains(issuer, &[0x00, 0x00, 0x03, 0xe8]));
+        assert!(set.contains(issuer, &[0x01]));
+        assert!(!set.contains(issuer, &1001u32.to_be_bytes()));
+        assert!(!set.contains(b"other issuer", &[0x01]));
+    }
+}
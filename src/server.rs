@@ -1,18 +1,56 @@
 use actix_web::dev::Extensions;
-use rustls::pki_types::{CertificateDer, PrivateKeyDer};
-use rustls::{RootCertStore, ServerConfig};
-use rustls_pemfile::{certs, pkcs8_private_keys};
+use actix_web::web::Bytes;
+use rustls::pki_types::CertificateDer;
+use rustls::{HandshakeKind, ServerConfig};
 use std::any::Any;
-use std::fs;
-use std::io::BufReader;
+use std::sync::atomic::Ordering;
 use std::sync::Arc;
+use std::time::Instant;
 use x509_parser::prelude::{FromDer, X509Certificate};
 
-use crate::response::CertificateInfo;
+use crate::access_log::{self, ConnectionInfo};
+use crate::acl::{Acl, ClientIdentity};
+use crate::chain::Chains;
+use crate::metrics::{metrics, ConnectionGuard};
+use crate::ratelimit;
+use crate::response::{CertificateInfo, MtlsResponse};
+use crate::reload::TlsReloader;
+use crate::revocation::Revocations;
+use crate::session::ResumptionConfig;
+use crate::tenant::Tenants;
+use crate::tls::{TenantResolver, TenantVerifier};
+
+/// ALPN protocols offered, in server preference order. With h2 a client (the
+/// Cloudflare tunnel in particular) multiplexes concurrent requests over one
+/// connection, and so one mTLS handshake, instead of opening one per request.
+pub const ALPN_PROTOCOLS: [&[u8]; 2] = [b"h2", b"http/1.1"];
+
+/// Peer certificate chain parsed once per connection, together with its
+/// verified chains and the ready-to-send /api/certs body. Stored as `Arc<PeerCertificates>` in the
+/// connection extensions so every request on the connection shares it; the
+/// connection extensions are attached to every stream of an HTTP/2
+/// connection, so each stream sees the chain of the connection it arrived on.
+#[derive(Debug)]
+pub struct PeerCertificates {
+    pub certificates: Vec<CertificateInfo>,
+    /// Whether at least one chain verified
+    pub verified: bool,
+    /// For other encodings and field selections than the default body
+    pub verified_chains: Arc<[Vec<CertificateInfo>]>,
+    pub body: Bytes,
+}
 
-/// Newtype wrapper for peer certificates in DER format
-#[derive(Clone, Debug)]
-pub struct PeerCertificates(pub Vec<Vec<u8>>);
+impl PeerCertificates {
+    /// Parse the presented chain and build the body with its verified
+    /// chains, which `chains` memoizes per presented chain
+    pub fn from_der(der_chain: &[CertificateDer<'_>], chains: &Chains) -> Self {
+        let certificates = parse_certificates(der_chain);
+        let verified_chains = chains.verified_chains(der_chain, parse_certificates);
+        let verified = !verified_chains.is_empty();
+        let body = MtlsResponse::from_chains(certificates.clone(), verified_chains.to_vec()).to_body();
+        Self { certificates, verified, verified_chains, body }
+    }
+}
 
 /// Server struct for testing/configuration
 #[derive(Clone)]
@@ -26,85 +64,128 @@ impl MtlsServer {
     }
 }
 
-/// Build TLS configuration with optional client certificate verification
+/// Build TLS configuration with optional client certificate verification.
+/// The server certificate and client CA verifier come from `reloader`, so a
+/// reload applies to every subsequent handshake without rebuilding the config.
+/// With SNI tenants the certificate is picked by hostname and client chains
+/// are verified per tenant in on_connect_handler.
 pub fn build_tls_config(
-    cert_path: &str,
-    key_path: &str,
-    ca_path: &str,
+    reloader: &TlsReloader,
+    resumption: &ResumptionConfig,
 ) -> Result<ServerConfig, Box<dyn std::error::Error>> {
-    // Load CA certificate into root cert store for client verification
-    let ca_pem = fs::read(ca_path)?;
-    let mut root_store = RootCertStore::empty();
-
-    let mut ca_reader = BufReader::new(&ca_pem[..]);
-    for cert in certs(&mut ca_reader) {
-        let cert_der = CertificateDer::from(cert?);
-        root_store.add(cert_der)?;
-    }
-
-    // Load server certificate chain
-    let cert_pem = fs::read(cert_path)?;
-    let mut cert_reader = BufReader::new(&cert_pem[..]);
-    let cert_chain: Vec<CertificateDer> = certs(&mut cert_reader)
-        .map(|cert| CertificateDer::from(cert.expect("cert parsing failed")))
-        .collect();
-
-    if cert_chain.is_empty() {
-        return Err("No certificates found".into());
+    // The reloadable wrappers also count ClientHellos and rejected client
+    // certs, and time the server signature and client chain verification
+    let builder = ServerConfig::builder_with_provider(reloader.provider())
+        .with_safe_default_protocol_versions()?;
+    let mut config = match reloader.tenants() {
+        Some(tenants) => {
+            let verifier = TenantVerifier::new(reloader.revocations(),
+                                               reloader.provider().signature_verification_algorithms);
+            builder
+                .with_client_cert_verifier(Arc::new(verifier))
+                .with_cert_resolver(Arc::new(TenantResolver::new(tenants, reloader.resolver())))
+        }
+        None => builder
+            .with_client_cert_verifier(reloader.verifier())
+            .with_cert_resolver(reloader.resolver()),
+    };
+
+    // Session resumption: stateful cache plus stateless tickets. Resumed
+    // sessions carry the client chain from the original handshake, so
+    // peer_certificates() is still populated for on_connect_handler.
+    config.session_storage = resumption.session_storage();
+    if let Some(ticketer) = resumption.ticketer()? {
+        config.ticketer = ticketer;
     }
 
-    // Load server private key
-    let key_pem = fs::read(key_path)?;
-    let mut key_reader = BufReader::new(&key_pem[..]);
-    let mut keys = pkcs8_private_keys(&mut key_reader);
-    let key_der = PrivateKeyDer::from(keys.next()
-        .ok_or("No private key found")??);
-
-    // Build server config using builder pattern
-    // Create client cert verifier with optional client auth
-    // WebPkiClientVerifier with allow_unauthenticated() accepts both authenticated and unauthenticated connections
-    let client_verifier = rustls::server::WebPkiClientVerifier::builder(Arc::new(root_store))
-        .allow_unauthenticated()
-        .build()?;
-
-    let config = ServerConfig::builder()
-        .with_client_cert_verifier(client_verifier)
-        .with_single_cert(cert_chain, key_der)?;
+    config.alpn_protocols = ALPN_PROTOCOLS.iter().map(|p| p.to_vec()).collect();
 
     Ok(config)
 }
 
-/// Handle TLS connection and extract peer certificates
-pub fn on_connect_handler(connection: &dyn Any, data: &mut Extensions) {
-    println!("[on_connect_handler] Called");
-
+/// Handle TLS connection and extract peer certificates. With `tenants`, the
+/// client chain is verified here against the client CAs of the tenant the
+/// client asked for (see TenantVerifier), or `chains` for other hostnames.
+pub fn on_connect_handler(connection: &dyn Any, data: &mut Extensions, revocations: &Revocations, acl: &Acl,
+                          chains: &Chains, tenants: Option<&Tenants>) {
     // Try to downcast to TlsStream and extract peer certificates
     // For rustls 0.23 with actix-tls
     if let Some(tls_stream) = connection.downcast_ref::<actix_tls::accept::rustls_0_23::TlsStream<tokio::net::TcpStream>>() {
-        println!("[on_connect_handler] Successfully downcast to TlsStream");
         let (_, server_connection) = tls_stream.get_ref();
-
-        if let Some(peer_certs) = server_connection.peer_certificates() {
-            println!("[on_connect_handler] Found {} peer certificates", peer_certs.len());
-            let der_certs: Vec<Vec<u8>> = peer_certs
-                .iter()
-                .map(|cert_der| cert_der.as_ref().to_vec())
-                .collect();
-
-            if !der_certs.is_empty() {
-                println!("[on_connect_handler] Storing {} DER certificates", der_certs.len());
-                data.insert(PeerCertificates(der_certs));
+        log::debug!("on_connect: handshake kind {:?}, ALPN {:?}",
+                    server_connection.handshake_kind(), server_connection.alpn_protocol());
+
+        // Dropped with the extensions when the connection closes
+        data.insert(ConnectionGuard::new());
+        let protocol_counter = match server_connection.alpn_protocol() {
+            Some(protocol) if protocol == b"h2" => &metrics().connections_h2,
+            _ => &metrics().connections_http1,
+        };
+        protocol_counter.fetch_add(1, Ordering::Relaxed);
+
+        let tenant = tenants
+            .and_then(|tenants| tenants.get(server_connection.server_name()))
+            .and_then(Result::ok);
+        let chains = tenant.as_ref().map_or(chains, |tenant| &tenant.chains);
+
+        let resumed = server_connection.handshake_kind() == Some(HandshakeKind::Resumed);
+        let mut info = ConnectionInfo { resumed, ..ConnectionInfo::default() };
+
+        match server_connection.peer_certificates() {
+            // Resumed handshakes skip the client verifier, so a certificate
+            // revoked after the original handshake is caught here instead:
+            // the connection is served as unauthenticated
+            Some(peer_certs) if resumed && revocations.is_revoked(peer_certs) =>
+            {
+                log::debug!("on_connect: resumed session presents a revoked certificate");
+                metrics().handshakes_failed.fetch_add(1, Ordering::Relaxed);
             }
-        } else {
-            println!("[on_connect_handler] No peer certificates found");
+            Some(peer_certs) if !peer_certs.is_empty() => {
+                // Parse straight from the rustls-owned DER, once per connection
+                let start = Instant::now();
+                let parsed = PeerCertificates::from_der(peer_certs, chains);
+                metrics().cert_parse.observe(start.elapsed());
+
+                // TenantVerifier defers chain verification to here; a chain
+                // the hostname's client CAs do not verify, including one
+                // memoized before a certificate on it expired, is served as
+                // unauthenticated
+                if tenants.is_some() && !parsed.verified {
+                    log::debug!("on_connect: client chain does not verify for {:?}", server_connection.server_name());
+                    metrics().handshakes_failed.fetch_add(1, Ordering::Relaxed);
+                } else {
+                    log::debug!("on_connect: {} peer certificates", peer_certs.len());
+                    metrics().handshakes_succeeded.fetch_add(1, Ordering::Relaxed);
+
+                    if access_log::enabled() {
+                        info.fingerprint = Some(access_log::fingerprint(&peer_certs[0]));
+                        info.subject_cn = parsed.certificates.first().and_then(|c| c.subject_cn.clone());
+                    }
+                    // Hashed here once so each request's ACL and rate limit
+                    // checks are lookups
+                    if acl.enabled() || ratelimit::keyed_by_certificate() {
+                        let subject_cn = parsed.certificates.first().and_then(|c| c.subject_cn.clone());
+                        data.insert(ClientIdentity::new(&peer_certs[0], subject_cn));
+                    }
+                    data.insert(Arc::new(parsed));
+                }
+            }
+            _ => {
+                log::debug!("on_connect: no peer certificates");
+                metrics().handshakes_no_client_cert.fetch_add(1, Ordering::Relaxed);
+            }
+        }
+
+        if access_log::enabled() {
+            data.insert(info);
         }
     } else {
-        println!("[on_connect_handler] Failed to downcast to TlsStream");
+        log::warn!("on_connect: connection is not a rustls TlsStream");
     }
 }
 
 /// Parse DER-encoded certificates into CertificateInfo
-pub fn parse_certificates(der_chain: &[Vec<u8>]) -> Vec<CertificateInfo> {
+pub fn parse_certificates(der_chain: &[CertificateDer<'_>]) -> Vec<CertificateInfo> {
     der_chain
         .iter()
         .filter_map(|der_bytes| {
@@ -131,20 +212,12 @@ pub fn parse_certificates(der_chain: &[Vec<u8>]) -> Vec<CertificateInfo> {
             let not_before_str = not_before.to_string();
             let not_after_str = not_after.to_string();
 
-            // Check if CA - look for Basic Constraints extension
+            // Check if CA - Basic Constraints lookup by OID, no string formatting
             let is_ca = cert
-                .tbs_certificate
-                .extensions()
-                .iter()
-                .find(|ext| {
-                    // OID 2.5.29.19 is Basic Constraints
-                    ext.oid.to_string() == "2.5.29.19"
-                })
-                .and_then(|ext| {
-                    x509_parser::extensions::BasicConstraints::from_der(ext.value)
-                        .ok()
-                        .map(|(_, bc)| bc.ca)
-                })
+                .basic_constraints()
+                .ok()
+                .flatten()
+                .map(|bc| bc.value.ca)
                 .unwrap_or(false);
 
             Some(CertificateInfo {
@@ -0,0 +1,345 @@
+use aws_lc_rs::aead::{Aad, LessSafeKey, Nonce, UnboundKey, AES_256_GCM, NONCE_LEN};
+use aws_lc_rs::digest::{digest, SHA256};
+use aws_lc_rs::rand::{SecureRandom, SystemRandom};
+use rustls::server::{
+    NoServerSessionStorage, ProducesTickets, ServerSessionMemoryCache, StoresServerSessions,
+};
+use std::fmt;
+use std::fs;
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, RwLock};
+use std::time::{Duration, SystemTime, UNIX_EPOCH};
+
+const KEY_LEN: usize = 32;
+const KEY_ID_LEN: usize = 4;
+/// Keys kept for decryption: the current one plus the one it replaced, so a
+/// ticket stays usable for at least one full rotation period.
+const RETAINED_KEYS: usize = 2;
+/// How often a ticket key file is re-read for keys rotated by another process.
+const KEY_FILE_POLL_SECS: u64 = 30;
+
+/// Session resumption settings for the TLS listener
+#[derive(Clone, Debug)]
+pub struct ResumptionConfig {
+    /// Maximum number of stateful sessions kept in memory (0 disables the cache)
+    pub cache_size: usize,
+    /// Ticket key rotation period (zero disables stateless tickets)
+    pub ticket_rotation: Duration,
+    /// Optional file of shared ticket keys, one 64 hex character key per line,
+    /// current key first. Lets several instances resume each other's sessions.
+    pub ticket_key_file: Option<PathBuf>,
+}
+
+impl Default for ResumptionConfig {
+    fn default() -> Self {
+        Self {
+            cache_size: 4096,
+            ticket_rotation: Duration::from_secs(6 * 60 * 60),
+            ticket_key_file: None,
+        }
+    }
+}
+
+impl ResumptionConfig {
+    /// Stateful session store bounded to `cache_size` entries
+    pub fn session_storage(&self) -> Arc<dyn StoresServerSessions> {
+        if self.cache_size == 0 {
+            Arc::new(NoServerSessionStorage {})
+        } else {
+            ServerSessionMemoryCache::new(self.cache_size)
+        }
+    }
+
+    /// Stateless ticketer, or None when tickets are disabled
+    pub fn ticketer(&self) -> Result<Option<Arc<dyn ProducesTickets>>, Box<dyn std::error::Error>> {
+        if self.ticket_rotation.is_zero() {
+            return Ok(None);
+        }
+
+        let ticketer = match &self.ticket_key_file {
+            Some(path) => RotatingTicketer::from_file(path, self.ticket_rotation)?,
+            None => RotatingTicketer::new(self.ticket_rotation)?,
+        };
+        Ok(Some(Arc::new(ticketer)))
+    }
+}
+
+/// A ticket encryption key and the short identifier carried in each ticket
+struct TicketKey {
+    id: [u8; KEY_ID_LEN],
+    aead: LessSafeKey,
+}
+
+impl TicketKey {
+    fn from_bytes(bytes: &[u8]) -> Result<Self, Box<dyn std::error::Error>> {
+        if bytes.len() != KEY_LEN {
+            return Err(format!("ticket key must be {} bytes, got {}", KEY_LEN, bytes.len()).into());
+        }
+
+        let mut id = [0u8; KEY_ID_LEN];
+        id.copy_from_slice(&digest(&SHA256, bytes).as_ref()[..KEY_ID_LEN]);
+        let aead = LessSafeKey::new(
+            UnboundKey::new(&AES_256_GCM, bytes).map_err(|_| "invalid ticket key")?,
+        );
+        Ok(Self { id, aead })
+    }
+
+    fn generate(rng: &SystemRandom) -> Result<Self, Box<dyn std::error::Error>> {
+        let mut bytes = [0u8; KEY_LEN];
+        rng.fill(&mut bytes).map_err(|_| "could not generate ticket key")?;
+        Self::from_bytes(&bytes)
+    }
+}
+
+enum KeySource {
+    Random,
+    File(PathBuf),
+}
+
+/// Stateless session ticketer using AES-256-GCM with rotating keys.
+///
+/// Ticket layout: key id (4 bytes) | nonce (12 bytes) | ciphertext | tag.
+/// Keys are either generated in-process and rotated every `rotation`, or
+/// loaded from a shared key file that is re-read periodically so that a key
+/// rotated by an external job reaches every instance.
+pub struct RotatingTicketer {
+    source: KeySource,
+    rotation: Duration,
+    keys: RwLock<Vec<TicketKey>>,
+    next_refresh: AtomicU64,
+    rng: SystemRandom,
+}
+
+impl RotatingTicketer {
+    /// Ticketer with random in-memory keys rotated every `rotation`
+    pub fn new(rotation: Duration) -> Result<Self, Box<dyn std::error::Error>> {
+        let rng = SystemRandom::new();
+        let key = TicketKey::generate(&rng)?;
+        Ok(Self {
+            source: KeySource::Random,
+            rotation,
+            keys: RwLock::new(vec![key]),
+            next_refresh: AtomicU64::new(unix_now() + rotation.as_secs().max(1)),
+            rng,
+        })
+    }
+
+    /// Ticketer with keys shared through `path`
+    pub fn from_file(path: &Path, rotation: Duration) -> Result<Self, Box<dyn std::error::Error>> {
+        let keys = load_key_file(path)?;
+        let source = KeySource::File(path.to_path_buf());
+        Ok(Self {
+            next_refresh: AtomicU64::new(unix_now() + refresh_interval(&source, rotation)),
+            source,
+            rotation,
+            keys: RwLock::new(keys),
+            rng: SystemRandom::new(),
+        })
+    }
+
+    /// Rotate (random keys) or reload (key file) once the refresh time passed.
+    /// Only the thread that wins the compare-exchange does the work; every
+    /// other caller keeps using the current keys.
+    fn maybe_refresh(&self) {
+        let now = unix_now();
+        let due = self.next_refresh.load(Ordering::Relaxed);
+        if now < due {
+            return;
+        }
+        let next = now + refresh_interval(&self.source, self.rotation);
+        if self
+            .next_refresh
+            .compare_exchange(due, next, Ordering::AcqRel, Ordering::Relaxed)
+            .is_err()
+        {
+            return;
+        }
+
+        match &self.source {
+            KeySource::Random => match TicketKey::generate(&self.rng) {
+                Ok(key) => {
+                    let mut keys = self.keys.write().unwrap();
+                    keys.insert(0, key);
+                    keys.truncate(RETAINED_KEYS);
+                }
+                Err(e) => log::warn!("Ticket key rotation failed: {}", e),
+            },
+            KeySource::File(path) => match load_key_file(path) {
+                Ok(loaded) => *self.keys.write().unwrap() = loaded,
+                Err(e) => log::warn!("Keeping previous ticket keys, reload of {} failed: {}",
+                                     path.display(), e),
+            },
+        }
+    }
+}
+
+impl fmt::Debug for RotatingTicketer {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        f.debug_struct("RotatingTicketer")
+            .field("rotation", &self.rotation)
+            .field("keys", &self.keys.read().map(|k| k.len()).unwrap_or(0))
+            .finish()
+    }
+}
+
+impl ProducesTickets for RotatingTicketer {
+    fn enabled(&self) -> bool {
+        true
+    }
+
+    fn lifetime(&self) -> u32 {
+        u32::try_from(self.rotation.as_secs()).unwrap_or(u32::MAX)
+    }
+
+    fn encrypt(&self, plain: &[u8]) -> Option<Vec<u8>> {
+        self.maybe_refresh();
+
+        let mut nonce = [0u8; NONCE_LEN];
+        self.rng.fill(&mut nonce).ok()?;
+
+        let keys = self.keys.read().ok()?;
+        let key = keys.first()?;
+
+        let header_len = KEY_ID_LEN + NONCE_LEN;
+        let mut ticket = Vec::with_capacity(header_len + plain.len() + AES_256_GCM.tag_len());
+        ticket.extend_from_slice(&key.id);
+        ticket.extend_from_slice(&nonce);
+        ticket.extend_from_slice(plain);
+
+        let tag = key
+            .aead
+            .seal_in_place_separate_tag(
+                Nonce::assume_unique_for_key(nonce),
+                Aad::from(key.id),
+                &mut ticket[header_len..],
+            )
+            .ok()?;
+        ticket.extend_from_slice(tag.as_ref());
+        Some(ticket)
+    }
+
+    fn decrypt(&self, ticket: &[u8]) -> Option<Vec<u8>> {
+        self.maybe_refresh();
+
+        if ticket.len() < KEY_ID_LEN + NONCE_LEN + AES_256_GCM.tag_len() {
+            return None;
+        }
+        let (id, rest) = ticket.split_at(KEY_ID_LEN);
+        let (nonce, sealed) = rest.split_at(NONCE_LEN);
+
+        let keys = self.keys.read().ok()?;
+        let key = keys.iter().find(|k| k.id[..] == *id)?;
+        let nonce = Nonce::try_assume_unique_for_key(nonce).ok()?;
+
+        let mut plain = sealed.to_vec();
+        let plain_len = key
+            .aead
+            .open_in_place(nonce, Aad::from(key.id), &mut plain)
+            .ok()?
+            .len();
+        plain.truncate(plain_len);
+        Some(plain)
+    }
+}
+
+fn refresh_interval(source: &KeySource, rotation: Duration) -> u64 {
+    match source {
+        KeySource::Random => rotation.as_secs().max(1),
+        KeySource::File(_) => KEY_FILE_POLL_SECS.min(rotation.as_secs().max(1)),
+    }
+}
+
+fn unix_now() -> u64 {
+    SystemTime::now()
+        .duration_since(UNIX_EPOCH)
+        .map(|d| d.as_secs())
+        .unwrap_or(0)
+}
+
+/// Load ticket keys from a file: one hex-encoded 32 byte key per line, the
+/// first being used for new tickets. Empty lines and `#` comments are skipped.
+fn load_key_file(path: &Path) -> Result<Vec<TicketKey>, Box<dyn std::error::Error>> {
+    let contents = fs::read_to_string(path)?;
+    let keys = contents
+        .lines()
+        .map(str::trim)
+        .filter(|line| !line.is_empty() && !line.starts_with('#'))
+        .map(|line| decode_hex(line).and_then(|bytes| TicketKey::from_bytes(&bytes)))
+        .collect::<Result<Vec<_>, _>>()?;
+
+    if keys.is_empty() {
+        return Err(format!("no ticket keys found in {}", path.display()).into());
+    }
+    Ok(keys)
+}
+
+fn decode_hex(s: &str) -> Result<Vec<u8>, Box<dyn std::error::Error>> {
+    if s.len() % 2 != 0 {
+        return Err("odd number of hex digits in ticket key".into());
+    }
+    (0..s.len())
+        .step_by(2)
+        .map(|i| {
+            u8::from_str_radix(s.get(i..i + 2).ok_or("invalid hex in ticket key")?, 16)
+                .map_err(|e| e.into())
+        })
+        .collect()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const KEY_A: &str = "000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f";
+    const KEY_B: &str = "1f1e1d1c1b1a191817161514131211100f0e0d0c0b0a09080706050403020100";
+
+    fn write_keys(name: &str, lines: &[&str]) -> PathBuf {
+        let path = std::env::temp_dir().join(format!("mtls-ticket-keys-{}-{}", name, std::process::id()));
+        fs::write(&path, lines.join("\n")).unwrap();
+        path
+    }
+
+    #[test]
+    fn test_ticket_round_trip() {
+        let ticketer = RotatingTicketer::new(Duration::from_secs(60)).unwrap();
+        let ticket = ticketer.encrypt(b"session state").unwrap();
+        assert_eq!(ticketer.decrypt(&ticket).unwrap(), b"session state");
+    }
+
+    #[test]
+    fn test_tampered_ticket_rejected() {
+        let ticketer = RotatingTicketer::new(Duration::from_secs(60)).unwrap();
+        let mut ticket = ticketer.encrypt(b"session state").unwrap();
+        let last = ticket.len() - 1;
+        ticket[last] ^= 0x01;
+        assert!(ticketer.decrypt(&ticket).is_none());
+        assert!(ticketer.decrypt(&ticket[..8]).is_none());
+    }
+
+    #[test]
+    fn test_shared_key_file_across_instances() {
+        let path = write_keys("shared", &["# current key first", KEY_A, KEY_B]);
+        let first = RotatingTicketer::from_file(&path, Duration::from_secs(60)).unwrap();
+        let second = RotatingTicketer::from_file(&path, Duration::from_secs(60)).unwrap();
+
+        let ticket = first.encrypt(b"resume me").unwrap();
+        assert_eq!(second.decrypt(&ticket).unwrap(), b"resume me");
+
+        // A ticket issued under the previous key is still accepted
+        let old_path = write_keys("old", &[KEY_B]);
+        let old = RotatingTicketer::from_file(&old_path, Duration::from_secs(60)).unwrap();
+        let old_ticket = old.encrypt(b"older").unwrap();
+        assert_eq!(second.decrypt(&old_ticket).unwrap(), b"older");
+
+        fs::remove_file(path).unwrap();
+        fs::remove_file(old_path).unwrap();
+    }
+
+    #[test]
+    fn test_invalid_key_file() {
+        let path = write_keys("invalid", &["abcd"]);
+        assert!(RotatingTicketer::from_file(&path, Duration::from_secs(60)).is_err());
+        fs::remove_file(path).unwrap();
+    }
+}
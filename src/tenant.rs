@@ -0,0 +1,343 @@
+use rustls::crypto::CryptoProvider;
+use rustls::sign::CertifiedKey;
+use std::collections::HashMap;
+use std::error::Error;
+use std::fs;
+use std::path::{Path, PathBuf};
+use std::sync::atomic::Ordering;
+use std::sync::{Arc, Mutex, RwLock};
+
+use crate::chain::Chains;
+use crate::metrics::metrics;
+use crate::reload::{file_stamp, load_certified_key, load_chain_index, FileStamp};
+use crate::tls::metered;
+
+/// A tenant's server certificate and the chain index of its client CAs
+#[derive(Debug)]
+pub struct LoadedTenant {
+    pub certified_key: Arc<CertifiedKey>,
+    pub chains: Arc<Chains>,
+}
+
+/// What loading a tenant's files produced, kept until one of them changes
+struct Loaded {
+    result: Result<Arc<LoadedTenant>, String>,
+    // cert, key, CA
+    stamps: [FileStamp; 3],
+}
+
+/// One line of the tenant file. Its certificate, key and CA bundle are only
+/// read on the first handshake for one of its hostnames.
+pub struct Tenant {
+    names: String,
+    cert_path: PathBuf,
+    key_path: PathBuf,
+    ca_path: PathBuf,
+    loaded: RwLock<Option<Arc<Loaded>>>,
+    // Serializes loading so concurrent handshakes read the files once
+    loading: Mutex<()>,
+}
+
+impl Tenant {
+    fn new(names: String, cert_path: PathBuf, key_path: PathBuf, ca_path: PathBuf) -> Self {
+        Self { names, cert_path, key_path, ca_path, loaded: RwLock::new(None), loading: Mutex::new(()) }
+    }
+
+    fn paths(&self) -> [&Path; 3] {
+        [&self.cert_path, &self.key_path, &self.ca_path]
+    }
+
+    fn current(&self) -> Option<Arc<Loaded>> {
+        self.loaded.read().unwrap().clone()
+    }
+
+    /// The tenant's certificate and chains, loading them on first use. A
+    /// failed load is remembered, and retried once a file changes.
+    pub fn get(&self, provider: &Arc<CryptoProvider>) -> Result<Arc<LoadedTenant>, String> {
+        if let Some(loaded) = self.current() {
+            return loaded.result.clone();
+        }
+        let _loading = self.loading.lock().unwrap();
+        if let Some(loaded) = self.current() {
+            return loaded.result.clone();
+        }
+
+        let stamps = self.paths().map(file_stamp);
+        let result = self.load(provider).map(Arc::new).map_err(|e| {
+            let message = format!("tenant {}: {}", self.names, e);
+            log::warn!("Could not load {}", message);
+            message
+        });
+        if result.is_ok() {
+            log::info!("Loaded tenant {}", self.names);
+            metrics().tenants_loaded.fetch_add(1, Ordering::Relaxed);
+        }
+        *self.loaded.write().unwrap() = Some(Arc::new(Loaded { result: result.clone(), stamps }));
+        result
+    }
+
+    fn load(&self, provider: &Arc<CryptoProvider>) -> Result<LoadedTenant, Box<dyn Error>> {
+        let certified_key = metered(load_certified_key(&self.cert_path, &self.key_path, provider)?);
+        let chains = Arc::new(Chains::default());
+        chains.swap(load_chain_index(&self.ca_path, None, provider)?);
+        Ok(LoadedTenant { certified_key, chains })
+    }
+
+    /// Drop the loaded files if any of them changed since; returns whether
+    /// it did
+    fn unload_if_stale(&self) -> bool {
+        let Some(loaded) = self.current() else {
+            return false;
+        };
+        if self.paths().map(file_stamp) == loaded.stamps {
+            return false;
+        }
+        *self.loaded.write().unwrap() = None;
+        true
+    }
+
+    fn is_loaded(&self) -> bool {
+        self.current().is_some_and(|loaded| loaded.result.is_ok())
+    }
+}
+
+/// Parsed tenant file. Each line is
+///
+/// ```text
+/// <hostname>[,<hostname>...] <cert.pem> <key.pem> <client-ca.pem>
+/// ```
+///
+/// where a hostname is exact or `*.<domain>`, which matches one extra
+/// label, and relative paths are resolved against the tenant file's
+/// directory. `#` starts a comment. The Go server also takes `acme` as the
+/// certificate; this one does not.
+#[derive(Default)]
+pub struct TenantIndex {
+    hosts: HashMap<String, Arc<Tenant>>,
+    tenants: Vec<Arc<Tenant>>,
+}
+
+impl TenantIndex {
+    /// Parse tenant file text. Tenants of `previous` whose line is unchanged
+    /// are carried over with whatever they have loaded.
+    pub fn parse(text: &str, dir: &Path, previous: Option<&TenantIndex>) -> Result<Self, String> {
+        let reuse: HashMap<(&str, &Path, &Path, &Path), &Arc<Tenant>> = previous
+            .map(|index| index.tenants.iter()
+                .map(|t| ((t.names.as_str(), t.cert_path.as_path(), t.key_path.as_path(), t.ca_path.as_path()), t))
+                .collect())
+            .unwrap_or_default();
+
+        let mut index = TenantIndex::default();
+        for (number, line) in text.lines().enumerate() {
+            let fields: Vec<&str> = line.split_whitespace().take_while(|f| !f.starts_with('#')).collect();
+            if fields.is_empty() {
+                continue;
+            }
+            let error = |msg: &str| format!("line {}: {}", number + 1, msg);
+            let [names, cert, key, ca] = fields[..] else {
+                return Err(error("expected <hostnames> <cert> <key> <client-ca>"));
+            };
+            if [cert, key, ca].contains(&"acme") {
+                return Err(error("ACME certificates are only supported by the Go server"));
+            }
+
+            let names = names.to_ascii_lowercase();
+            let (cert, key, ca) = (dir.join(cert), dir.join(key), dir.join(ca));
+            let tenant = match reuse.get(&(names.as_str(), cert.as_path(), key.as_path(), ca.as_path())) {
+                Some(tenant) => Arc::clone(tenant),
+                None => Arc::new(Tenant::new(names.clone(), cert, key, ca)),
+            };
+            for host in names.split(',') {
+                let host = host.strip_suffix('.').unwrap_or(host);
+                if host.is_empty() || host.strip_prefix("*.").unwrap_or(host).contains('*') {
+                    return Err(error(&format!("invalid hostname {:?}", host)));
+                }
+                if index.hosts.insert(host.to_string(), tenant.clone()).is_some() {
+                    return Err(error(&format!("duplicate hostname {:?}", host)));
+                }
+            }
+            index.tenants.push(tenant);
+        }
+        Ok(index)
+    }
+
+    /// Number of tenants (lines)
+    pub fn len(&self) -> usize {
+        self.tenants.len()
+    }
+
+    /// The tenant for an SNI hostname: an exact match, else the wildcard for
+    /// its parent domain. Two hash lookups at most, however many tenants.
+    pub fn lookup(&self, server_name: &str) -> Option<&Arc<Tenant>> {
+        let server_name = server_name.strip_suffix('.').unwrap_or(server_name);
+        let lowered;
+        let host = if server_name.bytes().any(|b| b.is_ascii_uppercase()) {
+            lowered = server_name.to_ascii_lowercase();
+            lowered.as_str()
+        } else {
+            server_name
+        };
+        if let Some(tenant) = self.hosts.get(host) {
+            return Some(tenant);
+        }
+        let dot = host.find('.').filter(|&i| i > 0)?;
+        self.hosts.get(&format!("*{}", &host[dot..]))
+    }
+}
+
+/// SNI hostnames with their own server certificate and client CAs, from a
+/// file that is reloaded when it changes. Only the file is read up front;
+/// a tenant's certificate, key and CA bundle are loaded by the first
+/// handshake for it and kept until they change on disk.
+pub struct Tenants {
+    path: PathBuf,
+    provider: Arc<CryptoProvider>,
+    index: RwLock<Arc<TenantIndex>>,
+    stamp: Mutex<FileStamp>,
+}
+
+impl Tenants {
+    pub fn load(path: &Path, provider: Arc<CryptoProvider>) -> Result<Self, Box<dyn Error>> {
+        let tenants = Self {
+            path: path.to_path_buf(),
+            provider,
+            index: RwLock::new(Arc::default()),
+            stamp: Mutex::new(None),
+        };
+        tenants.reload()?;
+        Ok(tenants)
+    }
+
+    fn index(&self) -> Arc<TenantIndex> {
+        self.index.read().unwrap().clone()
+    }
+
+    pub fn len(&self) -> usize {
+        self.index().len()
+    }
+
+    /// Certificate and chains for an SNI hostname: None if no tenant has it,
+    /// an error if the tenant's files could not be loaded
+    pub fn get(&self, server_name: Option<&str>) -> Option<Result<Arc<LoadedTenant>, String>> {
+        let index = self.index();
+        let tenant = index.lookup(server_name?)?;
+        Some(tenant.get(&self.provider))
+    }
+
+    /// Re-read the tenant file and start over with no tenant loaded (SIGHUP)
+    pub fn reload(&self) -> Result<(), Box<dyn Error>> {
+        let mut stamp = self.stamp.lock().unwrap();
+        self.reload_locked(&mut stamp, None)
+    }
+
+    /// Unload tenants whose files changed and reload the tenant file if it
+    /// changed, keeping what unchanged tenants have loaded. Returns whether
+    /// anything changed.
+    pub fn reload_if_changed(&self) -> Result<bool, Box<dyn Error>> {
+        let mut stamp = self.stamp.lock().unwrap();
+        let index = self.index();
+        let mut changed = false;
+        for tenant in &index.tenants {
+            changed |= tenant.unload_if_stale();
+        }
+        let mut result = Ok(());
+        if file_stamp(&self.path) != *stamp {
+            result = self.reload_locked(&mut stamp, Some(&index));
+            changed |= result.is_ok();
+        } else if changed {
+            self.count_loaded(&index);
+        }
+        result.map(|()| changed)
+    }
+
+    fn reload_locked(&self, stamp: &mut FileStamp, previous: Option<&TenantIndex>) -> Result<(), Box<dyn Error>> {
+        let new_stamp = file_stamp(&self.path);
+        let text = fs::read_to_string(&self.path)?;
+        let dir = self.path.parent().unwrap_or(Path::new(""));
+        let index = TenantIndex::parse(&text, dir, previous)
+            .map_err(|e| format!("{}: {}", self.path.display(), e))?;
+        log::info!("Loaded {} tenants from {}", index.len(), self.path.display());
+        metrics().tenants_configured.store(index.len() as u64, Ordering::Relaxed);
+        self.count_loaded(&index);
+        *self.index.write().unwrap() = Arc::new(index);
+        *stamp = new_stamp;
+        Ok(())
+    }
+
+    fn count_loaded(&self, index: &TenantIndex) {
+        let loaded = index.tenants.iter().filter(|t| t.is_loaded()).count();
+        metrics().tenants_loaded.store(loaded as u64, Ordering::Relaxed);
+    }
+}
+
+impl std::fmt::Debug for Tenants {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        f.debug_struct("Tenants").field("path", &self.path).field("tenants", &self.len()).finish()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const TENANTS: &str = "\
+# hostnames                cert   key    client CA
+nietst.uk,mtls.nietst.uk   a.pem  a.key  a-ca.pem
+*.nietst.uk                b.pem  b.key  /etc/b-ca.pem   # every other subdomain
+";
+
+    #[test]
+    fn test_lookup() {
+        let index = TenantIndex::parse(TENANTS, Path::new("/srv/tenants"), None).unwrap();
+        assert_eq!(index.len(), 2);
+        let cert = |name: &str| index.lookup(name).map(|t| t.cert_path.clone());
+
+        assert_eq!(cert("nietst.uk"), Some(PathBuf::from("/srv/tenants/a.pem")));
+        assert_eq!(cert("MTLS.nietst.uk."), Some(PathBuf::from("/srv/tenants/a.pem")));
+        assert_eq!(cert("api.nietst.uk"), Some(PathBuf::from("/srv/tenants/b.pem")));
+        assert_eq!(cert("a.b.nietst.uk"), None);
+        assert_eq!(cert("example.com"), None);
+        assert_eq!(index.lookup("api.nietst.uk").unwrap().ca_path, PathBuf::from("/etc/b-ca.pem"));
+    }
+
+    #[test]
+    fn test_parse_errors() {
+        for text in [
+            "nietst.uk a.pem a.key",
+            "nietst.uk a.pem a.key ca.pem\nnietst.uk b.pem b.key ca.pem",
+            "*.*.nietst.uk a.pem a.key ca.pem",
+            "nietst.uk acme acme ca.pem",
+        ] {
+            assert!(TenantIndex::parse(text, Path::new("."), None).is_err(), "{:?}", text);
+        }
+    }
+
+    #[test]
+    fn test_reparse_keeps_unchanged_tenants() {
+        let dir = Path::new("/srv/tenants");
+        let first = TenantIndex::parse(TENANTS, dir, None).unwrap();
+        let second = TenantIndex::parse(&TENANTS.replace("b.key", "c.key"), dir, Some(&first)).unwrap();
+        assert!(Arc::ptr_eq(first.lookup("nietst.uk").unwrap(), second.lookup("nietst.uk").unwrap()));
+        assert!(!Arc::ptr_eq(first.lookup("api.nietst.uk").unwrap(), second.lookup("api.nietst.uk").unwrap()));
+    }
+
+    #[test]
+    fn test_failed_load_is_remembered() {
+        let dir = std::env::temp_dir().join(format!("mtls-tenants-{}", std::process::id()));
+        fs::create_dir_all(&dir).unwrap();
+        let path = dir.join("tenants.txt");
+        fs::write(&path, "nietst.uk missing.pem missing.key missing-ca.pem\n").unwrap();
+
+        let provider = Arc::new(rustls::crypto::aws_lc_rs::default_provider());
+        let tenants = Tenants::load(&path, provider).unwrap();
+        assert_eq!(tenants.len(), 1);
+        assert!(tenants.get(Some("example.com")).is_none());
+        assert!(tenants.get(None).is_none());
+        let error = tenants.get(Some("nietst.uk")).unwrap().unwrap_err();
+        assert!(error.starts_with("tenant nietst.uk: "), "{}", error);
+        assert!(tenants.index().tenants[0].current().is_some());
+        assert!(!tenants.reload_if_changed().unwrap());
+
+        fs::remove_dir_all(&dir).unwrap();
+    }
+}
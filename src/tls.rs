@@ -0,0 +1,301 @@
+use rustls::client::danger::HandshakeSignatureValid;
+use rustls::crypto::{verify_tls12_signature, verify_tls13_signature, WebPkiSupportedAlgorithms};
+use rustls::pki_types::{CertificateDer, SubjectPublicKeyInfoDer, UnixTime};
+use rustls::server::danger::{ClientCertVerified, ClientCertVerifier};
+use rustls::server::{ClientHello, ResolvesServerCert};
+use rustls::sign::{CertifiedKey, Signer, SigningKey};
+use rustls::{CertificateError, DigitallySignedStruct, DistinguishedName, Error, SignatureAlgorithm, SignatureScheme};
+use std::sync::atomic::Ordering;
+use std::sync::{Arc, RwLock};
+use std::time::Instant;
+
+use crate::chain::Chains;
+use crate::metrics::metrics;
+use crate::ratelimit;
+use crate::revocation::Revocations;
+use crate::tenant::Tenants;
+
+/// Handshake error for a client certificate over its handshake rate
+const HANDSHAKE_RATE_LIMITED: &str = "client certificate handshake rate exceeded";
+
+/// Certificate resolver whose certificate can be swapped at runtime. It
+/// counts every ClientHello before handing out the current certificate.
+/// Handshakes already past this point keep the certificate they resolved.
+#[derive(Debug)]
+pub struct ReloadableResolver {
+    certified_key: RwLock<Arc<CertifiedKey>>,
+}
+
+impl ReloadableResolver {
+    pub fn new(certified_key: CertifiedKey) -> Self {
+        Self {
+            certified_key: RwLock::new(metered(certified_key)),
+        }
+    }
+
+    /// Serve `certified_key` to every handshake from now on
+    pub fn swap(&self, certified_key: CertifiedKey) {
+        *self.certified_key.write().unwrap() = metered(certified_key);
+    }
+}
+
+/// Wrap the signing key so every handshake signature is timed
+pub fn metered(mut certified_key: CertifiedKey) -> Arc<CertifiedKey> {
+    certified_key.key = Arc::new(MeteredSigningKey(certified_key.key));
+    Arc::new(certified_key)
+}
+
+impl ResolvesServerCert for ReloadableResolver {
+    fn resolve(&self, _client_hello: ClientHello<'_>) -> Option<Arc<CertifiedKey>> {
+        metrics().connections_accepted.fetch_add(1, Ordering::Relaxed);
+        Some(self.certified_key.read().unwrap().clone())
+    }
+}
+
+#[derive(Debug)]
+struct MeteredSigningKey(Arc<dyn SigningKey>);
+
+impl SigningKey for MeteredSigningKey {
+    fn choose_scheme(&self, offered: &[SignatureScheme]) -> Option<Box<dyn Signer>> {
+        self.0
+            .choose_scheme(offered)
+            .map(|signer| Box::new(MeteredSigner(signer)) as Box<dyn Signer>)
+    }
+
+    fn public_key(&self) -> Option<SubjectPublicKeyInfoDer<'_>> {
+        self.0.public_key()
+    }
+
+    fn algorithm(&self) -> SignatureAlgorithm {
+        self.0.algorithm()
+    }
+}
+
+#[derive(Debug)]
+struct MeteredSigner(Box<dyn Signer>);
+
+impl Signer for MeteredSigner {
+    fn sign(&self, message: &[u8]) -> Result<Vec<u8>, Error> {
+        let start = Instant::now();
+        let signature = self.0.sign(message);
+        metrics().handshake_sign.observe(start.elapsed());
+        signature
+    }
+
+    fn scheme(&self) -> SignatureScheme {
+        self.0.scheme()
+    }
+}
+
+/// Client certificate verifier that can be swapped at runtime (e.g. after a
+/// client CA change). It times chain verification and counts rejected
+/// certificates, delegating the decision to the current inner verifier and
+/// then rejecting chains that contain a revoked certificate. Configured
+/// intermediates (INTERMEDIATES_PATH) that lead from the client's leaf to a
+/// root are passed to the inner verifier along with the presented ones, so
+/// a client may send just its leaf.
+#[derive(Debug)]
+pub struct ReloadableVerifier {
+    inner: RwLock<Arc<dyn ClientCertVerifier>>,
+    revocations: Arc<Revocations>,
+    chains: Arc<Chains>,
+    // root_hint_subjects() must return a slice borrowed from &self, which a
+    // lock guard cannot provide. Each swap leaks its (small) hint list so the
+    // slice lives for the rest of the process; swaps only happen on CA
+    // rotation, so the leak is bounded by the number of reloads.
+    hints: RwLock<&'static [DistinguishedName]>,
+}
+
+impl ReloadableVerifier {
+    pub fn new(inner: Arc<dyn ClientCertVerifier>, revocations: Arc<Revocations>, chains: Arc<Chains>) -> Self {
+        Self {
+            hints: RwLock::new(leak_hints(inner.as_ref())),
+            inner: RwLock::new(inner),
+            revocations,
+            chains,
+        }
+    }
+
+    /// Verify every handshake from now on with `inner`
+    pub fn swap(&self, inner: Arc<dyn ClientCertVerifier>) {
+        let hints = leak_hints(inner.as_ref());
+        *self.inner.write().unwrap() = inner;
+        *self.hints.write().unwrap() = hints;
+    }
+
+    fn current(&self) -> Arc<dyn ClientCertVerifier> {
+        self.inner.read().unwrap().clone()
+    }
+}
+
+fn leak_hints(verifier: &dyn ClientCertVerifier) -> &'static [DistinguishedName] {
+    Box::leak(verifier.root_hint_subjects().to_vec().into_boxed_slice())
+}
+
+impl ClientCertVerifier for ReloadableVerifier {
+    fn offer_client_auth(&self) -> bool {
+        self.current().offer_client_auth()
+    }
+
+    fn client_auth_mandatory(&self) -> bool {
+        self.current().client_auth_mandatory()
+    }
+
+    fn root_hint_subjects(&self) -> &[DistinguishedName] {
+        *self.hints.read().unwrap()
+    }
+
+    fn verify_client_cert(
+        &self,
+        end_entity: &CertificateDer<'_>,
+        intermediates: &[CertificateDer<'_>],
+        now: UnixTime,
+    ) -> Result<ClientCertVerified, Error> {
+        if !ratelimit::admit_handshake(end_entity) {
+            return Err(Error::General(HANDSHAKE_RATE_LIMITED.into()));
+        }
+        let start = Instant::now();
+        let configured = self.chains.configured_intermediates(end_entity, intermediates);
+        let combined: Vec<CertificateDer<'_>>;
+        let intermediates = if configured.is_empty() {
+            intermediates
+        } else {
+            combined = intermediates.iter().cloned().chain(configured).collect();
+            &combined
+        };
+        let result = self.current().verify_client_cert(end_entity, intermediates, now).and_then(|verified| {
+            if self.revocations.is_revoked(std::iter::once(end_entity).chain(intermediates)) {
+                return Err(Error::InvalidCertificate(CertificateError::Revoked));
+            }
+            Ok(verified)
+        });
+        metrics().client_cert_verify.observe(start.elapsed());
+        if result.is_err() {
+            metrics().handshakes_failed.fetch_add(1, Ordering::Relaxed);
+        }
+        result
+    }
+
+    fn verify_tls12_signature(
+        &self,
+        message: &[u8],
+        cert: &CertificateDer<'_>,
+        dss: &DigitallySignedStruct,
+    ) -> Result<HandshakeSignatureValid, Error> {
+        self.current().verify_tls12_signature(message, cert, dss)
+    }
+
+    fn verify_tls13_signature(
+        &self,
+        message: &[u8],
+        cert: &CertificateDer<'_>,
+        dss: &DigitallySignedStruct,
+    ) -> Result<HandshakeSignatureValid, Error> {
+        self.current().verify_tls13_signature(message, cert, dss)
+    }
+
+    fn supported_verify_schemes(&self) -> Vec<SignatureScheme> {
+        self.current().supported_verify_schemes()
+    }
+}
+
+/// Certificate resolver for SNI tenants (TENANTS_FILE): a hostname in the
+/// tenant file gets its tenant's certificate, loaded by its first handshake,
+/// and any other hostname, or a ClientHello without SNI, gets the default
+/// one from `fallback`. A tenant whose files do not load fails its
+/// handshakes.
+#[derive(Debug)]
+pub struct TenantResolver {
+    tenants: Arc<Tenants>,
+    fallback: Arc<ReloadableResolver>,
+}
+
+impl TenantResolver {
+    pub fn new(tenants: Arc<Tenants>, fallback: Arc<ReloadableResolver>) -> Self {
+        Self { tenants, fallback }
+    }
+}
+
+impl ResolvesServerCert for TenantResolver {
+    fn resolve(&self, client_hello: ClientHello<'_>) -> Option<Arc<CertifiedKey>> {
+        match self.tenants.get(client_hello.server_name()) {
+            Some(tenant) => {
+                metrics().connections_accepted.fetch_add(1, Ordering::Relaxed);
+                tenant.ok().map(|tenant| tenant.certified_key.clone())
+            }
+            None => self.fallback.resolve(client_hello),
+        }
+    }
+}
+
+/// Client certificate verifier used with SNI tenants. rustls does not tell a
+/// verifier which hostname the client asked for, so the handshake only
+/// checks the client's signature, i.e. that it holds the key of the
+/// certificate it presents, and rejects revoked chains. The chain itself is
+/// verified against the client CAs of the tenant (or the default CA) in
+/// on_connect_handler, and a connection whose chain does not verify there is
+/// served as unauthenticated. No CA names are hinted, since the hint list
+/// cannot depend on the hostname either.
+#[derive(Debug)]
+pub struct TenantVerifier {
+    revocations: Arc<Revocations>,
+    algorithms: WebPkiSupportedAlgorithms,
+}
+
+impl TenantVerifier {
+    pub fn new(revocations: Arc<Revocations>, algorithms: WebPkiSupportedAlgorithms) -> Self {
+        Self { revocations, algorithms }
+    }
+}
+
+impl ClientCertVerifier for TenantVerifier {
+    fn offer_client_auth(&self) -> bool {
+        true
+    }
+
+    fn client_auth_mandatory(&self) -> bool {
+        false
+    }
+
+    fn root_hint_subjects(&self) -> &[DistinguishedName] {
+        &[]
+    }
+
+    fn verify_client_cert(
+        &self,
+        end_entity: &CertificateDer<'_>,
+        intermediates: &[CertificateDer<'_>],
+        _now: UnixTime,
+    ) -> Result<ClientCertVerified, Error> {
+        if !ratelimit::admit_handshake(end_entity) {
+            return Err(Error::General(HANDSHAKE_RATE_LIMITED.into()));
+        }
+        if self.revocations.is_revoked(std::iter::once(end_entity).chain(intermediates)) {
+            metrics().handshakes_failed.fetch_add(1, Ordering::Relaxed);
+            return Err(Error::InvalidCertificate(CertificateError::Revoked));
+        }
+        Ok(ClientCertVerified::assertion())
+    }
+
+    fn verify_tls12_signature(
+        &self,
+        message: &[u8],
+        cert: &CertificateDer<'_>,
+        dss: &DigitallySignedStruct,
+    ) -> Result<HandshakeSignatureValid, Error> {
+        verify_tls12_signature(message, cert, dss, &self.algorithms)
+    }
+
+    fn verify_tls13_signature(
+        &self,
+        message: &[u8],
+        cert: &CertificateDer<'_>,
+        dss: &DigitallySignedStruct,
+    ) -> Result<HandshakeSignatureValid, Error> {
+        verify_tls13_signature(message, cert, dss, &self.algorithms)
+    }
+
+    fn supported_verify_schemes(&self) -> Vec<SignatureScheme> {
+        self.algorithms.supported_schemes()
+    }
+}
@@ -0,0 +1,93 @@
+use std::env;
+use std::str::FromStr;
+use std::time::Duration;
+
+/// Parse environment variable `name`, falling back to `default` when it is
+/// unset or does not parse
+pub fn env_or<T: FromStr>(name: &str, default: T) -> T {
+    match env::var(name) {
+        Ok(value) => value.trim().parse().unwrap_or_else(|_| {
+            log::warn!("Ignoring invalid {}={:?}", name, value);
+            default
+        }),
+        Err(_) => default,
+    }
+}
+
+/// Boolean environment variable: 1/true/yes/on, anything else is false
+pub fn env_flag(name: &str) -> bool {
+    env::var(name)
+        .map(|v| matches!(v.trim().to_ascii_lowercase().as_str(), "1" | "true" | "yes" | "on"))
+        .unwrap_or(false)
+}
+
+/// Listener and connection handling settings. Defaults match actix-web's
+/// own, except that with several processes the worker threads are divided
+/// between them so the host is not oversubscribed.
+#[derive(Debug, Clone)]
+pub struct ServerTuning {
+    /// Server processes sharing the port via SO_REUSEPORT (PROCESSES)
+    pub processes: usize,
+    /// Bind with SO_REUSEPORT (REUSE_PORT, implied by PROCESSES > 1), so
+    /// independently started instances can share the port too
+    pub reuse_port: bool,
+    /// Worker threads per process (WORKERS)
+    pub workers: usize,
+    /// Listen backlog (BACKLOG)
+    pub backlog: u32,
+    /// Open connections per worker (MAX_CONNECTIONS)
+    pub max_connections: usize,
+    /// Concurrent TLS handshakes per worker (MAX_CONNECTION_RATE); handshakes
+    /// are CPU bound, so this bounds how much of a worker a burst can take
+    pub max_connection_rate: usize,
+    /// Idle keep-alive timeout, None to close after each response
+    /// (KEEP_ALIVE_SECS, 0 disables)
+    pub keep_alive: Option<Duration>,
+    /// Time allowed for a client to send the request head
+    /// (CLIENT_REQUEST_TIMEOUT_MS)
+    pub client_request_timeout: Duration,
+    /// Time allowed for a client to acknowledge connection shutdown
+    /// (CLIENT_DISCONNECT_TIMEOUT_MS)
+    pub client_disconnect_timeout: Duration,
+    /// Time allowed to complete the TLS handshake (TLS_HANDSHAKE_TIMEOUT_MS)
+    pub tls_handshake_timeout: Duration,
+    /// Time in-flight requests get to finish after SIGTERM, SIGINT or a
+    /// listener handoff before connections are closed (SHUTDOWN_TIMEOUT_SECS)
+    pub shutdown_timeout: Duration,
+    /// Time a new process gets to take over the listeners on SIGUSR2
+    /// (HANDOFF_TIMEOUT_SECS)
+    pub handoff_timeout: Duration,
+}
+
+impl ServerTuning {
+    pub fn from_env() -> Self {
+        let cores = std::thread::available_parallelism()
+            .map(|n| n.get())
+            .unwrap_or(1);
+        let mut processes = env_or("PROCESSES", 1usize).max(1);
+        let mut reuse_port = processes > 1 || env_flag("REUSE_PORT");
+        if reuse_port && !cfg!(unix) {
+            log::warn!("SO_REUSEPORT is not available on this platform, running a single process");
+            processes = 1;
+            reuse_port = false;
+        }
+
+        ServerTuning {
+            processes,
+            reuse_port,
+            workers: env_or("WORKERS", (cores / processes).max(1)).max(1),
+            backlog: env_or("BACKLOG", 2048),
+            max_connections: env_or("MAX_CONNECTIONS", 25_000),
+            max_connection_rate: env_or("MAX_CONNECTION_RATE", 256),
+            keep_alive: match env_or("KEEP_ALIVE_SECS", 5u64) {
+                0 => None,
+                secs => Some(Duration::from_secs(secs)),
+            },
+            client_request_timeout: Duration::from_millis(env_or("CLIENT_REQUEST_TIMEOUT_MS", 5000)),
+            client_disconnect_timeout: Duration::from_millis(env_or("CLIENT_DISCONNECT_TIMEOUT_MS", 0)),
+            tls_handshake_timeout: Duration::from_millis(env_or("TLS_HANDSHAKE_TIMEOUT_MS", 3000)),
+            shutdown_timeout: Duration::from_secs(env_or("SHUTDOWN_TIMEOUT_SECS", 30)),
+            handoff_timeout: Duration::from_secs(env_or("HANDOFF_TIMEOUT_SECS", 30)),
+        }
+    }
+}
@@ -1,10 +1,51 @@
 #!/usr/bin/env python3
-"""Test mTLS configuration"""
-import ssl
+"""Test mTLS configuration
+
+Without arguments this runs the functional checks against the local server
+(one request without a client certificate, one with).
+
+With --bench it becomes a load generator: a pool of worker threads keeps
+--concurrency connections busy for --duration seconds (or until --requests
+requests were sent) and reports TLS handshake time and request latency
+separately, split between workers that present a client certificate and
+workers that do not. With --resume each worker offers its previous TLS
+session when reconnecting, and full and resumed handshakes are reported
+side by side.
+
+--protocol h2 negotiates HTTP/2 through ALPN and multiplexes --streams
+concurrent requests over each connection, so --concurrency requests in
+flight need only concurrency/streams connections (and handshakes) instead
+of one each; --protocol compare runs HTTP/1.1 and then HTTP/2 with the same
+settings and prints them side by side. HTTP/2 needs the optional h2
+package (pip install h2). --check-peer verifies that every response
+reports the client certificate of the connection it was sent on.
+
+Examples:
+    python test-mtls.py
+    python test-mtls.py --bench --concurrency 50 --duration 10
+    python test-mtls.py --bench --mode keepalive --requests 20000 --cert-ratio 1
+    python test-mtls.py --bench --resume --cert-ratio 1 --duration 10
+    python test-mtls.py --bench --protocol compare --mode keepalive --concurrency 50 --streams 25
+"""
+import argparse
+import io
 import json
-import urllib.request
+import math
+import socket
+import ssl
 import sys
-import io
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:  # optional, only needed for --protocol h2/compare
+    h2 = None
 
 # Force UTF-8 output on Windows
 if sys.platform == "win32":
@@ -15,59 +56,87 @@ CERT_FILE = "client-cert.pem"
 KEY_FILE = "client-key.pem"
 CA_FILE = "ca.pem"
 
-# Create SSL context that trusts our CA
-context = ssl.create_default_context()
-context.check_hostname = False
-context.verify_mode = ssl.CERT_NONE  # Skip server cert verification for self-signed
+MODE_NEW = "new"
+MODE_KEEPALIVE = "keepalive"
 
-print("=" * 70)
-print("Testing mTLS Configuration")
-print("=" * 70)
+GROUP_WITH_CERT = "with-cert"
+GROUP_WITHOUT_CERT = "without-cert"
 
-# Test 1: Without client certificate
-print("\n✓ Test 1: Request WITHOUT client certificate")
-print("-" * 70)
-try:
-    req = urllib.request.Request(URL)
-    with urllib.request.urlopen(req, context=context) as response:
-        data = json.loads(response.read().decode())
-        print(f"Status: {response.status}")
-        print(f"Response: {json.dumps(data, indent=2)}")
-
-        if not data.get("mtls_valid"):
-            print("\n✅ Correct: mTLS validation failed (no client cert presented)")
-        else:
-            print("\n⚠️  Unexpected: mTLS validation succeeded")
-except Exception as e:
-    print(f"❌ Error: {e}")
+PROTOCOL_H1 = "h1"
+PROTOCOL_H2 = "h2"
+PROTOCOL_COMPARE = "compare"
+ALPN = {PROTOCOL_H1: "http/1.1", PROTOCOL_H2: "h2"}
 
-# Test 2: With client certificate
-print("\n✓ Test 2: Request WITH client certificate")
-print("-" * 70)
-try:
-    context.load_cert_chain(CERT_FILE, KEY_FILE)
-
-    req = urllib.request.Request(URL)
-    with urllib.request.urlopen(req, context=context) as response:
-        data = json.loads(response.read().decode())
-        print(f"Status: {response.status}")
-        print(f"Response: {json.dumps(data, indent=2)}")
-
-        if data.get("mtls_valid"):
-            print("\n✅ Success: mTLS validation passed!")
-            if data.get("verified_chains"):
-                print(f"   Verified chains: {len(data['verified_chains'])}")
-                for i, chain in enumerate(data['verified_chains']):
-                    print(f"   Chain {i+1}: {len(chain)} certificate(s)")
-        else:
-            print("\n⚠️  Warning: mTLS validation failed (should have passed)")
-except Exception as e:
-    print(f"❌ Error: {e}")
-
-print("\n" + "=" * 70)
-print("Test Summary:")
-print("=" * 70)
-print("""
+
+def make_context(with_cert, cert_file=CERT_FILE, key_file=KEY_FILE, protocol=None):
+    """Create a client SSL context, optionally presenting the client cert
+    and offering one ALPN protocol"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE  # Skip server cert verification for self-signed
+    if with_cert:
+        context.load_cert_chain(cert_file, key_file)
+    if protocol:
+        context.set_alpn_protocols([ALPN[protocol]])
+    return context
+
+
+# ---------------------------------------------------------------------------
+# Functional checks
+# ---------------------------------------------------------------------------
+
+def run_checks(url, cert_file=CERT_FILE, key_file=KEY_FILE):
+    # Create SSL context that trusts our CA
+    context = make_context(with_cert=False)
+
+    print("=" * 70)
+    print("Testing mTLS Configuration")
+    print("=" * 70)
+
+    # Test 1: Without client certificate
+    print("\n✓ Test 1: Request WITHOUT client certificate")
+    print("-" * 70)
+    try:
+        req = urllib.request.Request(url)
+        with urllib.request.urlopen(req, context=context) as response:
+            data = json.loads(response.read().decode())
+            print(f"Status: {response.status}")
+            print(f"Response: {json.dumps(data, indent=2)}")
+
+            if not data.get("mtls_valid"):
+                print("\n✅ Correct: mTLS validation failed (no client cert presented)")
+            else:
+                print("\n⚠️  Unexpected: mTLS validation succeeded")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
+    # Test 2: With client certificate
+    print("\n✓ Test 2: Request WITH client certificate")
+    print("-" * 70)
+    try:
+        context.load_cert_chain(cert_file, key_file)
+
+        req = urllib.request.Request(url)
+        with urllib.request.urlopen(req, context=context) as response:
+            data = json.loads(response.read().decode())
+            print(f"Status: {response.status}")
+            print(f"Response: {json.dumps(data, indent=2)}")
+
+            if data.get("mtls_valid"):
+                print("\n✅ Success: mTLS validation passed!")
+                if data.get("verified_chains"):
+                    print(f"   Verified chains: {len(data['verified_chains'])}")
+                    for i, chain in enumerate(data['verified_chains']):
+                        print(f"   Chain {i+1}: {len(chain)} certificate(s)")
+            else:
+                print("\n⚠️  Warning: mTLS validation failed (should have passed)")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
+    print("\n" + "=" * 70)
+    print("Test Summary:")
+    print("=" * 70)
+    print("""
 ✅ Cloudflare mTLS Configuration:
    - Access policy created for nietst.uk
    - Policy requires valid client certificates
@@ -81,3 +150,500 @@ Next Steps:
 1. Update nietst.uk DNS to Cloudflare nameservers
 2. Test production endpoint: curl --cert client.p12 https://nietst.uk/api/certs
 """)
+
+
+# ---------------------------------------------------------------------------
+# Load generator
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class GroupStats:
+    """Measurements for one group of workers (with or without client cert)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.handshake_ms = []
+        self.resumed_ms = []
+        self.latency_ms = []
+        self.requests = 0
+        self.errors = 0
+        self.status_codes = {}
+        self.error_kinds = {}
+
+    def record_handshake(self, ms, resumed=False):
+        with self.lock:
+            if resumed:
+                self.resumed_ms.append(ms)
+            else:
+                self.handshake_ms.append(ms)
+
+    def record_request(self, ms, status):
+        with self.lock:
+            self.requests += 1
+            self.latency_ms.append(ms)
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+    def record_peer(self, body, with_cert):
+        """Count a response whose mtls_valid does not match whether the
+        connection presented a client certificate"""
+        try:
+            valid = json.loads(body).get("mtls_valid")
+        except (ValueError, AttributeError):
+            valid = None
+        if valid != with_cert:
+            self.record_error(PeerMismatch(f"mtls_valid={valid!r}, expected {with_cert}"))
+
+    def record_error(self, exc):
+        kind = type(exc).__name__
+        with self.lock:
+            self.errors += 1
+            self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+    def summary(self, elapsed):
+        handshakes = sorted(self.handshake_ms)
+        resumed = sorted(self.resumed_ms)
+        latencies = sorted(self.latency_ms)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rps": self.requests / elapsed if elapsed > 0 else 0.0,
+            "handshakes": len(handshakes) + len(resumed),
+            "full_handshakes": len(handshakes),
+            "resumed_handshakes": len(resumed),
+            "full_handshakes_per_s": len(handshakes) / elapsed if elapsed > 0 else 0.0,
+            "resumed_handshakes_per_s": len(resumed) / elapsed if elapsed > 0 else 0.0,
+            "handshake_ms": distribution(handshakes),
+            "resumed_handshake_ms": distribution(resumed),
+            "latency_ms": distribution(latencies),
+            "status_codes": {str(k): v for k, v in sorted(self.status_codes.items())},
+            "error_kinds": dict(sorted(self.error_kinds.items())),
+        }
+
+
+class PeerMismatch(Exception):
+    """A response reported a different client certificate state than the
+    connection it was sent on"""
+
+
+def distribution(sorted_values):
+    return {
+        "p50": percentile(sorted_values, 50),
+        "p95": percentile(sorted_values, 95),
+        "p99": percentile(sorted_values, 99),
+        "max": sorted_values[-1] if sorted_values else 0.0,
+    }
+
+
+class RequestBudget:
+    """Shared stop condition: a deadline, a request count, or both"""
+
+    def __init__(self, duration, total_requests):
+        self.deadline = time.perf_counter() + duration if duration else None
+        self.remaining = total_requests
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return False
+        if self.remaining is None:
+            return True
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def connect(host, port, context, timeout, session=None):
+    """Open a TLS connection and return (socket, handshake_ms, resumed)
+
+    TCP connect time is excluded so the handshake figure isolates the TLS
+    work (key exchange, server signature and client chain verification).
+    Passing a previous `session` offers it for resumption.
+    """
+    raw = socket.create_connection((host, port), timeout=timeout)
+    raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        start = time.perf_counter()
+        tls = context.wrap_socket(raw, server_hostname=host, do_handshake_on_connect=False,
+                                  session=session)
+        tls.do_handshake()
+        return tls, (time.perf_counter() - start) * 1000.0, tls.session_reused
+    except BaseException:
+        raw.close()
+        raise
+
+
+def read_response(reader):
+    """Read one HTTP/1.1 response, returning (status, body, keep_alive)"""
+    status_line = reader.readline(65537)
+    if not status_line:
+        raise ConnectionError("connection closed before response")
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+        raise ConnectionError(f"malformed status line: {status_line!r}")
+    status = int(parts[1])
+
+    headers = {}
+    while True:
+        line = reader.readline(65537)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+        chunks = []
+        while True:
+            size = int(reader.readline(65537).split(b";", 1)[0], 16)
+            if size == 0:
+                reader.readline(65537)
+                break
+            chunks.append(reader.read(size))
+            reader.readline(65537)
+        body = b"".join(chunks)
+    elif b"content-length" in headers:
+        body = reader.read(int(headers[b"content-length"]))
+    else:
+        body = reader.read()
+
+    keep_alive = headers.get(b"connection", b"").lower() != b"close"
+    return status, body, keep_alive
+
+
+def bench_worker(target, context, mode, resume, budget, stats, timeout, check_peer=None):
+    """HTTP/1.1 worker: one request at a time on its connection. With
+    check_peer set, responses must report mtls_valid == check_peer."""
+    host, port, request = target["host"], target["port"], target["request"]
+    conn = reader = session = None
+    while budget.take():
+        try:
+            if conn is None:
+                conn, handshake_ms, resumed = connect(host, port, context, timeout, session)
+                reader = conn.makefile("rb")
+                stats.record_handshake(handshake_ms, resumed)
+
+            start = time.perf_counter()
+            conn.sendall(request)
+            status, body, keep_alive = read_response(reader)
+            stats.record_request((time.perf_counter() - start) * 1000.0, status)
+            if check_peer is not None:
+                stats.record_peer(body, check_peer)
+
+            # TLS 1.3 tickets arrive after the handshake, so the session is
+            # only worth keeping once a response has been read.
+            if resume:
+                session = conn.session
+
+            if mode == MODE_NEW or not keep_alive:
+                reader.close()
+                conn.close()
+                conn = reader = None
+        except (OSError, ValueError) as e:
+            stats.record_error(e)
+            if conn is not None:
+                reader.close()
+                conn.close()
+                conn = reader = None
+    if conn is not None:
+        reader.close()
+        conn.close()
+
+
+def h2_round(conn, h2conn, target, count, stats, check_peer):
+    """Send count concurrent requests as HTTP/2 streams and wait for all of
+    the responses"""
+    streams = {}
+    for _ in range(count):
+        stream_id = h2conn.get_next_available_stream_id()
+        h2conn.send_headers(stream_id, target["h2_headers"], end_stream=True)
+        streams[stream_id] = [time.perf_counter(), 0, bytearray()]
+    conn.sendall(h2conn.data_to_send())
+
+    while streams:
+        data = conn.recv(65536)
+        if not data:
+            raise ConnectionError(f"connection closed with {len(streams)} streams in flight")
+        for event in h2conn.receive_data(data):
+            if isinstance(event, h2.events.ResponseReceived):
+                streams[event.stream_id][1] = int(dict(event.headers)[b":status"])
+            elif isinstance(event, h2.events.DataReceived):
+                streams[event.stream_id][2] += event.data
+                h2conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                start, status, body = streams.pop(event.stream_id)
+                stats.record_request((time.perf_counter() - start) * 1000.0, status)
+                if check_peer is not None:
+                    stats.record_peer(bytes(body), check_peer)
+            elif isinstance(event, h2.events.StreamReset):
+                if streams.pop(event.stream_id, None) is not None:
+                    stats.record_error(ConnectionResetError(f"stream {event.stream_id} reset"))
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                raise ConnectionError(f"GOAWAY with {len(streams)} streams in flight")
+        pending = h2conn.data_to_send()
+        if pending:
+            conn.sendall(pending)
+
+
+def bench_worker_h2(target, context, mode, resume, budget, stats, timeout, streams, check_peer=None):
+    """HTTP/2 worker: rounds of up to `streams` concurrent requests on one
+    connection; in new-connection mode each round gets a fresh connection"""
+    host, port = target["host"], target["port"]
+    conn = h2conn = session = None
+    while True:
+        count = 0
+        while count < streams and budget.take():
+            count += 1
+        if not count:
+            break
+        try:
+            if conn is None:
+                conn, handshake_ms, resumed = connect(host, port, context, timeout, session)
+                stats.record_handshake(handshake_ms, resumed)
+                if conn.selected_alpn_protocol() != "h2":
+                    # Every connection would fail the same way
+                    stats.record_error(ConnectionError(
+                        f"server negotiated {conn.selected_alpn_protocol()!r}, not h2"))
+                    break
+                h2conn = h2.connection.H2Connection(
+                    config=h2.config.H2Configuration(client_side=True, header_encoding=None))
+                h2conn.initiate_connection()
+                conn.sendall(h2conn.data_to_send())
+
+            h2_round(conn, h2conn, target, count, stats, check_peer)
+
+            if resume:
+                session = conn.session
+            if mode == MODE_NEW:
+                h2conn.close_connection()
+                conn.sendall(h2conn.data_to_send())
+                conn.close()
+                conn = h2conn = None
+        except (OSError, ValueError, h2.exceptions.H2Error) as e:
+            stats.record_error(e)
+            if conn is not None:
+                conn.close()
+                conn = h2conn = None
+    if conn is not None:
+        conn.close()
+
+
+def build_target(url, mode):
+    parts = urlsplit(url)
+    host = parts.hostname or "127.0.0.1"
+    port = parts.port or 443
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    connection = "keep-alive" if mode == MODE_KEEPALIVE else "close"
+    request = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {parts.netloc}\r\n"
+        f"Accept: application/json\r\n"
+        f"Connection: {connection}\r\n"
+        f"\r\n"
+    ).encode("ascii")
+    h2_headers = [
+        (b":method", b"GET"),
+        (b":path", path.encode("ascii")),
+        (b":scheme", b"https"),
+        (b":authority", parts.netloc.encode("ascii")),
+        (b"accept", b"application/json"),
+    ]
+    return {"host": host, "port": port, "request": request, "h2_headers": h2_headers}
+
+
+def run_benchmark(args, protocol=PROTOCOL_H1):
+    target = build_target(args.url, args.mode)
+    budget = RequestBudget(args.duration, args.requests or None)
+
+    # --concurrency requests in flight: one connection each over HTTP/1.1,
+    # --streams per connection over HTTP/2
+    if protocol == PROTOCOL_H2:
+        workers = -(-args.concurrency // args.streams)
+        streams = [min(args.streams, args.concurrency - i * args.streams) for i in range(workers)]
+    else:
+        workers = args.concurrency
+        streams = [1] * workers
+
+    with_cert_workers = int(round(workers * args.cert_ratio))
+    groups = {
+        GROUP_WITH_CERT: GroupStats(GROUP_WITH_CERT),
+        GROUP_WITHOUT_CERT: GroupStats(GROUP_WITHOUT_CERT),
+    }
+    contexts = {
+        GROUP_WITH_CERT: make_context(True, args.cert, args.key, protocol) if with_cert_workers else None,
+        GROUP_WITHOUT_CERT: make_context(False, protocol=protocol),
+    }
+
+    threads = []
+    for i in range(workers):
+        group = GROUP_WITH_CERT if i < with_cert_workers else GROUP_WITHOUT_CERT
+        check_peer = (group == GROUP_WITH_CERT) if args.check_peer else None
+        worker_args = (target, contexts[group], args.mode, args.resume, budget, groups[group], args.timeout)
+        if protocol == PROTOCOL_H2:
+            thread = threading.Thread(target=bench_worker_h2, args=worker_args + (streams[i], check_peer),
+                                      daemon=True)
+        else:
+            thread = threading.Thread(target=bench_worker, args=worker_args + (check_peer,), daemon=True)
+        threads.append(thread)
+
+    print(f"Benchmarking {args.url} over {ALPN[protocol]}: {workers} connections "
+          f"({with_cert_workers} with cert), {args.concurrency} requests in flight, "
+          f"mode={args.mode}, resume={args.resume}", file=sys.stderr)
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    results = {
+        "url": args.url,
+        "protocol": ALPN[protocol],
+        "streams_per_connection": max(streams),
+        "mode": args.mode,
+        "resume": args.resume,
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "groups": {name: g.summary(elapsed) for name, g in groups.items() if g.requests or g.errors},
+    }
+    total_requests = sum(g.requests for g in groups.values())
+    total_errors = sum(g.errors for g in groups.values())
+    results["total"] = {
+        "requests": total_requests,
+        "errors": total_errors,
+        "rps": total_requests / elapsed if elapsed > 0 else 0.0,
+        "handshakes": sum(len(g.handshake_ms) + len(g.resumed_ms) for g in groups.values()),
+        "resumed_handshakes": sum(len(g.resumed_ms) for g in groups.values()),
+        "latency_ms": distribution(sorted(ms for g in groups.values() for ms in g.latency_ms)),
+    }
+    return results
+
+
+def print_report(results):
+    print("=" * 70)
+    print(f"mTLS Benchmark: {results['url']} ({results['protocol']})")
+    print(f"Mode: {results['mode']}, resume: {results['resume']}, in flight: {results['concurrency']}, "
+          f"streams/connection: {results['streams_per_connection']}, elapsed: {results['elapsed_s']:.2f}s")
+    print("=" * 70)
+
+    header = f"{'':16}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    for name, group in results["groups"].items():
+        print(f"\n{name}")
+        print("-" * 70)
+        print(f"requests: {group['requests']}  errors: {group['errors']}  "
+              f"rps: {group['rps']:.1f}  handshakes: {group['handshakes']}")
+        print(f"full handshakes: {group['full_handshakes']} ({group['full_handshakes_per_s']:.1f}/s)  "
+              f"resumed: {group['resumed_handshakes']} ({group['resumed_handshakes_per_s']:.1f}/s)")
+        print(header)
+        rows = [("full hs ms", "handshake_ms")]
+        if group["resumed_handshakes"]:
+            rows.append(("resumed hs ms", "resumed_handshake_ms"))
+        rows.append(("latency ms", "latency_ms"))
+        for label, key in rows:
+            d = group[key]
+            print(f"{label:16}{d['p50']:>10.2f}{d['p95']:>10.2f}{d['p99']:>10.2f}{d['max']:>10.2f}")
+        print(f"status codes: {group['status_codes']}")
+        if group["error_kinds"]:
+            print(f"errors: {group['error_kinds']}")
+
+    total = results["total"]
+    print("\n" + "=" * 70)
+    print(f"Total: {total['requests']} requests, {total['errors']} errors, "
+          f"{total['rps']:.1f} req/s, {total['handshakes']} handshakes "
+          f"({total['resumed_handshakes']} resumed)")
+    print("=" * 70)
+
+
+def print_comparison(runs):
+    """Side by side totals of runs over different protocols"""
+    print("\n" + "=" * 70)
+    print("Protocol comparison")
+    print("=" * 70)
+    print(f"{'':10}{'requests':>10}{'req/s':>10}{'handshakes':>12}{'req/hs':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for results in runs:
+        total = results["total"]
+        per_handshake = total["requests"] / total["handshakes"] if total["handshakes"] else 0.0
+        print(f"{results['protocol']:10}{total['requests']:>10}{total['rps']:>10.1f}{total['handshakes']:>12}"
+              f"{per_handshake:>9.1f}{total['latency_ms']['p50']:>9.2f}{total['latency_ms']['p99']:>9.2f}"
+              f"{total['errors']:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Test or benchmark the local mTLS server")
+    parser.add_argument("--url", default=URL, help=f"Target URL (default: {URL})")
+    parser.add_argument("--cert", default=CERT_FILE, help=f"Client certificate (default: {CERT_FILE})")
+    parser.add_argument("--key", default=KEY_FILE, help=f"Client private key (default: {KEY_FILE})")
+    parser.add_argument("--bench", action="store_true", help="Run the load generator instead of the checks")
+    parser.add_argument("-c", "--concurrency", type=int, default=10,
+                        help="Requests in flight: connections for HTTP/1.1, streams for HTTP/2")
+    parser.add_argument("-d", "--duration", type=float, default=None,
+                        help="Seconds to run (default 10 unless --requests is given)")
+    parser.add_argument("-n", "--requests", type=int, default=0, help="Total requests to send")
+    parser.add_argument("--mode", choices=(MODE_NEW, MODE_KEEPALIVE), default=MODE_NEW,
+                        help="New TLS connection per request, or keep-alive reuse")
+    parser.add_argument("--resume", action="store_true",
+                        help="Offer the previous TLS session when reconnecting (session resumption)")
+    parser.add_argument("--cert-ratio", type=float, default=0.5,
+                        help="Fraction of connections presenting the client certificate (0..1)")
+    parser.add_argument("--protocol", choices=(PROTOCOL_H1, PROTOCOL_H2, PROTOCOL_COMPARE), default=PROTOCOL_H1,
+                        help="HTTP/1.1, HTTP/2 (ALPN h2), or both one after the other")
+    parser.add_argument("--streams", type=int, default=10,
+                        help="Concurrent HTTP/2 streams per connection (default: 10)")
+    parser.add_argument("--check-peer", action="store_true",
+                        help="Check every response reports the client certificate state of its connection")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Socket timeout in seconds")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if not 0.0 <= args.cert_ratio <= 1.0:
+        parser.error("--cert-ratio must be between 0 and 1")
+    if args.streams < 1:
+        parser.error("--streams must be at least 1")
+    if args.protocol != PROTOCOL_H1 and h2 is None:
+        parser.error("--protocol h2/compare needs the h2 package: pip install h2")
+    if args.duration is None and not args.requests:
+        args.duration = 10.0
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.bench:
+        run_checks(args.url, args.cert, args.key)
+        return 0
+
+    if args.protocol == PROTOCOL_COMPARE:
+        runs = [run_benchmark(args, PROTOCOL_H1), run_benchmark(args, PROTOCOL_H2)]
+        output = {run["protocol"]: run for run in runs}
+    else:
+        runs = [run_benchmark(args, args.protocol)]
+        output = runs[0]
+
+    if args.json == "-":
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        for results in runs:
+            print_report(results)
+        if len(runs) > 1:
+            print_comparison(runs)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(output, f, indent=2)
+    return 1 if any(run["total"]["errors"] for run in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
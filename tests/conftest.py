@@ -0,0 +1,316 @@
+"""Fixtures booting the Rust and Go servers for the end-to-end suite
+
+Each session generates throwaway certificates the way `make certs` does
+(Test CA, a server certificate for 127.0.0.1/localhost, a client
+certificate), plus a client certificate from an unrelated CA and an expired
+one, and starts every selected server on ephemeral ports on 127.0.0.1. The
+Go server gets its certificate and client CA from a tenant file for
+localhost instead of ACME.
+
+Server binaries come from MTLS_RUST_SERVER / MTLS_GO_SERVER when set, else
+they are built (cargo build --release, go build -mod=vendor); a server
+whose toolchain is missing is skipped.
+
+    python -m pytest tests
+    python -m pytest tests --servers go -k perf --update-baseline
+"""
+import contextlib
+import datetime
+import http.client
+import ipaddress
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+REPO = Path(__file__).resolve().parent.parent
+SERVERS = ("rust", "go")
+DEFAULT_BASELINE = REPO / "tests" / "perf-baseline.json"
+START_TIMEOUT = 30.0
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("mtls", "mTLS end-to-end suite")
+    group.addoption("--servers", default=",".join(SERVERS),
+                    help=f"Comma-separated servers to test (default: {','.join(SERVERS)})")
+    group.addoption("--perf-baseline", default=str(DEFAULT_BASELINE),
+                    help="Baseline JSON the benchmark is compared with and recorded to")
+    group.addoption("--perf-tolerance", type=float, default=0.25,
+                    help="Allowed rps drop and p99 handshake increase as a fraction (default: 0.25)")
+    group.addoption("--perf-requests", type=int, default=1000, help="Requests per benchmark (default: 1000)")
+    group.addoption("--perf-concurrency", type=int, default=8, help="Connections in flight (default: 8)")
+    group.addoption("--update-baseline", action="store_true",
+                    help="Record the benchmark results as the new baseline instead of comparing")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "perf: load benchmark compared with the recorded baseline")
+
+
+# ---------------------------------------------------------------------------
+# Certificates
+# ---------------------------------------------------------------------------
+
+def _name(common_name):
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+                      x509.NameAttribute(NameOID.ORGANIZATION_NAME, "mTLS Test")])
+
+
+def _write(cert_path, key_path, cert, key):
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+
+
+def _issue(subject, key, issuer_cert, issuer_key, not_before, days, extensions):
+    builder = (x509.CertificateBuilder()
+               .subject_name(_name(subject))
+               .issuer_name(issuer_cert.subject if issuer_cert else _name(subject))
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(not_before)
+               .not_valid_after(not_before + datetime.timedelta(days=days)))
+    for extension, critical in extensions:
+        builder = builder.add_extension(extension, critical=critical)
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+
+def _make_ca(subject, now):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=4096)
+    cert = _issue(subject, key, None, None, now, 3650, [
+        (x509.BasicConstraints(ca=True, path_length=None), True),
+        (x509.SubjectKeyIdentifier.from_public_key(key.public_key()), False),
+    ])
+    return cert, key
+
+
+def _make_client(subject, ca_cert, ca_key, not_before, days=365):
+    """Client certificate as in client-ext.cnf"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    cert = _issue(subject, key, ca_cert, ca_key, not_before, days, [
+        (x509.BasicConstraints(ca=False, path_length=None), False),
+        (x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), False),
+    ])
+    return cert, key
+
+
+class PKI:
+    """Paths of the generated certificates and keys"""
+
+    def __init__(self, root):
+        self.root = root
+        self.ca = root / "ca.pem"
+        self.server_cert, self.server_key = root / "cert.pem", root / "key.pem"
+        self.clients = {}
+
+    def client(self, name):
+        """(cert, key) paths of the client certificate called name: valid,
+        wrong-ca or expired"""
+        return self.clients[name]
+
+
+@pytest.fixture(scope="session")
+def pki(tmp_path_factory):
+    root = tmp_path_factory.mktemp("pki")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    pki = PKI(root)
+
+    ca_cert, ca_key = _make_ca("Test CA", now)
+    _write(pki.ca, root / "ca-key.pem", ca_cert, ca_key)
+
+    # server-ext.cnf
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    cert = _issue("127.0.0.1", key, ca_cert, ca_key, now, 365, [
+        (x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+                                      x509.DNSName("localhost")]), False),
+        (x509.BasicConstraints(ca=False, path_length=None), False),
+    ])
+    _write(pki.server_cert, pki.server_key, cert, key)
+
+    other_cert, other_key = _make_ca("Other CA", now)
+    clients = {
+        "valid": _make_client("Test Client", ca_cert, ca_key, now - datetime.timedelta(minutes=5)),
+        "wrong-ca": _make_client("Test Client", other_cert, other_key, now - datetime.timedelta(minutes=5)),
+        "expired": _make_client("Test Client", ca_cert, ca_key, now - datetime.timedelta(days=30), days=1),
+    }
+    for name, (cert, key) in clients.items():
+        pki.clients[name] = (root / f"client-{name}-cert.pem", root / f"client-{name}-key.pem")
+        _write(*pki.clients[name], cert, key)
+    return pki
+
+
+# ---------------------------------------------------------------------------
+# Servers
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RunningServer:
+    """A started server and what differs between the two implementations"""
+
+    def __init__(self, name, process, port, path, unauthenticated_status, chains_field, log):
+        self.name = name
+        self.process = process
+        self.port = port
+        self.path = path
+        self.unauthenticated_status = unauthenticated_status
+        self.chains_field = chains_field
+        self.log = log
+
+    @property
+    def url(self):
+        return f"https://localhost:{self.port}{self.path}"
+
+    def output(self):
+        return self.log.read_text(errors="replace")[-4000:]
+
+
+def client_context(pki, client=None):
+    """Context verifying the server against the test CA, presenting the
+    named client certificate if given"""
+    context = ssl.create_default_context(cafile=str(pki.ca))
+    if client:
+        cert, key = pki.client(client)
+        context.load_cert_chain(str(cert), str(key))
+    return context
+
+
+def get(server, context, path=None):
+    """GET path (default: the server's certificate endpoint) on a new
+    connection; returns (status, parsed JSON body)"""
+    conn = http.client.HTTPSConnection("localhost", server.port, context=context, timeout=10)
+    try:
+        conn.request("GET", path or server.path, headers={"Accept": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        conn.close()
+
+
+def _wait_ready(server, pki):
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.process.poll() is not None:
+            pytest.fail(f"{server.name} server exited with {server.process.returncode}:\n{server.output()}")
+        try:
+            get(server, client_context(pki))
+            return
+        except (OSError, ValueError):
+            time.sleep(0.1)
+    pytest.fail(f"{server.name} server did not answer within {START_TIMEOUT:g}s:\n{server.output()}")
+
+
+def _build(name, env_var, tool, command, output):
+    if os.environ.get(env_var):
+        return os.environ[env_var]
+    if not shutil.which(tool):
+        pytest.skip(f"{tool} not found; build the {name} server and set {env_var}")
+    result = subprocess.run(command, cwd=REPO, capture_output=True, text=True)
+    if result.returncode != 0:
+        pytest.fail(f"{' '.join(command)} failed:\n{result.stderr[-4000:]}")
+    return str(output)
+
+
+@pytest.fixture(scope="session")
+def rust_binary(request):
+    return _build("Rust", "MTLS_RUST_SERVER", "cargo", ["cargo", "build", "--release", "--quiet"],
+                  REPO / "target" / "release" / "mtls-server")
+
+
+@pytest.fixture(scope="session")
+def go_binary(request, tmp_path_factory):
+    output = tmp_path_factory.mktemp("go") / "mtls-server"
+    return _build("Go", "MTLS_GO_SERVER", "go",
+                  ["go", "build", "-mod=vendor", "-o", str(output), "./cmd/mtls-server"], output)
+
+
+def tenants_file(pki):
+    """Tenant file serving localhost with the test server certificate and CA"""
+    tenants = pki.root / "tenants.txt"
+    tenants.write_text(f"localhost {pki.server_cert} {pki.server_key} {pki.ca}\n")
+    return tenants
+
+
+def _start_rust(request, pki, log, rust_env=None):
+    port = free_port()
+    env = dict(os.environ, BIND_ADDR="127.0.0.1", BIND_PORT=str(port), CERT_PATH=str(pki.server_cert),
+               KEY_PATH=str(pki.server_key), CA_PATH=str(pki.ca), TLS_RELOAD_INTERVAL_SECS="0", LOG_LEVEL="warn",
+               **(rust_env or {}))
+    process = subprocess.Popen([request.getfixturevalue("rust_binary")], env=env, cwd=pki.root,
+                               stdout=log, stderr=subprocess.STDOUT)
+    return RunningServer("rust", process, port, "/api/certs", 200, "verified_chains", Path(log.name))
+
+
+def _start_go(request, pki, log, args=()):
+    port = free_port()
+    command = [request.getfixturevalue("go_binary"),
+               "-https-addr", f"127.0.0.1:{port}", "-http-addr", f"127.0.0.1:{free_port()}",
+               "-root-ca", str(pki.ca), "-tenants", str(tenants_file(pki)), "-cert-cache", "",
+               "-root-ca-reload-interval", "0", *args]
+    # index.html and images/ are read relative to the working directory
+    process = subprocess.Popen(command, cwd=REPO / "site", stdout=log, stderr=subprocess.STDOUT)
+    return RunningServer("go", process, port, "/json", 401, "verified_certificate_chains", Path(log.name))
+
+
+@contextlib.contextmanager
+def running_server(request, pki, tmp_path_factory, go_args=(), rust_env=None):
+    """Start the server named by request.param, the Go server with the extra
+    flags go_args and the Rust server with the extra environment rust_env,
+    and stop it afterwards"""
+    name = request.param
+    if name not in request.config.getoption("--servers").split(","):
+        pytest.skip(f"{name} server not selected by --servers")
+
+    log_path = tmp_path_factory.mktemp(name) / "server.log"
+    with open(log_path, "wb") as log:
+        if name == "rust":
+            started = _start_rust(request, pki, log, rust_env)
+        else:
+            started = _start_go(request, pki, log, go_args)
+    try:
+        _wait_ready(started, pki)
+        yield started
+    finally:
+        started.process.terminate()
+        try:
+            started.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            started.process.kill()
+            started.process.wait()
+
+
+@pytest.fixture(scope="session", params=SERVERS)
+def server(request, pki, tmp_path_factory):
+    """Every selected server, started once per session"""
+    with running_server(request, pki, tmp_path_factory) as started:
+        yield started
+
+
+@pytest.fixture(params=SERVERS)
+def own_server(request, pki, tmp_path_factory):
+    """Every selected server, started for one test that may stop or restart it"""
+    with running_server(request, pki, tmp_path_factory) as started:
+        yield started
+
+
+@pytest.fixture
+def fetch(server, pki):
+    """fetch(client=None, path=None) -> (status, body) from the server under
+    test, presenting the named client certificate"""
+    def fetch(client=None, path=None):
+        return get(server, client_context(pki, client), path)
+    return fetch
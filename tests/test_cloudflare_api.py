@@ -0,0 +1,160 @@
+"""The shared Cloudflare API client against cloudflare_standin.py
+
+Each test starts the stand-in on a free port with the lists padded past one
+page, then checks what the client sent against the stand-in's own request
+counts: every page is fetched once, a 429 pauses every thread of the client
+for Retry-After, a 5xx is retried only for idempotent methods, and fan_out
+re-raises the first error once every call finished.
+"""
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+from cloudflare_api import CloudflareClient, CloudflareError  # noqa: E402
+
+ZONE_ID = "9b9e2119bd8cf84887e5eaa68fcbe58e"
+APPS = f"zones/{ZONE_ID}/access/apps"
+POLICIES = f"zones/{ZONE_ID}/access/policies"
+DNS_RECORDS = f"zones/{ZONE_ID}/dns_records"
+START_TIMEOUT = 10.0
+
+
+@pytest.fixture
+def standin():
+    """Start cloudflare_standin.py with the given arguments and return its
+    API base URL"""
+    processes = []
+
+    def start(*args):
+        process = subprocess.Popen([sys.executable, "-u", str(REPO / "cloudflare_standin.py"), "--port", "0", *args],
+                                   stdout=subprocess.PIPE, text=True)
+        processes.append(process)
+        # Printed once the socket is bound
+        line = process.stdout.readline()
+        assert line.startswith("Cloudflare stand-in on "), line
+        return line.split()[-1]
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=START_TIMEOUT)
+
+
+def _client(base_url, **kwargs):
+    return CloudflareClient(token="test", base_url=base_url, backoff=0.01, **kwargs)
+
+
+def _stats(client):
+    return client.get("_stats")
+
+
+@pytest.mark.parametrize("pagination", [(), ("--cursors",)], ids=["pages", "cursors"])
+def test_lists_every_page(standin, pagination):
+    with _client(standin("--apps", "120", "--policies", "80", *pagination)) as client:
+        apps = client.list(APPS)
+        assert client.requests_sent == 3
+        policies = client.list(POLICIES)
+        assert client.requests_sent == 5
+
+        assert len(apps) == 120 and len({app["id"] for app in apps}) == 120
+        assert apps[-1]["domain"] == "nietst.uk"
+        assert len(policies) == 80 and len({policy["id"] for policy in policies}) == 80
+        assert client.retries == 0
+        assert _stats(client)["requests"] == client.requests_sent
+
+
+def test_rate_limit_pauses_every_thread(standin):
+    # Every fourth request is rate limited with Retry-After: 1
+    with _client(standin("--rate-limit", "4", "--retry-after", "1")) as client:
+        for path in ("accounts", "zones", "accounts"):
+            client.get(path)
+        elapsed = {}
+
+        def timed(name, path):
+            started = time.monotonic()
+            client.get(path)
+            elapsed[name] = time.monotonic() - started
+
+        limited = threading.Thread(target=timed, args=("limited", "accounts"))
+        limited.start()
+        time.sleep(0.2)
+        # Sent after the 429, so it waits out the same Retry-After without
+        # being rate limited itself
+        timed("paused", "zones")
+        limited.join()
+
+        assert elapsed["limited"] >= 1.0
+        assert elapsed["paused"] >= 0.7
+        assert (client.requests_sent, client.retries) == (6, 1)
+        stats = _stats(client)
+        assert (stats["requests"], stats["rate_limited"]) == (7, 1)
+
+
+def test_rate_limited_fan_out_completes(standin):
+    # Every fifth request is rate limited while three lists are paginated at once
+    with _client(standin("--rate-limit", "5", "--retry-after", "0", "--apps", "120", "--policies", "80",
+                         "--dns-records", "60")) as client:
+        results = client.fan_out({
+            "apps": lambda: client.list(APPS),
+            "policies": lambda: client.list(POLICIES),
+            "dns_records": lambda: client.list(DNS_RECORDS),
+        })
+        assert [len(results[name]) for name in ("apps", "policies", "dns_records")] == [120, 80, 60]
+        # 3 + 2 + 2 pages, and a retry for every 429
+        assert client.requests_sent - client.retries == 7
+        assert client.retries == client.requests_sent // 5 > 0
+        stats = _stats(client)
+        assert stats["requests"] == client.requests_sent
+        assert stats["rate_limited"] == client.retries
+
+
+def test_server_errors_retried_only_for_idempotent_methods(standin):
+    # Every second request fails with 503
+    with _client(standin("--server-errors", "2")) as client:
+        assert client.get("accounts")
+        with pytest.raises(CloudflareError) as failed:
+            client.post(DNS_RECORDS, json={"type": "A", "name": "new.nietst.uk", "content": "192.0.2.10"})
+        assert failed.value.status == 503
+        assert (client.requests_sent, client.retries) == (2, 0)
+
+        records = client.get(DNS_RECORDS)
+        assert all(record["name"] != "new.nietst.uk" for record in records)
+        assert client.get("zones")
+        assert (client.requests_sent, client.retries) == (5, 1)
+        stats = _stats(client)
+        assert (stats["requests"], stats["server_errors"]) == (7, 3)
+
+    with _client(standin("--server-errors", "1"), max_retries=2) as client:
+        with pytest.raises(CloudflareError) as failed:
+            client.get("accounts")
+        assert failed.value.status == 503
+        assert (client.requests_sent, client.retries) == (3, 2)
+
+
+def test_fan_out_raises_first_error_after_every_call(standin):
+    with _client(standin()) as client:
+        finished = []
+
+        def slow_lookup():
+            time.sleep(0.3)
+            finished.append("zones")
+            return client.get("zones")
+
+        results = client.fan_out({"accounts": lambda: client.get("accounts"), "zones": slow_lookup})
+        assert results["accounts"][0]["id"] and results["zones"][0]["name"] == "nietst.uk"
+
+        finished.clear()
+        with pytest.raises(CloudflareError) as failed:
+            client.fan_out({
+                "missing": lambda: client.get(f"accounts/{results['accounts'][0]['id']}/cfd_tunnel/missing"),
+                "zones": slow_lookup,
+            })
+        assert failed.value.status == 404
+        assert finished == ["zones"]
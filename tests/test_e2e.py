@@ -0,0 +1,128 @@
+"""Functional checks of client certificate handling on both servers"""
+import datetime
+import http.client
+import ssl
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from conftest import SERVERS, _make_client, _write, client_context, get, running_server, tenants_file
+
+SHORT_LIVED_SECS = 3
+
+
+def test_without_certificate(server, fetch):
+    status, body = fetch()
+    assert status == server.unauthenticated_status
+    assert body["mtls_valid"] is False
+    assert not body["presented_certificates"]
+
+
+def test_valid_certificate(server, fetch):
+    status, body = fetch("valid")
+    assert status == 200
+    assert body["mtls_valid"] is True
+    assert body["presented_certificates"]
+    chains = body[server.chains_field]
+    assert len(chains) == 1 and len(chains[0]) == 2, chains
+
+
+@pytest.mark.parametrize("client", ["wrong-ca", "expired"])
+def test_rejected_certificate(server, fetch, client):
+    # With TLS 1.3 the client finishes its handshake before the server
+    # checks the certificate, so the alert can surface on the first read
+    with pytest.raises((ssl.SSLError, ConnectionError)):
+        fetch(client)
+
+
+def test_rejected_certificate_does_not_affect_others(server, fetch):
+    with pytest.raises((ssl.SSLError, ConnectionError)):
+        fetch("wrong-ca")
+    status, body = fetch("valid")
+    assert status == 200 and body["mtls_valid"] is True
+
+
+def _request(server, pki, method, path, client=None, accept=None):
+    """(status, headers, raw body) of one request on a new connection"""
+    conn = http.client.HTTPSConnection("localhost", server.port, context=client_context(pki, client), timeout=10)
+    try:
+        conn.request(method, path, headers={"Accept": accept} if accept else {})
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
+
+
+def test_field_selection(server, pki, fetch):
+    status, body = fetch("valid", f"{server.path}?fields=mtls_valid,leaf_common_name")
+    assert status == 200
+    assert body == {"mtls_valid": True, "leaf_common_name": "Test Client"}
+    status, _, _ = _request(server, pki, "GET", f"{server.path}?fields=serial", "valid")
+    assert status == 400
+
+
+@pytest.mark.parametrize("accept, content_type", [
+    ("application/cbor", "application/cbor"),
+    ("application/x-msgpack", "application/msgpack"),
+])
+def test_binary_encodings(server, pki, accept, content_type):
+    status, headers, body = _request(server, pki, "GET", f"{server.path}?fields=mtls_valid", "valid", accept)
+    assert status == 200 and headers["Content-Type"] == content_type
+    # A one-member map of "mtls_valid" to true
+    assert body in (b"\xa1\x6amtls_valid\xf5", b"\x81\xaamtls_valid\xc3")
+
+
+def test_not_acceptable(server, pki):
+    status, _, _ = _request(server, pki, "GET", server.path, "valid", "text/csv")
+    assert status == 406
+
+
+@pytest.mark.parametrize("method", ["GET", "HEAD"])
+def test_validity_fast_path(server, pki, method):
+    status, _, body = _request(server, pki, method, f"{server.path}/valid", "valid")
+    assert status == 204 and body == b""
+    status, _, body = _request(server, pki, method, f"{server.path}/valid")
+    assert status == 401 and body == b""
+
+
+def test_head(server, pki):
+    status, headers, body = _request(server, pki, "HEAD", server.path, "valid")
+    assert status == 200 and headers["Content-Type"] == "application/json" and body == b""
+
+
+@pytest.fixture(params=SERVERS)
+def tenant_server(request, pki, tmp_path_factory):
+    """Every selected server, serving localhost as an SNI tenant"""
+    rust_env = {"TENANTS_FILE": str(tenants_file(pki))}
+    with running_server(request, pki, tmp_path_factory, rust_env=rust_env) as started:
+        yield started
+
+
+def test_tenant_rejects_certificate_expired_since_warm_up(tenant_server, pki, tmp_path):
+    ca_cert = x509.load_pem_x509_certificate(pki.ca.read_bytes())
+    ca_key = serialization.load_pem_private_key((pki.root / "ca-key.pem").read_bytes(), None)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    not_before = now - datetime.timedelta(minutes=1)
+    lifetime = datetime.timedelta(minutes=1, seconds=SHORT_LIVED_SECS)
+    cert, key = _make_client("Short Lived", ca_cert, ca_key, not_before, days=lifetime / datetime.timedelta(days=1))
+    cert_path, key_path = tmp_path / "short-lived-cert.pem", tmp_path / "short-lived-key.pem"
+    _write(cert_path, key_path, cert, key)
+
+    def fetch():
+        context = client_context(pki)
+        context.load_cert_chain(str(cert_path), str(key_path))
+        return get(tenant_server, context)
+
+    # The server remembers chains it verified; that must not outlive them
+    status, body = fetch()
+    assert status == 200 and body["mtls_valid"] is True
+    time.sleep(max(0.0, (not_before + lifetime - datetime.datetime.now(datetime.timezone.utc)).total_seconds()) + 1.5)
+
+    try:
+        status, body = fetch()
+    except (ssl.SSLError, ConnectionError):
+        return
+    assert status == tenant_server.unauthenticated_status
+    assert body["mtls_valid"] is False
@@ -0,0 +1,115 @@
+"""EST enrollment on the Go server
+
+Clients re-enroll with their current certificate and use the certificate
+they get back, and a wave of re-enrollments, as before a CA rollover, is
+turned away with 503 once the signing queue is full instead of slowing
+down /json.
+"""
+import base64
+import http.client
+import json
+import threading
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from conftest import _name, client_context, get, running_server
+
+ENROLL = "/.well-known/est/simpleenroll"
+REENROLL = "/.well-known/est/simplereenroll"
+PEM_CHAIN = "application/pem-certificate-chain"
+
+
+@pytest.fixture(params=["go"])
+def enroll_server(request, pki, tmp_path_factory):
+    """The Go server enrolling with the test CA on one signing worker"""
+    manifest = tmp_path_factory.mktemp("enroll") / "manifest.jsonl"
+    go_args = ["-enroll-ca-cert", str(pki.ca), "-enroll-ca-key", str(pki.root / "ca-key.pem"),
+               "-enroll-workers", "1", "-enroll-queue", "4", "-enroll-manifest", str(manifest)]
+    with running_server(request, pki, tmp_path_factory, go_args) as started:
+        started.manifest = manifest
+        yield started
+
+
+def _csr(common_name):
+    key = ec.generate_private_key(ec.SECP256R1())
+    csr = x509.CertificateSigningRequestBuilder().subject_name(_name(common_name)).sign(key, hashes.SHA256())
+    return key, base64.b64encode(csr.public_bytes(serialization.Encoding.DER))
+
+
+def _reenroll(server, context, csr, accept=PEM_CHAIN, path=REENROLL):
+    conn = http.client.HTTPSConnection("localhost", server.port, context=context, timeout=30)
+    try:
+        conn.request("POST", path, body=csr, headers={"Accept": accept, "Content-Type": "application/pkcs10"})
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
+
+
+def test_reenroll_and_use_certificate(enroll_server, pki, tmp_path):
+    key, csr = _csr("Test Client")
+    status, headers, body = _reenroll(enroll_server, client_context(pki, "valid"), csr)
+    assert status == 200, body
+    assert headers["Content-Type"] == PEM_CHAIN
+    renewed = x509.load_pem_x509_certificate(body)
+    assert renewed.subject == _name("Test Client")
+
+    cert_path, key_path = tmp_path / "renewed.pem", tmp_path / "renewed-key.pem"
+    cert_path.write_bytes(body)
+    key_path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.NoEncryption()))
+    context = client_context(pki)
+    context.load_cert_chain(str(cert_path), str(key_path))
+    status, response = get(enroll_server, context)
+    assert status == 200 and response["mtls_valid"] is True
+
+    current = x509.load_pem_x509_certificate(pki.client("valid")[0].read_bytes())
+    record = json.loads(enroll_server.manifest.read_text().splitlines()[-1])
+    assert record["serial"] == format(renewed.serial_number, "x")
+    assert record["replaces"] == format(current.serial_number, "x")
+    assert record["enrolled"] == "simplereenroll"
+
+    # A certificate only renews its own subject, through either endpoint
+    _, other = _csr("Someone Else")
+    for path in (REENROLL, ENROLL):
+        status, _, _ = _reenroll(enroll_server, client_context(pki, "valid"), other, path=path)
+        assert status == 403
+
+
+def test_mass_reenrollment_does_not_starve_json(enroll_server, pki):
+    _, csr = _csr("Test Client")
+    enroll_context = client_context(pki, "valid")
+    statuses, retry_after, stop = [], [], threading.Event()
+
+    def reenroll():
+        while not stop.is_set():
+            status, headers, _ = _reenroll(enroll_server, enroll_context, csr)
+            statuses.append(status)
+            if status == 503:
+                retry_after.append(headers["Retry-After"])
+
+    threads = [threading.Thread(target=reenroll, daemon=True) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    latencies, errors = [], []
+    context = client_context(pki, "valid")
+    deadline = time.monotonic() + 3
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        status, body = get(enroll_server, context)
+        latencies.append(time.monotonic() - started)
+        if status != 200 or body["mtls_valid"] is not True:
+            errors.append(status)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert not errors, errors[:5]
+    assert max(latencies) < 2.0, max(latencies)
+    assert set(statuses) <= {200, 503}, set(statuses)
+    assert 200 in statuses
+    assert all(retry_after), retry_after[:5]
@@ -0,0 +1,79 @@
+"""Short fixed-size load benchmark compared with a recorded baseline
+
+Every request is a new connection with a full handshake presenting the
+valid client certificate, driven by test-mtls.py's load generator. The run
+fails when requests/s drops, or the p99 handshake time grows, by more than
+--perf-tolerance against the baseline for the same server and workload.
+Baselines only compare on the machine they were recorded on, so none are
+committed: --update-baseline records one, and a server without one is
+skipped.
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+WARMUP_REQUESTS = 100
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location("test_mtls_bench", REPO / "test-mtls.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench(generator, server, pki, requests, concurrency):
+    cert, key = pki.client("valid")
+    args = argparse.Namespace(url=server.url, cert=str(cert), key=str(key), mode=generator.MODE_NEW,
+                              resume=False, duration=None, requests=requests, concurrency=concurrency,
+                              cert_ratio=1.0, streams=1, check_peer=True, timeout=10.0)
+    return generator.run_benchmark(args)
+
+
+@pytest.mark.perf
+def test_handshake_throughput(server, pki, request):
+    config = request.config
+    requests = config.getoption("--perf-requests")
+    concurrency = config.getoption("--perf-concurrency")
+    tolerance = config.getoption("--perf-tolerance")
+    baseline_path = Path(config.getoption("--perf-baseline"))
+
+    generator = load_generator()
+    bench(generator, server, pki, WARMUP_REQUESTS, concurrency)
+    results = bench(generator, server, pki, requests, concurrency)
+
+    assert results["total"]["errors"] == 0, results["groups"]
+    measured = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "rps": round(results["total"]["rps"], 1),
+        "handshake_p99_ms": round(results["groups"]["with-cert"]["handshake_ms"]["p99"], 2),
+        "recorded": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+    print(f"\n{server.name}: {measured['rps']} req/s, p99 handshake {measured['handshake_p99_ms']} ms")
+
+    baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if config.getoption("--update-baseline"):
+        baselines[server.name] = measured
+        baseline_path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        return
+    baseline = baselines.get(server.name)
+    if baseline is None:
+        pytest.skip(f"no {server.name} baseline in {baseline_path}; record one on this machine with "
+                    f"`python -m pytest tests --servers {server.name} -k perf --update-baseline`")
+    if (baseline["requests"], baseline["concurrency"]) != (requests, concurrency):
+        pytest.fail(f"{baseline_path} was recorded with {baseline['requests']} requests at concurrency "
+                    f"{baseline['concurrency']}; rerun with --update-baseline to compare this workload")
+
+    regressions = []
+    if measured["rps"] < baseline["rps"] * (1 - tolerance):
+        regressions.append(f"rps {measured['rps']} < {baseline['rps']} - {tolerance:.0%}")
+    if measured["handshake_p99_ms"] > baseline["handshake_p99_ms"] * (1 + tolerance):
+        regressions.append(f"p99 handshake {measured['handshake_p99_ms']} ms > "
+                           f"{baseline['handshake_p99_ms']} ms + {tolerance:.0%}")
+    assert not regressions, f"{server.name} regressed against {baseline_path}: " + "; ".join(regressions)
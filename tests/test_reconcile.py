@@ -0,0 +1,179 @@
+"""reconcile-mtls.py's Reconciler against cloudflare_standin.py
+
+The stand-in runs in-process so a test can change or delete objects behind
+the reconciler's back, the way someone editing the dashboard would. Each
+run goes through the cache file like the script does: load the snapshot,
+refresh, plan, apply, save.
+"""
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import cloudflare_standin  # noqa: E402
+from cloudflare_api import CloudflareClient  # noqa: E402
+from mtls_state import Reconciler, Snapshot, load_desired  # noqa: E402
+
+ZONE_ID = cloudflare_standin.ZONE_ID
+DOMAIN = cloudflare_standin.ZONE_NAME
+NEW_RECORD = f"www.{DOMAIN}"
+
+
+@pytest.fixture
+def standin():
+    server, api = cloudflare_standin.serve()
+    yield f"http://127.0.0.1:{server.server_port}{cloudflare_standin.API_PREFIX}", api
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def desired(pki, tmp_path):
+    """mtls-state.json with the test CA and one DNS record the stand-in
+    doesn't have yet"""
+    state = json.loads((REPO / "mtls-state.json").read_text())
+    state["dns"].append({"type": "CNAME", "name": NEW_RECORD, "content": "{tunnel_id}.cfargotunnel.com",
+                         "proxied": True})
+    shutil.copy(pki.ca, tmp_path / "ca.pem")
+    (tmp_path / "mtls-state.json").write_text(json.dumps(state))
+    return load_desired(str(tmp_path / "mtls-state.json"))
+
+
+class Run:
+    """One reconcile run: the plan, what failed to apply and what it cost"""
+
+    def __init__(self, actions, failed, requests, not_modified):
+        self.actions = actions
+        self.failed = failed
+        self.requests = requests
+        self.not_modified = not_modified
+
+    def changes(self):
+        """(op, kind, key) of every action that is not a no-op"""
+        return sorted((a.op, a.kind, a.key) for a in self.actions if a.op != "noop")
+
+    def action(self, kind, key):
+        return next(a for a in self.actions if (a.kind, a.key) == (kind, key))
+
+
+@pytest.fixture
+def reconcile(standin, desired, tmp_path):
+    base_url, _ = standin
+    cache = str(tmp_path / ".mtls-state-cache.json")
+
+    def run():
+        snapshot = Snapshot.load(cache, DOMAIN)
+        with CloudflareClient(token="test", base_url=base_url) as client:
+            reconciler = Reconciler(client, desired, snapshot)
+            reconciler.refresh()
+            actions = reconciler.plan()
+            failed = reconciler.apply(actions)
+        snapshot.save(cache)
+        return Run(actions, failed, client.requests_sent, reconciler.not_modified)
+
+    return run
+
+
+def _records(api, name):
+    with api.lock:
+        return [r for r in api.state["dns_records"][ZONE_ID] if r["name"] == name]
+
+
+def _mtls_app(api):
+    with api.lock:
+        return next(app for app in api.state["apps"][ZONE_ID] if app["domain"] == DOMAIN)
+
+
+def test_first_run_creates_then_nothing_changes(standin, desired, reconcile):
+    _, api = standin
+    fingerprint = desired["ca_certificates"][0]["fingerprint"]
+
+    first = reconcile()
+    assert first.failed == []
+    assert first.changes() == [("create", "certificates", fingerprint),
+                               ("create", "dns_records", f"CNAME {NEW_RECORD}")]
+    assert api.stats["mutations"] == 2
+    assert len(_records(api, NEW_RECORD)) == 1
+    assert _records(api, NEW_RECORD)[0]["content"] == f"{cloudflare_standin.TUNNEL_ID}.cfargotunnel.com"
+
+    # Everything is matched now, so each object is read back by ID once
+    second = reconcile()
+    assert second.changes() == []
+    assert not any(action.drifted for action in second.actions)
+    assert second.requests == len(second.actions) == 6
+
+    # and from then on costs a 304
+    third = reconcile()
+    assert third.changes() == []
+    assert third.requests == third.not_modified == 6
+    assert api.stats["mutations"] == 2
+
+
+def test_changed_remotely_is_flagged_and_put_back(standin, reconcile):
+    _, api = standin
+    reconcile()
+    reconcile()
+
+    with api.lock:
+        app = next(app for app in api.state["apps"][ZONE_ID] if app["domain"] == DOMAIN)
+        app["name"] = "Renamed in the dashboard"
+        app["modified_on"] = cloudflare_standin.now()
+        policy = next(p for p in api.state["policies"][ZONE_ID] if p["name"] == "mTLS Policy")
+        # A field the state file doesn't set: nothing to undo, only reported
+        policy["session_duration"] = "1h"
+        policy["modified_on"] = "2099-01-01T00:00:00Z"
+
+    changed = reconcile()
+    assert changed.failed == []
+    assert changed.changes() == [("update", "apps", DOMAIN)]
+    update = changed.action("apps", DOMAIN)
+    assert update.drifted and update.changes == ["name"]
+    assert "(changed remotely since the last run)" in update.describe()
+    noop = changed.action("policies", "mTLS Policy")
+    assert noop.op == "noop" and noop.drifted
+    assert changed.not_modified == 4
+    assert _mtls_app(api)["name"] == "mTLS"
+
+    after = reconcile()
+    assert after.changes() == []
+    assert not any(action.drifted for action in after.actions)
+
+
+def test_deleted_remotely_is_relisted_and_recreated(standin, reconcile):
+    _, api = standin
+    reconcile()
+    reconcile()
+    old_id = _records(api, NEW_RECORD)[0]["id"]
+    with api.lock:
+        records = api.state["dns_records"][ZONE_ID]
+        records[:] = [r for r in records if r["name"] != NEW_RECORD]
+
+    # The 404 drops the record from the cache and the collection is listed
+    # again, in case it was recreated under a new ID
+    deleted = reconcile()
+    assert deleted.failed == []
+    assert deleted.changes() == [("create", "dns_records", f"CNAME {NEW_RECORD}")]
+    assert deleted.requests == 6 + 1 + 1
+    records = _records(api, NEW_RECORD)
+    assert len(records) == 1 and records[0]["id"] != old_id
+
+    assert reconcile().changes() == []
+
+
+def test_recreated_remotely_is_matched_by_key(standin, reconcile):
+    _, api = standin
+    reconcile()
+    reconcile()
+    with api.lock:
+        record = next(r for r in api.state["dns_records"][ZONE_ID] if r["name"] == NEW_RECORD)
+        record["id"] = cloudflare_standin.new_id()
+
+    recreated = reconcile()
+    assert recreated.changes() == []
+    assert api.stats["mutations"] == 2
+    assert len(_records(api, NEW_RECORD)) == 1
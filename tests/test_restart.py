@@ -0,0 +1,183 @@
+"""Graceful shutdown and zero-downtime restarts through listener handoff
+
+A client keeps sending requests, each on a new connection or on one kept
+alive, while the server hands its listeners to a new process (SIGUSR2) or
+drains on SIGTERM. No request the server accepted may fail in between.
+"""
+import http.client
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import client_context, get
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="listener handoff needs Unix signals")
+
+HANDOFF_TIMEOUT = 30.0
+
+
+class _Counted:
+    """File wrapper counting the bytes read through it into counter[0]"""
+
+    def __init__(self, fp, counter):
+        self._fp, self._counter = fp, counter
+
+    def _count(self, data):
+        self._counter[0] += len(data)
+        return data
+
+    def read(self, *args):
+        return self._count(self._fp.read(*args))
+
+    def read1(self, *args):
+        return self._count(self._fp.read1(*args))
+
+    def readline(self, *args):
+        return self._count(self._fp.readline(*args))
+
+    def readinto(self, buffer):
+        n = self._fp.readinto(buffer)
+        self._counter[0] += n or 0
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class Load:
+    """Requests in a loop on a background thread, on a new connection each
+    or on one kept alive, sorting out the failures
+
+    A connection that fails to connect or complete its handshake was never
+    accepted: it was refused, or reset while queued in the closed
+    listener's backlog. Any failure after the handshake is an error. The
+    one exception is a kept-alive connection the server closed while idle,
+    just as the next request went out. Nothing comes back for that request,
+    and it is retried once on a new connection, as HTTP clients do for
+    idempotent requests.
+    """
+
+    def __init__(self, server, pki, keep_alive=False):
+        self.server, self.context, self.keep_alive = server, client_context(pki, "valid"), keep_alive
+        self.ok, self.retried, self.not_accepted, self.errors = 0, 0, [], []
+        self._conn = None
+        self._received = [0]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _connect(self):
+        conn = http.client.HTTPSConnection("localhost", self.server.port, context=self.context, timeout=10)
+        conn.response_class = self._response
+        conn.connect()
+        return conn
+
+    def _response(self, sock, *args, **kwargs):
+        response = http.client.HTTPResponse(sock, *args, **kwargs)
+        response.fp = _Counted(response.fp, self._received)
+        return response
+
+    def _request(self, conn):
+        self._received[0] = 0
+        conn.request("GET", self.server.path, headers={"Accept": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+
+    def _once(self, retry=True):
+        reused = self._conn is not None and self._conn.sock is not None
+        if reused:
+            conn = self._conn
+        else:
+            try:
+                conn = self._connect()
+            except OSError as e:
+                self.not_accepted.append(repr(e))
+                return
+        try:
+            status, body = self._request(conn)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            conn.close()
+            self._conn = None
+            if reused and retry and self._received[0] == 0:
+                self.retried += 1
+                self._once(retry=False)
+            else:
+                self.errors.append(f"{e!r} after {self._received[0]} response bytes")
+            return
+        if self.keep_alive:
+            self._conn = conn
+        else:
+            conn.close()
+        if status == 200 and body["mtls_valid"] is True:
+            self.ok += 1
+        else:
+            self.errors.append(f"status {status}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._once()
+        if self._conn is not None:
+            self._conn.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=15)
+
+
+def _wait_for_exit(pid, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.parametrize("keep_alive", [False, True], ids=["new-connections", "keep-alive"])
+def test_handoff_without_errors(own_server, pki, keep_alive):
+    with Load(own_server, pki, keep_alive) as load:
+        time.sleep(0.5)
+        own_server.process.send_signal(signal.SIGUSR2)
+        own_server.process.wait(timeout=HANDOFF_TIMEOUT)
+        before = load.ok
+        time.sleep(0.5)
+
+    match = re.search(r"handed off listeners to pid (\d+)", own_server.output())
+    assert match, own_server.output()
+    successor = int(match.group(1))
+    try:
+        assert own_server.process.returncode == 0, own_server.output()
+        # The listeners never close, so every connection is accepted
+        assert not load.errors, load.errors[:5]
+        assert not load.not_accepted, load.not_accepted[:5]
+        assert load.ok > before > 0
+        # The successor serves on its own, and drains on SIGTERM in turn
+        status, body = get(own_server, client_context(pki, "valid"))
+        assert status == 200 and body["mtls_valid"] is True
+    finally:
+        os.kill(successor, signal.SIGTERM)
+        assert _wait_for_exit(successor, 15), own_server.output()
+
+
+@pytest.mark.parametrize("keep_alive", [False, True], ids=["new-connections", "keep-alive"])
+def test_sigterm_drains_and_exits(own_server, pki, keep_alive):
+    with Load(own_server, pki, keep_alive) as load:
+        time.sleep(0.5)
+        own_server.process.send_signal(signal.SIGTERM)
+        own_server.process.wait(timeout=HANDOFF_TIMEOUT)
+    assert own_server.process.returncode == 0, own_server.output()
+    # Connections cut off by the closed listener are never accepted; none
+    # may fail after the server accepted them
+    assert not load.errors, load.errors[:5]
+    assert load.ok > 0